@@ -45,6 +45,10 @@ SAVE_DEDUP_HAMMING_THRESHOLD = 4
 
 _DCT_MATRIX_CACHE = {}
 _LABEL_PHASH_CACHE = {}
+_SOLVE_CACHE = {"mtime": None, "db": None, "index": None}
+
+# popcount cho tung byte, dung khi numpy chua co np.bitwise_count (< 2.0)
+_POPCOUNT_U8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
 
 
 def is_md5_key(key):
@@ -83,7 +87,7 @@ def get_label_phash_cache(label):
         return cache
 
     label_dir = os.path.join(TRAIN_DIR, label)
-    cache = []
+    cache = PhashIndex()
     if os.path.exists(label_dir):
         for fname in os.listdir(label_dir):
             if not fname.lower().endswith(".png"):
@@ -91,7 +95,7 @@ def get_label_phash_cache(label):
             fpath = os.path.join(label_dir, fname)
             try:
                 img = Image.open(fpath).convert("RGB")
-                cache.append(phash_cell(img))
+                cache.upsert(phash_cell(img), label)
             except Exception:
                 continue
     _LABEL_PHASH_CACHE[label] = cache
@@ -106,12 +110,11 @@ def persist_labeled_cell(cell, label, md5_hash):
     if not os.path.exists(out_path):
         new_phash = phash_cell(cell)
         known_phashes = get_label_phash_cache(label)
-        for known in known_phashes:
-            if hamming_distance_hex(new_phash, known) <= SAVE_DEDUP_HAMMING_THRESHOLD:
-                return False
+        if known_phashes.has_within(new_phash, SAVE_DEDUP_HAMMING_THRESHOLD):
+            return False
 
         cell.save(out_path)
-        known_phashes.append(new_phash)
+        known_phashes.upsert(new_phash, label)
         return True
     return False
 
@@ -295,12 +298,73 @@ def hamming_distance_hex(a, b):
     return (int(a, 16) ^ int(b, 16)).bit_count()
 
 
+def popcount_u64(arr):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(arr).astype(np.int32)
+    return _POPCOUNT_U8[arr.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int32)
+
+
+class PhashIndex:
+    """
+    pHash -> label, luu dang mang uint64 lien tuc de tinh Hamming distance vectorized
+    (XOR + popcount tren ca mang) thay vi int(x, 16) tung entry.
+    Thu tu entry giu theo thu tu them vao (giong vong for cu khi co nhieu entry cung khoang cach).
+    """
+
+    def __init__(self, entries=()):
+        self._hashes = np.zeros(64, dtype=np.uint64)
+        self._size = 0
+        self._labels = []
+        self._pos = {}
+        for phash_hex, label in entries:
+            self.upsert(phash_hex, label)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield f"{int(self._hashes[i]):016x}", self._labels[i]
+
+    def upsert(self, phash_hex, label):
+        value = int(phash_hex, 16)
+        i = self._pos.get(value)
+        if i is not None:
+            self._labels[i] = label
+            return
+        if self._size == len(self._hashes):
+            grown = np.zeros(len(self._hashes) * 2, dtype=np.uint64)
+            grown[: self._size] = self._hashes
+            self._hashes = grown
+        self._hashes[self._size] = value
+        self._labels.append(label)
+        self._pos[value] = self._size
+        self._size += 1
+
+    def distances(self, phash_hex):
+        return popcount_u64(self._hashes[: self._size] ^ np.uint64(int(phash_hex, 16)))
+
+    def nearest2(self, phash_hex):
+        """(best_label, best_dist, second_label, second_dist), None/10**9 neu khong co"""
+        if self._size == 0:
+            return None, 10**9, None, 10**9
+        dist = self.distances(phash_hex)
+        best = int(np.argmin(dist))
+        best_dist = int(dist[best])
+        if self._size == 1:
+            return self._labels[best], best_dist, None, 10**9
+        dist[best] = np.iinfo(np.int32).max
+        second = int(np.argmin(dist))
+        return self._labels[best], best_dist, self._labels[second], int(dist[second])
+
+    def has_within(self, phash_hex, max_distance):
+        return self._size > 0 and bool((self.distances(phash_hex) <= max_distance).any())
+
+
 def build_phash_index(db):
-    index = []
-    for key, label in db.items():
-        if is_phash_key(key):
-            index.append((key[len(PHASH_PREFIX):], label))
-    return index
+    return PhashIndex(
+        (key[len(PHASH_PREFIX):], label) for key, label in db.items() if is_phash_key(key)
+    )
 
 
 def find_cell_label(cell, db, phash_index, max_distance=PHASH_DISTANCE_THRESHOLD):
@@ -309,23 +373,7 @@ def find_cell_label(cell, db, phash_index, max_distance=PHASH_DISTANCE_THRESHOLD
         return db[md5_hash], "exact", 0, md5_hash, None
 
     cell_phash = phash_cell(cell)
-    best_label = None
-    best_dist = 10**9
-    second_label = None
-    second_dist = 10**9
-
-    for known_phash, label in phash_index:
-        dist = hamming_distance_hex(cell_phash, known_phash)
-        if dist < best_dist:
-            second_label = best_label
-            second_dist = best_dist
-            best_dist = dist
-            best_label = label
-            if best_dist == 0:
-                break
-        elif dist < second_dist:
-            second_label = label
-            second_dist = dist
+    best_label, best_dist, second_label, second_dist = phash_index.nearest2(cell_phash)
 
     # Accept confident near-match:
     # - very close match (<= 5), or
@@ -344,15 +392,20 @@ def find_cell_label(cell, db, phash_index, max_distance=PHASH_DISTANCE_THRESHOLD
     return None, "unknown", best_dist, md5_hash, cell_phash
 
 
-def upsert_phash_label(db, cell, label, force=False):
+def upsert_phash_label(db, cell, label, force=False, phash_index=None):
+    """phash_index (neu co) duoc cap nhat cung luc voi db, khong can build lai"""
     phash_value = phash_cell(cell)
     key = f"{PHASH_PREFIX}{phash_value}"
     if key not in db:
         db[key] = label
+        if phash_index is not None:
+            phash_index.upsert(phash_value, label)
         return True, False, False
     if db[key] != label:
         if force:
             db[key] = label
+            if phash_index is not None:
+                phash_index.upsert(phash_value, label)
             return False, False, True
         return False, True, False
     return False, False, False
@@ -505,7 +558,6 @@ def build_mode(count=20):
         md5_added_now, files_saved_now = learn_recognized_cells(cells, db, phash_index)
         if md5_added_now or files_saved_now:
             save_db(db)
-            phash_index = build_phash_index(db)
             print(f"   + Luu tam tu nhan dien: md5 +{md5_added_now}, files +{files_saved_now}")
 
         unknown_count = sum(
@@ -518,7 +570,6 @@ def build_mode(count=20):
                 md5_added, files_saved = learn_recognized_cells(cells, db, phash_index)
                 if md5_added or files_saved:
                     save_db(db)
-                    phash_index = build_phash_index(db)
                     print(f"   + Hoc them tu auto: md5 +{md5_added}, files +{files_saved}")
                 print(f"✅ Auto: {answer}")
                 solved += 1
@@ -557,7 +608,7 @@ def build_mode(count=20):
                         print(f"  ✓  O {i+1}: {db[md5_hash]} (md5 da biet)")
 
                 phash_added, phash_conflict, phash_overwrite = upsert_phash_label(
-                    db, cell, label, force=True
+                    db, cell, label, force=True, phash_index=phash_index
                 )
                 if phash_added:
                     print(f"     + pHash them moi")
@@ -570,7 +621,6 @@ def build_mode(count=20):
                     print("     + Luu file training_data")
 
             save_db(db)
-            phash_index = build_phash_index(db)
             break
 
         answer = auto_solve(cells, db, phash_index)
@@ -585,10 +635,21 @@ def build_mode(count=20):
     print(f"\n💾 Hoan tat | exact={db_image_count(db)} | phash={db_phash_count(db)}")
 
 
+def load_solver_state():
+    """db + PhashIndex, chi load lai khi captcha_db.json thay doi (theo mtime)."""
+    try:
+        mtime = os.path.getmtime(DB_FILE)
+    except OSError:
+        mtime = None
+    if _SOLVE_CACHE["db"] is None or _SOLVE_CACHE["mtime"] != mtime:
+        db = load_db()
+        _SOLVE_CACHE.update(mtime=mtime, db=db, index=build_phash_index(db))
+    return _SOLVE_CACHE["db"], _SOLVE_CACHE["index"]
+
+
 def solve(img_bytes):
     """API for crawler: return answer or None."""
-    db = load_db()
-    phash_index = build_phash_index(db)
+    db, phash_index = load_solver_state()
     cells, _ = cut_cells(img_bytes)
     if len(cells) != 4:
         return None
@@ -635,7 +696,7 @@ def dedup_training_data():
         if not files:
             continue
 
-        kept = []  # (phash, filename)
+        kept = PhashIndex()
         moved = 0
 
         for fname in files:
@@ -646,13 +707,7 @@ def dedup_training_data():
             except Exception:
                 continue
 
-            is_dup = False
-            for kp, _ in kept:
-                if hamming_distance_hex(p, kp) <= SAVE_DEDUP_HAMMING_THRESHOLD:
-                    is_dup = True
-                    break
-
-            if is_dup:
+            if kept.has_within(p, SAVE_DEDUP_HAMMING_THRESHOLD):
                 trash_label_dir = os.path.join(DEDUP_TRASH_DIR, label)
                 os.makedirs(trash_label_dir, exist_ok=True)
                 target = os.path.join(trash_label_dir, fname)
@@ -668,7 +723,7 @@ def dedup_training_data():
                 shutil.move(fpath, target)
                 moved += 1
             else:
-                kept.append((p, fname))
+                kept.upsert(p, fname)
 
         moved_total += moved
         kept_total += len(kept)
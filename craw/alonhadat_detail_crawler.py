@@ -15,13 +15,15 @@ import os
 import random
 import re
 import sys
+import time
 from typing import Any, Dict, List, Optional
 from pathlib import Path
 
 from bs4 import BeautifulSoup
 from lxml import html as lxml_html
 
-from database import Database
+from database import Database, LinkLeaseQueue
+from template_engine import apply_exclude_words, compile_template, is_xpath_selector, node_text, parse_exclude_words, select
 
 try:
     from curl_cffi import requests as cffi_requests
@@ -152,37 +154,11 @@ def refresh_cookie_from_playwright(
 
 
 def _parse_exclude_words(field: Dict[str, Any]) -> List[str]:
-    raw = field.get("excludeWords")
-    if not raw:
-        return []
-    if isinstance(raw, list):
-        return [str(w).strip() for w in raw if str(w).strip()]
-    if isinstance(raw, str):
-        parts = re.split(r"[|,]", raw)
-        return [p.strip() for p in parts if p.strip()]
-    return []
+    return parse_exclude_words(field)
 
 
 def _apply_exclude_words(value: Any, field: Dict[str, Any]) -> Any:
-    if value is None:
-        return None
-    words = _parse_exclude_words(field)
-    if not words:
-        return value
-    if isinstance(value, list):
-        out = []
-        for item in value:
-            cleaned = _apply_exclude_words(item, field)
-            if cleaned:
-                out.append(cleaned)
-        return out
-    if not isinstance(value, str):
-        return value
-    cleaned = value
-    for w in words:
-        cleaned = cleaned.replace(w, "")
-    cleaned = cleaned.strip()
-    return cleaned or None
+    return apply_exclude_words(value, field, empty_as_none=True)
 
 
 def _norm_text(s: Optional[str]) -> Optional[str]:
@@ -217,8 +193,7 @@ def _normalize_alonhadat_ngaydang(value: Any) -> Any:
 
 
 def _is_xpath(selector: str) -> bool:
-    sel = (selector or "").strip()
-    return sel.startswith("/") or sel.startswith("(")
+    return is_xpath_selector(selector)
 
 
 def _extract_style_url(style_text: str) -> List[str]:
@@ -321,19 +296,19 @@ def _is_valid_listing_image_url(u: str) -> bool:
     return ("/files/properties/" in s) and ("/images/" in s) and s.endswith((".jpg", ".jpeg", ".png", ".webp"))
 
 
-def _fallback_extract_images(soup: BeautifulSoup, tree: Any) -> List[str]:
+def _fallback_extract_images(tree: Any) -> List[str]:
     vals: List[str] = []
 
     # Priority 1: single image container variant seen on Alonhadat
     for sel in [".imageview #limage", ".imageview img", "#limage"]:
-        for n in soup.select(sel):
+        for n in select(tree, sel):
             for k in ("src", "data-src", "data-original", "data-lazy-src"):
                 v = n.get(k)
                 if v:
                     vals.append(_to_abs_url(v))
 
     # Priority 2: images inside detail description block
-    for n in soup.select('[itemprop="description"] img, .detail img, .text-content img'):
+    for n in select(tree, '[itemprop="description"] img, .detail img, .text-content img'):
         for k in ("src", "data-src", "data-original", "data-lazy-src"):
             v = n.get(k)
             if v:
@@ -352,22 +327,16 @@ def _fallback_extract_images(soup: BeautifulSoup, tree: Any) -> List[str]:
     return _unique_keep_order(vals)
 
 
-def _extract_field_value(
-    field: Dict[str, Any],
-    soup: BeautifulSoup,
-    tree: Any,
-) -> Any:
-    selector = (field.get("selector") or "").strip()
-    value_type = (field.get("valueType") or field.get("type") or "text").strip().lower()
+def _extract_field_value(cf: Any, tree: Any) -> Any:
+    """cf: CompiledField (template_engine). CSS cũng chạy trên cây lxml qua XPath đã compile."""
+    selector = (cf.field.get("selector") or "").strip()
+    value_type = (cf.field.get("valueType") or cf.field.get("type") or "text").strip().lower()
     if not selector:
         return None, 0
 
     nodes = []
     try:
-        if _is_xpath(selector):
-            nodes = tree.xpath(selector)
-        else:
-            nodes = soup.select(selector)
+        nodes = cf.select(tree)
     except Exception:
         nodes = []
 
@@ -375,60 +344,53 @@ def _extract_field_value(
         return None, 0
 
     first = nodes[0]
-    is_xpath_node = _is_xpath(selector)
+    is_xpath_node = cf.is_xpath
 
     if value_type == "src":
-        val = _extract_src_values(first, is_xpath_node)
+        val = _extract_src_values(first, True)
     elif value_type == "href":
-        if is_xpath_node:
-            val = first.get("href") if hasattr(first, "get") else None
-        else:
-            val = first.get("href")
+        val = first.get("href") if hasattr(first, "get") else None
         val = _norm_text(val)
     elif value_type == "html":
-        if is_xpath_node:
-            val = lxml_html.tostring(first, encoding="unicode")
+        if isinstance(first, str):
+            val = first
         else:
-            val = str(first)
+            val = lxml_html.tostring(first, encoding="unicode", with_tail=is_xpath_node)
         val = val.strip() if isinstance(val, str) else val
     elif value_type in ("innertext", "multiline_text"):
         if is_xpath_node:
-            if isinstance(first, str):
-                val = _norm_multiline_text(first)
-            else:
-                val = _norm_multiline_text(first.text_content())
+            val = _norm_multiline_text(node_text(first))
         else:
-            val = _norm_multiline_text(first.get_text("\n", strip=True))
+            val = _norm_multiline_text(node_text(first, "\n", strip=True))
     else:
         # text
         if is_xpath_node:
-            if isinstance(first, str):
-                val = _norm_text(first)
-            else:
-                val = _norm_text(first.text_content())
+            val = _norm_text(node_text(first))
         else:
-            val = _norm_text(first.get_text(" ", strip=True))
+            val = _norm_text(node_text(first, " ", strip=True))
 
-    val = _apply_exclude_words(val, field)
+    val = cf.apply_exclude(val, empty_as_none=True)
     return val, len(nodes)
 
 
 def extract_with_template(html_text: str, template: Dict[str, Any]) -> Dict[str, Any]:
-    soup = BeautifulSoup(html_text, "html.parser")
     tree = lxml_html.fromstring(html_text)
+    compiled = compile_template(template)
     extracted: Dict[str, Any] = {}
 
-    for field in template.get("fields", []):
-        name = field.get("name")
+    for cf in compiled.fields:
+        name = cf.name
         if not name:
             continue
-        value, _ = _extract_field_value(field, soup, tree)
+        t0 = time.perf_counter()
+        value, _ = _extract_field_value(cf, tree)
+        compiled.record(name, time.perf_counter() - t0)
         extracted[name] = value if value else None
 
     # Image fallback: when template selector misses (.image-list not present)
     imgs = extracted.get("img")
     if not imgs:
-        fb = _fallback_extract_images(soup, tree)
+        fb = _fallback_extract_images(tree)
         if fb:
             extracted["img"] = fb
     elif isinstance(imgs, list):
@@ -436,10 +398,10 @@ def extract_with_template(html_text: str, template: Dict[str, Any]) -> Dict[str,
         normalized = [x for x in normalized if _is_valid_listing_image_url(x)]
         if normalized:
             # Merge with fallback images, keep order unique
-            fb = _fallback_extract_images(soup, tree)
+            fb = _fallback_extract_images(tree)
             extracted["img"] = _unique_keep_order(normalized + fb)
         else:
-            fb = _fallback_extract_images(soup, tree)
+            fb = _fallback_extract_images(tree)
             extracted["img"] = fb or None
 
     return extracted
@@ -732,6 +694,49 @@ def run_full(
         template = json.load(f)
 
     db = Database()
+    # Claim link theo lease: nhiều process crawl song song không lấy trùng link,
+    # process chết thì link tự về hàng đợi khi lease hết hạn.
+    queue = LinkLeaseQueue(db, "alonhadat-detail", lease_seconds=900, domain="alonhadat.com.vn")
+    try:
+        return _run_full_loop(
+            db, queue, template, cookie, force_domain,
+            delay_min_seconds, delay_max_seconds, batch_limit,
+            max_consecutive_block, cycle_sleep_seconds,
+            auto_refresh_cookie_on_block, cookie_profile_dir,
+            cookie_refresh_headless, login_user, login_pass,
+        )
+    finally:
+        queue.release()
+
+
+def _sleep_with_heartbeat(queue: LinkLeaseQueue, seconds: float):
+    """Ngủ dài (backoff) nhưng vẫn gia hạn lease các link đang giữ."""
+    end = time.monotonic() + seconds
+    while True:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(60.0, remaining))
+        queue.heartbeat()
+
+
+def _run_full_loop(
+    db: Database,
+    queue: LinkLeaseQueue,
+    template: dict,
+    cookie: Optional[str],
+    force_domain: Optional[str],
+    delay_min_seconds: float,
+    delay_max_seconds: float,
+    batch_limit: int,
+    max_consecutive_block: int,
+    cycle_sleep_seconds: float,
+    auto_refresh_cookie_on_block: bool,
+    cookie_profile_dir: str,
+    cookie_refresh_headless: bool,
+    login_user: str,
+    login_pass: str,
+) -> int:
     total_ok = 0
     total_fail = 0
     cycle = 0
@@ -741,20 +746,10 @@ def run_full(
     while True:
         cycle += 1
         batch_status = "PENDING"
-        links = get_links_by_status(
-            db,
-            status=batch_status,
-            limit=batch_limit,
-            domain="alonhadat.com.vn",
-        )
+        links = queue.claim(batch_limit, from_status=batch_status)
         if not links:
             batch_status = "ERROR"
-            links = get_links_by_status(
-                db,
-                status=batch_status,
-                limit=batch_limit,
-                domain="alonhadat.com.vn",
-            )
+            links = queue.claim(batch_limit, from_status=batch_status)
         if not links:
             break
 
@@ -774,6 +769,7 @@ def run_full(
                 meta["domain"] = force_domain
 
             print(f"[{idx}/{len(links)}] Crawling id={link_id} url={url[:120]}")
+            queue.heartbeat()
             try:
                 ok, html_text, final_url, reason = fetch_html_with_captcha(url, runtime_cookie)
                 print(f"  -> final={final_url}")
@@ -799,7 +795,7 @@ def run_full(
                 if not ok:
                     print("  -> Verification not passed, set ERROR")
                     try:
-                        db.update_link_status(url, "ERROR")
+                        queue.ack([link_id], "ERROR")
                     except Exception:
                         pass
                     total_fail += 1
@@ -809,13 +805,12 @@ def run_full(
                     # Progressive backoff on consecutive verification blocks:
                     # 2 -> 5m, 3 -> 10m, 4 -> 15m, ... up to 10 -> 45m.
                     if consecutive_block >= 2:
-                        import time
                         backoff_minutes = min((consecutive_block - 1) * 5, 45)
                         print(
                             f"  -> blocked backoff: sleeping {backoff_minutes} minutes "
                             f"(consecutive_block={consecutive_block})"
                         )
-                        time.sleep(backoff_minutes * 60)
+                        _sleep_with_heartbeat(queue, backoff_minutes * 60)
 
                     if max_consecutive_block > 0 and consecutive_block >= max_consecutive_block:
                         print(
@@ -852,27 +847,23 @@ def run_full(
                             db.add_detail_images(detail_id, imgs)
                         elif isinstance(imgs, str):
                             db.add_detail_images(detail_id, [imgs])
-                    db.update_link_status(url, "CRAWLED")
+                    queue.ack([link_id], "CRAWLED")
                     total_ok += 1
                     consecutive_block = 0
                     print(f"  -> Saved detail_id={detail_id}")
             except Exception as e:
                 print(f"  -> ERROR: {e}")
                 try:
-                    db.update_link_status(url, "ERROR")
+                    queue.ack([link_id], "ERROR")
                 except Exception:
                     pass
                 total_fail += 1
 
             if delay_max_seconds > 0:
-                import time
-
                 delay_s = random.uniform(delay_min_seconds, delay_max_seconds)
                 time.sleep(delay_s)
 
         if cycle_sleep_seconds > 0:
-            import time
-
             print(f"[BATCH] cycle={cycle} done, sleeping {cycle_sleep_seconds}s before next batch...")
             time.sleep(cycle_sleep_seconds)
 
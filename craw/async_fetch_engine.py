@@ -0,0 +1,356 @@
+"""
+Async fetch engine dùng chung cho các detail crawler chạy bằng HTTP (mogi_fast, guland, thuviennhadat).
+
+Thay vì N thread mỗi thread 1 request + time.sleep(delay), 1 event loop giữ nhiều request đang bay:
+  - giới hạn song song theo host (Semaphore) + token bucket req/s theo host
+  - 1 session keep-alive dùng chung (curl_cffi AsyncSession, không có thì requests.Session qua thread)
+  - retry + exponential backoff có jitter cho lỗi mạng / 429 / 5xx / trang Cloudflare 403-503;
+    khi bị chặn, cả host bị "làm nguội" (bucket tạm dừng) chứ không chỉ request đó
+  - crawl_queue(): link được claim liên tục từ LinkLeaseQueue vào asyncio.Queue có giới hạn,
+    worker lấy link tiếp ngay khi xong link trước (không chờ cả lô), lease được heartbeat định kỳ
+
+Crawler chỉ cần viết handler parse/lưu:
+
+    async def handle(link, result, fetcher):
+        if not result.ok:
+            return "ERROR" if result.status == 404 else RETRY
+        data = await asyncio.to_thread(parse_detail, link["url"], result.text)
+        ...
+        return "DONE"
+
+    async def main():
+        queue = LinkLeaseQueue(db, "mogi-async", domain="mogi.vn")
+        async with AsyncFetcher(per_host=8, rate_per_host=5.0, headers=HEADERS) as fetcher:
+            stats = await crawl_queue(queue, handle, fetcher, workers=16)
+
+    asyncio.run(main())
+"""
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from curl_cffi.requests import AsyncSession
+except Exception:
+    AsyncSession = None
+
+# Handler trả về RETRY (hoặc None) -> nack, link được claim lại sau retry_delay
+RETRY = "RETRY"
+
+DEFAULT_RETRY_STATUSES = (403, 429, 500, 502, 503, 504)
+_CLOUDFLARE_MARKERS = ("cloudflare", "cf-chl", "/cdn-cgi/challenge-platform/", "just a moment")
+
+
+def default_is_blocked(status: int, text: str) -> bool:
+    """Trang chặn kiểu Cloudflare: 403/503 kèm dấu hiệu challenge trong body"""
+    if status not in (403, 503):
+        return False
+    t = (text or "").lower()
+    return any(m in t for m in _CLOUDFLARE_MARKERS)
+
+
+class TokenBucket:
+    """Token bucket rate req/s, burst token; pause() dừng cấp token trong n giây (cooldown khi bị chặn)"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        # Lock giữ thứ tự FIFO: coroutine chờ trước lấy token trước
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class FetchResult:
+    url: str
+    status: int = 0
+    text: str = ""
+    error: Optional[str] = None
+    attempts: int = 0
+    elapsed: float = 0.0
+    blocked: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.blocked and 200 <= self.status < 300
+
+
+class AsyncFetcher:
+    def __init__(
+        self,
+        per_host: int = 8,
+        rate_per_host: float = 5.0,
+        burst: int = 2,
+        retries: int = 3,
+        backoff_base: float = 2.0,
+        backoff_max: float = 60.0,
+        timeout: float = 30.0,
+        headers: Optional[Dict[str, str]] = None,
+        impersonate: Optional[str] = "chrome124",
+        proxy: Optional[str] = None,
+        is_blocked: Callable[[int, str], bool] = default_is_blocked,
+        retry_statuses: Iterable[int] = DEFAULT_RETRY_STATUSES,
+        backend: str = "auto",
+    ):
+        """
+        per_host: số request song song tối đa mỗi host
+        rate_per_host: số request/giây tối đa mỗi host (0 = không giới hạn)
+        is_blocked(status, text): nhận diện trang chặn/captcha (kể cả trả 200)
+        backend: "auto" (curl_cffi nếu có), "curl" hoặc "requests"
+        """
+        self.per_host = max(1, int(per_host))
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.retries = max(0, int(retries))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.impersonate = impersonate
+        self.proxy = proxy
+        self.is_blocked = is_blocked
+        self.retry_statuses = set(retry_statuses)
+        if backend == "auto":
+            backend = "curl" if AsyncSession is not None else "requests"
+        if backend == "curl" and AsyncSession is None:
+            raise RuntimeError("curl_cffi is required for backend='curl'")
+        self.backend = backend
+        self._session = None
+        self._hosts: Dict[str, tuple] = {}
+
+    # ------------------------------------------------------------------
+    # Session
+    # ------------------------------------------------------------------
+
+    async def __aenter__(self) -> "AsyncFetcher":
+        proxies = {"http": self.proxy, "https": self.proxy} if self.proxy else None
+        if self.backend == "curl":
+            kwargs = {"headers": self.headers, "timeout": self.timeout, "max_clients": self.per_host * 8}
+            if self.impersonate:
+                kwargs["impersonate"] = self.impersonate
+            if proxies:
+                kwargs["proxies"] = proxies
+            self._session = AsyncSession(**kwargs)
+        else:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=self.per_host * 8)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(self.headers)
+            if proxies:
+                session.proxies = proxies
+            self._session = session
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        session, self._session = self._session, None
+        if session is None:
+            return
+        if self.backend == "curl":
+            await session.close()
+        else:
+            session.close()
+
+    def _host(self, url: str) -> tuple:
+        host = urlparse(url).netloc.lower()
+        limiter = self._hosts.get(host)
+        if limiter is None:
+            limiter = self._hosts[host] = (
+                asyncio.Semaphore(self.per_host),
+                TokenBucket(self.rate_per_host, self.burst),
+            )
+        return limiter
+
+    async def _request(self, url: str, timeout: float, headers: Optional[Dict[str, str]]) -> tuple:
+        if self.backend == "curl":
+            resp = await self._session.get(url, headers=headers, timeout=timeout)
+        else:
+            resp = await asyncio.to_thread(self._session.get, url, headers=headers, timeout=timeout)
+        return resp.status_code, resp.text or ""
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return delay * random.uniform(0.5, 1.5)
+
+    # ------------------------------------------------------------------
+    # Fetch
+    # ------------------------------------------------------------------
+
+    async def fetch(
+        self,
+        url: str,
+        timeout: Optional[float] = None,
+        headers: Optional[Dict[str, str]] = None,
+        retries: Optional[int] = None,
+    ) -> FetchResult:
+        """GET url theo giới hạn của host, tự retry/backoff. Không raise: lỗi nằm trong FetchResult."""
+        if self._session is None:
+            raise RuntimeError("AsyncFetcher must be used as 'async with AsyncFetcher(...)'")
+        sem, bucket = self._host(url)
+        max_attempts = 1 + (self.retries if retries is None else max(0, int(retries)))
+        result = FetchResult(url=url)
+        started = time.monotonic()
+
+        for attempt in range(1, max_attempts + 1):
+            result = FetchResult(url=url, attempts=attempt)
+            async with sem:
+                await bucket.acquire()
+                try:
+                    result.status, result.text = await self._request(url, timeout or self.timeout, headers)
+                except Exception as e:
+                    result.error = str(e) or e.__class__.__name__
+
+            if result.error is None:
+                result.blocked = bool(self.is_blocked(result.status, result.text))
+                if result.ok:
+                    break
+                if not result.blocked and result.status not in self.retry_statuses:
+                    break  # 404, 410... retry cũng vô ích
+
+            if attempt < max_attempts:
+                delay = self._backoff(attempt)
+                if result.blocked or result.status == 429:
+                    bucket.pause(delay)  # cả host nghỉ, không chỉ request này
+                await asyncio.sleep(delay)
+
+        result.elapsed = time.monotonic() - started
+        return result
+
+
+Handler = Callable[[dict, FetchResult, AsyncFetcher], Awaitable[Optional[str]]]
+
+
+async def crawl_queue(
+    queue: Any,
+    handle: Handler,
+    fetcher: AsyncFetcher,
+    workers: int = 16,
+    claim_size: int = 50,
+    max_links: int = 0,
+    max_consecutive_block: int = 5,
+    retry_delay: int = 300,
+    label: str = "async",
+) -> Dict[str, int]:
+    """
+    Claim link liên tục từ queue (LinkLeaseQueue), fetch + gọi handle(link, result, fetcher).
+
+    handle trả về status để ack ("DONE", "ERROR"...) hoặc RETRY/None để nack (claim lại sau retry_delay).
+    Trang bị chặn không gọi handle: link được nack, đếm vào circuit breaker;
+    quá max_consecutive_block trang chặn liên tiếp thì dừng, link chưa xử lý được trả lại hàng đợi.
+    max_links > 0: chỉ claim tối đa n link (chạy thử).
+    """
+    stats = {"claimed": 0, "done": 0, "error": 0, "retry": 0, "blocked": 0}
+    links_q: asyncio.Queue = asyncio.Queue(maxsize=max(claim_size * 2, workers))
+    stop = asyncio.Event()
+    state = {"consecutive_block": 0}
+    started = time.monotonic()
+
+    async def producer():
+        try:
+            while not stop.is_set():
+                limit = claim_size
+                if max_links:
+                    limit = min(limit, max_links - stats["claimed"])
+                    if limit <= 0:
+                        break
+                links = await asyncio.to_thread(queue.claim, limit)
+                if not links:
+                    break
+                stats["claimed"] += len(links)
+                for link in links:
+                    await links_q.put(link)
+        except Exception as e:
+            print(f"[{label}] claim failed: {e}")
+        finally:
+            for _ in range(workers):
+                await links_q.put(None)
+
+    async def heartbeat():
+        interval = max(5.0, queue.lease_seconds / 3)
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(queue.heartbeat, True)
+
+    async def finish(link_id, status):
+        try:
+            if status in (None, RETRY):
+                stats["retry"] += 1
+                await asyncio.to_thread(queue.nack, [link_id], "PENDING", retry_delay)
+            else:
+                stats["done" if status == "DONE" else "error"] += 1
+                await asyncio.to_thread(queue.ack, [link_id], status)
+        except Exception as e:
+            print(f"[{label}] ack/nack failed for id={link_id}: {e}")
+
+    async def worker():
+        while True:
+            link = await links_q.get()
+            if link is None:
+                return
+            if stop.is_set():
+                continue  # đã dừng: link còn lease, queue.release() trả lại
+            url = link["url"]
+            result = await fetcher.fetch(url)
+            if result.blocked:
+                stats["blocked"] += 1
+                state["consecutive_block"] += 1
+                print(f"[{label}] blocked ({result.status}) {url}")
+                await finish(link["id"], RETRY)
+                if state["consecutive_block"] > max_consecutive_block and not stop.is_set():
+                    print(
+                        f"[{label}] STOP: consecutive_block={state['consecutive_block']} > "
+                        f"max_consecutive_block={max_consecutive_block}"
+                    )
+                    stop.set()
+                continue
+            state["consecutive_block"] = 0
+            try:
+                status = await handle(link, result, fetcher)
+            except Exception as e:
+                print(f"[{label}] handler failed on {url}: {e}")
+                status = RETRY
+            await finish(link["id"], status)
+
+    hb = asyncio.create_task(heartbeat())
+    try:
+        await asyncio.gather(producer(), *(worker() for _ in range(workers)))
+    finally:
+        hb.cancel()
+        await asyncio.to_thread(queue.release)
+
+    elapsed = time.monotonic() - started
+    handled = stats["done"] + stats["error"] + stats["retry"]
+    rate = handled / elapsed * 60 if elapsed > 0 else 0.0
+    print(
+        f"[{label}] claimed={stats['claimed']} done={stats['done']} error={stats['error']} "
+        f"retry={stats['retry']} blocked={stats['blocked']} in {elapsed:.1f}s ({rate:.1f} links/min)"
+    )
+    return stats
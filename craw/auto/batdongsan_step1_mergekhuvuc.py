@@ -4,6 +4,8 @@ import time
 
 import pymysql
 
+from id_range_batcher import IdRangeBatcher
+
 
 DEFAULT_BATCH_SIZE = 5000
 DB_HOST = "localhost"
@@ -65,11 +67,8 @@ def run_step1(domain, batch_size, max_batches=0):
 
     # 1) Map ward + province IDs from location_batdongsan
     print("[Step1] Mapping cf_ward_id + cf_province_id from location_batdongsan...")
-    total_mapped = 0
-    batch_no = 0
-    while True:
-        batch_no += 1
-        sql_map = f"""
+    def _map(lo, hi):
+        sql_map = """
         UPDATE data_clean_v1 d
         JOIN location_batdongsan l
           ON CAST(d.src_ward_id AS UNSIGNED) = l.ward_id
@@ -81,26 +80,22 @@ def run_step1(domain, batch_size, max_batches=0):
           AND (d.cf_ward_id IS NULL OR d.cf_ward_id = 0)
           AND l.cafeland_ward_id_new IS NOT NULL
           AND l.cafeland_ward_id_new > 0
-        LIMIT {int(batch_size)}
+          AND d.id > %s AND d.id <= %s
         """
-        cursor.execute(sql_map, (domain,))
-        affected = cursor.rowcount
+        cursor.execute(sql_map, (domain, lo, hi))
         conn.commit()
-        total_mapped += affected
-        print(f"[Step1][Batch {batch_no}] mapped={affected:,} | total_mapped={total_mapped:,}")
-        if max_batches > 0 and batch_no >= max_batches:
-            print(f"[Step1] Reached max_batches={max_batches}, stopping map phase.")
-            break
-        if affected < batch_size:
-            break
+        return cursor.rowcount
+
+    total_mapped = IdRangeBatcher(
+        cursor, "domain = %s AND process_status = 0", (domain,),
+        span=batch_size, label="Step1", checkpoint=f"{SCRIPT_NAME}.{domain}.map",
+    ).run(_map, max_batches=max_batches)
 
     # 2) Finalize step 1 only for rows with valid ward mapping
     print("[Step1] Finalizing process_status=1 for rows with cf_ward_id > 0...")
-    total_finalized = 0
-    batch_no = 0
-    while True:
-        batch_no += 1
-        sql_finalize = f"""
+
+    def _finalize(lo, hi):
+        sql_finalize = """
         UPDATE data_clean_v1
         SET process_status = 1,
             last_script = %s
@@ -108,18 +103,16 @@ def run_step1(domain, batch_size, max_batches=0):
           AND process_status = 0
           AND cf_ward_id IS NOT NULL
           AND cf_ward_id > 0
-        LIMIT {int(batch_size)}
+          AND id > %s AND id <= %s
         """
-        cursor.execute(sql_finalize, (SCRIPT_NAME, domain))
-        affected = cursor.rowcount
+        cursor.execute(sql_finalize, (SCRIPT_NAME, domain, lo, hi))
         conn.commit()
-        total_finalized += affected
-        print(f"[Finalize][Batch {batch_no}] finalized={affected:,} | total_finalized={total_finalized:,}")
-        if max_batches > 0 and batch_no >= max_batches:
-            print(f"[Finalize] Reached max_batches={max_batches}, stopping finalize phase.")
-            break
-        if affected < batch_size:
-            break
+        return cursor.rowcount
+
+    total_finalized = IdRangeBatcher(
+        cursor, "domain = %s AND process_status = 0", (domain,),
+        span=batch_size, label="Finalize", checkpoint=f"{SCRIPT_NAME}.{domain}.finalize",
+    ).run(_finalize, max_batches=max_batches)
 
     pending_after = count_pending(cursor, domain)
     ready_after = count_ready_to_finalize(cursor, domain)
@@ -139,7 +132,7 @@ def run_step1(domain, batch_size, max_batches=0):
 def main():
     parser = argparse.ArgumentParser(description="Step 1 map khu vuc for batdongsan domain")
     parser.add_argument("--domain", default=DEFAULT_DOMAIN, help="Domain in data_clean_v1")
-    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Update limit per batch")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Initial id span per batch (auto-adjusted)")
     parser.add_argument("--max-batches", type=int, default=0, help="Safety cap for test (0=run to completion)")
     args = parser.parse_args()
     run_step1(domain=args.domain, batch_size=args.batch_size, max_batches=args.max_batches)
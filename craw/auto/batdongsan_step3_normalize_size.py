@@ -3,7 +3,8 @@ import pymysql
 import time
 import re
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
+
 DB_HOST = 'localhost'
 DB_USER = 'root'
 DB_PASS = ''
@@ -77,23 +78,21 @@ def main():
     print(f"=== Running {script_name} ===")
     start_time = time.time()
 
-    total_updated = 0
-    
-    while True:
+    def _batch(lo, hi):
         # Get Batch (Status = 2 from Step 2)
         # We only process Batdongsan domain
-        sql_get = f"""
+        sql_get = """
             SELECT id, src_size, price_vnd 
             FROM data_clean_v1 
             WHERE domain = 'batdongsan.com.vn'
             AND process_status = 2 
-            LIMIT {BATCH_SIZE}
+            AND id > %s AND id <= %s
         """
-        cursor.execute(sql_get)
+        cursor.execute(sql_get, (lo, hi))
         rows = cursor.fetchall()
         
         if not rows:
-            break
+            return 0
             
         batch_count = 0
         for row in rows:
@@ -123,11 +122,12 @@ def main():
             batch_count += 1
                 
         conn.commit()
-        total_updated += batch_count
-        print(f"  Batch: +{batch_count} rows (Total: {total_updated})")
-        
-        if len(rows) < BATCH_SIZE:
-            break
+        return batch_count
+
+    total_updated = IdRangeBatcher(
+        cursor, "domain = 'batdongsan.com.vn' AND process_status = 2", label="size",
+        checkpoint=f"{script_name}.size",
+    ).run(_batch)
 
     print(f"-> Parsed area for {total_updated} rows.")
     # Final Update Removed (Done in batch)
@@ -2,7 +2,8 @@
 import pymysql
 import time
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
+
 DB_HOST = 'localhost'
 DB_USER = 'root'
 DB_PASS = ''
@@ -19,26 +20,24 @@ def main():
     print(f"=== Running {script_name} ===")
     start_time = time.time()
 
-    total_updated = 0
-    
-    while True:
+    def _batch(lo, hi):
         # Get Batch (Status = 3 from Step 3)
         # We process Batdongsan domain
         # Join with scraped_details_flat to get the URL
-        sql_get = f"""
+        sql_get = """
             SELECT d.id, d.src_category_id, s.url
             FROM data_clean_v1 d
             JOIN scraped_details_flat s ON d.ad_id = s.matin
             WHERE d.domain = 'batdongsan.com.vn'
               AND s.domain = 'batdongsan.com.vn'
               AND d.process_status = 3 
-            LIMIT {BATCH_SIZE}
+            AND d.id > %s AND d.id <= %s
         """
-        cursor.execute(sql_get)
+        cursor.execute(sql_get, (lo, hi))
         rows = cursor.fetchall()
         
         if not rows:
-            break
+            return 0
             
         batch_count = 0
         for row in rows:
@@ -66,11 +65,12 @@ def main():
             batch_count += 1
                 
         conn.commit()
-        total_updated += batch_count
-        print(f"  Batch: +{batch_count} rows (Total: {total_updated})")
-        
-        if len(rows) < BATCH_SIZE:
-            break
+        return batch_count
+
+    total_updated = IdRangeBatcher(
+        cursor, "domain = 'batdongsan.com.vn' AND process_status = 3", label="type",
+        checkpoint=f"{script_name}.type",
+    ).run(_batch)
 
     print(f"-> Normalized Type/Category for {total_updated} rows.")
     print("=== Finished ===")
@@ -4,7 +4,8 @@ import time
 import unicodedata
 import re
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
+
 DB_HOST = 'localhost'
 DB_USER = 'root'
 DB_PASS = ''
@@ -34,7 +35,6 @@ def main():
     start_time = time.time()
 
     total_scanned = 0
-    total_mapped = 0
     
     # 0. Ensure column exists (Just in case, though likely exists from other scripts)
     try:
@@ -43,21 +43,22 @@ def main():
     except Exception:
         pass
 
-    while True:
+    def _batch(lo, hi):
+        nonlocal total_scanned
         # Get Batch (Status = 4 from Step 4)
-        sql_get = f"""
+        sql_get = """
             SELECT id, std_trans_type, std_category 
             FROM data_clean_v1 
             WHERE domain = 'batdongsan.com.vn'
               AND process_status = 4 
               AND median_group IS NULL
-            LIMIT {BATCH_SIZE}
+              AND id > %s AND id <= %s
         """
-        cursor.execute(sql_get)
+        cursor.execute(sql_get, (lo, hi))
         rows = cursor.fetchall()
         
         if not rows:
-            break
+            return 0
             
         batch_scanned = 0
         batch_mapped = 0
@@ -120,14 +121,13 @@ def main():
                 
         conn.commit()
         total_scanned += batch_scanned
-        total_mapped += batch_mapped
-        print(
-            f"  Batch: scanned={batch_scanned}, mapped={batch_mapped} "
-            f"(Totals: scanned={total_scanned}, mapped={total_mapped})"
-        )
+        return batch_mapped
 
-        if len(rows) < BATCH_SIZE or batch_mapped == 0:
-            break
+    # Dòng chưa map được ở lại Step 4, keyset đi qua chúng đúng 1 lần mỗi lượt chạy
+    total_mapped = IdRangeBatcher(
+        cursor, "domain = 'batdongsan.com.vn' AND process_status = 4", label="median_group",
+        checkpoint=f"{script_name}.median_group",
+    ).run(_batch)
 
     print(f"-> Grouped Median for {total_mapped} rows (scanned {total_scanned} rows).")
     print("=== Finished ===")
@@ -1,7 +1,8 @@
 import pymysql
 import time
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
+
 DB_HOST = "localhost"
 DB_USER = "root"
 DB_PASS = ""
@@ -32,15 +33,13 @@ def main():
     except Exception:
         pass
 
-    total_updated = 0
-
     # 1) Compute std_date in batches for Step 5 rows.
     # Priority:
     #   - orig_list_time in YYYYMMDD (from source date mapping)
     #   - fallback update_time as unix timestamp (seconds / milliseconds)
-    while True:
+    def _batch(lo, hi):
         now_ts = int(time.time())
-        sql_update = f"""
+        sql_update = """
             UPDATE data_clean_v1
             SET
               std_date = COALESCE(
@@ -64,18 +63,16 @@ def main():
                 (orig_list_time IS NOT NULL AND orig_list_time > 0)
                 OR (update_time IS NOT NULL AND update_time > 0)
               )
-            ORDER BY id
-            LIMIT {BATCH_SIZE}
+              AND id > %s AND id <= %s
         """
-        cursor.execute(sql_update, (now_ts, script_name, DOMAIN))
-        rows = cursor.rowcount
+        cursor.execute(sql_update, (now_ts, script_name, DOMAIN, lo, hi))
         conn.commit()
-        if rows == 0:
-            break
-        total_updated += rows
-        print(f"  Batch: +{rows} rows (Total: {total_updated})")
-        if rows < BATCH_SIZE:
-            break
+        return cursor.rowcount
+
+    total_updated = IdRangeBatcher(
+        cursor, "domain = %s AND process_status = 5", (DOMAIN,), label="date",
+        checkpoint=f"{script_name}.date",
+    ).run(_batch)
 
     # 2) Finalize only rows having valid std_date.
     cursor.execute(
@@ -9,11 +9,19 @@ Rules:
   - if same prj_id already appeared in an older row: mark row status=POSTAGAIN
   - append repost row id to original row's history CSV
 - set history_flag=2 (processed by this script version), so never re-process this row
+
+--stream: thay vì 1 lookup idx_bds_prj_lookup/idx_bds_urlbase_lookup + 1-2 UPDATE cho mỗi
+dòng, đọc cả domain 1 lượt theo (batch_date, id) và giữ map prj_id -> dòng gốc,
+md5(url_base) -> dòng gốc trong RAM. POSTAGAIN/history_flag/history được ghi bằng
+UPDATE ... CASE theo chunk, checkpoint (batch_date, id) sau mỗi chunk để --resume.
 """
 
 import argparse
 import hashlib
+import json
+import os
 import time
+from array import array
 from datetime import datetime
 
 import pymysql
@@ -32,6 +40,10 @@ DB_CONFIG = {
 }
 
 DOMAIN = "batdongsan.com.vn"
+STREAM_CHUNK = 5000
+CASE_CHUNK = 500
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".checkpoints")
+STREAM_CHECKPOINT = os.path.join(CHECKPOINT_DIR, "bds_backfill_postagain_history.stream.json")
 
 
 def now_str():
@@ -366,6 +378,296 @@ def process_once(conn, batch_size=3, dry_run=False, verbose_first_seen=False):
     return {"scanned": len(rows), "repost": repost_count, "history_updated": hist_update_count}
 
 
+# ---------------------------------------------------------------------------
+# --stream: 1 lượt đọc theo (batch_date, id), map trong RAM, UPDATE CASE theo chunk
+# ---------------------------------------------------------------------------
+
+def ensure_stream_index(conn):
+    """Keyset (batch_date, id) trên toàn domain cần index riêng (idx_bds_history_scan có history_flag đứng trước)."""
+    if index_exists(conn, "collected_links", "idx_bds_domain_batch"):
+        return False
+    print("[INDEX] Adding idx_bds_domain_batch(domain, batch_date, id) ...")
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE collected_links ADD INDEX idx_bds_domain_batch (domain, batch_date, id)")
+    conn.commit()
+    print("[INDEX] Added idx_bds_domain_batch.")
+    return True
+
+
+def _md5_key(md5_hex):
+    """64 bit đầu của md5 -> int (key dict gọn hơn chuỗi 32 ký tự)."""
+    return int(md5_hex[:16], 16) if md5_hex else None
+
+
+def iter_domain_rows(conn, chunk_size=STREAM_CHUNK, after=None):
+    """
+    Duyệt collected_links của DOMAIN theo (batch_date, id) bằng keyset, giống ORDER BY batch_date, id
+    của MySQL (batch_date NULL đứng trước). after=(batch_date, id) bỏ qua các dòng <= vị trí đó.
+    Yield từng chunk (list dict).
+    """
+    cols = "id, prj_id, batch_date, status, url, url_base, url_base_md5, history_flag"
+    null_phase = after is None or after[0] is None
+    last_id = after[1] if after else 0
+    last_batch = after[0] if after else None
+
+    with conn.cursor() as cur:
+        while null_phase:
+            cur.execute(
+                f"""
+                SELECT {cols}
+                FROM collected_links
+                WHERE domain = %s AND batch_date IS NULL AND id > %s
+                ORDER BY id
+                LIMIT %s
+                """,
+                (DOMAIN, last_id, chunk_size),
+            )
+            rows = cur.fetchall()
+            if rows:
+                last_id = int(rows[-1]["id"])
+                yield rows
+            if len(rows) < chunk_size:
+                null_phase = False
+                last_batch, last_id = None, 0
+
+        while True:
+            if last_batch is None:
+                cur.execute(
+                    f"""
+                    SELECT {cols}
+                    FROM collected_links
+                    WHERE domain = %s AND batch_date IS NOT NULL
+                    ORDER BY batch_date, id
+                    LIMIT %s
+                    """,
+                    (DOMAIN, chunk_size),
+                )
+            else:
+                cur.execute(
+                    f"""
+                    SELECT {cols}
+                    FROM collected_links
+                    WHERE domain = %s
+                      AND (batch_date > %s OR (batch_date = %s AND id > %s))
+                    ORDER BY batch_date, id
+                    LIMIT %s
+                    """,
+                    (DOMAIN, last_batch, last_batch, last_id, chunk_size),
+                )
+            rows = cur.fetchall()
+            if not rows:
+                return
+            last_batch, last_id = rows[-1]["batch_date"], int(rows[-1]["id"])
+            yield rows
+            if len(rows) < chunk_size:
+                return
+
+
+class OriginIndex:
+    """
+    Dòng gốc (sớm nhất theo (batch_date, id)) của mỗi prj_id / md5(url_base).
+    Giá trị map là số thứ tự trong luồng đọc, ids[seq] = id: so sánh 2 ứng viên chỉ cần so seq.
+    """
+
+    def __init__(self):
+        self.by_prj = {}
+        self.by_md5 = {}
+        self.ids = array("q")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def observe(self, row_id, prj_id, md5_key):
+        """Ghi nhận 1 dòng theo thứ tự đọc, trả về id dòng gốc (chính nó nếu là lần đầu)."""
+        seq = len(self.ids)
+        self.ids.append(row_id)
+        candidates = []
+        if prj_id:
+            candidates.append(self.by_prj.setdefault(prj_id, seq))
+        if md5_key is not None:
+            candidates.append(self.by_md5.setdefault(md5_key, seq))
+        return self.ids[min(candidates)] if candidates else row_id
+
+
+def _case_update(cur, column, values, where_extra=""):
+    """UPDATE collected_links SET column = CASE id WHEN .. THEN .. END WHERE id IN (..), chia CASE_CHUNK."""
+    items = list(values.items())
+    for pos in range(0, len(items), CASE_CHUNK):
+        chunk = items[pos:pos + CASE_CHUNK]
+        case_sql = " ".join(["WHEN %s THEN %s"] * len(chunk))
+        ph = ",".join(["%s"] * len(chunk))
+        params = [x for pair in chunk for x in pair] + [k for k, _ in chunk] + [DOMAIN]
+        cur.execute(
+            f"""
+            UPDATE collected_links
+            SET {column} = CASE id {case_sql} END
+            WHERE id IN ({ph}) AND domain = %s {where_extra}
+            """,
+            params,
+        )
+
+
+def apply_stream_chunk(conn, processed, reposts, appends, dry_run=False):
+    """
+    processed: {id: (url_base, url_base_md5)} các dòng pending của chunk -> history_flag=2
+    reposts:   set id -> status POSTAGAIN
+    appends:   {original_id: [repost_id, ...]} -> nối vào history hiện tại của dòng gốc
+    Trả về số dòng gốc đổi history.
+    """
+    if not processed and not appends:
+        return 0
+    histories = {}
+    with conn.cursor() as cur:
+        oids = list(appends)
+        for pos in range(0, len(oids), CASE_CHUNK):
+            chunk = oids[pos:pos + CASE_CHUNK]
+            ph = ",".join(["%s"] * len(chunk))
+            cur.execute(f"SELECT id, history FROM collected_links WHERE id IN ({ph})", chunk)
+            for r in cur.fetchall():
+                histories[int(r["id"])] = r.get("history")
+
+        new_history = {}
+        for oid, rids in appends.items():
+            hist_ids = normalize_history_ids(histories.get(oid))
+            before = len(hist_ids)
+            for rid in rids:
+                if str(rid) not in hist_ids:
+                    hist_ids.append(str(rid))
+            if len(hist_ids) != before:
+                new_history[oid] = ",".join(hist_ids)
+
+        if dry_run:
+            return len(new_history)
+
+        ids = list(processed)
+        for pos in range(0, len(ids), CASE_CHUNK):
+            chunk = ids[pos:pos + CASE_CHUNK]
+            base_case = " ".join(["WHEN %s THEN %s"] * len(chunk))
+            status_ids = [i for i in chunk if i in reposts]
+            status_sql = "status"
+            status_params = []
+            if status_ids:
+                status_sql = f"CASE WHEN id IN ({','.join(['%s'] * len(status_ids))}) THEN 'POSTAGAIN' ELSE status END"
+                status_params = status_ids
+            ph = ",".join(["%s"] * len(chunk))
+            cur.execute(
+                f"""
+                UPDATE collected_links
+                SET status = {status_sql},
+                    history_flag = 2,
+                    url_base = CASE id {base_case} END,
+                    url_base_md5 = CASE id {base_case} END
+                WHERE id IN ({ph}) AND domain = %s
+                """,
+                status_params
+                + [x for i in chunk for x in (i, processed[i][0])]
+                + [x for i in chunk for x in (i, processed[i][1])]
+                + chunk
+                + [DOMAIN],
+            )
+        _case_update(cur, "history", new_history)
+    conn.commit()
+    return len(new_history)
+
+
+def _batch_key(batch_date):
+    """batch_date dạng so sánh được (chuỗi YYYYMMDD), None giữ nguyên (đứng trước mọi giá trị)."""
+    return None if batch_date is None else str(batch_date)
+
+
+def load_stream_checkpoint():
+    try:
+        with open(STREAM_CHECKPOINT, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return (_batch_key(data.get("batch_date")), int(data["id"]))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_stream_checkpoint(batch_date, last_id, stats):
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    tmp = STREAM_CHECKPOINT + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"batch_date": _batch_key(batch_date), "id": int(last_id), "stats": stats, "updated_at": now_str()}, f)
+    os.replace(tmp, STREAM_CHECKPOINT)
+
+
+def clear_stream_checkpoint():
+    try:
+        os.remove(STREAM_CHECKPOINT)
+    except OSError:
+        pass
+
+
+def process_stream(conn, chunk_size=STREAM_CHUNK, dry_run=False, resume=False):
+    """
+    1 lượt đọc toàn domain. Dòng trước checkpoint (khi --resume) chỉ dùng để dựng lại map
+    (đã ghi ở lần chạy trước); dòng sau checkpoint có history_flag NULL/1 và prj_id > 0 được xử lý.
+    """
+    checkpoint = load_stream_checkpoint() if resume else None
+    if checkpoint:
+        print(f"[STREAM] resume after batch_date={checkpoint[0]} id={checkpoint[1]} (rebuilding map first)")
+    index = OriginIndex()
+    stats = {"read": 0, "scanned": 0, "repost": 0, "history_updated": 0}
+    replaying = checkpoint is not None
+    started = time.time()
+
+    for rows in iter_domain_rows(conn, chunk_size):
+        processed = {}
+        reposts = set()
+        appends = {}
+        for r in rows:
+            cid = int(r["id"])
+            c_base = (r.get("url_base") or "").strip() or url_base_from_url(r.get("url") or "")
+            c_md5 = (r.get("url_base_md5") or "").strip() or url_base_md5(c_base)
+            prj_id = int(r["prj_id"]) if r.get("prj_id") else 0
+            oid = index.observe(cid, prj_id if prj_id > 0 else None, _md5_key(c_md5))
+
+            if replaying:
+                if not _position_after(r["batch_date"], cid, checkpoint):
+                    continue
+                replaying = False
+            pending = prj_id > 0 and r.get("history_flag") in (None, 1)
+            if not pending:
+                continue
+            processed[cid] = (c_base, c_md5)
+            if oid != cid:
+                reposts.add(cid)
+                appends.setdefault(oid, []).append(cid)
+        stats["read"] += len(rows)
+        if processed or appends:
+            stats["scanned"] += len(processed)
+            stats["repost"] += len(reposts)
+            stats["history_updated"] += apply_stream_chunk(conn, processed, reposts, appends, dry_run=dry_run)
+        if not replaying and not dry_run:
+            save_stream_checkpoint(rows[-1]["batch_date"], rows[-1]["id"], stats)
+        elapsed = max(time.time() - started, 1e-6)
+        print(
+            f"[STREAM] read={stats['read']} pending={stats['scanned']} repost={stats['repost']} "
+            f"history_updated={stats['history_updated']} keys(prj={len(index.by_prj)}, url={len(index.by_md5)}) "
+            f"rate={stats['read'] / elapsed:.0f} rows/s{' (replay)' if replaying else ''}"
+        )
+
+    if not dry_run:
+        clear_stream_checkpoint()
+    print(
+        f"[STREAM] done read={stats['read']} scanned={stats['scanned']} repost={stats['repost']} "
+        f"history_updated={stats['history_updated']} dry_run={dry_run}"
+    )
+    return stats
+
+
+def _position_after(batch_date, row_id, checkpoint):
+    """True nếu (batch_date, id) nằm sau checkpoint theo thứ tự đọc (NULL batch_date đứng trước)."""
+    c_batch, c_id = checkpoint
+    batch_date = _batch_key(batch_date)
+    if batch_date is None or c_batch is None:
+        if batch_date is None and c_batch is None:
+            return row_id > c_id
+        return c_batch is None
+    return (batch_date, row_id) > (c_batch, c_id)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Backfill POSTAGAIN/history using history_flag for batdongsan.")
     parser.add_argument("--batch-size", type=int, default=3, help="Rows per run (default 3).")
@@ -376,6 +678,13 @@ def main():
         help="Repeat batch runs until no history_flag IS NULL rows left.",
     )
     parser.add_argument("--sleep-seconds", type=float, default=0.2, help="Sleep between cycles when looping.")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Single pass over the domain in (batch_date, id) order with in-memory prj_id/url_base maps and bulk CASE updates.",
+    )
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK, help="Rows per chunk for --stream.")
+    parser.add_argument("--resume", action="store_true", help="--stream: continue after the last committed chunk.")
     parser.add_argument(
         "--verbose-first-seen",
         action="store_true",
@@ -395,6 +704,12 @@ def main():
     conn = pymysql.connect(**DB_CONFIG)
     try:
         ensure_schema_and_indexes(conn)
+        if args.stream:
+            # url_base/url_base_md5 thiếu được tính trong Python và ghi cùng UPDATE CASE
+            ensure_stream_index(conn)
+            process_stream(conn, max(100, int(args.chunk_size)), dry_run=args.dry_run, resume=args.resume)
+            print(f"=== END {now_str()} ===")
+            return
         filled = backfill_url_base_metadata(conn, limit_rows=max(5000, batch_size))
         if filled:
             print(f"[BACKFILL] url_base rows filled: {filled}")
@@ -12,16 +12,35 @@ Rules implemented from craw/thanhkhoan.md:
   * 25-75%    -> THANH_KHOAN_TRUNG_BINH
   * BOTTOM25% -> THANH_KHOAN_THAP
   * N < 10    -> KHONG_DU_DU_LIEU
+
+Incremental mode (--incremental):
+- Mỗi tháng lưu 1 file craw/auto/.thanhkhoan_cells/<YYYY-MM>.npz chứa mảng giá đã sort
+  của từng cell (scope, province, ward, street, median_group)
+- Watermark = cột data_clean_v1.tk_updated_at (ON UPDATE CURRENT_TIMESTAMP): chỉ đọc lại
+  các cặp (tháng, tỉnh) có dòng thay đổi từ lần build trước
+- Dòng bị DELETE hoặc đổi std_month/cf_province_id: trigger ghi cặp (tháng, tỉnh) CŨ vào
+  bảng thanhkhoan_dirty_cells, cũng được tính là touched; cell không còn dòng nào bị xoá
+  khỏi thanhkhoan_index
+- TRUNCATE/DROP data_clean_v1 (recreate_datacleanv1_mogi, create_data_clean_v1) không chạy
+  trigger: sau đó phải chạy --incremental --full. Nên lên lịch --full định kỳ (vd hằng tuần)
+- Quý/năm được merge từ các cell tháng, không quét lại data_clean_v1
+- Chỉ upsert các kỳ (tháng/quý/năm) bị ảnh hưởng; --full để build lại toàn bộ cell
+
+Metrics được tính vectorized cho mọi cell (compute_metrics_batch/assign_liquidity_levels_batch);
+compute_metrics/assign_liquidity_levels giữ làm bản tham chiếu, --self-check để đối chiếu 2 đường.
 """
 
 import argparse
+import json
 import math
+import os
 from collections import defaultdict
 from dataclasses import dataclass
 from datetime import datetime
 from statistics import median, pstdev
 from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 import pymysql
 from pymysql.cursors import SSDictCursor
 
@@ -37,6 +56,38 @@ DB_CONFIG = {
     "autocommit": True,
 }
 
+CELL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".thanhkhoan_cells")
+STATE_FILE = os.path.join(CELL_DIR, "state.json")
+WATERMARK_COLUMN = "tk_updated_at"
+DIRTY_TABLE = "thanhkhoan_dirty_cells"
+DIRTY_TRIGGERS = {
+    "trg_dcv1_tk_delete": (
+        "AFTER DELETE",
+        f"""
+        IF OLD.std_month IS NOT NULL AND OLD.cf_province_id IS NOT NULL THEN
+            INSERT INTO {DIRTY_TABLE} (std_month, cf_province_id) VALUES (OLD.std_month, OLD.cf_province_id)
+            ON DUPLICATE KEY UPDATE changed_at = CURRENT_TIMESTAMP;
+        END IF;
+        """,
+    ),
+    "trg_dcv1_tk_rekey": (
+        "AFTER UPDATE",
+        f"""
+        IF OLD.std_month IS NOT NULL AND OLD.cf_province_id IS NOT NULL
+           AND NOT (OLD.std_month <=> NEW.std_month AND OLD.cf_province_id <=> NEW.cf_province_id) THEN
+            INSERT INTO {DIRTY_TABLE} (std_month, cf_province_id) VALUES (OLD.std_month, OLD.cf_province_id)
+            ON DUPLICATE KEY UPDATE changed_at = CURRENT_TIMESTAMP;
+        END IF;
+        """,
+    ),
+}
+
+SCOPE_CODES = {"ward": 0, "region": 1, "street": 2}
+SCOPE_NAMES = {v: k for k, v in SCOPE_CODES.items()}
+
+# (scope, province_id, ward_id, street_id, median_group)
+CellKey = Tuple[str, Optional[int], Optional[int], Optional[int], int]
+
 
 @dataclass
 class AggRow:
@@ -126,6 +177,56 @@ def ensure_table(conn):
             pass
 
 
+def ensure_watermark_column(conn):
+    """Cột watermark cho incremental mode, tự cập nhật mỗi khi dòng data_clean_v1 bị UPDATE"""
+    with conn.cursor() as cur:
+        try:
+            cur.execute(
+                f"ALTER TABLE data_clean_v1 ADD COLUMN {WATERMARK_COLUMN} TIMESTAMP NOT NULL "
+                "DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"
+            )
+        except Exception:
+            pass
+        try:
+            cur.execute(f"ALTER TABLE data_clean_v1 ADD INDEX idx_{WATERMARK_COLUMN} ({WATERMARK_COLUMN})")
+        except Exception:
+            pass
+
+
+def ensure_change_log(conn) -> bool:
+    """
+    Bảng + trigger ghi lại (tháng, tỉnh) cũ của dòng bị xoá/đổi key, watermark không thấy được.
+    Trả False nếu không tạo được trigger (thiếu quyền TRIGGER...) -> chỉ --full mới bắt được các case này.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {DIRTY_TABLE} (
+                std_month VARCHAR(7) NOT NULL,
+                cf_province_id INT NOT NULL,
+                changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (std_month, cf_province_id),
+                INDEX idx_changed_at (changed_at)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """
+        )
+        cur.execute(
+            "SELECT TRIGGER_NAME FROM information_schema.TRIGGERS "
+            "WHERE TRIGGER_SCHEMA = DATABASE() AND EVENT_OBJECT_TABLE = 'data_clean_v1'"
+        )
+        existing = {r["TRIGGER_NAME"] for r in cur.fetchall()}
+        ok = True
+        for name, (timing, body) in DIRTY_TRIGGERS.items():
+            if name in existing:
+                continue
+            try:
+                cur.execute(f"CREATE TRIGGER {name} {timing} ON data_clean_v1 FOR EACH ROW BEGIN {body} END")
+            except Exception as e:
+                ok = False
+                print(f"WARNING: cannot create trigger {name} ({e}); deleted/re-keyed rows need --full")
+    return ok
+
+
 def quarter_of(month_str: str) -> str:
     year, mm = month_str.split("-")
     q = (int(mm) - 1) // 3 + 1
@@ -136,6 +237,18 @@ def year_of(month_str: str) -> str:
     return month_str.split("-")[0]
 
 
+def months_between(from_month: str, to_month: str) -> List[str]:
+    y, m = (int(x) for x in from_month.split("-"))
+    ty, tm = (int(x) for x in to_month.split("-"))
+    out: List[str] = []
+    while (y, m) <= (ty, tm):
+        out.append(f"{y:04d}-{m:02d}")
+        m += 1
+        if m > 12:
+            y, m = y + 1, 1
+    return out
+
+
 def safe_int(v) -> Optional[int]:
     if v is None:
         return None
@@ -183,12 +296,15 @@ def load_monthly_median_map(conn, from_month: str, to_month: str) -> Dict[Tuple[
     return out
 
 
-def stream_rows(conn, from_month: str, to_month: str, domain: str = ""):
+def stream_rows(conn, from_month: str, to_month: str, domain: str = "", provinces: Optional[List[int]] = None):
     where_domain = ""
     params: List = [from_month, to_month]
     if domain:
         where_domain = " AND domain = %s "
         params.append(domain)
+    if provinces:
+        where_domain += f" AND cf_province_id IN ({','.join(['%s'] * len(provinces))}) "
+        params.extend(provinces)
 
     sql = f"""
     SELECT
@@ -291,6 +407,144 @@ def assign_liquidity_levels(rows: List[AggRow]) -> None:
                 r.liquidity_level = "THANH_KHOAN_TRUNG_BINH"
 
 
+def compute_metrics_batch(
+    cells: List,
+    force_medians: List[Optional[float]],
+    presorted: bool = False,
+) -> Dict[str, np.ndarray]:
+    """
+    Bản vectorized của compute_metrics cho nhiều cell cùng lúc.
+    Giá của từng cell được sort rồi nối vào 1 mảng liền (offsets theo cell),
+    sau đó tính trim 10% / median / pstdev / CV / vitality cho mọi cell bằng numpy. NaN = None.
+    presorted=True: mảng giá của từng cell đã sort sẵn (cell tháng trong incremental mode).
+    """
+    g = len(cells)
+    counts = np.fromiter((len(c) for c in cells), dtype=np.int64, count=g)
+    offsets = np.zeros(g + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    total = int(offsets[-1])
+    prep = (lambda c: np.asarray(c, dtype=np.float64)) if presorted else (lambda c: np.sort(np.asarray(c, dtype=np.float64)))
+    values = np.concatenate([prep(c) for c in cells]) if total else np.empty(0, dtype=np.float64)
+    gid = np.repeat(np.arange(g, dtype=np.int64), counts)
+
+    # trim_10_percent: n <= 2 giữ nguyên, ngược lại cắt floor(n*0.1) mỗi đầu
+    cut = np.where(counts > 2, np.floor(counts * 0.1).astype(np.int64), 0)
+    trim_n = counts - 2 * cut
+    has = trim_n > 0
+
+    pos = np.arange(total, dtype=np.int64) - offsets[:-1][gid]
+    keep = (pos >= cut[gid]) & (pos < (counts - cut)[gid])
+    tv = values[keep]
+    tgid = gid[keep]
+
+    safe_n = np.where(has, trim_n, 1)
+    mean = np.bincount(tgid, weights=tv, minlength=g) / safe_n
+    dev = tv - mean[tgid]
+    sd = np.sqrt(np.bincount(tgid, weights=dev * dev, minlength=g) / safe_n)
+    sd = np.where(trim_n > 1, sd, 0.0)
+
+    lo = offsets[:-1] + cut
+    mid = np.minimum(lo + trim_n // 2, max(total - 1, 0))
+    odd = (trim_n % 2) == 1
+    if total:
+        med_odd = values[mid]
+        med_even = (values[np.maximum(mid - 1, 0)] + values[mid]) / 2
+        med = np.where(odd, med_odd, med_even)
+    else:
+        med = np.zeros(g, dtype=np.float64)
+
+    fm = np.array([np.nan if f is None else float(f) for f in force_medians], dtype=np.float64).reshape(g)
+    use_fm = np.nan_to_num(fm, nan=0.0) > 0
+    med = np.where(use_fm, fm, med)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cv = np.where(med > 0, sd / med, np.nan)
+        vitality = np.where(cv > 0, trim_n / cv, np.nan)
+
+    nan = np.full(g, np.nan)
+    return {
+        "raw_n": counts,
+        "trim_n": np.where(has, trim_n, 0),
+        "median": np.where(has, med, nan),
+        "stddev": np.where(has, sd, nan),
+        "cv": np.where(has, cv, nan),
+        "vitality": np.where(has, vitality, nan),
+        "data_median": has & use_fm,
+    }
+
+
+def assign_liquidity_levels_batch(rows: List[AggRow]) -> None:
+    """Bản vectorized của assign_liquidity_levels (cùng thứ tự ổn định khi vitality bằng nhau)"""
+    cohort_ids: Dict[Tuple, int] = {}
+    cohort = np.full(len(rows), -1, dtype=np.int64)
+    vitality = np.zeros(len(rows), dtype=np.float64)
+
+    for i, r in enumerate(rows):
+        if r.trimmed_rows < 10 or r.vitality_score is None:
+            r.liquidity_level = "KHONG_DU_DU_LIEU"
+            continue
+        if r.scope in ("ward", "street") and r.province_id is not None:
+            ck = (r.scope, r.period_type, r.period_value, r.province_id, r.median_group)
+        elif r.scope == "region":
+            ck = (r.scope, r.period_type, r.period_value, r.median_group)
+        else:
+            r.liquidity_level = None
+            continue
+        cohort[i] = cohort_ids.setdefault(ck, len(cohort_ids))
+        vitality[i] = r.vitality_score
+
+    idx = np.flatnonzero(cohort >= 0)
+    if not len(idx):
+        return
+    order = idx[np.lexsort((-vitality[idx], cohort[idx]))]
+    c = cohort[order]
+    sizes = np.bincount(c)
+    starts = np.zeros(len(sizes), dtype=np.int64)
+    np.cumsum(sizes[:-1], out=starts[1:])
+    rank = np.arange(len(order)) - starts[c]
+    n = sizes[c]
+    edge = np.maximum(1, np.ceil(n * 0.25).astype(np.int64))
+
+    levels = np.where(
+        rank < edge,
+        "THANH_KHOAN_CAO",
+        np.where(rank >= n - edge, "THANH_KHOAN_THAP", "THANH_KHOAN_TRUNG_BINH"),
+    )
+    for i, level in zip(order.tolist(), levels.tolist()):
+        rows[i].liquidity_level = level
+
+
+def delete_stale_rows(conn, rows: List[AggRow], periods: set) -> int:
+    """Xoá các cell của kỳ vừa tính lại mà không còn trong rows (mọi dòng đã bị xoá/chuyển đi)."""
+    keep = {
+        (r.period_type, r.period_value, r.scope, r.province_id, r.ward_id, r.street_id, r.median_group)
+        for r in rows
+    }
+    stale = []
+    with conn.cursor() as cur:
+        for pt, pv in sorted(periods):
+            cur.execute(
+                """
+                SELECT id, period_type, period_value, scope, province_id, ward_id, street_id, median_group
+                FROM thanhkhoan_index
+                WHERE period_type = %s AND period_value = %s
+                """,
+                (pt, pv),
+            )
+            for r in cur.fetchall():
+                key = (
+                    r["period_type"], r["period_value"], r["scope"],
+                    r["province_id"], r["ward_id"], r["street_id"], int(r["median_group"]),
+                )
+                if key not in keep:
+                    stale.append(r["id"])
+        for i in range(0, len(stale), 1000):
+            chunk = stale[i : i + 1000]
+            cur.execute(f"DELETE FROM thanhkhoan_index WHERE id IN ({','.join(['%s'] * len(chunk))})", chunk)
+    conn.commit()
+    return len(stale)
+
+
 def upsert_rows(conn, rows: List[AggRow]) -> int:
     if not rows:
         return 0
@@ -347,6 +601,115 @@ def upsert_rows(conn, rows: List[AggRow]) -> int:
     return len(data)
 
 
+def row_cells(r, ward_filter: Optional[int] = None, province_filter: Optional[int] = None):
+    """Các (scope, province_id, ward_id, street_id, median_group, price) cấp tháng của 1 dòng"""
+    province_id = safe_int(r["cf_province_id"])
+    ward_id = safe_int(r["cf_ward_id"])
+    street_id = safe_int(r["cf_street_id"])
+    mg = safe_int(r["median_group"])
+    price_m2 = float(r["price_m2"]) if r["price_m2"] is not None else None
+    land_ok = (r.get("land_price_status") == "DONE" and r.get("price_land") is not None and r.get("std_area") is not None and float(r["std_area"]) > 0)
+    land_price_m2 = (float(r["price_land"]) / float(r["std_area"])) if land_ok else None
+    domain_name = r.get("domain")
+
+    if province_id is None:
+        return
+    if province_filter is not None and province_id != province_filter:
+        return
+    if ward_filter is not None and ward_id != ward_filter:
+        return
+
+    metrics = []
+    if mg is not None:
+        metrics.append((mg, price_m2))
+    metrics.append((5, land_price_m2))
+
+    for group_id, metric_value in metrics:
+        if metric_value is None or metric_value <= 0:
+            continue
+        if ward_id is not None:
+            yield "ward", province_id, ward_id, None, group_id, metric_value
+        yield "region", province_id, None, None, group_id, metric_value
+        if domain_name == "nhadat" and street_id is not None and street_id > 0:
+            yield "street", province_id, None, street_id, group_id, metric_value
+
+
+def _force_median(key, monthly_median: Dict[Tuple[str, int, int, str], float]) -> Optional[float]:
+    pt, pv, scope, province_id, ward_id, street_id, mg = key
+    if pt != "month":
+        return None
+    if scope == "ward" and ward_id is not None:
+        return monthly_median.get(("ward", ward_id, mg, pv))
+    if scope == "street" and street_id is not None:
+        return monthly_median.get(("street", street_id, mg, pv))
+    if scope == "region" and province_id is not None:
+        return monthly_median.get(("region", province_id, mg, pv))
+    return None
+
+
+def _none_if_nan(v: float) -> Optional[float]:
+    return None if math.isnan(v) else v
+
+
+def make_agg_rows(grouped, monthly_median: Dict[Tuple[str, int, int, str], float], vectorized: bool = True, presorted: bool = False) -> List[AggRow]:
+    """vectorized=False: đường Python gốc (compute_metrics/assign_liquidity_levels), dùng để đối chiếu"""
+    out: List[AggRow] = []
+    keys = list(grouped.keys())
+
+    if not vectorized:
+        for key in keys:
+            raw_n, trim_n, med, sd, cv, vitality, med_src = compute_metrics(grouped[key], _force_median(key, monthly_median))
+            out.append(_agg_row(key, raw_n, trim_n, med, sd, cv, vitality, med_src))
+        assign_liquidity_levels(out)
+        return out
+
+    m = compute_metrics_batch(
+        [grouped[k] for k in keys],
+        [_force_median(k, monthly_median) for k in keys],
+        presorted=presorted,
+    )
+    cols = zip(
+        m["raw_n"].tolist(),
+        m["trim_n"].tolist(),
+        m["median"].tolist(),
+        m["stddev"].tolist(),
+        m["cv"].tolist(),
+        m["vitality"].tolist(),
+        m["data_median"].tolist(),
+    )
+    for key, (raw_n, trim_n, med, sd, cv, vitality, from_dm) in zip(keys, cols):
+        out.append(
+            _agg_row(
+                key, raw_n, trim_n,
+                _none_if_nan(med), _none_if_nan(sd), _none_if_nan(cv), _none_if_nan(vitality),
+                "data_median" if from_dm else "python",
+            )
+        )
+    assign_liquidity_levels_batch(out)
+    return out
+
+
+def _agg_row(key, raw_n, trim_n, med, sd, cv, vitality, med_src) -> AggRow:
+    pt, pv, scope, province_id, ward_id, street_id, mg = key
+    return AggRow(
+        period_type=pt,
+        period_value=pv,
+        scope=scope,
+        province_id=province_id,
+        ward_id=ward_id,
+        street_id=street_id,
+        median_group=mg,
+        raw_rows=raw_n,
+        trimmed_rows=trim_n,
+        median_price_m2=med,
+        stddev_price_m2=sd,
+        cv=cv,
+        vitality_score=vitality,
+        liquidity_level=None,
+        median_source=med_src,
+    )
+
+
 def build_index(conn, from_month: str, to_month: str, domain: str = "", ward_filter: Optional[int] = None, province_filter: Optional[int] = None) -> List[AggRow]:
     # Key => list prices
     # key: (period_type, period_value, scope, province_id, ward_id, street_id, median_group)
@@ -355,83 +718,248 @@ def build_index(conn, from_month: str, to_month: str, domain: str = "", ward_fil
     for r in stream_rows(conn, from_month, to_month, domain=domain):
         loaded += 1
         m = r["std_month"]
-        province_id = safe_int(r["cf_province_id"])
-        ward_id = safe_int(r["cf_ward_id"])
-        street_id = safe_int(r["cf_street_id"])
-        mg = safe_int(r["median_group"])
-        price_m2 = float(r["price_m2"]) if r["price_m2"] is not None else None
-        land_ok = (r.get("land_price_status") == "DONE" and r.get("price_land") is not None and r.get("std_area") is not None and float(r["std_area"]) > 0)
-        land_price_m2 = (float(r["price_land"]) / float(r["std_area"])) if land_ok else None
-        domain_name = r.get("domain")
+        periods = (("month", m), ("quarter", quarter_of(m)), ("year", year_of(m)))
+        for scope, province_id, ward_id, street_id, group_id, value in row_cells(r, ward_filter, province_filter):
+            for pt, pv in periods:
+                grouped[(pt, pv, scope, province_id, ward_id, street_id, group_id)].append(value)
 
-        if province_id is None:
-            continue
-        if province_filter is not None and province_id != province_filter:
-            continue
-        if ward_filter is not None and ward_id != ward_filter:
+    print(f"Loaded rows: {loaded:,}")
+
+    monthly_median = load_monthly_median_map(conn, from_month, to_month)
+    return make_agg_rows(grouped, monthly_median)
+
+
+# ----------------------------------------------------------------------
+# Incremental mode: cell tháng lưu trên đĩa + watermark
+# ----------------------------------------------------------------------
+
+def cell_path(month: str) -> str:
+    return os.path.join(CELL_DIR, f"{month}.npz")
+
+
+def save_month_cells(month: str, cells: Dict[CellKey, np.ndarray]) -> None:
+    """keys (N x 5, None = -1) + offsets (N+1) + values (giá đã sort, nối liền)"""
+    os.makedirs(CELL_DIR, exist_ok=True)
+    items = list(cells.items())
+    keys = np.array(
+        [
+            [SCOPE_CODES[scope], -1 if p is None else p, -1 if w is None else w, -1 if st is None else st, mg]
+            for (scope, p, w, st, mg), _ in items
+        ],
+        dtype=np.int64,
+    ).reshape(-1, 5)
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    np.cumsum([len(arr) for _, arr in items], out=offsets[1:])
+    values = np.concatenate([arr for _, arr in items]) if items else np.empty(0, dtype=np.float64)
+
+    path = cell_path(month)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, keys=keys, offsets=offsets, values=values)
+    os.replace(tmp, path)
+
+
+def load_month_cells(month: str) -> Optional[Dict[CellKey, np.ndarray]]:
+    path = cell_path(month)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        keys, offsets, values = data["keys"], data["offsets"], data["values"]
+    out: Dict[CellKey, np.ndarray] = {}
+    for i, (sc, p, w, st, mg) in enumerate(keys.tolist()):
+        key = (SCOPE_NAMES[sc], None if p < 0 else p, None if w < 0 else w, None if st < 0 else st, mg)
+        out[key] = values[offsets[i] : offsets[i + 1]]
+    return out
+
+
+def load_state() -> Dict:
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state: Dict) -> None:
+    os.makedirs(CELL_DIR, exist_ok=True)
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, STATE_FILE)
+
+
+def find_touched(conn, months: List[str], watermark: Optional[str]) -> Dict[str, Optional[set]]:
+    """month => set(province_id) cần đọc lại (None = cả tháng)"""
+    touched: Dict[str, Optional[set]] = {}
+    for m in months:
+        if watermark is None or not os.path.exists(cell_path(m)):
+            touched[m] = None
+    if watermark is None:
+        return touched
+
+    sql = f"""
+    SELECT DISTINCT std_month, cf_province_id
+    FROM data_clean_v1
+    WHERE {WATERMARK_COLUMN} >= %s
+      AND std_month >= %s AND std_month <= %s
+      AND cf_province_id IS NOT NULL
+    """
+    # (tháng, tỉnh) cũ của dòng đã bị xoá / chuyển sang tháng hoặc tỉnh khác
+    dirty_sql = f"""
+    SELECT std_month, cf_province_id
+    FROM {DIRTY_TABLE}
+    WHERE changed_at >= %s AND std_month >= %s AND std_month <= %s
+    """
+    with conn.cursor() as cur:
+        cur.execute(sql, (watermark, months[0], months[-1]))
+        rows = list(cur.fetchall())
+        cur.execute(dirty_sql, (watermark, months[0], months[-1]))
+        rows.extend(cur.fetchall())
+    for r in rows:
+        m = r["std_month"]
+        if m in touched and touched[m] is None:
             continue
+        pid = safe_int(r["cf_province_id"])
+        if pid is not None:
+            touched.setdefault(m, set()).add(pid)
+    return touched
 
-        def add_metric(group_id: int, metric_value: Optional[float]) -> None:
-            if metric_value is None or metric_value <= 0:
-                return
 
-            if ward_id is not None:
-                grouped[("month", m, "ward", province_id, ward_id, None, group_id)].append(metric_value)
-                grouped[("quarter", quarter_of(m), "ward", province_id, ward_id, None, group_id)].append(metric_value)
-                grouped[("year", year_of(m), "ward", province_id, ward_id, None, group_id)].append(metric_value)
+def rebuild_month_cells(conn, month: str, provinces: Optional[set]) -> int:
+    """Đọc lại data_clean_v1 của (tháng, các tỉnh) và thay các cell tương ứng trong file tháng"""
+    cells = {} if provinces is None else (load_month_cells(month) or {})
+    if provinces is not None:
+        cells = {k: v for k, v in cells.items() if k[1] not in provinces}
 
-            grouped[("month", m, "region", province_id, None, None, group_id)].append(metric_value)
-            grouped[("quarter", quarter_of(m), "region", province_id, None, None, group_id)].append(metric_value)
-            grouped[("year", year_of(m), "region", province_id, None, None, group_id)].append(metric_value)
+    grouped: Dict[CellKey, List[float]] = defaultdict(list)
+    loaded = 0
+    prov_list = sorted(provinces) if provinces is not None else None
+    for r in stream_rows(conn, month, month, provinces=prov_list):
+        loaded += 1
+        for scope, province_id, ward_id, street_id, group_id, value in row_cells(r):
+            grouped[(scope, province_id, ward_id, street_id, group_id)].append(value)
+
+    for key, prices in grouped.items():
+        cells[key] = np.sort(np.asarray(prices, dtype=np.float64))
+    save_month_cells(month, cells)
+    return loaded
 
-            if domain_name == "nhadat" and street_id is not None and street_id > 0:
-                grouped[("month", m, "street", province_id, None, street_id, group_id)].append(metric_value)
-                grouped[("quarter", quarter_of(m), "street", province_id, None, street_id, group_id)].append(metric_value)
-                grouped[("year", year_of(m), "street", province_id, None, street_id, group_id)].append(metric_value)
 
-        if mg is not None:
-            add_metric(mg, price_m2)
-        add_metric(5, land_price_m2)
+def merge_period_cells(months: List[str]) -> Dict[CellKey, np.ndarray]:
+    """Gộp cell của nhiều tháng (quý/năm) từ file, không đọc lại DB"""
+    parts: Dict[CellKey, List[np.ndarray]] = defaultdict(list)
+    for m in months:
+        for key, arr in (load_month_cells(m) or {}).items():
+            parts[key].append(arr)
+    return {
+        key: arrs[0] if len(arrs) == 1 else np.sort(np.concatenate(arrs), kind="mergesort")
+        for key, arrs in parts.items()
+    }
 
+
+def build_index_incremental(conn, from_month: str, to_month: str, full: bool = False) -> Tuple[List[AggRow], Dict, set]:
+    """
+    Trả về (rows của các kỳ bị ảnh hưởng, state mới, các kỳ đó).
+    Gọi delete_stale_rows + save_state sau khi upsert xong.
+    """
+    state = load_state()
+    watermark = None if full else state.get("watermark")
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT NOW() AS now")
+        run_started = str(cur.fetchone()["now"])
+
+    months = months_between(from_month, to_month)
+    touched = find_touched(conn, months, watermark)
+    print(f"Watermark: {watermark or '-'} | touched months: {len(touched)}")
+
+    loaded = 0
+    for m in sorted(touched):
+        provinces = touched[m]
+        n = rebuild_month_cells(conn, m, provinces)
+        loaded += n
+        scope_txt = "all provinces" if provinces is None else f"{len(provinces)} provinces"
+        print(f"  {m}: reloaded {n:,} rows ({scope_txt})")
     print(f"Loaded rows: {loaded:,}")
 
-    monthly_median = load_monthly_median_map(conn, from_month, to_month)
-    out: List[AggRow] = []
+    periods = set()
+    for m in touched:
+        periods.add(("month", m))
+        periods.add(("quarter", quarter_of(m)))
+        periods.add(("year", year_of(m)))
 
-    for (pt, pv, scope, province_id, ward_id, street_id, mg), prices in grouped.items():
-        force_median = None
+    grouped: Dict[Tuple, np.ndarray] = {}
+    for pt, pv in sorted(periods):
         if pt == "month":
-            if scope == "ward" and ward_id is not None:
-                force_median = monthly_median.get(("ward", ward_id, mg, pv))
-            elif scope == "street" and street_id is not None:
-                force_median = monthly_median.get(("street", street_id, mg, pv))
-            elif scope == "region" and province_id is not None:
-                force_median = monthly_median.get(("region", province_id, mg, pv))
+            period_months = [pv]
+        elif pt == "quarter":
+            period_months = [m for m in months if quarter_of(m) == pv]
+        else:
+            period_months = [m for m in months if year_of(m) == pv]
+        for (scope, province_id, ward_id, street_id, mg), arr in merge_period_cells(period_months).items():
+            grouped[(pt, pv, scope, province_id, ward_id, street_id, mg)] = arr
 
-        raw_n, trim_n, med, sd, cv, vitality, med_src = compute_metrics(prices, force_median)
+    monthly_median = load_monthly_median_map(conn, min(touched), max(touched)) if touched else {}
+    rows = make_agg_rows(grouped, monthly_median, presorted=True)
+    return rows, {"watermark": run_started}, periods
 
-        out.append(
-            AggRow(
-                period_type=pt,
-                period_value=pv,
-                scope=scope,
-                province_id=province_id,
-                ward_id=ward_id,
-                street_id=street_id,
-                median_group=mg,
-                raw_rows=raw_n,
-                trimmed_rows=trim_n,
-                median_price_m2=med,
-                stddev_price_m2=sd,
-                cv=cv,
-                vitality_score=vitality,
-                liquidity_level=None,
-                median_source=med_src,
-            )
-        )
 
-    assign_liquidity_levels(out)
-    return out
+def self_check(seed: int = 7, cells: int = 3000) -> bool:
+    """
+    Đối chiếu đường vectorized với đường Python gốc trên bộ dữ liệu giả (không cần DB).
+    raw/trimmed/median/level phải khớp tuyệt đối, stddev/cv/vitality sai số tương đối <= 1e-9.
+    """
+    rng = np.random.default_rng(seed)
+    grouped: Dict[Tuple, List[float]] = {}
+    monthly_median: Dict[Tuple[str, int, int, str], float] = {}
+    sizes = [1, 2, 3, 9, 10, 11, 19, 20, 21, 50, 200]
+    for i in range(cells):
+        pt, pv = [("month", "2026-01"), ("quarter", "2026-Q1"), ("year", "2026")][i % 3]
+        scope = ["ward", "region", "street"][i % 5 % 3]
+        province_id = int(rng.integers(1, 4))
+        ward_id = i if scope == "ward" else None
+        street_id = i if scope == "street" else None
+        mg = int(rng.integers(1, 6))
+        n = sizes[i % len(sizes)] if i % 4 else int(rng.integers(1, 400))
+        if i % 17 == 0:
+            prices = [50.0] * n  # stddev = 0
+        else:
+            prices = np.round(rng.lognormal(4, 0.6, n), 2 if i % 2 else 6).tolist()
+        key = (pt, pv, scope, province_id, ward_id, street_id, mg)
+        grouped[key] = prices
+        if pt == "month" and i % 7 == 0:
+            area = {"ward": ward_id, "street": street_id, "region": province_id}[scope]
+            monthly_median[(scope, area, mg, pv)] = float(rng.uniform(0, 100)) if i % 14 else 0.0
+    # cell trùng hệt nhau -> vitality bằng nhau, kiểm tra thứ tự ổn định
+    for j in range(5):
+        grouped[("month", "2026-01", "region", 99, None, None, j % 2 + 1)] = [10.0, 11.0, 12.0] * 5
+
+    ref = make_agg_rows(grouped, monthly_median, vectorized=False)
+    vec = make_agg_rows(grouped, monthly_median, vectorized=True)
+
+    def close(a, b):
+        if a is None or b is None:
+            return a is None and b is None
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+
+    bad = 0
+    for a, b in zip(ref, vec):
+        ok = (
+            a.raw_rows == b.raw_rows
+            and a.trimmed_rows == b.trimmed_rows
+            and a.median_price_m2 == b.median_price_m2
+            and a.median_source == b.median_source
+            and a.liquidity_level == b.liquidity_level
+            and close(a.stddev_price_m2, b.stddev_price_m2)
+            and close(a.cv, b.cv)
+            and close(a.vitality_score, b.vitality_score)
+        )
+        if not ok:
+            bad += 1
+            if bad <= 5:
+                print(f"MISMATCH\n  python: {a}\n  numpy:  {b}")
+    print(f"Self-check: {len(ref):,} cells, {bad} mismatches")
+    return bad == 0
 
 
 def parse_args():
@@ -442,12 +970,21 @@ def parse_args():
     p.add_argument("--ward-id", type=int, default=0, help="Only compute for one ward_id")
     p.add_argument("--province-id", type=int, default=0, help="Only compute for one province_id")
     p.add_argument("--truncate", action="store_true", help="Truncate target table before insert")
-    return p.parse_args()
+    p.add_argument("--incremental", action="store_true", help="Only recompute months/provinces touched since last build (cells in .thanhkhoan_cells)")
+    p.add_argument("--self-check", action="store_true", help="Compare numpy path with the Python reference on a synthetic fixture, then exit")
+    p.add_argument("--full", action="store_true", help="With --incremental: ignore watermark, rebuild all month cells in range")
+    args = p.parse_args()
+    if args.incremental and (args.domain.strip() or args.ward_id > 0 or args.province_id > 0):
+        p.error("--incremental does not support --domain/--ward-id/--province-id")
+    return args
 
 
 def main():
     args = parse_args()
 
+    if args.self_check:
+        raise SystemExit(0 if self_check() else 1)
+
     conn = get_conn()
     try:
         ensure_table(conn)
@@ -457,18 +994,38 @@ def main():
                 cur.execute("TRUNCATE TABLE thanhkhoan_index")
             print("Truncated thanhkhoan_index")
 
-        rows = build_index(
-            conn,
-            from_month=args.from_month,
-            to_month=args.to_month,
-            domain=args.domain.strip(),
-            ward_filter=(args.ward_id if args.ward_id > 0 else None),
-            province_filter=(args.province_id if args.province_id > 0 else None),
-        )
+        new_state = None
+        periods = None
+        if args.incremental:
+            ensure_watermark_column(conn)
+            ensure_change_log(conn)
+            # Bảng index vừa truncate thì các kỳ không bị chạm cũng phải ghi lại
+            rows, new_state, periods = build_index_incremental(
+                conn,
+                from_month=args.from_month,
+                to_month=args.to_month,
+                full=(args.full or args.truncate),
+            )
+        else:
+            rows = build_index(
+                conn,
+                from_month=args.from_month,
+                to_month=args.to_month,
+                domain=args.domain.strip(),
+                ward_filter=(args.ward_id if args.ward_id > 0 else None),
+                province_filter=(args.province_id if args.province_id > 0 else None),
+            )
         print(f"Computed rows: {len(rows):,}")
 
         written = upsert_rows(conn, rows)
         print(f"Upserted rows: {written:,}")
+
+        if periods:
+            removed = delete_stale_rows(conn, rows, periods)
+            print(f"Removed empty cells: {removed:,}")
+
+        if new_state is not None:
+            save_state(new_state)
     finally:
         conn.close()
 
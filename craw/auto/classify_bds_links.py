@@ -8,49 +8,16 @@ import time
 sys.path.append(os.getcwd())
 try:
     from craw.database import Database
+    from craw.bds_url_classifier import get_bds_mapping, get_classifier
 except ImportError:
     # Try adding parent dir if run from subdir
     sys.path.append(os.path.dirname(os.path.dirname(os.getcwd())))
     from craw.database import Database
+    from craw.bds_url_classifier import get_bds_mapping, get_classifier
 
 def get_mapping():
-    # Longest keys first to prevent partial matches
-    # e.g. ban-can-ho-chung-cu-mini before ban-can-ho-chung-cu
-    
-    # Format: Prefix -> (TradeType, PropertyType)
-    # TradeType: 'Bán' / 'Thuê'
-    
-    mapping = {
-        # --- BÁN ---
-        'ban-can-ho-chung-cu-mini': ('Bán', 'Căn hộ chung cư mini'),
-        'ban-can-ho-chung-cu': ('Bán', 'Căn hộ chung cư'),
-        'ban-nha-rieng': ('Bán', 'Nhà riêng'),
-        'ban-nha-biet-thu-lien-ke': ('Bán', 'Biệt thự liền kề'),
-        'ban-nha-mat-pho': ('Bán', 'Nhà mặt phố'),
-        'ban-shophouse-nha-pho-thuong-mai': ('Bán', 'Shophouse'),
-        'ban-dat-nen-du-an': ('Bán', 'Đất nền dự án'),
-        'ban-dat': ('Bán', 'Đất'),
-        'ban-trang-trai-khu-nghi-duong': ('Bán', 'Trang trại/Khu nghỉ dưỡng'),
-        'ban-condotel': ('Bán', 'Condotel'),
-        'ban-kho-nha-xuong': ('Bán', 'Kho, nhà xưởng'),
-        'ban-loai-bat-dong-san-khac': ('Bán', 'BĐS khác'),
-        
-        # --- THUÊ ---
-        'cho-thue-can-ho-chung-cu-mini': ('Thuê', 'Căn hộ chung cư mini'),
-        'cho-thue-can-ho-chung-cu': ('Thuê', 'Căn hộ chung cư'),
-        'cho-thue-nha-rieng': ('Thuê', 'Nhà riêng'),
-        'cho-thue-nha-biet-thu-lien-ke': ('Thuê', 'Biệt thự liền kề'),
-        'cho-thue-nha-mat-pho': ('Thuê', 'Nhà mặt phố'),
-        'cho-thue-shophouse-nha-pho-thuong-mai': ('Thuê', 'Shophouse'),
-        'cho-thue-nha-tro-phong-tro': ('Thuê', 'Nhà trọ, phòng trọ'),
-        'cho-thue-van-phong': ('Thuê', 'Văn phòng'),
-        'cho-thue-sang-nhuong-cua-hang-ki-ot': ('Thuê', 'Cửa hàng, Ki-ốt'),
-        'cho-thue-kho-nha-xuong-dat': ('Thuê', 'Kho, nhà xưởng, đất'),
-        'cho-thue-loai-bat-dong-san-khac': ('Thuê', 'BĐS khác'),
-    }
-    
-    # Sort by length descending
-    return dict(sorted(mapping.items(), key=lambda x: len(x[0]), reverse=True))
+    # Prefix -> (TradeType, PropertyType), longest first
+    return get_bds_mapping()
 
 def main():
     parser = argparse.ArgumentParser(description="Classify Batdongsan Links")
@@ -89,7 +56,7 @@ def main():
         print("No unclassified links found.")
         return
 
-    mapping = get_mapping()
+    classifier = get_classifier(get_mapping())
     updates = [] # List of (loaihinh, trade_type, id)
     
     matches = 0
@@ -102,19 +69,13 @@ def main():
             lid = row[0]
             url = row[1]
             
-        # Parse URL Path
-        # Remove https://batdongsan.com.vn/
-        path = url.replace("https://batdongsan.com.vn/", "").replace("https://www.batdongsan.com.vn/", "")
-        
-        found = False
-        for prefix, (trade, ptype) in mapping.items():
-            if path.startswith(prefix + "-") or path == prefix:
-                updates.append((ptype, trade, lid))
-                found = True
-                matches += 1
-                if args.dry_run and matches <= 10:
-                    print(f"[PREVIEW] {url} -> Type: {ptype}, Trade: {trade}")
-                break
+        # Trie theo slug đầu path, lấy prefix dài nhất khớp
+        ptype, trade = classifier.classify(url)
+        if ptype:
+            updates.append((ptype, trade, lid))
+            matches += 1
+            if args.dry_run and matches <= 10:
+                print(f"[PREVIEW] {url} -> Type: {ptype}, Trade: {trade}")
         
         # if not found and args.dry_run:
         #    print(f"[Unmatched] {url}")
@@ -10,6 +10,8 @@ from decimal import Decimal
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from database import Database
+from location_resolver import get_resolver
+from datafull_batch import BatchStats, prefetch_existing, prefetch_first_images, write_batch
 
 
 SOURCE_DOMAIN = "alonhadat.com.vn"
@@ -65,15 +67,6 @@ def normalize_text(value):
     return value.strip()
 
 
-def normalize_admin_name(value):
-    value = normalize_text(value)
-    if not value:
-        return ""
-    value = re.sub(r"^(phuong|xa|thi tran)\s+", "", value)
-    value = re.sub(r"^(tp\.?|thanh pho|tinh)\s+", "", value)
-    return value.strip()
-
-
 def clean_raw(value):
     if value is None:
         return None
@@ -207,128 +200,6 @@ def slugify(value):
     return base or None
 
 
-def build_location_maps(conn):
-    province_new = {}
-    province_old = {}
-    child_new = {}
-    child_old = {}
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT new_city_id, new_city_parent_id, new_city_name, old_city_name, action_type
-            FROM transaction_city_merge
-            """
-        )
-        for row in cur.fetchall():
-            new_city_id = int(row["new_city_id"])
-            parent_id = int(row["new_city_parent_id"] or 0)
-            action_type = int(row["action_type"] or 0)
-            new_name = clean_raw(row.get("new_city_name"))
-            old_name = clean_raw(row.get("old_city_name"))
-            if parent_id == 0:
-                if new_name:
-                    key = normalize_admin_name(new_name)
-                    province_new.setdefault(key, []).append((action_type, new_city_id, new_name, old_name))
-                if old_name:
-                    key = normalize_admin_name(old_name)
-                    province_old.setdefault(key, []).append((action_type, new_city_id, new_name, old_name))
-            else:
-                if new_name:
-                    key = (parent_id, normalize_admin_name(new_name))
-                    child_new.setdefault(key, []).append((action_type, new_city_id, new_name, old_name))
-                if old_name:
-                    key = (parent_id, normalize_admin_name(old_name))
-                    child_old.setdefault(key, []).append((action_type, new_city_id, new_name, old_name))
-    return province_new, province_old, child_new, child_old
-
-
-def pick_best(candidates):
-    if not candidates:
-        return None
-    return sorted(candidates, key=lambda x: (x[0] != 0, x[1]))[0]
-
-
-def parse_location(diachi, province_new, province_old, child_new, child_old):
-    diachi = clean_raw(diachi)
-    if not diachi:
-        return {
-            "province_id": None,
-            "ward_id": None,
-            "street": None,
-            "city_name_raw": None,
-            "ward_name_raw": None,
-            "address_case": None,
-        }
-
-    parts = [p.strip() for p in diachi.split(",")]
-    parts = [p for p in parts if p]
-    if not parts:
-        return {
-            "province_id": None,
-            "ward_id": None,
-            "street": None,
-            "city_name_raw": None,
-            "ward_name_raw": None,
-            "address_case": None,
-        }
-
-    city_name_raw = parts[-1]
-    city_key = normalize_admin_name(city_name_raw)
-    province_row = pick_best(province_new.get(city_key, [])) or pick_best(province_old.get(city_key, []))
-    province_id = province_row[1] if province_row else None
-
-    ward_name_raw = parts[-2] if len(parts) >= 2 else None
-    ward_key = normalize_admin_name(ward_name_raw) if ward_name_raw else None
-    ward_row = None
-    if province_id and ward_key:
-        ward_row = pick_best(child_new.get((province_id, ward_key), []))
-        if not ward_row:
-            ward_row = pick_best(child_old.get((province_id, ward_key), []))
-    ward_id = ward_row[1] if ward_row else None
-
-    street = None
-    if len(parts) >= 3:
-        street = clean_raw(parts[0])
-
-    return {
-        "province_id": province_id,
-        "ward_id": ward_id,
-        "street": street,
-        "city_name_raw": city_name_raw,
-        "ward_name_raw": ward_name_raw,
-        "address_case": "new" if ward_row and any(x for x in child_new.get((province_id, ward_key), [])) else ("old" if ward_row else None),
-    }
-
-
-def build_project_merge_map(conn):
-    project_map = {}
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT
-                alonhadat_project_name,
-                duan_id,
-                duan_ten
-            FROM duan_alonhadat_duan_merge
-            WHERE alonhadat_project_name IS NOT NULL
-              AND alonhadat_project_name <> ''
-              AND duan_id IS NOT NULL
-            """
-        )
-        for row in cur.fetchall():
-            raw_name = clean_project_name(row.get("alonhadat_project_name"))
-            if not raw_name:
-                continue
-            key = normalize_text(raw_name)
-            prev = project_map.get(key)
-            if not prev or int(row["duan_id"]) > int(prev["project_id"]):
-                project_map[key] = {
-                    "project_id": int(row["duan_id"]),
-                    "project_name": clean_raw(row.get("duan_ten")) or raw_name,
-                }
-    return project_map
-
-
 def map_rule(loaibds, trade_type):
     loaibds = clean_raw(loaibds)
     trade_type = clean_raw(trade_type)
@@ -361,40 +232,27 @@ def infer_stratum_id(phaply):
     return STRATUM_RULES.get(phaply, 8)
 
 
-def get_image_for_detail(cur, detail_id):
-    cur.execute(
-        """
-        SELECT image_url
-        FROM scraped_detail_images
-        WHERE detail_id = %s
-        ORDER BY idx ASC, id ASC
-        LIMIT 1
-        """,
-        (detail_id,),
-    )
-    row = cur.fetchone()
-    return row["image_url"] if row else None
-
-
-def build_payload(row, province_new, province_old, child_new, child_old, project_merge_map, cur):
+def build_payload(row, loc, resolver, img):
+    """loc: kết quả resolver.resolve_many() cho row["diachi"], img: ảnh đầu tiên (prefetch_first_images)"""
     trade_type = row.get("trade_type")
     rule = map_rule(row.get("loaibds"), trade_type)
     if not rule:
         return None, "skip_type"
 
-    loc = parse_location(row.get("diachi"), province_new, province_old, child_new, child_old)
     if not loc["province_id"] or not loc["ward_id"]:
         return None, "skip_region"
 
     raw_project_name = clean_project_name(row.get("thuocduan"))
     merged_project = None
     if raw_project_name:
-        merged_project = project_merge_map.get(normalize_text(raw_project_name))
+        hit = resolver.project("alonhadat", raw_project_name)
+        if hit:
+            merged_project = {"project_id": hit[0], "project_name": hit[1] or raw_project_name}
     payload = {
         "title": clean_raw(row.get("title")),
         "address": None,
         "posted_at": parse_posted_at(row.get("ngaydang")),
-        "img": get_image_for_detail(cur, row["id"]),
+        "img": img,
         "price": parse_price_to_vnd(row.get("khoanggia")),
         "area": parse_area(row.get("dientich")),
         "description": clean_raw(row.get("mota")),
@@ -494,6 +352,25 @@ def fetch_preview_rows(conn, limit, matin_list=None):
         return cur.fetchall()
 
 
+def fetch_batch(conn, last_id, limit):
+    """Keyset theo id tăng dần cho chế độ --batch-size."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT *
+            FROM scraped_details_flat
+            WHERE domain = %s
+              AND id > %s
+              AND COALESCE(datafull_converted, 0) = 0
+              AND datafull_skip_reason IS NULL
+            ORDER BY id ASC
+            LIMIT %s
+            """,
+            (SOURCE_DOMAIN, last_id, limit),
+        )
+        return cur.fetchall()
+
+
 def print_preview(row, payload, skip_reason=None):
     print("=" * 100)
     print(f"link_id={row['id']} matin={row.get('matin')} title={row.get('title')}")
@@ -555,59 +432,40 @@ INSERT_COLUMNS = [
 ]
 
 
-def insert_payload(cur, payload):
-    placeholders = ", ".join(["%s"] * len(INSERT_COLUMNS))
-    sql = f"""
-        INSERT INTO data_full (
-            {", ".join(INSERT_COLUMNS)}
-        ) VALUES (
-            {placeholders}
-        )
-    """
-    values = [payload.get(col.replace("`", "")) for col in INSERT_COLUMNS]
-    cur.execute(sql, values)
-    return cur.lastrowid
-
-
-def mark_converted(cur, sdf_id):
-    cur.execute(
-        """
-        UPDATE scraped_details_flat
-        SET datafull_converted = 1,
-            datafull_skip_reason = NULL,
-            datafull_skip_at = NULL
-        WHERE id = %s
-        """,
-        (sdf_id,),
-    )
-
-
-def mark_skipped(cur, sdf_id, skip_reason):
-    cur.execute(
-        """
-        UPDATE scraped_details_flat
-        SET datafull_skip_reason = %s,
-            datafull_skip_at = NOW()
-        WHERE id = %s
-        """,
-        (skip_reason, sdf_id),
-    )
-
-
-def already_exists(cur, source_post_id):
-    cur.execute(
-        """
-        SELECT id
-        FROM data_full
-        WHERE source = %s
-          AND source_post_id = %s
-        ORDER BY id DESC
-        LIMIT 1
-        """,
-        (SOURCE_DOMAIN, source_post_id),
-    )
-    row = cur.fetchone()
-    return row["id"] if row else None
+def convert_rows(conn, cur, rows, resolver, insert=False, verbose=True):
+    """Build payload cho cả batch (prefetch ảnh + tin đã có), insert/mark trong 1 transaction."""
+    locs = resolver.resolve_many([row.get("diachi") for row in rows])
+    first_img = prefetch_first_images(cur, [row["id"] for row in rows])
+    existing = prefetch_existing(cur, SOURCE_DOMAIN, [row.get("matin") for row in rows]) if insert else {}
+
+    payloads, converted_ids, skipped = [], [], []
+    counts = {"insert": 0, "exists": 0, "skip": 0}
+    for row, loc in zip(rows, locs):
+        payload, skip_reason = build_payload(row, loc, resolver, first_img.get(row["id"]))
+        if verbose:
+            print_preview(row, payload, skip_reason=skip_reason)
+        if skip_reason:
+            skipped.append((row["id"], skip_reason))
+            counts["skip"] += 1
+            continue
+        payload.pop("_debug", None)
+        matin = str(row.get("matin") or "")
+        if matin and matin in existing:
+            if verbose:
+                print(f"already_exists_in_data_full={existing[matin]}")
+            converted_ids.append(row["id"])
+            counts["exists"] += 1
+            continue
+        if matin:
+            # Trùng matin trong cùng batch: chỉ insert bản đầu tiên
+            existing[matin] = 0
+        payloads.append(payload)
+        converted_ids.append(row["id"])
+        counts["insert"] += 1
+
+    if insert:
+        write_batch(conn, cur, INSERT_COLUMNS, payloads, converted_ids, skipped)
+    return counts
 
 
 def main():
@@ -615,36 +473,39 @@ def main():
     ap.add_argument("--preview-limit", type=int, default=2)
     ap.add_argument("--matin", help="Comma-separated source_post_id/matin to preview")
     ap.add_argument("--insert", action="store_true", help="Insert into data_full")
+    ap.add_argument("--batch-size", type=int, default=0, help="Convert all pending rows in batches of N (0 = preview mode)")
+    ap.add_argument("--start-id", type=int, default=0)
+    ap.add_argument("--max-batches", type=int, default=0, help="0 = no limit")
+    ap.add_argument("--refresh-locations", action="store_true", help="Ignore the location snapshot and reload from DB")
     args = ap.parse_args()
 
     db = Database()
     conn = db.get_connection()
     ensure_datafull_converted_column(conn)
-    province_new, province_old, child_new, child_old = build_location_maps(conn)
-    project_merge_map = build_project_merge_map(conn)
+    resolver = get_resolver(conn, sections=("admin", "project:alonhadat"), refresh=args.refresh_locations)
+    stats = BatchStats()
+
+    if args.batch_size > 0:
+        last_id = args.start_id
+        batch_no = 0
+        with conn.cursor() as cur:
+            while not (args.max_batches and batch_no >= args.max_batches):
+                rows = fetch_batch(conn, last_id, args.batch_size)
+                if not rows:
+                    break
+                batch_no += 1
+                last_id = rows[-1]["id"]
+                stats.add(len(rows), **convert_rows(conn, cur, rows, resolver, insert=args.insert, verbose=False))
+                print(f"[BATCH {batch_no}] last_id={last_id} {stats.line()}", flush=True)
+        print(f"[DONE] {stats.line()}", flush=True)
+        conn.close()
+        return
+
     matin_list = [x.strip() for x in args.matin.split(",") if x.strip()] if args.matin else None
     rows = fetch_preview_rows(conn, args.preview_limit, matin_list=matin_list)
     with conn.cursor() as cur:
-        for row in rows:
-            payload, skip_reason = build_payload(row, province_new, province_old, child_new, child_old, project_merge_map, cur)
-            print_preview(row, payload, skip_reason=skip_reason)
-            if not args.insert:
-                continue
-            if skip_reason:
-                mark_skipped(cur, row["id"], skip_reason)
-                conn.commit()
-                continue
-
-            existing_id = already_exists(cur, row.get("matin"))
-            if existing_id:
-                print(f"already_exists_in_data_full={existing_id}")
-                mark_converted(cur, row["id"])
-                continue
-
-            new_id = insert_payload(cur, payload)
-            mark_converted(cur, row["id"])
-            conn.commit()
-            print(f"inserted_data_full_id={new_id}")
+        stats.add(len(rows), **convert_rows(conn, cur, rows, resolver, insert=args.insert))
+    print(f"[DONE] {stats.line()}")
     conn.close()
 
 
@@ -10,6 +10,8 @@ from decimal import Decimal
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from database import Database
+from location_resolver import get_resolver
+from datafull_batch import BatchStats, prefetch_existing, prefetch_first_images, write_batch
 
 
 SOURCE_DOMAIN = "guland.vn"
@@ -64,22 +66,6 @@ def normalize_text(value):
     return value.strip()
 
 
-def normalize_province_name(value):
-    value = normalize_text(value)
-    if not value:
-        return ""
-    value = re.sub(r"^(tp\.?|thanh pho|tinh)\s+", "", value)
-    return value.strip()
-
-
-def normalize_ward_name(value):
-    value = normalize_text(value)
-    if not value:
-        return ""
-    value = re.sub(r"^(phuong|xa|thi tran)\s+", "", value)
-    return value.strip()
-
-
 def looks_like_ward(value):
     value = normalize_text(value)
     return bool(re.match(r"^(phuong|xa|thi tran)\s+", value))
@@ -199,76 +185,12 @@ def parse_posted_at(relative_text, crawled_at):
     return crawled_at
 
 
-def build_location_maps(conn):
-    province_new = {}
-    province_old = {}
-    child_new = {}
-    child_old = {}
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT new_city_id, new_city_parent_id, new_city_name, old_city_name, action_type
-            FROM transaction_city_merge
-            """
-        )
-        for row in cur.fetchall():
-            new_city_id = int(row["new_city_id"])
-            parent_id = int(row["new_city_parent_id"] or 0)
-            action_type = int(row["action_type"] or 0)
-            new_name = clean_raw(row.get("new_city_name"))
-            old_name = clean_raw(row.get("old_city_name"))
-            if parent_id == 0:
-                if new_name:
-                    key = normalize_province_name(new_name)
-                    province_new.setdefault(key, []).append((action_type, new_city_id, new_name, old_name))
-                if old_name:
-                    key = normalize_province_name(old_name)
-                    province_old.setdefault(key, []).append((action_type, new_city_id, new_name, old_name))
-            else:
-                if new_name:
-                    key = (parent_id, normalize_ward_name(new_name))
-                    child_new.setdefault(key, []).append((action_type, new_city_id, new_name, old_name))
-                if old_name:
-                    key = (parent_id, normalize_ward_name(old_name))
-                    child_old.setdefault(key, []).append((action_type, new_city_id, new_name, old_name))
-    return province_new, province_old, child_new, child_old
-
-
-def build_project_merge_map(conn):
-    project_map = {}
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT guland_project_name, duan_id, duan_ten
-            FROM duan_guland_duan_merge
-            """
-        )
-        for row in cur.fetchall():
-            raw_name = clean_raw(row.get("guland_project_name"))
-            if not raw_name:
-                continue
-            # Keep the newest/highest duan_id if duplicate names exist in merge table.
-            prev = project_map.get(raw_name)
-            if not prev or int(row["duan_id"]) > int(prev["project_id"]):
-                project_map[raw_name] = {
-                    "project_id": int(row["duan_id"]),
-                    "project_name": clean_raw(row.get("duan_ten")) or raw_name,
-                }
-    return project_map
-
-
-def pick_best(candidates):
-    if not candidates:
-        return None
-    return sorted(candidates, key=lambda x: (x[0] != 0, x[1]))[0]
-
-
-def parse_location(diachi, province_new, province_old, child_new, child_old):
+def parse_location(resolver, diachi):
+    """Parser địa chỉ guland cho resolver.resolve_many (kiểu mới xã/tỉnh và kiểu cũ xã/huyện/tỉnh)."""
     raw = clean_raw(diachi)
     if not raw:
         return {"province_id": None, "ward_id": None, "street": None, "province_name_raw": None, "ward_name_raw": None, "address_case": None}
     is_new_address = "(mới)" in normalize_text(raw)
-    cleaned = re.sub(r"\(\s*moi\s*\)", "", normalize_text(raw), flags=re.I)
     # normalize_text removed accents; keep raw parts for street.
     raw_cleaned = re.sub(r"\(\s*Mới\s*\)", "", raw, flags=re.I).strip()
     parts = [p.strip() for p in raw_cleaned.split(",") if p.strip()]
@@ -287,42 +209,35 @@ def parse_location(diachi, province_new, province_old, child_new, child_old):
 
     if is_new_address or not old_style:
         address_case = "new"
-        province_key = normalize_province_name(province_name_raw)
-        province_row = pick_best(province_new.get(province_key, []))
-        if not province_row:
-            province_row = pick_best(province_old.get(province_key, []))
-        if province_row:
-            province_id = province_row[1]
+        province = resolver.find_province(province_name_raw)
+        if province:
+            province_id = province.id
             ward_name_raw = parts[-2]
-            ward_row = pick_best(child_new.get((province_id, normalize_ward_name(ward_name_raw)), []))
-            if ward_row:
-                ward_id = ward_row[1]
-            elif ward_name_raw:
-                ward_row = pick_best(child_old.get((province_id, normalize_ward_name(ward_name_raw)), []))
-                if ward_row:
-                    ward_id = ward_row[1]
+            ward = resolver.find_ward(province_id, ward_name_raw)
+            if ward:
+                ward_id = ward.id
             if len(parts) >= 3:
                 street = ", ".join(parts[:-2]).strip() or None
     else:
         address_case = "old"
-        province_row = pick_best(province_old.get(normalize_province_name(province_name_raw), []))
-        if province_row:
-            province_id = province_row[1]
+        province = resolver.find_old_province(province_name_raw)
+        if province:
+            province_id = province.id
             # Old full pattern: [street], ward_old, district_old, province_old
             if len(parts) >= 4 and looks_like_district(parts[-2]):
                 ward_name_raw = parts[-3]
                 if ward_name_raw:
-                    ward_row = pick_best(child_old.get((province_id, normalize_ward_name(ward_name_raw)), []))
-                    if ward_row:
-                        ward_id = ward_row[1]
+                    ward = resolver.find_old_ward(province_id, ward_name_raw)
+                    if ward:
+                        ward_id = ward.id
                 street = ", ".join(parts[:-3]).strip() or None
             # Old short pattern with ward: [ward_old], district_old, province_old
             elif len(parts) == 3 and looks_like_district(parts[-2]):
                 if looks_like_ward(parts[0]):
                     ward_name_raw = parts[0]
-                    ward_row = pick_best(child_old.get((province_id, normalize_ward_name(ward_name_raw)), []))
-                    if ward_row:
-                        ward_id = ward_row[1]
+                    ward = resolver.find_old_ward(province_id, ward_name_raw)
+                    if ward:
+                        ward_id = ward.id
                     street = None
                     address_case = "old_short_with_ward"
                 else:
@@ -342,21 +257,6 @@ def parse_location(diachi, province_new, province_old, child_new, child_old):
     }
 
 
-def get_first_image(cur, detail_id):
-    cur.execute(
-        """
-        SELECT image_url
-        FROM scraped_detail_images
-        WHERE detail_id = %s
-        ORDER BY idx ASC, id ASC
-        LIMIT 1
-        """,
-        (detail_id,),
-    )
-    row = cur.fetchone()
-    return row["image_url"] if row else None
-
-
 def map_rule(loaibds, trade_type):
     loaibds = clean_raw(loaibds)
     trade_type = clean_raw(trade_type)
@@ -369,17 +269,21 @@ def infer_unit(cat_id):
     return "tháng" if cat_id == 3 else "md"
 
 
-def build_payload(row, loc_maps, project_merge_map, cur):
+def build_payload(row, loc, resolver, img):
+    """loc: kết quả resolver.resolve_many(..., parser=parse_location) cho row["diachi"], img: ảnh đầu tiên"""
     rule = map_rule(row.get("loaibds"), row.get("trade_type"))
     if not rule:
         return None, "skip_type"
-    loc = parse_location(row.get("diachi"), *loc_maps)
     if not loc["province_id"] or not loc["ward_id"]:
         return None, "skip_region"
 
     created_at = row.get("created_at")
     raw_project_name = clean_raw(row.get("thuocduan"))
-    merged_project = project_merge_map.get(raw_project_name) if raw_project_name else None
+    merged_project = None
+    if raw_project_name:
+        hit = resolver.project("guland", raw_project_name)
+        if hit:
+            merged_project = {"project_id": hit[0], "project_name": hit[1] or raw_project_name}
 
     price_vnd = parse_price_to_vnd(row.get("khoanggia"))
     if price_vnd is not None and (price_vnd <= 0 or price_vnd > MAX_DB_PRICE_VND):
@@ -389,7 +293,7 @@ def build_payload(row, loc_maps, project_merge_map, cur):
         "title": clean_raw(row.get("title")),
         "address": None,
         "posted_at": parse_posted_at(row.get("ngaydang"), created_at),
-        "img": get_first_image(cur, row["id"]),
+        "img": img,
         "price": price_vnd,
         "area": parse_area(row.get("dientich")),
         "description": clean_raw(row.get("mota")),
@@ -501,52 +405,28 @@ def fetch_rows(conn, limit, matin_list=None):
         return cur.fetchall()
 
 
-def already_exists(cur, source_post_id):
-    cur.execute(
-        """
-        SELECT id
-        FROM data_full
-        WHERE source = %s AND source_post_id = %s
-        ORDER BY id DESC
-        LIMIT 1
-        """,
-        (SOURCE_DOMAIN, source_post_id),
-    )
-    row = cur.fetchone()
-    return row["id"] if row else None
-
-
-def mark_converted(cur, sdf_id):
-    cur.execute(
-        """
-        UPDATE scraped_details_flat
-        SET datafull_converted = 1,
-            datafull_skip_reason = NULL,
-            datafull_skip_at = NULL
-        WHERE id = %s
-        """,
-        (sdf_id,),
-    )
-
-
-def mark_skipped(cur, sdf_id, skip_reason):
-    cur.execute(
-        """
-        UPDATE scraped_details_flat
-        SET datafull_skip_reason = %s,
-            datafull_skip_at = NOW()
-        WHERE id = %s
-        """,
-        (skip_reason, sdf_id),
-    )
-
-
-def insert_payload(cur, payload):
-    placeholders = ", ".join(["%s"] * len(INSERT_COLUMNS))
-    sql = f"INSERT INTO data_full ({', '.join(INSERT_COLUMNS)}) VALUES ({placeholders})"
-    values = [payload.get(col.replace("`", "")) for col in INSERT_COLUMNS]
-    cur.execute(sql, values)
-    return cur.lastrowid
+def fetch_batch(conn, last_id, limit):
+    """Keyset theo id tăng dần cho chế độ --batch-size."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT *
+            FROM scraped_details_flat
+            WHERE domain = %s
+              AND id > %s
+              AND title IS NOT NULL
+              AND mota IS NOT NULL
+              AND khoanggia IS NOT NULL
+              AND dientich IS NOT NULL
+              AND matin IS NOT NULL
+              AND COALESCE(datafull_converted, 0) = 0
+              AND datafull_skip_reason IS NULL
+            ORDER BY id ASC
+            LIMIT %s
+            """,
+            (SOURCE_DOMAIN, last_id, limit),
+        )
+        return cur.fetchall()
 
 
 def print_preview(row, payload, skip_reason=None):
@@ -560,42 +440,79 @@ def print_preview(row, payload, skip_reason=None):
     print(f"debug={json.dumps(debug, ensure_ascii=False)}")
 
 
+def convert_rows(conn, cur, rows, resolver, insert=False, verbose=True):
+    """Build payload cho cả batch (prefetch ảnh + tin đã có), insert/mark trong 1 transaction."""
+    locs = resolver.resolve_many([row.get("diachi") for row in rows], parser=parse_location)
+    first_img = prefetch_first_images(cur, [row["id"] for row in rows])
+    existing = prefetch_existing(cur, SOURCE_DOMAIN, [row.get("matin") for row in rows]) if insert else {}
+
+    payloads, converted_ids, skipped = [], [], []
+    counts = {"insert": 0, "exists": 0, "skip": 0}
+    for row, loc in zip(rows, locs):
+        payload, skip_reason = build_payload(row, loc, resolver, first_img.get(row["id"]))
+        if verbose:
+            print_preview(row, payload, skip_reason)
+        if skip_reason:
+            skipped.append((row["id"], skip_reason))
+            counts["skip"] += 1
+            continue
+        payload.pop("_debug", None)
+        matin = str(row.get("matin"))
+        if matin in existing:
+            if verbose:
+                print(f"already_exists_in_data_full={existing[matin]}")
+            converted_ids.append(row["id"])
+            counts["exists"] += 1
+            continue
+        # Trùng matin trong cùng batch: chỉ insert bản đầu tiên
+        existing[matin] = 0
+        payloads.append(payload)
+        converted_ids.append(row["id"])
+        counts["insert"] += 1
+
+    if insert:
+        write_batch(conn, cur, INSERT_COLUMNS, payloads, converted_ids, skipped)
+    return counts
+
+
 def main():
     ap = argparse.ArgumentParser(description="Convert Guland -> data_full (preview or insert)")
     ap.add_argument("--preview-limit", type=int, default=3)
     ap.add_argument("--matin", help="Comma-separated matin list")
     ap.add_argument("--insert", action="store_true")
+    ap.add_argument("--batch-size", type=int, default=0, help="Convert all pending rows in batches of N (0 = preview mode)")
+    ap.add_argument("--start-id", type=int, default=0)
+    ap.add_argument("--max-batches", type=int, default=0, help="0 = no limit")
+    ap.add_argument("--refresh-locations", action="store_true", help="Ignore the location snapshot and reload from DB")
     args = ap.parse_args()
 
-    matin_list = [x.strip() for x in args.matin.split(",") if x.strip()] if args.matin else None
-
     db = Database()
     conn = db.get_connection(True)
     ensure_datafull_converted_column(conn)
-    loc_maps = build_location_maps(conn)
-    project_merge_map = build_project_merge_map(conn)
-    rows = fetch_rows(conn, args.preview_limit, matin_list=matin_list)
+    resolver = get_resolver(conn, sections=("admin", "project:guland"), refresh=args.refresh_locations)
+    stats = BatchStats()
+
+    if args.batch_size > 0:
+        last_id = args.start_id
+        batch_no = 0
+        with conn.cursor() as cur:
+            while not (args.max_batches and batch_no >= args.max_batches):
+                rows = fetch_batch(conn, last_id, args.batch_size)
+                if not rows:
+                    break
+                batch_no += 1
+                last_id = rows[-1]["id"]
+                stats.add(len(rows), **convert_rows(conn, cur, rows, resolver, insert=args.insert, verbose=False))
+                print(f"[BATCH {batch_no}] last_id={last_id} {stats.line()}", flush=True)
+        print(f"[DONE] {stats.line()}", flush=True)
+        conn.close()
+        return
 
+    matin_list = [x.strip() for x in args.matin.split(",") if x.strip()] if args.matin else None
+    rows = fetch_rows(conn, args.preview_limit, matin_list=matin_list)
     with conn.cursor() as cur:
-        for row in rows:
-            payload, skip_reason = build_payload(row, loc_maps, project_merge_map, cur)
-            print_preview(row, payload, skip_reason)
-            if not args.insert:
-                continue
-            if skip_reason:
-                mark_skipped(cur, row["id"], skip_reason)
-                conn.commit()
-                continue
-            existing_id = already_exists(cur, row.get("matin"))
-            if existing_id:
-                print(f"already_exists_in_data_full={existing_id}")
-                mark_converted(cur, row["id"])
-                conn.commit()
-                continue
-            new_id = insert_payload(cur, payload)
-            mark_converted(cur, row["id"])
-            conn.commit()
-            print(f"inserted_data_full_id={new_id}")
+        stats.add(len(rows), **convert_rows(conn, cur, rows, resolver, insert=args.insert))
+    print(f"[DONE] {stats.line()}")
     conn.close()
 
 
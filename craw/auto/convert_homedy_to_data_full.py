@@ -2,12 +2,17 @@
 import argparse
 import os
 import re
+import sys
 import time
 from datetime import datetime, timedelta
 from decimal import Decimal, InvalidOperation
 
 import pymysql
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from location_resolver import get_resolver
+from datafull_batch import BatchStats, prefetch_existing, prefetch_first_images
+
 
 SALE_TYPE_MAP = {
     57: ("Bán căn hộ chung cư", 1, 5),
@@ -197,25 +202,12 @@ def main():
     args = parse_args()
     conn = connect(args)
 
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT location_id,cafeland_id FROM location_homedy WHERE level_type='city' AND cafeland_id IS NOT NULL"
-        )
-        city_map = {str(r["location_id"]): int(r["cafeland_id"]) for r in cur.fetchall()}
-        cur.execute(
-            "SELECT location_id,cafeland_id FROM location_homedy WHERE level_type='ward' AND cafeland_id IS NOT NULL"
-        )
-        ward_map = {str(r["location_id"]): int(r["cafeland_id"]) for r in cur.fetchall()}
-        cur.execute("SELECT homedy_project_id,duan_id,duan_ten FROM duan_homedy_duan_merge")
-        project_map = {
-            str(r["homedy_project_id"]): (r["duan_id"], r["duan_ten"])
-            for r in cur.fetchall()
-            if r.get("homedy_project_id")
-        }
+    resolver = get_resolver(conn, sections=("homedy", "project:homedy"))
 
     last_id = args.start_id
     batch_no = 0
     seen = inserted = updated = skip_exists = skip_type = skip_date = skip_region = 0
+    stats = BatchStats()
     six_months_ago = datetime.now() - timedelta(days=183)
 
     while True:
@@ -244,34 +236,11 @@ def main():
 
         last_id = rows[-1]["id"]
         seen += len(rows)
+        stats.add(len(rows))
 
-        ids = [r["id"] for r in rows]
-        mats = [str(r["matin"]) for r in rows]
-
-        first_img = {}
         with conn.cursor() as cur:
-            ph = ",".join(["%s"] * len(ids))
-            cur.execute(
-                f"""
-                SELECT detail_id, SUBSTRING_INDEX(GROUP_CONCAT(image_url ORDER BY idx,id SEPARATOR '||'),'||',1) AS first_img
-                FROM scraped_detail_images
-                WHERE detail_id IN ({ph})
-                GROUP BY detail_id
-                """,
-                ids,
-            )
-            for rr in cur.fetchall():
-                first_img[int(rr["detail_id"])] = rr["first_img"]
-
-        existing = {}
-        with conn.cursor() as cur:
-            ph = ",".join(["%s"] * len(mats))
-            cur.execute(
-                f"SELECT id,source_post_id FROM data_full WHERE source='homedy.com' AND source_post_id IN ({ph})",
-                mats,
-            )
-            for rr in cur.fetchall():
-                existing[str(rr["source_post_id"])] = int(rr["id"])
+            first_img = prefetch_first_images(cur, [r["id"] for r in rows])
+            existing = prefetch_existing(cur, "homedy.com", [r["matin"] for r in rows])
 
         to_insert = []
         to_update = []
@@ -289,8 +258,8 @@ def main():
                 continue
             property_type, cat_id, type_id = mapped
 
-            province_id = city_map.get(str(r["city_ext"])) if r.get("city_ext") is not None else None
-            ward_id = ward_map.get(str(r["ward_ext"])) if r.get("ward_ext") is not None else None
+            province_id = resolver.homedy_id("city", r.get("city_ext"))
+            ward_id = resolver.homedy_id("ward", r.get("ward_ext"))
             if not province_id or not ward_id:
                 skip_region += 1
                 continue
@@ -298,7 +267,7 @@ def main():
             project_id = None
             project_name = None
             if r.get("thuocduan"):
-                pm = project_map.get(str(r["thuocduan"]))
+                pm = resolver.project("homedy", r["thuocduan"])
                 if pm:
                     project_id, project_name = pm
 
@@ -386,13 +355,13 @@ def main():
 
         print(
             f"[BATCH {batch_no}] last_id={last_id} seen={seen} insert={inserted} update={updated} "
-            f"skip_date={skip_date} skip_type={skip_type} skip_region={skip_region}",
+            f"skip_date={skip_date} skip_type={skip_type} skip_region={skip_region} rate={stats.rate():.1f} rows/s",
             flush=True,
         )
 
     print(
         f"[DONE] seen={seen} insert={inserted} update={updated} skip_date={skip_date} "
-        f"skip_type={skip_type} skip_region={skip_region}",
+        f"skip_type={skip_type} skip_region={skip_region} rate={stats.rate():.1f} rows/s",
         flush=True,
     )
     conn.close()
@@ -7,6 +7,10 @@ from decimal import Decimal, InvalidOperation
 
 import pymysql
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from location_resolver import get_resolver
+from datafull_batch import BatchStats, prefetch_existing, prefetch_first_images
+
 
 SALE_MAP = {
     "nha_rieng": ("Bán nhà riêng", 1, 2),
@@ -124,25 +128,12 @@ def main():
     args = parse_args()
     conn = connect(args)
 
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT code,cafeland_id FROM location_meeland WHERE level_type='city' AND code IS NOT NULL AND cafeland_id IS NOT NULL"
-        )
-        city_map = {str(r["code"]): int(r["cafeland_id"]) for r in cur.fetchall()}
-        cur.execute(
-            "SELECT code,cafeland_id FROM location_meeland WHERE level_type='ward' AND code IS NOT NULL AND cafeland_id IS NOT NULL"
-        )
-        ward_map = {str(r["code"]): int(r["cafeland_id"]) for r in cur.fetchall()}
-        cur.execute("SELECT meeyland_project_id,duan_id,duan_ten FROM duan_meeyland_duan_merge")
-        project_map = {
-            str(r["meeyland_project_id"]): (r["duan_id"], r["duan_ten"])
-            for r in cur.fetchall()
-            if r.get("meeyland_project_id")
-        }
+    resolver = get_resolver(conn, sections=("meeyland", "project:meeyland"))
 
     last_id = args.start_id
     batch_no = 0
     seen = inserted = skip_type = skip_region = skip_exists = 0
+    stats = BatchStats()
 
     while True:
         if args.max_batches and batch_no >= args.max_batches:
@@ -173,41 +164,17 @@ def main():
 
         last_id = rows[-1]["id"]
         seen += len(rows)
+        stats.add(len(rows))
 
-        ids = [r["id"] for r in rows]
         mats_by_source = {}
         for r in rows:
             mats_by_source.setdefault(r["domain"], []).append(r["matin"])
 
-        first_img = {}
-        with conn.cursor() as cur:
-            ph = ",".join(["%s"] * len(ids))
-            cur.execute(
-                f"""
-                SELECT detail_id,SUBSTRING_INDEX(GROUP_CONCAT(image_url ORDER BY idx,id SEPARATOR '||'),'||',1) AS first_img
-                FROM scraped_detail_images
-                WHERE detail_id IN ({ph})
-                GROUP BY detail_id
-                """,
-                ids,
-            )
-            for rr in cur.fetchall():
-                first_img[int(rr["detail_id"])] = rr["first_img"]
-
         existing = set()
         with conn.cursor() as cur:
+            first_img = prefetch_first_images(cur, [r["id"] for r in rows])
             for src, mats in mats_by_source.items():
-                uniq = list(dict.fromkeys(mats))
-                chunk = 500
-                for i in range(0, len(uniq), chunk):
-                    sub = uniq[i : i + chunk]
-                    ph = ",".join(["%s"] * len(sub))
-                    cur.execute(
-                        f"SELECT source_post_id FROM data_full WHERE source=%s AND source_post_id IN ({ph})",
-                        [src, *sub],
-                    )
-                    for rr in cur.fetchall():
-                        existing.add((src, str(rr["source_post_id"])))
+                existing.update((src, spid) for spid in prefetch_existing(cur, src, mats))
 
         to_insert = []
         converted_ids = []
@@ -222,8 +189,8 @@ def main():
                 skip_type += 1
                 continue
 
-            province_id = city_map.get(str(r["city_ext"])) if r["city_ext"] is not None else None
-            ward_id = ward_map.get(str(r["ward_ext"])) if r["ward_ext"] is not None else None
+            province_id = resolver.meeyland_id("city", r["city_ext"])
+            ward_id = resolver.meeyland_id("ward", r["ward_ext"])
             if not province_id or not ward_id:
                 skip_region += 1
                 continue
@@ -237,7 +204,7 @@ def main():
 
             project_id = project_name = None
             if r.get("thuocduan"):
-                mapped = project_map.get(str(r["thuocduan"]))
+                mapped = resolver.project("meeyland", r["thuocduan"])
                 if mapped:
                     project_id, project_name = mapped
                 else:
@@ -297,12 +264,13 @@ def main():
         inserted += len(to_insert)
         print(
             f"[BATCH {batch_no}] last_id={last_id} seen={seen} inserted={inserted} "
-            f"skip_exists={skip_exists} skip_type={skip_type} skip_region={skip_region}",
+            f"skip_exists={skip_exists} skip_type={skip_type} skip_region={skip_region} rate={stats.rate():.1f} rows/s",
             flush=True,
         )
 
     print(
-        f"[DONE] seen={seen} inserted={inserted} skip_exists={skip_exists} skip_type={skip_type} skip_region={skip_region}",
+        f"[DONE] seen={seen} inserted={inserted} skip_exists={skip_exists} skip_type={skip_type} skip_region={skip_region} "
+        f"rate={stats.rate():.1f} rows/s",
         flush=True,
     )
     conn.close()
@@ -7,6 +7,7 @@ from datetime import datetime
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from database import Database
+from location_resolver import get_resolver
 
 
 RETRYABLE_DB_ERROR_CODES = {1205, 1206, 1213, 2006, 2013}
@@ -238,9 +239,10 @@ def get_candidates(conn, source_post_ids):
             NULL AS district,
             NULL AS ward,
             d.street_name AS street,
-            tcm_province.new_city_id AS province_id,
+            d.region_v2,
+            d.area_v2,
+            d.ward AS src_ward,
             NULL AS district_id,
-            tcm_ward.new_city_id AS ward_id,
             NULL AS street_id,
             d.pty_project_name AS project_name,
             NULL AS slug_name,
@@ -252,18 +254,6 @@ def get_candidates(conn, source_post_ids):
             d.land_type,
             d.commercial_type
         FROM ad_listing_detail d
-        LEFT JOIN location_detail ld_province
-            ON ld_province.level = 1
-           AND ld_province.region_id = d.region_v2
-        LEFT JOIN transaction_city_merge tcm_province
-            ON tcm_province.old_city_id = ld_province.cafeland_id
-        LEFT JOIN location_detail ld_ward
-            ON ld_ward.level = 3
-           AND ld_ward.region_id = d.region_v2
-           AND ld_ward.area_id = d.area_v2
-           AND ld_ward.ward_id = d.ward
-        LEFT JOIN transaction_city_merge tcm_ward
-            ON tcm_ward.old_city_id = ld_ward.cafeland_id
         WHERE d.list_id IN ({placeholders})
         ORDER BY d.list_time DESC, d.list_id DESC
     """
@@ -274,6 +264,16 @@ def get_candidates(conn, source_post_ids):
 
     rows = run_db_with_retry(conn, _load_rows, "get_candidates")
 
+    # region/area/ward nhatot -> cafeland_id (location_detail) -> id sau sáp nhập (transaction_city_merge),
+    # tra trong bộ nhớ thay vì JOIN 4 bảng cho mỗi batch
+    resolver = get_resolver(conn, sections=("admin", "nhatot"))
+    for row in rows:
+        province_cf, _, ward_cf = resolver.nhatot_ids(
+            row.pop("region_v2"), row.pop("area_v2"), row.pop("src_ward"), apply_merge=False
+        )
+        row["province_id"] = resolver.merged_id(province_cf)
+        row["ward_id"] = resolver.merged_id(ward_cf)
+
     # Resolve first image per ad_id with indexed point lookups instead of a full derived scan
     detail_ids = [str(r["id_img"]) for r in rows if r.get("id_img") is not None]
     if detail_ids:
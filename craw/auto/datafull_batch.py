@@ -0,0 +1,159 @@
+"""
+Helper batch cho các convert_*_to_data_full.
+
+Vòng cũ xử lý từng dòng: SELECT ảnh đầu tiên, SELECT data_full đã có, INSERT,
+UPDATE scraped_details_flat, commit -> ~5 round-trip cho mỗi tin.
+Ở đây mỗi batch chỉ còn:
+  - 1 query ảnh đầu tiên cho cả batch (prefetch_first_images)
+  - 1 query source_post_id đã có (prefetch_existing, chia chunk IN)
+  - 1 INSERT nhiều dòng + 1-2 UPDATE ... WHERE id IN, commit 1 lần (write_batch)
+
+Usage:
+    stats = BatchStats()
+    with conn.cursor() as cur:
+        first_img = prefetch_first_images(cur, [r["id"] for r in rows])
+        existing = prefetch_existing(cur, SOURCE_DOMAIN, [r["matin"] for r in rows])
+        ...
+        write_batch(conn, cur, INSERT_COLUMNS, payloads, converted_ids, skipped)
+    stats.add(len(rows)); print(stats.line())
+"""
+
+import time
+
+import pymysql
+
+IN_CHUNK = 500
+
+
+def _chunks(items, size=IN_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def prefetch_first_images(cur, detail_ids):
+    """{detail_id: image_url} ảnh đầu tiên (ORDER BY idx, id) của từng detail."""
+    out = {}
+    ids = list(dict.fromkeys(int(i) for i in detail_ids if i is not None))
+    for sub in _chunks(ids):
+        ph = ",".join(["%s"] * len(sub))
+        cur.execute(
+            f"""
+            SELECT detail_id, SUBSTRING_INDEX(GROUP_CONCAT(image_url ORDER BY idx, id SEPARATOR '||'), '||', 1) AS first_img
+            FROM scraped_detail_images
+            WHERE detail_id IN ({ph})
+            GROUP BY detail_id
+            """,
+            sub,
+        )
+        for r in cur.fetchall():
+            out[int(r["detail_id"])] = r["first_img"]
+    return out
+
+
+def prefetch_existing(cur, source, source_post_ids):
+    """{source_post_id: data_full.id lớn nhất} của các tin đã có trong data_full."""
+    out = {}
+    keys = list(dict.fromkeys(str(k) for k in source_post_ids if k is not None and str(k) != ""))
+    for sub in _chunks(keys):
+        ph = ",".join(["%s"] * len(sub))
+        cur.execute(
+            f"""
+            SELECT source_post_id, MAX(id) AS id
+            FROM data_full
+            WHERE source = %s AND source_post_id IN ({ph})
+            GROUP BY source_post_id
+            """,
+            [source, *sub],
+        )
+        for r in cur.fetchall():
+            out[str(r["source_post_id"])] = int(r["id"])
+    return out
+
+
+def insert_payloads(cur, columns, payloads):
+    """INSERT nhiều dòng vào data_full (pymysql executemany gộp thành multi-row VALUES)."""
+    if not payloads:
+        return 0
+    placeholders = ", ".join(["%s"] * len(columns))
+    sql = f"INSERT INTO data_full ({', '.join(columns)}) VALUES ({placeholders})"
+    keys = [col.replace("`", "") for col in columns]
+    cur.executemany(sql, [[p.get(k) for k in keys] for p in payloads])
+    return len(payloads)
+
+
+def mark_converted_many(cur, sdf_ids):
+    for sub in _chunks(list(sdf_ids)):
+        ph = ",".join(["%s"] * len(sub))
+        cur.execute(
+            f"""
+            UPDATE scraped_details_flat
+            SET datafull_converted = 1,
+                datafull_skip_reason = NULL,
+                datafull_skip_at = NULL
+            WHERE id IN ({ph})
+            """,
+            sub,
+        )
+
+
+def mark_skipped_many(cur, skipped):
+    """skipped: [(sdf_id, skip_reason)], gom theo reason -> 1 UPDATE ... IN cho mỗi reason."""
+    by_reason = {}
+    for sdf_id, reason in skipped:
+        by_reason.setdefault(reason, []).append(sdf_id)
+    for reason, ids in by_reason.items():
+        for sub in _chunks(ids):
+            ph = ",".join(["%s"] * len(sub))
+            cur.execute(
+                f"""
+                UPDATE scraped_details_flat
+                SET datafull_skip_reason = %s,
+                    datafull_skip_at = NOW()
+                WHERE id IN ({ph})
+                """,
+                [reason, *sub],
+            )
+
+
+def write_batch(conn, cur, columns, payloads, converted_ids, skipped, retries=3):
+    """Insert + đánh dấu converted/skipped của 1 batch trong 1 transaction (retry khi lock wait/deadlock).
+
+    BEGIN tường minh mỗi lượt: connection từ pool của Database chạy autocommit=True, không có BEGIN thì
+    INSERT đã commit trước khi UPDATE deadlock, rollback không còn tác dụng và lượt retry insert trùng.
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            conn.begin()
+            insert_payloads(cur, columns, payloads)
+            mark_converted_many(cur, converted_ids)
+            mark_skipped_many(cur, skipped)
+            conn.commit()
+            return
+        except pymysql.err.OperationalError as ex:
+            conn.rollback()
+            if ex.args and ex.args[0] in (1205, 1213) and attempt < retries:
+                time.sleep(1.5 * attempt)
+                continue
+            raise
+
+
+class BatchStats:
+    """Đếm số dòng/nhãn và tốc độ rows/s từ lúc khởi tạo."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.seen = 0
+        self.counts = {}
+
+    def add(self, seen=0, **counts):
+        self.seen += seen
+        for key, n in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + n
+
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.seen / elapsed if elapsed > 0 else 0.0
+
+    def line(self):
+        parts = [f"seen={self.seen}"] + [f"{k}={v}" for k, v in self.counts.items()]
+        return " ".join(parts) + f" rate={self.rate():.1f} rows/s"
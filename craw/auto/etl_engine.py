@@ -0,0 +1,571 @@
+"""
+ETL 1 lượt cho data_clean_v1.
+
+Thay cho chuỗi stepN_*.py (mỗi step quét lại bảng bằng vòng UPDATE ... LIMIT riêng
+và nâng process_status 1 nấc), engine này:
+  - Đọc mỗi dòng chưa xong đúng 1 lần bằng keyset cursor (id > last_id ORDER BY id)
+  - Áp lần lượt các transform (location -> price -> size -> type -> median -> date) trong RAM
+  - Ghi lại bằng 1 câu UPDATE ... JOIN (derived table) cho mỗi batch
+
+Mỗi step cũ là 1 Transform (pluggable); logic parse dùng lại từ chính các step script.
+Dòng đang dở ở step nào (process_status = k) chỉ chạy các transform có step > k,
+nên chạy xen kẽ với step script cũ vẫn an toàn.
+
+Usage:
+    python craw/auto/etl_engine.py --domain nhatot
+    python craw/auto/etl_engine.py --domain homedy.com --batch-size 5000 --max-rows 20000
+    python craw/auto/etl_engine.py --self-check      # đối chiếu parse giá với step 2 cũ
+"""
+
+import math
+import os
+import re
+import sys
+import time
+import argparse
+from datetime import datetime
+
+import pymysql
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from nhatot_step2_normalize_price import parse_price_to_vnd
+from nhatot_step3_normalize_size import parse_size_to_m2
+from nhatot_step6_normalize_date import convert_timestamp_to_date
+from homedy_step2_normalize_price import parse_price as homedy_parse_price
+from meeyland_step2_normalize_price import parse_price as meeyland_parse_price
+import homedy_step5_group_median as homedy_groups
+import meeyland_step5_group_median as meeyland_groups
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from location_resolver import get_resolver
+
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "root",
+    "password": "",
+    "database": "craw_db",
+    "charset": "utf8mb4",
+    "cursorclass": pymysql.cursors.DictCursor,
+}
+
+BATCH_SIZE = 5000
+FINAL_STATUS = 6
+NUMERIC_SIZE_RE = re.compile(r"^[0-9]+(\.[0-9]+)?$")
+
+
+class Transform:
+    """1 step của pipeline. apply() sửa row tại chỗ, trả False nếu dòng lỗi ở step này."""
+
+    step = 0
+    name = ""
+    reads = ()
+    writes = ()
+    # True: dòng lỗi giữ nguyên process_status (hành vi cũ của 1 số step), False: set -step
+    hold_on_fail = False
+
+    def prepare(self, cursor):
+        """Nạp bảng tra cứu 1 lần cho cả lượt chạy."""
+
+    def apply(self, row):
+        return True
+
+
+# ---------------------------------------------------------------------------
+# Step 1: location
+# ---------------------------------------------------------------------------
+
+class NhatotLocationTransform(Transform):
+    """nhatot_step1_mergekhuvuc: src region/area/ward -> cafeland_id qua location_detail"""
+
+    step = 1
+    name = "nhatot_step1_mergekhuvuc.py"
+    reads = ("src_province_id", "src_district_id", "src_ward_id", "cf_province_id", "cf_district_id", "cf_ward_id")
+    writes = ("cf_province_id", "cf_district_id", "cf_ward_id")
+
+    def __init__(self, apply_city_merge=False):
+        # apply_city_merge=True: xã đã sáp nhập -> id mới (logic nhatot_step1_mergekhuvuc_v2)
+        self.apply_city_merge = apply_city_merge
+        self.resolver = None
+
+    def prepare(self, cursor):
+        self.resolver = get_resolver(cursor.connection, sections=("admin", "nhatot"))
+
+    def apply(self, row):
+        province_id, district_id, ward_id = self.resolver.nhatot_ids(
+            row["src_province_id"], row["src_district_id"], row["src_ward_id"],
+            apply_merge=self.apply_city_merge,
+        )
+        row["cf_province_id"] = province_id if province_id is not None else row["cf_province_id"]
+        row["cf_district_id"] = district_id if district_id is not None else row["cf_district_id"]
+        row["cf_ward_id"] = ward_id if ward_id is not None else row["cf_ward_id"]
+        return True
+
+
+class PassthroughLocationTransform(Transform):
+    """homedy_step1_mergekhuvuc: src_* đã là cafeland id (map từ lúc crawl)"""
+
+    step = 1
+    name = "homedy_step1_mergekhuvuc.py"
+    reads = ("src_province_id", "src_district_id", "src_ward_id")
+    writes = ("cf_province_id", "cf_district_id", "cf_ward_id")
+
+    def apply(self, row):
+        row["cf_province_id"] = row["src_province_id"]
+        row["cf_district_id"] = row["src_district_id"]
+        row["cf_ward_id"] = row["src_ward_id"]
+        return bool(row["src_province_id"] and row["src_district_id"])
+
+
+class MeeylandLocationTransform(Transform):
+    """meeyland_step1_mergekhuvuc: code meeyland -> cafeland_id qua location_meeland"""
+
+    step = 1
+    name = "meeyland_step1_mergekhuvuc.py"
+    reads = ("src_province_id", "src_district_id", "src_ward_id")
+    writes = ("cf_province_id", "cf_district_id", "cf_ward_id")
+    # Step cũ để nguyên status 0 khi chưa map được tỉnh/huyện
+    hold_on_fail = True
+
+    def __init__(self):
+        self.resolver = None
+
+    def prepare(self, cursor):
+        self.resolver = get_resolver(cursor.connection, sections=("meeyland",))
+
+    def apply(self, row):
+        c_code = str(row["src_province_id"]) if row["src_province_id"] else ""
+        d_code = str(row["src_district_id"]) if row["src_district_id"] else ""
+        w_code = str(row["src_ward_id"]) if row["src_ward_id"] else ""
+        cf_dist, d_meey = self.resolver.meeyland_id("district", d_code) or (None, None)
+        row["cf_province_id"] = self.resolver.meeyland_id("city", c_code)
+        row["cf_district_id"] = cf_dist
+        row["cf_ward_id"] = (
+            self.resolver.meeyland_id("ward_in_district", f"{w_code}_{d_meey}") if w_code and d_meey else None
+        )
+        return bool(row["cf_province_id"] and row["cf_district_id"])
+
+
+# ---------------------------------------------------------------------------
+# Step 2: price
+# ---------------------------------------------------------------------------
+
+def _to_bigint(val):
+    """Float -> BIGINT như MySQL khi step cũ ghi float vào price_vnd: làm tròn, .5 ra xa 0 (int() cắt 2.01 tỷ thành 2009999999)."""
+    return int(math.copysign(math.floor(abs(val) + 0.5), val))
+
+
+class PriceTransform(Transform):
+    step = 2
+    reads = ("src_price", "price_vnd")
+    writes = ("price_vnd",)
+
+    def __init__(self, parse_fn, name, required=False):
+        # required=False (nhatot): chỉ điền price_vnd còn trống, không parse được vẫn qua step
+        # required=True (homedy/meeyland): ghi đè, giá <= 0 hoặc không parse được -> -2
+        self.parse_fn = parse_fn
+        self.name = name
+        self.required = required
+
+    def _parse(self, raw):
+        try:
+            return self.parse_fn(raw)
+        except ValueError:
+            return None
+
+    def apply(self, row):
+        if not self.required:
+            if row["src_price"] is not None and row["price_vnd"] is None:
+                val = self._parse(row["src_price"])
+                if val is not None:
+                    row["price_vnd"] = _to_bigint(val)
+            return True
+        val = self._parse(row["src_price"])
+        if val is not None and val > 0:
+            row["price_vnd"] = _to_bigint(val)
+            return True
+        row["price_vnd"] = None
+        return False
+
+
+# ---------------------------------------------------------------------------
+# Step 3: size + price_m2
+# ---------------------------------------------------------------------------
+
+class ParsedSizeTransform(Transform):
+    """nhatot_step3_normalize_size: lấy số đầu tiên trong src_size, rồi price_m2"""
+
+    step = 3
+    name = "nhatot_step3_normalize_size.py"
+    reads = ("src_size", "std_area", "price_vnd", "price_m2")
+    writes = ("std_area", "price_m2")
+
+    def apply(self, row):
+        if row["src_size"] is not None and row["std_area"] is None:
+            row["std_area"] = parse_size_to_m2(row["src_size"])
+        price, area = row["price_vnd"], row["std_area"]
+        if row["price_m2"] is None and price and price > 0 and area and area > 0:
+            row["price_m2"] = round(float(price) / float(area), 2)
+        return True
+
+
+class NumericSizeTransform(Transform):
+    """homedy/meeyland_step3_normalize_size: src_size phải là số thuần, không thì -3"""
+
+    step = 3
+    reads = ("src_size", "price_vnd", "unit")
+    writes = ("std_area", "unit", "price_m2")
+
+    def __init__(self, name):
+        self.name = name
+
+    def apply(self, row):
+        raw = str(row["src_size"] or "").strip().replace(",", ".")
+        area = float(raw) if NUMERIC_SIZE_RE.match(raw) else 0.0
+        if area <= 0:
+            row["std_area"] = None
+            row["price_m2"] = None
+            return False
+        row["std_area"] = round(area, 2)
+        row["unit"] = "m2"
+        row["price_m2"] = round(float(row["price_vnd"]) / area, 2) if row["price_vnd"] is not None else None
+        return True
+
+
+# ---------------------------------------------------------------------------
+# Step 4: type/category
+# ---------------------------------------------------------------------------
+
+class TypeCopyTransform(Transform):
+    step = 4
+    reads = ("src_category_id", "src_type", "std_category", "std_trans_type")
+    writes = ("std_category", "std_trans_type")
+
+    def __init__(self, name, required=False):
+        # required=False (nhatot): chỉ copy khi còn thiếu; required=True: thiếu type/category -> -4
+        self.name = name
+        self.required = required
+
+    def apply(self, row):
+        if self.required or row["std_category"] is None or row["std_trans_type"] is None:
+            row["std_category"] = row["src_category_id"]
+            row["std_trans_type"] = row["src_type"]
+        if self.required:
+            return bool(row["src_type"] and row["src_category_id"])
+        return True
+
+
+# ---------------------------------------------------------------------------
+# Step 5: median group
+# ---------------------------------------------------------------------------
+
+def _nhatot_median_group(trans_type, category):
+    if trans_type == "s":
+        return {"1020": 1, "1010": 2, "1040": 3}.get(str(category))
+    if trans_type == "u":
+        return 4
+    return None
+
+
+def _homedy_median_group(trans_type, category):
+    if trans_type in ("u", "r"):
+        return 4
+    category = str(category)
+    if category in homedy_groups.GROUP_1:
+        return 1
+    if category in homedy_groups.GROUP_2:
+        return 2
+    if category in homedy_groups.GROUP_3:
+        return 3
+    return None
+
+
+def _meeyland_median_group(trans_type, category):
+    if trans_type == "u":
+        return 4
+    if trans_type == "s":
+        if category in meeyland_groups.GROUP_1:
+            return 1
+        if category in meeyland_groups.GROUP_2:
+            return 2
+        if category in meeyland_groups.GROUP_3:
+            return 3
+    return None
+
+
+class MedianGroupTransform(Transform):
+    step = 5
+    reads = ("std_trans_type", "std_category", "median_group")
+    writes = ("median_group",)
+
+    def __init__(self, group_fn, name, only_missing=False, required=False):
+        self.group_fn = group_fn
+        self.name = name
+        self.only_missing = only_missing
+        self.required = required
+
+    def apply(self, row):
+        if not (self.only_missing and row["median_group"] is not None):
+            row["median_group"] = self.group_fn(row["std_trans_type"], row["std_category"])
+        return row["median_group"] is not None or not self.required
+
+
+# ---------------------------------------------------------------------------
+# Step 6: date
+# ---------------------------------------------------------------------------
+
+class NhatotDateTransform(Transform):
+    """nhatot_step6_normalize_date: orig_list_time/update_time (s hoặc ms) -> std_date"""
+
+    step = 6
+    name = "nhatot_step6_normalize_date.py"
+    reads = ("orig_list_time", "update_time", "transfer_time", "median_flag")
+    writes = ("std_date", "transfer_time", "median_flag")
+
+    def apply(self, row):
+        row["std_date"] = convert_timestamp_to_date(row["orig_list_time"] or row["update_time"])
+        if row["transfer_time"] is None:
+            row["transfer_time"] = int(time.time())
+        if row["median_flag"] is None:
+            row["median_flag"] = 0
+        return True
+
+
+class EpochDateTransform(Transform):
+    """homedy/meeyland_step6_normalize_date: orig_list_time (epoch s) -> std_date"""
+
+    step = 6
+    reads = ("orig_list_time",)
+    writes = ("std_date", "median_flag")
+
+    def __init__(self, name, required=False):
+        self.name = name
+        self.required = required
+
+    def apply(self, row):
+        ts = row["orig_list_time"]
+        row["std_date"] = datetime.fromtimestamp(int(ts)).strftime("%Y-%m-%d") if ts is not None else None
+        if not self.required:
+            row["median_flag"] = 1
+            return True
+        row["median_flag"] = 1 if ts is not None else None
+        return ts is not None
+
+
+# ---------------------------------------------------------------------------
+# Pipelines
+# ---------------------------------------------------------------------------
+
+def build_pipeline(domain):
+    """Danh sách transform theo domain (thứ tự = step 1..6)"""
+    if domain == "nhatot":
+        return [
+            NhatotLocationTransform(),
+            PriceTransform(parse_price_to_vnd, "nhatot_step2_normalize_price.py"),
+            ParsedSizeTransform(),
+            TypeCopyTransform("nhatot_step4_normalize_type.py"),
+            MedianGroupTransform(_nhatot_median_group, "nhatot_step5_group_median.py", only_missing=True),
+            NhatotDateTransform(),
+        ]
+    if domain == "homedy.com":
+        return [
+            PassthroughLocationTransform(),
+            PriceTransform(homedy_parse_price, "homedy_step2_normalize_price.py", required=True),
+            NumericSizeTransform("homedy_step3_normalize_size.py"),
+            TypeCopyTransform("homedy_step4_normalize_type.py", required=True),
+            MedianGroupTransform(_homedy_median_group, "homedy_step5_group_median.py", required=True),
+            EpochDateTransform("homedy_step6_normalize_date.py", required=True),
+        ]
+    if domain == "meeyland.com":
+        return [
+            MeeylandLocationTransform(),
+            PriceTransform(meeyland_parse_price, "meeyland_step2_normalize_price.py", required=True),
+            NumericSizeTransform("meeyland_step3_normalize_size.py"),
+            TypeCopyTransform("meeyland_step4_normalize_type.py", required=True),
+            MedianGroupTransform(_meeyland_median_group, "meeyland_step5_group_median.py"),
+            EpochDateTransform("meeyland_step6_normalize_date.py"),
+        ]
+    raise ValueError(f"Unsupported domain: {domain}")
+
+
+PIPELINE_DOMAINS = ("nhatot", "homedy.com", "meeyland.com")
+
+
+def ensure_columns(cursor):
+    """Các cột step 5/6 cũ tự ALTER thêm"""
+    for ddl in (
+        "ALTER TABLE data_clean_v1 ADD COLUMN median_group TINYINT NULL",
+        "ALTER TABLE data_clean_v1 ADD COLUMN transfer_time BIGINT NULL",
+        "ALTER TABLE data_clean_v1 ADD COLUMN median_flag TINYINT NULL",
+    ):
+        try:
+            cursor.execute(ddl)
+        except Exception:
+            pass
+
+
+def run_row(transforms, row):
+    """Chạy các transform còn thiếu cho 1 dòng, cập nhật process_status/last_script"""
+    status = row["process_status"]
+    for t in transforms:
+        if t.step <= status:
+            continue
+        ok = t.apply(row)
+        if ok is False:
+            if not t.hold_on_fail:
+                row["process_status"] = -t.step
+                row["last_script"] = t.name
+            return
+        row["process_status"] = t.step
+        row["last_script"] = t.name
+
+
+def bulk_update(cursor, rows, columns):
+    """1 câu UPDATE ... JOIN (SELECT ... UNION ALL ...) cho cả batch.
+
+    Không dùng INSERT ... ON DUPLICATE KEY UPDATE vì ad_id NOT NULL không có default.
+    """
+    if not rows:
+        return 0
+    cols = ("id",) + tuple(columns)
+    first = "SELECT " + ", ".join(f"%s AS `{c}`" for c in cols)
+    rest = "SELECT " + ", ".join(["%s"] * len(cols))
+    derived = " UNION ALL ".join([first] + [rest] * (len(rows) - 1))
+    assignments = ", ".join(f"d.`{c}` = v.`{c}`" for c in columns)
+    params = [row[c] for row in rows for c in cols]
+    cursor.execute(
+        f"UPDATE data_clean_v1 d JOIN ({derived}) v ON d.id = v.id SET {assignments}",
+        params,
+    )
+    return cursor.rowcount
+
+
+def run_pipeline(domain, batch_size=BATCH_SIZE, max_rows=0, transforms=None, conn=None):
+    """Chạy toàn bộ step 1..6 cho domain trong 1 lượt quét data_clean_v1.
+
+    Trả về dict thống kê: rows, done, failed, by_status.
+    """
+    transforms = transforms or build_pipeline(domain)
+    own_conn = conn is None
+    conn = conn or pymysql.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+
+    print(f"=== ETL engine: {domain} ({', '.join(t.name for t in transforms)}) ===")
+    start = time.time()
+    ensure_columns(cursor)
+    for t in transforms:
+        t.prepare(cursor)
+
+    reads = ["id", "process_status", "last_script"]
+    writes = ["process_status", "last_script"]
+    for t in transforms:
+        writes.extend(c for c in t.writes if c not in writes)
+    # Đọc luôn cột sẽ ghi: dòng dừng giữa chừng được ghi lại nguyên giá trị cũ
+    for t in transforms:
+        reads.extend(c for c in t.reads + t.writes if c not in reads)
+    status_list = ",".join(str(s) for s in range(FINAL_STATUS))
+    select_sql = f"""
+        SELECT {', '.join(f'`{c}`' for c in reads)}
+        FROM data_clean_v1
+        WHERE domain = %s
+          AND process_status IN ({status_list})
+          AND id > %s
+        ORDER BY id
+        LIMIT %s
+    """
+
+    stats = {"rows": 0, "done": 0, "failed": 0, "by_status": {}}
+    last_id = 0
+    try:
+        while True:
+            limit = batch_size
+            if max_rows:
+                limit = min(limit, max_rows - stats["rows"])
+                if limit <= 0:
+                    break
+            cursor.execute(select_sql, (domain, last_id, limit))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+
+            for row in rows:
+                run_row(transforms, row)
+                status = row["process_status"]
+                stats["by_status"][status] = stats["by_status"].get(status, 0) + 1
+                if status == FINAL_STATUS:
+                    stats["done"] += 1
+                elif status < 0:
+                    stats["failed"] += 1
+
+            bulk_update(cursor, rows, writes)
+            conn.commit()
+            stats["rows"] += len(rows)
+            elapsed = time.time() - start
+            print(
+                f"  Batch: +{len(rows)} rows (Total: {stats['rows']}, done={stats['done']}, "
+                f"failed={stats['failed']}, last_id={last_id}, {stats['rows'] / max(elapsed, 1e-6):.0f} rows/s)"
+            )
+            if len(rows) < limit:
+                break
+    finally:
+        cursor.close()
+        if own_conn:
+            conn.close()
+
+    print(f"=== Finished {domain}: {stats['rows']} rows in {time.time() - start:.2f}s ===")
+    print(f"    by process_status: {dict(sorted(stats['by_status'].items()))}")
+    return stats
+
+
+# (domain, src_price, price_vnd mà step cũ ghi vào data_clean_v1)
+PRICE_PARITY_CASES = [
+    ("nhatot", "5 tỷ", 5_000_000_000),
+    ("nhatot", "2.01 tỷ", 2_009_999_999),  # parse_price_to_vnd tự int() cắt, step cũ ghi đúng giá trị này
+    ("nhatot", "2,5 tỷ", 2_500_000_000),
+    ("nhatot", "800 triệu", 800_000_000),
+    ("nhatot", "15 triệu/tháng", 15_000_000),
+    ("homedy.com", "2.01 tỷ", 2_010_000_000),
+    ("homedy.com", "1,15 tỷ", 1_150_000_000),
+    ("homedy.com", "4.35 tỷ", 4_350_000_000),
+    ("homedy.com", "3.3 triệu", 3_300_000),
+    ("homedy.com", "7.8 triệu/tháng", 7_800_000),
+    ("homedy.com", "1250000000", 1_250_000_000),
+    ("homedy.com", "2.5", 3),
+    ("meeyland.com", "2.01 tỷ", 2_010_000_000),
+    ("meeyland.com", "6.07 tỷ", 6_070_000_000),
+    ("meeyland.com", "0.29 tỷ", 290_000_000),
+    ("meeyland.com", "9.1 triệu", 9_100_000),
+    ("meeyland.com", "4.6 nghìn", 4_600),
+]
+
+
+def self_check() -> bool:
+    """Đối chiếu PriceTransform với giá trị step 2 cũ ghi vào DB (giá lẻ tỷ/triệu), không cần DB."""
+    transforms = {d: next(t for t in build_pipeline(d) if t.step == 2) for d in PIPELINE_DOMAINS}
+    bad = 0
+    for domain, raw, expected in PRICE_PARITY_CASES:
+        row = {"src_price": raw, "price_vnd": None}
+        transforms[domain].apply(row)
+        if row["price_vnd"] != expected:
+            bad += 1
+            print(f"MISMATCH {domain} {raw!r}: engine={row['price_vnd']} legacy={expected}")
+    print(f"Self-check: {len(PRICE_PARITY_CASES)} price cases, {bad} mismatches")
+    return bad == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-pass ETL (step 1..6) cho data_clean_v1")
+    parser.add_argument("--domain", choices=PIPELINE_DOMAINS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max-rows", type=int, default=0, help="0 = toàn bộ")
+    parser.add_argument("--self-check", action="store_true", help="Compare price parsing with the legacy step scripts, then exit")
+    args = parser.parse_args()
+    if args.self_check:
+        raise SystemExit(0 if self_check() else 1)
+    if not args.domain:
+        parser.error("--domain is required")
+    run_pipeline(args.domain, batch_size=args.batch_size, max_rows=args.max_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Batching theo khoảng id (keyset) cho các vòng UPDATE/SELECT lớn trên data_clean_v1.
+
+Vòng kiểu cũ:
+    while True:
+        UPDATE ... WHERE <điều kiện> ORDER BY id LIMIT 5000
+        if rowcount < 5000: break
+mỗi lượt phải quét lại từ đầu index qua các dòng đã bị loại (không khớp JOIN,
+parse lỗi...), tổng chi phí ~ O(n^2) khi bảng có hàng triệu dòng.
+
+IdRangeBatcher đi tuần tự theo khoảng id (last_id, last_id + span]:
+  - span tự co giãn theo thời gian chạy mỗi batch (mục tiêu target_seconds)
+  - in tiến độ %/ETA theo id
+  - lưu checkpoint last_id ra file, chạy lại sau khi bị ngắt sẽ đi tiếp từ đó
+    (checkpoint bị xoá khi chạy hết khoảng id)
+
+Usage:
+    batcher = IdRangeBatcher(cursor, "domain = %s AND process_status = 0", ("mogi",),
+                             label="province", checkpoint="mogi_step1.province")
+
+    def _batch(lo, hi):
+        cursor.execute("UPDATE ... WHERE ... AND d.id > %s AND d.id <= %s", (lo, hi))
+        conn.commit()
+        return cursor.rowcount
+
+    total = batcher.run(_batch)
+"""
+
+import os
+import json
+import time
+
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".checkpoints")
+
+DEFAULT_SPAN = 20000
+MIN_SPAN = 1000
+MAX_SPAN = 1000000
+
+
+def _format_eta(seconds):
+    seconds = int(max(seconds, 0))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{(seconds % 3600) // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class IdRangeBatcher:
+    def __init__(
+        self,
+        cursor,
+        where,
+        params=(),
+        table="data_clean_v1",
+        span=DEFAULT_SPAN,
+        min_span=MIN_SPAN,
+        max_span=MAX_SPAN,
+        target_seconds=1.0,
+        label="",
+        checkpoint=None,
+        resume=True,
+    ):
+        """
+        cursor: cursor dùng để lấy MIN/MAX(id) (DictCursor hoặc tuple cursor đều được)
+        where/params: điều kiện lọc dòng cần xử lý, dùng cho MIN/MAX(id)
+        checkpoint: tên file checkpoint (None = không lưu)
+        """
+        self.cursor = cursor
+        self.where = where
+        self.params = tuple(params)
+        self.table = table
+        self.span = max(min_span, min(int(span), max_span))
+        self.min_span = min_span
+        self.max_span = max_span
+        self.target_seconds = target_seconds
+        self.label = label
+        self.checkpoint = checkpoint
+        self.resume = resume
+
+    # ------------------------------------------------------------------
+    # Checkpoint
+    # ------------------------------------------------------------------
+
+    def _checkpoint_path(self):
+        return os.path.join(CHECKPOINT_DIR, f"{self.checkpoint}.json")
+
+    def load_checkpoint(self):
+        if not (self.checkpoint and self.resume):
+            return None
+        try:
+            with open(self._checkpoint_path(), "r", encoding="utf-8") as f:
+                return int(json.load(f)["last_id"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save_checkpoint(self, last_id, max_id):
+        if not self.checkpoint:
+            return
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        path = self._checkpoint_path()
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"last_id": last_id, "max_id": max_id, "updated_at": int(time.time())}, f)
+        os.replace(tmp, path)
+
+    def clear_checkpoint(self):
+        if not self.checkpoint:
+            return
+        try:
+            os.remove(self._checkpoint_path())
+        except OSError:
+            pass
+
+    # ------------------------------------------------------------------
+    # Run
+    # ------------------------------------------------------------------
+
+    def bounds(self):
+        """(min_id, max_id) của các dòng khớp where, (None, None) nếu rỗng"""
+        self.cursor.execute(
+            f"SELECT MIN(id) AS min_id, MAX(id) AS max_id FROM {self.table} WHERE {self.where}",
+            self.params,
+        )
+        row = self.cursor.fetchone()
+        if not row:
+            return None, None
+        if isinstance(row, dict):
+            return row["min_id"], row["max_id"]
+        return row[0], row[1]
+
+    def _adapt(self, elapsed):
+        if elapsed < self.target_seconds / 2:
+            self.span = min(self.span * 2, self.max_span)
+        elif elapsed > self.target_seconds * 2:
+            self.span = max(self.span // 2, self.min_span)
+
+    def run(self, fn, max_batches=0):
+        """Gọi fn(lo, hi) cho từng khoảng id (lo, hi], fn trả về số dòng đã xử lý. Trả về tổng.
+
+        max_batches > 0: dừng sau n batch, giữ checkpoint để lần sau chạy tiếp.
+        """
+        prefix = f"[{self.label}] " if self.label else ""
+        min_id, max_id = self.bounds()
+        if min_id is None:
+            print(f"  {prefix}No rows to process.")
+            self.clear_checkpoint()
+            return 0
+
+        start_id = int(min_id) - 1
+        resumed = self.load_checkpoint()
+        if resumed is not None and start_id < resumed < int(max_id):
+            print(f"  {prefix}Resuming from checkpoint id > {resumed}")
+            start_id = resumed
+        max_id = int(max_id)
+
+        total = 0
+        batches = 0
+        last_id = start_id
+        started = time.time()
+        while last_id < max_id:
+            if max_batches and batches >= max_batches:
+                print(f"  {prefix}Reached max_batches={max_batches}, checkpoint kept at id {last_id}.")
+                return total
+            batches += 1
+            hi = min(last_id + self.span, max_id)
+            t0 = time.time()
+            rows = fn(last_id, hi) or 0
+            total += rows
+            self._adapt(time.time() - t0)
+            last_id = hi
+            self.save_checkpoint(last_id, max_id)
+
+            done = last_id - start_id
+            pct = 100.0 * done / max(max_id - start_id, 1)
+            elapsed = time.time() - started
+            eta = elapsed / done * (max_id - last_id) if done else 0
+            print(
+                f"  {prefix}Batch id <= {last_id}: +{rows} rows (Total: {total}) "
+                f"[{pct:.1f}%, span={self.span}, ETA {_format_eta(eta)}]"
+            )
+
+        self.clear_checkpoint()
+        return total
@@ -1,7 +1,12 @@
+import os
+import sys
 import pymysql
 import argparse
 import time
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from location_resolver import get_resolver
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--limit", type=int, default=5000, help="Number of records to process")
@@ -12,21 +17,8 @@ def main():
 
     print(f"=== meeyland_step1_mergekhuvuc.py ===")
     
-    # Load locations into memory to avoid table scans on updates
-    cursor.execute("SELECT level_type, code, cafeland_id, district_meey_id, meey_id FROM location_meeland WHERE cafeland_id IS NOT NULL")
-    locations = cursor.fetchall()
-    
-    cities = {}
-    districts = {}
-    wards = {}
-    
-    for loc in locations:
-        if loc['level_type'] == 'city' and loc['code']:
-            cities[str(loc['code'])] = loc['cafeland_id']
-        elif loc['level_type'] == 'district' and loc['code']:
-            districts[str(loc['code'])] = { 'cafeland_id': loc['cafeland_id'], 'meey_id': loc['meey_id'] }
-        elif loc['level_type'] == 'ward' and loc['code']:
-            wards[f"{str(loc['code'])}_{str(loc['district_meey_id'])}"] = loc['cafeland_id']
+    # location_meeland nằm trong RAM (dùng chung với converter/ETL, có snapshot)
+    resolver = get_resolver(conn, sections=("meeyland",))
 
     # Fetch batch to update
     sql = "SELECT id, src_province_id, src_district_id, src_ward_id FROM data_clean_v1 WHERE domain = 'meeyland.com' AND process_status = 0 LIMIT %s"
@@ -45,17 +37,13 @@ def main():
         d_code = str(r['src_district_id']) if r['src_district_id'] else ""
         w_code = str(r['src_ward_id']) if r['src_ward_id'] else ""
         
-        cf_prov = cities.get(c_code)
-        cf_dist = None
-        d_meey = None
-        if d_code in districts:
-            cf_dist = districts[d_code]['cafeland_id']
-            d_meey = districts[d_code]['meey_id']
-            
+        cf_prov = resolver.meeyland_id('city', c_code)
+        cf_dist, d_meey = resolver.meeyland_id('district', d_code) or (None, None)
+
         cf_ward = None
         if w_code and d_meey:
-            cf_ward = wards.get(f"{w_code}_{d_meey}")
-            
+            cf_ward = resolver.meeyland_id('ward_in_district', f"{w_code}_{d_meey}")
+
         updates.append((cf_prov, cf_dist, cf_ward, r['id']))
 
     update_query = "UPDATE data_clean_v1 SET cf_province_id = %s, cf_district_id = %s, cf_ward_id = %s WHERE id = %s"
@@ -1,7 +1,7 @@
 import pymysql
 import time
 
-BATCH_SIZE = 10000
+from id_range_batcher import IdRangeBatcher
 
 def main():
     conn = pymysql.connect(
@@ -20,9 +20,8 @@ def main():
 
     # 1. Update Province (CITY)
     print("Updating cf_province_id (CITY)...")
-    total_p = 0
-    while True:
-        sql_province = f"""
+    def _province(lo, hi):
+        cursor.execute("""
         UPDATE data_clean_v1 d
         JOIN location_mogi l ON d.src_province_id = l.mogi_id
         SET d.cf_province_id = l.cafeland_id
@@ -30,22 +29,20 @@ def main():
           AND d.domain = 'mogi'
           AND d.process_status = 0
           AND d.cf_province_id IS NULL
-        LIMIT {BATCH_SIZE}
-        """
-        cursor.execute(sql_province)
-        rows = cursor.rowcount
+          AND d.id > %s AND d.id <= %s
+        """, (lo, hi))
         conn.commit()
-        total_p += rows
-        print(f"  Batch: +{rows} rows (Total: {total_p})")
-        if rows < BATCH_SIZE:
-            break
+        return cursor.rowcount
+    total_p = IdRangeBatcher(
+        cursor, "domain = 'mogi' AND process_status = 0", label="province",
+        checkpoint=f"{script_name}.province",
+    ).run(_province)
     print(f"-> Updated {total_p} provinces.")
 
     # 2. Update District (DISTRICT)
     print("Updating cf_district_id (DISTRICT)...")
-    total_d = 0
-    while True:
-        sql_district = f"""
+    def _district(lo, hi):
+        cursor.execute("""
         UPDATE data_clean_v1 d
         JOIN location_mogi l ON d.src_district_id = l.mogi_id
         SET d.cf_district_id = l.cafeland_id
@@ -53,22 +50,20 @@ def main():
           AND d.domain = 'mogi'
           AND d.process_status = 0
           AND d.cf_district_id IS NULL
-        LIMIT {BATCH_SIZE}
-        """
-        cursor.execute(sql_district)
-        rows = cursor.rowcount
+          AND d.id > %s AND d.id <= %s
+        """, (lo, hi))
         conn.commit()
-        total_d += rows
-        print(f"  Batch: +{rows} rows (Total: {total_d})")
-        if rows < BATCH_SIZE:
-            break
+        return cursor.rowcount
+    total_d = IdRangeBatcher(
+        cursor, "domain = 'mogi' AND process_status = 0", label="district",
+        checkpoint=f"{script_name}.district",
+    ).run(_district)
     print(f"-> Updated {total_d} districts.")
 
     # 3. Update Ward (WARD)
     print("Updating cf_ward_id (WARD)...")
-    total_w = 0
-    while True:
-        sql_ward = f"""
+    def _ward(lo, hi):
+        cursor.execute("""
         UPDATE data_clean_v1 d
         JOIN location_mogi l ON d.src_ward_id = l.mogi_id
         SET d.cf_ward_id = COALESCE(l.cafeland_new_id, l.cafeland_id)
@@ -76,15 +71,14 @@ def main():
           AND d.domain = 'mogi'
           AND d.process_status = 0
           AND d.cf_ward_id IS NULL
-        LIMIT {BATCH_SIZE}
-        """
-        cursor.execute(sql_ward)
-        rows = cursor.rowcount
+          AND d.id > %s AND d.id <= %s
+        """, (lo, hi))
         conn.commit()
-        total_w += rows
-        print(f"  Batch: +{rows} rows (Total: {total_w})")
-        if rows < BATCH_SIZE:
-            break
+        return cursor.rowcount
+    total_w = IdRangeBatcher(
+        cursor, "domain = 'mogi' AND process_status = 0", label="ward",
+        checkpoint=f"{script_name}.ward",
+    ).run(_ward)
     print(f"-> Updated {total_w} wards.")
 
     # 4. Finalize Step
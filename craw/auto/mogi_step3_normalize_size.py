@@ -2,7 +2,7 @@ import pymysql
 import time
 import re
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
 
 def parse_size_to_m2(size_str):
     """
@@ -45,80 +45,74 @@ def main():
 
     # PHASE 1: Parse diện tích
     print("--- Phase 1: Parsing size ---")
-    total_size_updated = 0
+    size_batcher = IdRangeBatcher(
+        cursor, "domain = 'mogi' AND process_status = 2", label="size",
+        checkpoint=f"{script_name}.size",
+    )
 
     # Fast path: do the same "first number token" extraction in SQL (MariaDB supports REGEXP_SUBSTR).
     # This preserves existing logic:
     # - take first numeric token (supports '.' or ',')
     # - replace ',' -> '.'
     # - cast to float and keep only > 0
-    try:
-        while True:
-            sql_update = f"""
-                UPDATE data_clean_v1
-                SET std_area = CAST(
+    def _sql_batch(lo, hi):
+        sql_update = """
+            UPDATE data_clean_v1
+            SET std_area = CAST(
+                REPLACE(
+                    REGEXP_SUBSTR(LOWER(src_size), '[-+]?[0-9]*[\\\\.,][0-9]+|[0-9]+'),
+                    ',', '.'
+                ) AS DECIMAL(18,4)
+            )
+            WHERE domain = 'mogi'
+              AND process_status = 2
+              AND src_size IS NOT NULL AND src_size <> ''
+              AND std_area IS NULL
+              AND REGEXP_SUBSTR(LOWER(src_size), '[-+]?[0-9]*[\\\\.,][0-9]+|[0-9]+') IS NOT NULL
+              AND CAST(
                     REPLACE(
                         REGEXP_SUBSTR(LOWER(src_size), '[-+]?[0-9]*[\\\\.,][0-9]+|[0-9]+'),
                         ',', '.'
                     ) AS DECIMAL(18,4)
-                )
-                WHERE domain = 'mogi'
-                  AND process_status = 2
-                  AND src_size IS NOT NULL AND src_size <> ''
-                  AND std_area IS NULL
-                  AND REGEXP_SUBSTR(LOWER(src_size), '[-+]?[0-9]*[\\\\.,][0-9]+|[0-9]+') IS NOT NULL
-                  AND CAST(
-                        REPLACE(
-                            REGEXP_SUBSTR(LOWER(src_size), '[-+]?[0-9]*[\\\\.,][0-9]+|[0-9]+'),
-                            ',', '.'
-                        ) AS DECIMAL(18,4)
-                    ) > 0
-                LIMIT {BATCH_SIZE}
-            """
-            cursor.execute(sql_update)
-            rows = cursor.rowcount
+                ) > 0
+              AND id > %s AND id <= %s
+        """
+        cursor.execute(sql_update, (lo, hi))
+        conn.commit()
+        return cursor.rowcount
+
+    # Fallback: keep Python logic but reduce DB round-trips (executemany).
+    def _python_batch(lo, hi):
+        sql_get = """
+            SELECT id, src_size
+            FROM data_clean_v1
+            WHERE domain = 'mogi'
+              AND process_status = 2
+              AND src_size IS NOT NULL
+              AND std_area IS NULL
+              AND id > %s AND id <= %s
+        """
+        cursor.execute(sql_get, (lo, hi))
+        rows = cursor.fetchall()
+
+        updates = []
+        for row in rows:
+            std_area = parse_size_to_m2(row.get('src_size'))
+            if std_area is not None:
+                updates.append((std_area, row.get('id')))
+
+        if updates:
+            cursor.executemany("UPDATE data_clean_v1 SET std_area=%s WHERE id=%s", updates)
             conn.commit()
-            if rows == 0:
-                break
-            total_size_updated += rows
-            print(f"  Batch: +{rows} rows (Total: {total_size_updated})")
-            if rows < BATCH_SIZE:
-                break
+        return len(updates)
+
+    try:
+        total_size_updated = size_batcher.run(_sql_batch)
     except Exception as e:
-        # Fallback: keep Python logic but reduce DB round-trips (executemany).
+        conn.rollback()
         print(f"[WARN] SQL fast-path failed ({e}). Falling back to Python parsing...")
-        while True:
-            sql_get = f"""
-                SELECT id, src_size
-                FROM data_clean_v1
-                WHERE domain = 'mogi'
-                  AND process_status = 2
-                  AND src_size IS NOT NULL
-                  AND std_area IS NULL
-                LIMIT {BATCH_SIZE}
-            """
-            cursor.execute(sql_get)
-            rows = cursor.fetchall()
-
-            if not rows:
-                break
-
-            updates = []
-            for row in rows:
-                raw_size = row.get('src_size')
-                record_id = row.get('id')
-                std_area = parse_size_to_m2(raw_size)
-                if std_area is not None:
-                    updates.append((std_area, record_id))
-
-            if updates:
-                cursor.executemany("UPDATE data_clean_v1 SET std_area=%s WHERE id=%s", updates)
-                conn.commit()
-                total_size_updated += len(updates)
-                print(f"  Batch: +{len(updates)} rows (Total: {total_size_updated})")
-            else:
-                # Nothing parsed in this batch; avoid infinite loop.
-                break
+        # Checkpoint giữ nguyên vị trí fast-path đã đi tới, fallback chạy tiếp từ đó
+        total_size_updated = size_batcher.run(_python_batch)
 
     print(f"-> Parsed size for {total_size_updated} rows.")
 
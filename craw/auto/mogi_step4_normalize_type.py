@@ -1,7 +1,7 @@
 import pymysql
 import time
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
 
 def main():
     conn = pymysql.connect(
@@ -18,9 +18,8 @@ def main():
     print(f"=== Running {script_name} ===")
     start_time = time.time()
 
-    total_updated = 0
-    while True:
-        sql_update = f"""
+    def _type(lo, hi):
+        cursor.execute("""
             UPDATE data_clean_v1 FORCE INDEX (idx_domain_status)
             SET std_category = src_category_id,
                 std_trans_type = CASE
@@ -38,16 +37,14 @@ def main():
                 std_category IS NULL OR std_category <> src_category_id
                 OR std_trans_type IS NULL OR std_trans_type = ''
               )
-            ORDER BY id
-            LIMIT {BATCH_SIZE}
-        """
-        cursor.execute(sql_update)
-        rows = cursor.rowcount
+              AND id > %s AND id <= %s
+        """, (lo, hi))
         conn.commit()
-        total_updated += rows
-        print(f"  Batch: +{rows} rows (Total: {total_updated})")
-        if rows < BATCH_SIZE:
-            break
+        return cursor.rowcount
+    total_updated = IdRangeBatcher(
+        cursor, "domain = 'mogi' AND process_status = 3", label="type",
+        checkpoint=f"{script_name}.type",
+    ).run(_type)
 
     print(f"-> Normalized Category/Type for {total_updated} rows.")
 
@@ -1,7 +1,7 @@
 import pymysql
 import time
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
 
 GROUP_1 = [
     "Nhà hẻm ngõ",
@@ -54,8 +54,7 @@ def main():
     params = [*GROUP_1, *GROUP_2, *GROUP_3]
 
     print("Updating median_group (bulk CASE)...")
-    total_updated = 0
-    while True:
+    def _batch(lo, hi):
         sql = f"""
             UPDATE data_clean_v1 FORCE INDEX (idx_domain_status)
             SET median_group = CASE
@@ -76,18 +75,16 @@ def main():
                     OR std_category IN ({placeholders_g3})
                 ))
               )
-            ORDER BY id
-            LIMIT {BATCH_SIZE}
+              AND id > %s AND id <= %s
         """
-        cursor.execute(sql, params + params)  # CASE + WHERE
-        rows = cursor.rowcount
+        cursor.execute(sql, params + params + [lo, hi])  # CASE + WHERE + id range
         conn.commit()
-        if rows == 0:
-            break
-        total_updated += rows
-        print(f"  Batch: +{rows} rows (Total: {total_updated})")
-        if rows < BATCH_SIZE:
-            break
+        return cursor.rowcount
+
+    IdRangeBatcher(
+        cursor, "domain = 'mogi' AND process_status = 4", label="median_group",
+        checkpoint=f"{script_name}.median_group",
+    ).run(_batch)
 
     print("Finalizing step status...")
     cursor.execute(
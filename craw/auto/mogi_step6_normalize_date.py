@@ -1,7 +1,7 @@
 import pymysql
 import time
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
 
 def main():
     conn = pymysql.connect(
@@ -28,10 +28,9 @@ def main():
     # Bulk SQL is much faster than per-row Python timestamp parsing.
     # orig_list_time from mogi convert is typically UNIX seconds.
     # Also support milliseconds if any older rows exist.
-    total_updated = 0
-    while True:
+    def _batch(lo, hi):
         now_ts = int(time.time())
-        sql_update = f"""
+        sql_update = """
             UPDATE data_clean_v1 FORCE INDEX (idx_domain_status)
             SET
               std_date = DATE(
@@ -54,18 +53,16 @@ def main():
                 (orig_list_time IS NOT NULL AND orig_list_time > 0)
                 OR (update_time IS NOT NULL AND update_time > 0)
               )
-            ORDER BY id
-            LIMIT {BATCH_SIZE}
+              AND id > %s AND id <= %s
         """
-        cursor.execute(sql_update, (now_ts, script_name))
-        rows = cursor.rowcount
+        cursor.execute(sql_update, (now_ts, script_name, lo, hi))
         conn.commit()
-        if rows == 0:
-            break
-        total_updated += rows
-        print(f"  Batch: +{rows} rows (Total: {total_updated})")
-        if rows < BATCH_SIZE:
-            break
+        return cursor.rowcount
+
+    total_updated = IdRangeBatcher(
+        cursor, "domain = 'mogi' AND process_status = 5", label="date",
+        checkpoint=f"{script_name}.date",
+    ).run(_batch)
 
     # Finalize status=5 rows only if std_date was computed (avoid marking incomplete as done).
     cursor.execute(
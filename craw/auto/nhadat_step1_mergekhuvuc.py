@@ -3,6 +3,8 @@ import time
 
 import pymysql
 
+from id_range_batcher import IdRangeBatcher
+
 
 def connect():
     return pymysql.connect(
@@ -20,7 +22,7 @@ def main():
         description="Step 1 (Region) for data_clean_v1 domain='nhadat' (mark processed only)"
     )
     parser.add_argument("--domain", default="nhadat", help="Domain in data_clean_v1 (default: nhadat)")
-    parser.add_argument("--batch-size", type=int, default=10000, help="Batch size for UPDATE LIMIT")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Initial id span per batch (auto-adjusted)")
     parser.add_argument(
         "--force",
         action="store_true",
@@ -78,8 +80,7 @@ def main():
         where_extra += " AND cf_province_id IS NOT NULL AND cf_province_id <> 0"
 
     print("Finalizing step status (process_status 0 -> 1)...")
-    total_updated = 0
-    while True:
+    def _finalize(lo, hi):
         sql = f"""
         UPDATE data_clean_v1
         SET process_status = 1,
@@ -87,18 +88,17 @@ def main():
         WHERE domain = %s
           AND process_status = 0
           {where_extra}
-        ORDER BY id
-        LIMIT {int(args.batch_size)}
+          AND id > %s AND id <= %s
         """
-        cursor.execute(sql, (script_name, args.domain))
+        cursor.execute(sql, (script_name, args.domain, lo, hi))
         rows = cursor.rowcount
         conn.commit()
-        total_updated += rows
-        if rows == 0:
-            break
-        print(f"  Batch: +{rows} rows (Total: {total_updated})")
-        if rows < args.batch_size:
-            break
+        return rows
+
+    total_updated = IdRangeBatcher(
+        cursor, "domain = %s AND process_status = 0", (args.domain,),
+        span=args.batch_size, label="finalize", checkpoint=f"{script_name}.{args.domain}.finalize",
+    ).run(_finalize)
 
     end_time = time.time()
     print(f"=== Finished in {end_time - start_time:.2f}s ===")
@@ -3,6 +3,8 @@ import time
 
 import pymysql
 
+from id_range_batcher import IdRangeBatcher
+
 
 BATCH_SIZE_DEFAULT = 5000
 
@@ -113,57 +115,51 @@ def main():
 
     # Nhadat: src_price is already numeric (API gives VND number).
     # Fast-path: bulk SQL update in batches.
-    total_updated = 0
-    while True:
+    def _price(lo, hi):
         cursor.execute(
-            f"""
+            """
             UPDATE data_clean_v1
             SET price_vnd = CAST(src_price AS UNSIGNED)
             WHERE domain=%s
               AND process_status=1
               AND price_vnd IS NULL
               AND src_price REGEXP '^[0-9]+$'
-            ORDER BY id
-            LIMIT {int(args.batch_size)}
+              AND id > %s AND id <= %s
             """,
-            (args.domain,),
+            (args.domain, lo, hi),
         )
-        rows = cursor.rowcount
         conn.commit()
-        if rows == 0:
-            break
-        total_updated += rows
-        print(f"  Batch: +{rows} rows (Total: {total_updated})")
-        if rows < args.batch_size:
-            break
+        return cursor.rowcount
+
+    total_updated = IdRangeBatcher(
+        cursor, "domain = %s AND process_status = 1", (args.domain,),
+        span=args.batch_size, label="price", checkpoint=f"{script_name}.{args.domain}.price",
+    ).run(_price)
 
     print(f"-> Copied src_price -> price_vnd for {total_updated} rows.")
 
     # Finalize only rows that have price_vnd after Step 2.
     print("Finalizing step status (process_status 1 -> 2, only price_vnd NOT NULL)...")
-    total_finalized = 0
-    while True:
+    def _finalize(lo, hi):
         cursor.execute(
-            f"""
+            """
             UPDATE data_clean_v1
             SET process_status=2, last_script=%s
             WHERE domain=%s
               AND process_status=1
               AND price_vnd IS NOT NULL
               AND price_vnd > 0
-            ORDER BY id
-            LIMIT {int(args.batch_size)}
+              AND id > %s AND id <= %s
             """,
-            (script_name, args.domain),
+            (script_name, args.domain, lo, hi),
         )
-        rows = cursor.rowcount
         conn.commit()
-        if rows == 0:
-            break
-        total_finalized += rows
-        print(f"  Batch finalize: +{rows} rows (Total: {total_finalized})")
-        if rows < args.batch_size:
-            break
+        return cursor.rowcount
+
+    total_finalized = IdRangeBatcher(
+        cursor, "domain = %s AND process_status = 1", (args.domain,),
+        span=args.batch_size, label="finalize", checkpoint=f"{script_name}.{args.domain}.finalize",
+    ).run(_finalize)
     print(f"-> Updated process_status = 2 for {total_finalized} rows.")
 
     cursor.execute(
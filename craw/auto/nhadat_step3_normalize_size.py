@@ -4,6 +4,8 @@ from typing import List
 
 import pymysql
 
+from id_range_batcher import IdRangeBatcher
+
 
 # data_clean_v1.price_m2 is DECIMAL(18,2) => max integer part has 16 digits.
 MAX_DECIMAL18_INT = 9_999_999_999_999_999
@@ -212,10 +214,9 @@ def main():
     # - price_vnd >= min_price_vnd
     # - price_m2 is NOT NULL (computed)
     print("Finalizing step status (process_status 2 -> 3, only completed rows)...")
-    total_finalized = 0
-    while True:
+    def _finalize(lo, hi):
         cur.execute(
-            f"""
+            """
             UPDATE data_clean_v1
             SET process_status=3, last_script=%s
             WHERE domain=%s
@@ -223,19 +224,18 @@ def main():
               AND price_vnd IS NOT NULL
               AND price_vnd >= %s
               AND price_m2 IS NOT NULL
-            ORDER BY id
-            LIMIT {int(args.batch_size)}
+              AND id > %s AND id <= %s
             """,
-            (script_name, args.domain, int(args.min_price_vnd)),
+            (script_name, args.domain, int(args.min_price_vnd), lo, hi),
         )
         rows = cur.rowcount
         conn.commit()
-        if rows == 0:
-            break
-        total_finalized += rows
-        print(f"  Batch finalize: +{rows} rows (Total: {total_finalized})")
-        if rows < args.batch_size:
-            break
+        return rows
+
+    total_finalized = IdRangeBatcher(
+        cur, "domain = %s AND process_status = 2", (args.domain,),
+        span=args.batch_size, label="finalize", checkpoint=f"{script_name}.{args.domain}.finalize",
+    ).run(_finalize)
 
     # Report remaining rows still in step 2 (incomplete).
     cur.execute(
@@ -3,6 +3,8 @@ import time
 
 import pymysql
 
+from id_range_batcher import IdRangeBatcher
+
 
 BATCH_SIZE_DEFAULT = 5000
 
@@ -97,8 +99,7 @@ def main():
         return
 
     log("--- Phase 1: Normalizing trans_type + copying category ---")
-    total_updated = 0
-    while True:
+    def _type(lo, hi):
         cursor.execute(
             f"""
             UPDATE data_clean_v1
@@ -115,48 +116,49 @@ def main():
                 std_category IS NULL OR std_category <> src_category_id
                 OR std_trans_type IS NULL OR std_trans_type = ''
               )
-            ORDER BY id
-            LIMIT {int(args.batch_size)}
+              AND id > %s AND id <= %s
             """,
-            (args.domain,),
+            (args.domain, lo, hi),
         )
         rows = cursor.rowcount
         conn.commit()
-        if rows == 0:
-            break
-        total_updated += rows
-        log(f"  Batch: +{rows} rows (Total: {total_updated})")
         if args.sleep:
             time.sleep(args.sleep)
+        return rows
+
+    total_updated = IdRangeBatcher(
+        cursor, f"domain = %s AND process_status IN ({statuses_sql})", (args.domain,),
+        span=args.batch_size, label="type", checkpoint=f"{script_name}.{args.domain}.type",
+    ).run(_type)
 
     log(f"-> Updated {total_updated} rows.")
 
     # Finalize only rows that actually completed Step 4.
     # Completion rule: std_trans_type + std_category not NULL/empty.
     log("Finalizing step status (process_status 3 -> 4, only completed rows)...")
-    total_finalized = 0
-    while True:
+    def _finalize(lo, hi):
         cursor.execute(
-            f"""
+            """
             UPDATE data_clean_v1
             SET process_status=4, last_script=%s
             WHERE domain=%s
               AND process_status=3
               AND std_trans_type IS NOT NULL AND std_trans_type <> ''
               AND std_category IS NOT NULL AND std_category <> ''
-            ORDER BY id
-            LIMIT {int(args.batch_size)}
+              AND id > %s AND id <= %s
             """,
-            (script_name, args.domain),
+            (script_name, args.domain, lo, hi),
         )
         rows = cursor.rowcount
         conn.commit()
-        if rows == 0:
-            break
-        total_finalized += rows
-        log(f"  Batch: +{rows} rows (Total: {total_finalized})")
         if args.sleep:
             time.sleep(args.sleep)
+        return rows
+
+    total_finalized = IdRangeBatcher(
+        cursor, "domain = %s AND process_status = 3", (args.domain,),
+        span=args.batch_size, label="finalize", checkpoint=f"{script_name}.{args.domain}.finalize",
+    ).run(_finalize)
     log(f"-> Updated process_status = 4 for {total_finalized} rows.")
 
     cursor.execute(
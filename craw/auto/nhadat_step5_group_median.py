@@ -3,6 +3,8 @@ import time
 
 import pymysql
 
+from id_range_batcher import IdRangeBatcher
+
 
 BATCH_SIZE_DEFAULT = 5000
 
@@ -116,8 +118,7 @@ def main():
     #   group 3: 8,10,11
     extra_where = "" if args.recompute else "AND median_group IS NULL"
 
-    # Only target rows that will actually change, otherwise cursor.rowcount can be < LIMIT
-    # and we would stop early even though there are more updatable rows later.
+    # Only target rows that will actually change (keeps rowcount meaningful per id range).
     update_target_where = """
       AND (
         std_trans_type = 'u'
@@ -125,8 +126,7 @@ def main():
       )
     """
 
-    total_updated = 0
-    while True:
+    def _median_group(lo, hi):
         cursor.execute(
             f"""
             UPDATE data_clean_v1
@@ -141,19 +141,20 @@ def main():
               AND process_status IN ({statuses_sql})
               {extra_where}
               {update_target_where}
-            ORDER BY id
-            LIMIT {int(args.batch_size)}
+              AND id > %s AND id <= %s
             """,
-            (args.domain,),
+            (args.domain, lo, hi),
         )
         rows = cursor.rowcount
         conn.commit()
-        if rows == 0:
-            break
-        total_updated += rows
-        log(f"  Batch: +{rows} rows (Total: {total_updated})")
         if args.sleep:
             time.sleep(args.sleep)
+        return rows
+
+    total_updated = IdRangeBatcher(
+        cursor, f"domain = %s AND process_status IN ({statuses_sql})", (args.domain,),
+        span=args.batch_size, label="median_group", checkpoint=f"{script_name}.{args.domain}.median_group",
+    ).run(_median_group)
 
     log(f"-> Updated median_group for {total_updated} rows.")
 
@@ -175,28 +176,28 @@ def main():
     # Finalize only rows that actually completed Step 5.
     # Completion rule: median_group is NOT NULL.
     log("Finalizing step status (process_status 4 -> 5, only completed rows)...")
-    total_finalized = 0
-    while True:
+    def _finalize(lo, hi):
         cursor.execute(
-            f"""
+            """
             UPDATE data_clean_v1
             SET process_status=5, last_script=%s
             WHERE domain=%s
               AND process_status=4
               AND median_group IS NOT NULL
-            ORDER BY id
-            LIMIT {int(args.batch_size)}
+              AND id > %s AND id <= %s
             """,
-            (script_name, args.domain),
+            (script_name, args.domain, lo, hi),
         )
         rows = cursor.rowcount
         conn.commit()
-        if rows == 0:
-            break
-        total_finalized += rows
-        log(f"  Batch: +{rows} rows (Total: {total_finalized})")
         if args.sleep:
             time.sleep(args.sleep)
+        return rows
+
+    total_finalized = IdRangeBatcher(
+        cursor, "domain = %s AND process_status = 4", (args.domain,),
+        span=args.batch_size, label="finalize", checkpoint=f"{script_name}.{args.domain}.finalize",
+    ).run(_finalize)
     log(f"-> Updated process_status = 5 for {total_finalized} rows.")
 
     cursor.execute(
@@ -3,6 +3,8 @@ import time
 
 import pymysql
 
+from id_range_batcher import IdRangeBatcher
+
 
 BATCH_SIZE_DEFAULT = 5000
 
@@ -77,9 +79,8 @@ def main():
         return
 
     extra = "" if args.recompute else "AND std_date IS NULL"
-    total_updated = 0
     now_ts = int(time.time())
-    while True:
+    def _date(lo, hi):
         cursor.execute(
             f"""
             UPDATE data_clean_v1
@@ -94,19 +95,18 @@ def main():
               AND orig_list_time IS NOT NULL AND orig_list_time <> 0
               AND STR_TO_DATE(CAST(orig_list_time AS CHAR), '%%Y%%m%%d') IS NOT NULL
               {extra}
-            ORDER BY id
-            LIMIT {int(args.batch_size)}
+              AND id > %s AND id <= %s
             """,
-            (now_ts, script_name, args.domain),
+            (now_ts, script_name, args.domain, lo, hi),
         )
         rows = cursor.rowcount
         conn.commit()
-        if rows == 0:
-            break
-        total_updated += rows
-        print(f"  Batch: +{rows} rows (Total: {total_updated})")
-        if rows < args.batch_size:
-            break
+        return rows
+
+    total_updated = IdRangeBatcher(
+        cursor, "domain = %s AND process_status = 5", (args.domain,),
+        span=args.batch_size, label="date", checkpoint=f"{script_name}.{args.domain}.date",
+    ).run(_date)
 
     end_time = time.time()
     print(f"-> Normalized Date for {total_updated} rows (std_date set).")
@@ -1,7 +1,31 @@
+import os
+import sys
 import pymysql
 import time
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from location_resolver import get_resolver
+
+LOCATION_COLS = ("cf_province_id", "cf_district_id", "cf_ward_id")
+
+
+def update_locations(cursor, rows):
+    """1 câu UPDATE ... JOIN (derived table) cho cả batch, chỉ điền cột còn NULL."""
+    if not rows:
+        return 0
+    cols = ("id",) + LOCATION_COLS
+    first = "SELECT " + ", ".join(f"%s AS `{c}`" for c in cols)
+    rest = "SELECT " + ", ".join(["%s"] * len(cols))
+    derived = " UNION ALL ".join([first] + [rest] * (len(rows) - 1))
+    assignments = ", ".join(f"d.`{c}` = COALESCE(d.`{c}`, v.`{c}`)" for c in LOCATION_COLS)
+    cursor.execute(
+        f"UPDATE data_clean_v1 d JOIN ({derived}) v ON d.id = v.id SET {assignments}",
+        [v for row in rows for v in row],
+    )
+    return cursor.rowcount
+
 
 def main():
     conn = pymysql.connect(
@@ -18,75 +42,34 @@ def main():
     print(f"=== Running {script_name} ===")
     start_time = time.time()
 
-    # 1. Update Province (Level 1) - Batch processing
-    print("Updating cf_province_id...")
-    total_p = 0
-    while True:
-        sql_province = f"""
-        UPDATE data_clean_v1 d
-        JOIN location_detail l ON d.src_province_id = l.region_id
-        SET d.cf_province_id = l.cafeland_id
-        WHERE l.level = 1 AND l.cafeland_id IS NOT NULL 
-          AND d.domain = 'nhatot'
-          AND d.process_status = 0 
-          AND d.cf_province_id IS NULL
-        LIMIT {BATCH_SIZE}
-        """
-        cursor.execute(sql_province)
-        rows = cursor.rowcount
-        conn.commit()
-        total_p += rows
-        print(f"  Batch: +{rows} rows (Total: {total_p})")
-        if rows < BATCH_SIZE:
-            break
-    print(f"-> Updated {total_p} provinces.")
-
-    # 2. Update District (Level 2) - Batch processing
-    print("Updating cf_district_id...")
-    total_d = 0
-    while True:
-        sql_district = f"""
-        UPDATE data_clean_v1 d
-        JOIN location_detail l ON d.src_district_id = l.area_id AND d.src_province_id = l.region_id
-        SET d.cf_district_id = l.cafeland_id
-        WHERE l.level = 2 AND l.cafeland_id IS NOT NULL 
-          AND d.domain = 'nhatot'
-          AND d.process_status = 0
-          AND d.cf_district_id IS NULL
-        LIMIT {BATCH_SIZE}
-        """
-        cursor.execute(sql_district)
-        rows = cursor.rowcount
-        conn.commit()
-        total_d += rows
-        print(f"  Batch: +{rows} rows (Total: {total_d})")
-        if rows < BATCH_SIZE:
-            break
-    print(f"-> Updated {total_d} districts.")
+    # Bảng location_detail + transaction_city_merge nằm trong RAM (dùng chung, có snapshot),
+    # mỗi khoảng id chỉ cần 1 SELECT + 1 UPDATE thay cho 3 vòng UPDATE ... JOIN
+    resolver = get_resolver(conn, sections=("admin", "nhatot"))
 
-    # 3. Update Ward (Level 3) - Batch processing
-    print("Updating cf_ward_id...")
-    total_w = 0
-    while True:
-        sql_ward = f"""
-        UPDATE data_clean_v1 d
-        JOIN location_detail l ON d.src_ward_id = l.ward_id AND d.src_district_id = l.area_id AND d.src_province_id = l.region_id
-        LEFT JOIN transaction_city_merge m ON l.cafeland_id = m.old_city_id
-        SET d.cf_ward_id = COALESCE(m.new_city_id, l.cafeland_id)
-        WHERE l.level = 3 AND l.cafeland_id IS NOT NULL 
-          AND d.domain = 'nhatot'
-          AND d.process_status = 0
-          AND d.cf_ward_id IS NULL
-        LIMIT {BATCH_SIZE}
-        """
-        cursor.execute(sql_ward)
-        rows = cursor.rowcount
+    # 1-3. Update Province / District / Ward - Batch processing
+    print("Updating cf_province_id / cf_district_id / cf_ward_id...")
+    def _locations(lo, hi):
+        cursor.execute("""
+        SELECT id, src_province_id, src_district_id, src_ward_id
+        FROM data_clean_v1
+        WHERE domain = 'nhatot'
+          AND process_status = 0
+          AND (cf_province_id IS NULL OR cf_district_id IS NULL OR cf_ward_id IS NULL)
+          AND id > %s AND id <= %s
+        """, (lo, hi))
+        updates = []
+        for r in cursor.fetchall():
+            ids = resolver.nhatot_ids(r['src_province_id'], r['src_district_id'], r['src_ward_id'])
+            if any(v is not None for v in ids):
+                updates.append((r['id'],) + ids)
+        rowcount = update_locations(cursor, updates)
         conn.commit()
-        total_w += rows
-        print(f"  Batch: +{rows} rows (Total: {total_w})")
-        if rows < BATCH_SIZE:
-            break
-    print(f"-> Updated {total_w} wards.")
+        return rowcount
+    total = IdRangeBatcher(
+        cursor, "domain = 'nhatot' AND process_status = 0", label="location",
+        checkpoint=f"{script_name}.location",
+    ).run(_locations)
+    print(f"-> Updated {total} rows.")
 
     # 4. Finalize Step
     print("Finalizing step status and tracking...")
@@ -2,7 +2,7 @@ import pymysql
 import time
 import re
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
 
 def parse_price_to_vnd(price_str):
     """
@@ -59,42 +59,34 @@ def main():
     print(f"=== Running {script_name} ===")
     start_time = time.time()
 
-    total_updated = 0
-    
-    while True:
-        # Lấy batch dữ liệu cần xử lý (đã xong Step 1)
-        sql_get = f"""
+    def _batch(lo, hi):
+        # Lấy dữ liệu cần xử lý (đã xong Step 1) trong khoảng id
+        sql_get = """
             SELECT id, src_price 
             FROM data_clean_v1 
             WHERE process_status = 1 
             AND src_price IS NOT NULL 
             AND price_vnd IS NULL
-            LIMIT {BATCH_SIZE}
+            AND id > %s AND id <= %s
         """
-        cursor.execute(sql_get)
+        cursor.execute(sql_get, (lo, hi))
         rows = cursor.fetchall()
         
-        if not rows:
-            break
-            
-        batch_count = 0
+        updates = []
         for row in rows:
-            raw_price = row.get('src_price')
-            record_id = row.get('id')
-            
-            price_vnd = parse_price_to_vnd(raw_price)
-            
+            price_vnd = parse_price_to_vnd(row.get('src_price'))
             if price_vnd is not None:
-                sql_update = "UPDATE data_clean_v1 SET price_vnd = %s WHERE id = %s"
-                cursor.execute(sql_update, (price_vnd, record_id))
-                batch_count += 1
+                updates.append((price_vnd, row.get('id')))
                 
+        if updates:
+            cursor.executemany("UPDATE data_clean_v1 SET price_vnd = %s WHERE id = %s", updates)
         conn.commit()
-        total_updated += batch_count
-        print(f"  Batch: +{batch_count} rows (Total: {total_updated})")
-        
-        if len(rows) < BATCH_SIZE:
-            break
+        return len(updates)
+
+    total_updated = IdRangeBatcher(
+        cursor, "process_status = 1", label="price",
+        checkpoint=f"{script_name}.price",
+    ).run(_batch)
 
     print(f"-> Parsed price for {total_updated} rows.")
 
@@ -2,7 +2,7 @@ import pymysql
 import time
 import re
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
 
 def parse_size_to_m2(size_str):
     """
@@ -48,42 +48,34 @@ def main():
 
     # PHẦN 1: Parse diện tích
     print("--- Phase 1: Parsing size ---")
-    total_size_updated = 0
-    
-    while True:
-        sql_get = f"""
+    def _batch(lo, hi):
+        sql_get = """
             SELECT id, src_size 
             FROM data_clean_v1 
             WHERE domain = 'nhatot'
             AND process_status = 2
             AND src_size IS NOT NULL 
             AND std_area IS NULL
-            LIMIT {BATCH_SIZE}
+            AND id > %s AND id <= %s
         """
-        cursor.execute(sql_get)
+        cursor.execute(sql_get, (lo, hi))
         rows = cursor.fetchall()
         
-        if not rows:
-            break
-            
-        batch_count = 0
+        updates = []
         for row in rows:
-            raw_size = row.get('src_size')
-            record_id = row.get('id')
-            
-            std_area = parse_size_to_m2(raw_size)
-            
+            std_area = parse_size_to_m2(row.get('src_size'))
             if std_area is not None:
-                sql_update = "UPDATE data_clean_v1 SET std_area = %s WHERE id = %s"
-                cursor.execute(sql_update, (std_area, record_id))
-                batch_count += 1
+                updates.append((std_area, row.get('id')))
                 
+        if updates:
+            cursor.executemany("UPDATE data_clean_v1 SET std_area = %s WHERE id = %s", updates)
         conn.commit()
-        total_size_updated += batch_count
-        print(f"  Batch: +{batch_count} rows (Total: {total_size_updated})")
-        
-        if len(rows) < BATCH_SIZE:
-            break
+        return len(updates)
+
+    total_size_updated = IdRangeBatcher(
+        cursor, "domain = 'nhatot' AND process_status = 2", label="size",
+        checkpoint=f"{script_name}.size",
+    ).run(_batch)
 
     print(f"-> Parsed size for {total_size_updated} rows.")
 
@@ -1,7 +1,7 @@
 import pymysql
 import time
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
 
 def main():
     conn = pymysql.connect(
@@ -19,24 +19,22 @@ def main():
     start_time = time.time()
 
     print("--- Phase 1: Copying category/type ---")
-    total_updated = 0
-    while True:
-        sql_update = f"""
+    def _type(lo, hi):
+        cursor.execute("""
             UPDATE data_clean_v1
             SET std_category = src_category_id,
                 std_trans_type = src_type
             WHERE domain = 'nhatot'
               AND process_status = 3
               AND (std_category IS NULL OR std_trans_type IS NULL)
-            LIMIT {BATCH_SIZE}
-        """
-        cursor.execute(sql_update)
-        rows = cursor.rowcount
+              AND id > %s AND id <= %s
+        """, (lo, hi))
         conn.commit()
-        total_updated += rows
-        print(f"  Batch: +{rows} rows (Total: {total_updated})")
-        if rows < BATCH_SIZE:
-            break
+        return cursor.rowcount
+    total_updated = IdRangeBatcher(
+        cursor, "domain = 'nhatot' AND process_status = 3", label="type",
+        checkpoint=f"{script_name}.type",
+    ).run(_type)
     print(f"-> Copied Category/Type for {total_updated} rows.")
 
     # Finalize
@@ -2,7 +2,7 @@ import pymysql
 import time
 from datetime import datetime
 
-BATCH_SIZE = 5000
+from id_range_batcher import IdRangeBatcher
 
 def convert_timestamp_to_date(ts):
     if not ts:
@@ -44,43 +44,40 @@ def main():
     except Exception:
         pass
 
-    total_rows = 0
     count_updated = 0
 
-    while True:
-        sql_get = f"""
+    def _batch(lo, hi):
+        nonlocal count_updated
+        sql_get = """
             SELECT id, orig_list_time, update_time, transfer_time
             FROM data_clean_v1
             WHERE domain = 'nhatot'
               AND process_status = 5
-            LIMIT {BATCH_SIZE}
+              AND id > %s AND id <= %s
         """
-        cursor.execute(sql_get)
+        cursor.execute(sql_get, (lo, hi))
         rows = cursor.fetchall()
 
         if not rows:
-            break
+            return 0
 
-        total_rows += len(rows)
         now_ts = int(time.time())
-
+        updates = []
         for row in rows:
-            record_id = row.get('id')
             ts = row.get('orig_list_time') or row.get('update_time')
             std_date = convert_timestamp_to_date(ts)
-
-            sql_update = """
-                UPDATE data_clean_v1
-                SET std_date = %s,
-                    transfer_time = COALESCE(transfer_time, %s)
-                WHERE id = %s
-            """
-            cursor.execute(sql_update, (std_date, now_ts, record_id))
+            updates.append((std_date, now_ts, row.get('id')))
             if std_date:
                 count_updated += 1
 
+        sql_update = """
+            UPDATE data_clean_v1
+            SET std_date = %s,
+                transfer_time = COALESCE(transfer_time, %s)
+            WHERE id = %s
+        """
+        cursor.executemany(sql_update, updates)
         conn.commit()
-        print(f"  Batch: +{len(rows)} rows (Total: {total_rows})")
 
         ids = [str(r['id']) for r in rows]
         id_list = ",".join(ids)
@@ -94,9 +91,12 @@ def main():
         """
         cursor.execute(sql_final)
         conn.commit()
+        return len(rows)
 
-        if len(rows) < BATCH_SIZE:
-            break
+    total_rows = IdRangeBatcher(
+        cursor, "domain = 'nhatot' AND process_status = 5", label="date",
+        checkpoint=f"{script_name}.date",
+    ).run(_batch)
 
     print(f"-> Normalized Date for {count_updated}/{total_rows} rows.")
 
@@ -0,0 +1,302 @@
+"""
+Sync MySQL -> PostgreSQL theo phần thay đổi, stream thẳng vào COPY (không file CSV tạm).
+
+Mỗi bảng (TableSpec) có 1 cột high-water mark `hwm` (computed_at hoặc id):
+  1. mốc = MAX(hwm) đang có bên PG (bảng PG rỗng hoặc --full -> lấy toàn bộ)
+  2. SSCursor (unbuffered) SELECT các dòng hwm >= mốc bên MySQL
+  3. từng dòng ghi CSV vào stdin của 1 process psql đang chạy script:
+        BEGIN;
+        CREATE TEMP TABLE <stage> ON COMMIT DROP AS SELECT <cols> FROM <bảng> WHERE false;
+        COPY <stage> (<cols>) FROM STDIN ...;   <dữ liệu> \\.
+        [DELETE dòng không còn trong stage  -- chỉ khi full + prune]
+        [DELETE bản cũ khớp key có cột NULL -- nullable_keys]
+        INSERT INTO <bảng> SELECT ... FROM <stage> ON CONFLICT (...) DO UPDATE ...;
+        COMMIT;
+     -> người đọc vẫn thấy dữ liệu cũ tới lúc COMMIT, không còn khoảng bảng rỗng do TRUNCATE
+  4. in rows, MB, rows/s và lag (MySQL max hwm - PG max hwm) trước/sau khi sync
+
+Mốc dùng >= (không phải >): các dòng cùng computed_at với mốc được gửi lại, merge idempotent.
+hwm theo id chỉ bắt được dòng mới; bảng có UPDATE tại chỗ thì thỉnh thoảng chạy full.
+
+Usage:
+    from pg_copy_sync import TableSpec, sync_table
+    stats = sync_table(spec)                       # incremental
+    stats = sync_table(spec, full=True, prune=True)  # thay toàn bộ, vẫn 1 transaction
+"""
+
+import csv
+import io
+import os
+import subprocess
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Sequence
+
+import pymysql
+from pymysql.cursors import SSCursor
+
+MYSQL_CONFIG = {
+    'host': os.getenv('MYSQL_HOST', '127.0.0.1'),
+    'port': int(os.getenv('MYSQL_PORT', '3306')),
+    'user': os.getenv('MYSQL_USER', 'root'),
+    'password': os.getenv('MYSQL_PASSWORD', ''),
+    'database': os.getenv('MYSQL_DATABASE', 'craw_db'),
+    'charset': 'utf8mb4',
+}
+
+PG_CONFIG = {
+    'host': os.getenv('PG_HOST', '118.69.81.54'),
+    'port': os.getenv('PG_PORT', '35432'),
+    'user': os.getenv('PG_USERNAME', 'reportuser'),
+    'password': os.getenv('PG_PASSWORD', 'klcjalksjc1n1c1k1cckn1n'),
+    'database': os.getenv('PG_DATABASE', 'report'),
+    'schema': os.getenv('PG_SCHEMA', 'public'),
+}
+
+NULL_MARKER = '\\N'
+FLUSH_BYTES = 1 << 20
+PROGRESS_ROWS = 200000
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    table: str
+    columns: Sequence[str]
+    conflict: Sequence[str]
+    hwm: str
+    hwm_kind: str = 'id'              # 'id' | 'timestamp'
+    ddl: str = ''                     # DDL bên PG, có {schema}
+    mysql_hwm_index: Optional[str] = None  # tên index trên cột hwm bên MySQL (tạo nếu thiếu)
+    nullable_keys: Sequence[str] = ()      # cột số trong conflict có thể NULL
+
+
+class SyncError(RuntimeError):
+    pass
+
+
+# ============================================
+# psql
+# ============================================
+
+def _psql_cmd(*extra):
+    return [
+        'psql', '-X', '-q',
+        '-h', PG_CONFIG['host'],
+        '-p', str(PG_CONFIG['port']),
+        '-U', PG_CONFIG['user'],
+        '-d', PG_CONFIG['database'],
+        '-v', 'ON_ERROR_STOP=1',
+        *extra,
+    ]
+
+
+def _psql_env():
+    env = os.environ.copy()
+    env['PGPASSWORD'] = PG_CONFIG['password']
+    return env
+
+
+def run_psql(sql: str):
+    subprocess.run(_psql_cmd('-c', sql), check=True, env=_psql_env())
+
+
+def psql_scalar(sql: str) -> Optional[str]:
+    out = subprocess.check_output(_psql_cmd('-At', '-c', sql), env=_psql_env(), text=True).strip()
+    return out or None
+
+
+# ============================================
+# High-water mark
+# ============================================
+
+def _parse_hwm(spec: TableSpec, value):
+    if value is None or value == '':
+        return None
+    if spec.hwm_kind == 'timestamp':
+        if isinstance(value, datetime):
+            return value
+        return datetime.fromisoformat(str(value).split('+')[0].strip())
+    return int(value)
+
+
+def pg_hwm(spec: TableSpec):
+    schema = PG_CONFIG['schema']
+    return _parse_hwm(spec, psql_scalar(f'SELECT MAX({spec.hwm}) FROM {schema}.{spec.table}'))
+
+
+def mysql_hwm(conn, spec: TableSpec):
+    with conn.cursor(pymysql.cursors.Cursor) as cur:
+        cur.execute(f'SELECT MAX({spec.hwm}) FROM {spec.table}')
+        row = cur.fetchone()
+    return _parse_hwm(spec, row[0] if row else None)
+
+
+def hwm_lag(spec: TableSpec, source, target) -> str:
+    """Độ trễ PG so với MySQL: giây (timestamp) hoặc số id."""
+    if source is None:
+        return '0'
+    if target is None:
+        return 'all'
+    if spec.hwm_kind == 'timestamp':
+        return f'{max(0.0, (source - target).total_seconds()):.0f}s'
+    return f'{max(0, source - target)} ids'
+
+
+def ensure_mysql_hwm_index(conn, spec: TableSpec):
+    """Index trên cột hwm bên MySQL để SELECT hwm >= mốc không quét cả bảng."""
+    if not spec.mysql_hwm_index:
+        return
+    with conn.cursor(pymysql.cursors.Cursor) as cur:
+        cur.execute(f'SHOW INDEX FROM {spec.table} WHERE Key_name = %s', (spec.mysql_hwm_index,))
+        if cur.fetchone():
+            return
+        print(f'[{spec.table}] Creating index {spec.mysql_hwm_index} ({spec.hwm})...')
+        cur.execute(f'ALTER TABLE {spec.table} ADD INDEX {spec.mysql_hwm_index} ({spec.hwm})')
+    conn.commit()
+
+
+# ============================================
+# Script COPY + merge
+# ============================================
+
+def _script_head(spec: TableSpec, stage: str) -> str:
+    schema = PG_CONFIG['schema']
+    cols = ', '.join(spec.columns)
+    return (
+        "SET client_encoding TO 'UTF8';\n"
+        "BEGIN;\n"
+        f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS SELECT {cols} FROM {schema}.{spec.table} WHERE false;\n"
+        f"COPY {stage} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '{NULL_MARKER}');\n"
+    )
+
+
+def _key_match(spec: TableSpec) -> str:
+    # COALESCE thay cho IS NOT DISTINCT FROM để PG vẫn hash join được
+    return ' AND '.join(
+        f'COALESCE(s.{c}, -1) = COALESCE(t.{c}, -1)' if c in spec.nullable_keys else f's.{c} = t.{c}'
+        for c in spec.conflict
+    )
+
+
+def _script_tail(spec: TableSpec, stage: str, prune: bool) -> str:
+    schema = PG_CONFIG['schema']
+    cols = ', '.join(spec.columns)
+    conflict = ', '.join(spec.conflict)
+    updates = ',\n    '.join(f'{c} = EXCLUDED.{c}' for c in spec.columns if c not in spec.conflict)
+    action = f'DO UPDATE SET\n    {updates}' if updates else 'DO NOTHING'
+    sql = "\\.\n" f"ANALYZE {stage};\n"
+    if prune:
+        # Xoá trước INSERT: dòng PG cũ giữ cặp unique khác (vd source/neighbor osm) dưới id đã đổi
+        # sẽ làm INSERT vi phạm unique và huỷ cả transaction
+        sql += (
+            f"DELETE FROM {schema}.{spec.table} t\n"
+            f"WHERE NOT EXISTS (SELECT 1 FROM {stage} s WHERE {_key_match(spec)});\n"
+        )
+    if spec.nullable_keys:
+        # unique index coi NULL là khác nhau -> ON CONFLICT không bắt được, xoá bản cũ trước (cùng transaction)
+        sql += f"DELETE FROM {schema}.{spec.table} t USING {stage} s WHERE {_key_match(spec)};\n"
+    sql += (
+        f"INSERT INTO {schema}.{spec.table} ({cols})\n"
+        f"SELECT {cols} FROM {stage}\n"
+        f"ON CONFLICT ({conflict})\n"
+        f"{action};\n"
+    )
+    return sql + "COMMIT;\n"
+
+
+def _csv_value(value):
+    return NULL_MARKER if value is None else value
+
+
+def sync_table(spec: TableSpec, full: bool = False, prune: bool = False) -> dict:
+    """
+    Sync 1 bảng, trả về dict thống kê (rows, bytes, seconds, rows_per_s, lag_before, lag_after).
+    prune chỉ có tác dụng khi full (xoá bên PG các dòng không còn ở MySQL, cùng transaction).
+    """
+    schema = PG_CONFIG['schema']
+    prune = prune and full
+    if spec.ddl:
+        run_psql(spec.ddl.format(schema=schema))
+
+    conn = pymysql.connect(**MYSQL_CONFIG, cursorclass=SSCursor)
+    proc = None
+    try:
+        ensure_mysql_hwm_index(conn, spec)
+        source_max = mysql_hwm(conn, spec)
+        target_max = pg_hwm(spec)
+        lag_before = hwm_lag(spec, source_max, target_max)
+        since = None if full else target_max
+        print(f'[{spec.table}] hwm={spec.hwm} mysql_max={source_max} pg_max={target_max} '
+              f'lag={lag_before} mode={"full" if full else "incremental"}')
+
+        sql = f"SELECT {', '.join(spec.columns)} FROM {spec.table}"
+        params = ()
+        if since is not None:
+            sql += f' WHERE {spec.hwm} >= %s'
+            params = (since,)
+
+        stage = f'{spec.table}_stage'
+        started = time.time()
+        proc = subprocess.Popen(
+            _psql_cmd('-f', '-'), stdin=subprocess.PIPE, env=_psql_env(), text=True, encoding='utf-8',
+        )
+        rows = 0
+        sent = 0
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator='\n')
+        try:
+            proc.stdin.write(_script_head(spec, stage))
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                for row in cur:
+                    writer.writerow([_csv_value(v) for v in row])
+                    rows += 1
+                    if buf.tell() >= FLUSH_BYTES:
+                        chunk = buf.getvalue()
+                        proc.stdin.write(chunk)
+                        sent += len(chunk.encode('utf-8'))
+                        buf.seek(0)
+                        buf.truncate()
+                    if rows % PROGRESS_ROWS == 0:
+                        elapsed = time.time() - started
+                        print(f'[{spec.table}] streamed={rows} {rows / elapsed:.0f} rows/s')
+            chunk = buf.getvalue()
+            proc.stdin.write(chunk)
+            sent += len(chunk.encode('utf-8'))
+            proc.stdin.write(_script_tail(spec, stage, prune))
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        code = proc.wait()
+        if code != 0:
+            raise SyncError(f'psql exited with code {code} while loading {spec.table}')
+        proc = None
+    finally:
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+        conn.close()
+
+    elapsed = time.time() - started
+    lag_after = hwm_lag(spec, source_max, pg_hwm(spec))
+    stats = {
+        'table': spec.table,
+        'rows': rows,
+        'bytes': sent,
+        'seconds': round(elapsed, 2),
+        'rows_per_s': round(rows / elapsed, 1) if elapsed > 0 else 0.0,
+        'lag_before': lag_before,
+        'lag_after': lag_after,
+    }
+    print(format_stats(stats))
+    return stats
+
+
+def format_stats(stats: dict) -> str:
+    return (
+        f"[{stats['table']}] rows={stats['rows']} mb={stats['bytes'] / 1048576:.1f} "
+        f"time={stats['seconds']}s rate={stats['rows_per_s']} rows/s "
+        f"lag_before={stats['lag_before']} lag_after={stats['lag_after']}"
+    )
+
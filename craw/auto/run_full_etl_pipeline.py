@@ -1,7 +1,10 @@
 import subprocess
+import argparse
 import time
 import os
 
+from etl_engine import run_pipeline
+
 SCRIPTS = [
     "nhatot_step1_mergekhuvuc.py",
     "nhatot_step2_normalize_price.py",
@@ -30,15 +33,27 @@ def run_script(script_name):
         print(f">>> ERROR running {script_name}: {e}")
         return False
 
-def main():
-    print("=== STARTING FULL ETL PIPELINE FOR NHATOT ===")
-    overall_start = time.time()
-    
+def run_legacy():
     for script in SCRIPTS:
         success = run_script(script)
         if not success:
             print(f"!!! PIPELINE STOPPED DUE TO ERROR IN {script}")
             break
+
+def main():
+    parser = argparse.ArgumentParser(description="Full ETL pipeline (step 1..6) cho nhatot")
+    parser.add_argument("--legacy", action="store_true", help="Chạy lần lượt 6 step script (subprocess) như cũ")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    print("=== STARTING FULL ETL PIPELINE FOR NHATOT ===")
+    overall_start = time.time()
+    
+    if args.legacy:
+        run_legacy()
+    else:
+        # 1 lượt quét data_clean_v1, áp cả 6 step trong RAM (xem etl_engine.py)
+        run_pipeline("nhatot", batch_size=args.batch_size)
             
     print(f"\n=== PIPELINE FINISHED IN {time.time() - overall_start:.2f}s ===")
 
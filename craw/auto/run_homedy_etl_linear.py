@@ -3,6 +3,8 @@ import time
 import subprocess
 import pymysql
 
+from etl_engine import run_pipeline
+
 DB_CONFIG = {
     "host": "localhost",
     "user": "root",
@@ -81,23 +83,8 @@ def main():
     # Step 0
     run_script_in_loop("craw/auto/homedy_step0_recreate.py", limit, get_count_raw, "Step 0 (Migrate Raw)")
     
-    # Step 1
-    run_script_in_loop("craw/auto/homedy_step1_mergekhuvuc.py", limit, lambda: get_count_step(0), "Step 1 (Location)")
-    
-    # Step 2
-    run_script_in_loop("craw/auto/homedy_step2_normalize_price.py", limit, lambda: get_count_step(1), "Step 2 (Price)")
-    
-    # Step 3
-    run_script_in_loop("craw/auto/homedy_step3_normalize_size.py", limit, lambda: get_count_step(2), "Step 3 (Size)")
-    
-    # Step 4
-    run_script_in_loop("craw/auto/homedy_step4_normalize_type.py", limit, lambda: get_count_step(3), "Step 4 (Type)")
-    
-    # Step 5
-    run_script_in_loop("craw/auto/homedy_step5_group_median.py", limit, lambda: get_count_step(4), "Step 5 (Median Group)")
-    
-    # Step 6
-    run_script_in_loop("craw/auto/homedy_step6_normalize_date.py", limit, lambda: get_count_step(5), "Step 6 (Date)")
+    # Step 1..6: 1 lượt keyset qua data_clean_v1 (etl_engine), thay cho 6 step script chạy lặp
+    run_pipeline("homedy.com", batch_size=limit)
     
     # Step 7
     print(f"\n--- Running Step 7 (Land Price) until completion ---")
@@ -1,22 +1,10 @@
 #!/usr/bin/env python3
 import argparse
-import csv
-import os
-import subprocess
-import tempfile
-from pathlib import Path
 
-import pymysql
+from pg_copy_sync import PG_CONFIG, TableSpec, psql_scalar, sync_table
 
-MYSQL = dict(host='127.0.0.1', port=3306, user='root', password='', database='craw_db', charset='utf8mb4', cursorclass=pymysql.cursors.DictCursor)
-PGHOST='118.69.81.54'
-PGPORT='35432'
-PGUSER='reportuser'
-PGDATABASE='report'
-PGPASSWORD='klcjalksjc1n1c1k1cckn1n'
-SCHEMA='public'
-TABLE='location_neightbor'
-STAGE=f'{TABLE}_stage'
+SCHEMA = PG_CONFIG['schema']
+TABLE = 'location_neightbor'
 
 COLUMNS = [
     'id','source_osm_id','source_admin_level','source_unit_type','source_name_vi','source_name_en',
@@ -26,7 +14,7 @@ COLUMNS = [
 ]
 
 DDL = f"""
-CREATE TABLE IF NOT EXISTS {SCHEMA}.{TABLE} (
+CREATE TABLE IF NOT EXISTS {{schema}}.{TABLE} (
   id BIGINT PRIMARY KEY,
   source_osm_id BIGINT NOT NULL,
   source_admin_level INTEGER NULL,
@@ -46,61 +34,34 @@ CREATE TABLE IF NOT EXISTS {SCHEMA}.{TABLE} (
   neighbor_parent_cafeland_id INTEGER NULL,
   created_at TIMESTAMP NULL
 );
-CREATE UNIQUE INDEX IF NOT EXISTS uq_location_neightbor_source_neighbor ON {SCHEMA}.{TABLE}(source_osm_id, neighbor_osm_id);
-CREATE INDEX IF NOT EXISTS idx_location_neightbor_source_osm ON {SCHEMA}.{TABLE}(source_osm_id);
-CREATE INDEX IF NOT EXISTS idx_location_neightbor_neighbor_osm ON {SCHEMA}.{TABLE}(neighbor_osm_id);
-CREATE INDEX IF NOT EXISTS idx_location_neightbor_source_type ON {SCHEMA}.{TABLE}(source_unit_type);
-CREATE INDEX IF NOT EXISTS idx_location_neightbor_source_cafeland ON {SCHEMA}.{TABLE}(source_cafeland_id);
-CREATE INDEX IF NOT EXISTS idx_location_neightbor_neighbor_cafeland ON {SCHEMA}.{TABLE}(neighbor_cafeland_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_location_neightbor_source_neighbor ON {{schema}}.{TABLE}(source_osm_id, neighbor_osm_id);
+CREATE INDEX IF NOT EXISTS idx_location_neightbor_source_osm ON {{schema}}.{TABLE}(source_osm_id);
+CREATE INDEX IF NOT EXISTS idx_location_neightbor_neighbor_osm ON {{schema}}.{TABLE}(neighbor_osm_id);
+CREATE INDEX IF NOT EXISTS idx_location_neightbor_source_type ON {{schema}}.{TABLE}(source_unit_type);
+CREATE INDEX IF NOT EXISTS idx_location_neightbor_source_cafeland ON {{schema}}.{TABLE}(source_cafeland_id);
+CREATE INDEX IF NOT EXISTS idx_location_neightbor_neighbor_cafeland ON {{schema}}.{TABLE}(neighbor_cafeland_id);
 """
 
 
-def run_psql(sql: str):
-    env = dict(os.environ)
-    env['PGPASSWORD'] = PGPASSWORD
-    subprocess.run(['psql','-h',PGHOST,'-p',PGPORT,'-U',PGUSER,'-d',PGDATABASE,'-v','ON_ERROR_STOP=1','-c',sql], check=True, env=env)
-
-
-def export_mysql(csv_path: Path):
-    conn = pymysql.connect(**MYSQL)
-    try:
-        with conn.cursor() as cur, open(csv_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            cur.execute(f"SELECT {', '.join(COLUMNS)} FROM {TABLE} ORDER BY id")
-            count = 0
-            for row in cur:
-                writer.writerow([row[c] for c in COLUMNS])
-                count += 1
-        return count
-    finally:
-        conn.close()
+SPEC = TableSpec(
+    table=TABLE,
+    columns=COLUMNS,
+    conflict=['id'],
+    hwm='id',
+    ddl=DDL,
+)
 
 
 def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument('--truncate', action='store_true')
+    ap = argparse.ArgumentParser(description='Sync location_neightbor MySQL -> PostgreSQL (incremental theo id)')
+    # id chỉ bắt dòng mới: sau khi chạy lại map_location_neightbor_to_cafeland thì chạy --full
+    ap.add_argument('--full', action='store_true', help='Stream the whole table (picks up in-place updates)')
+    ap.add_argument('--truncate', action='store_true',
+                    help='Replace PG contents: full load + delete rows missing in MySQL, in one transaction')
     args = ap.parse_args()
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        csv_path = Path(tmpdir) / f'{TABLE}.csv'
-        exported = export_mysql(csv_path)
-
-        run_psql(DDL)
-        if args.truncate:
-            run_psql(f'TRUNCATE TABLE {SCHEMA}.{TABLE};')
-        run_psql(f'DROP TABLE IF EXISTS {SCHEMA}.{STAGE}; CREATE TABLE {SCHEMA}.{STAGE} AS SELECT {", ".join(COLUMNS)} FROM {SCHEMA}.{TABLE} WHERE 1=0;')
-
-        env = dict(os.environ)
-        env['PGPASSWORD'] = PGPASSWORD
-        copy_sql = f"\\copy {SCHEMA}.{STAGE} ({', '.join(COLUMNS)}) FROM '{csv_path}' WITH (FORMAT csv)"
-        subprocess.run(['psql','-h',PGHOST,'-p',PGPORT,'-U',PGUSER,'-d',PGDATABASE,'-v','ON_ERROR_STOP=1','-c',copy_sql], check=True, env=env)
-
-        update_assign = ', '.join([f'{c}=EXCLUDED.{c}' for c in COLUMNS if c != 'id'])
-        run_psql(f"INSERT INTO {SCHEMA}.{TABLE} ({', '.join(COLUMNS)}) SELECT {', '.join(COLUMNS)} FROM {SCHEMA}.{STAGE} ON CONFLICT (id) DO UPDATE SET {update_assign}; DROP TABLE IF EXISTS {SCHEMA}.{STAGE};")
-
-        out = subprocess.check_output(['psql','-h',PGHOST,'-p',PGPORT,'-U',PGUSER,'-d',PGDATABASE,'-At','-c',f'SELECT COUNT(*) FROM {SCHEMA}.{TABLE};'], env=env, text=True).strip()
-        print(f'exported_rows={exported}')
-        print(f'pg_rows={out}')
+    sync_table(SPEC, full=args.full or args.truncate, prune=args.truncate)
+    print(f'pg_rows={psql_scalar(f"SELECT COUNT(*) FROM {SCHEMA}.{TABLE};")}')
 
 if __name__ == '__main__':
     main()
@@ -8,12 +8,14 @@ import sys
 import time
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
-from urllib.parse import urlparse
 
 import pymysql
 from curl_cffi import requests
 from lxml import html as lxml_html
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bds_url_classifier import get_classifier
+
 
 DOMAIN = "batdongsan.com.vn"
 DEFAULT_IMPERSONATE = "chrome124"
@@ -99,41 +101,8 @@ def url_base_md5(url_base: str) -> Optional[str]:
     return hashlib.md5(s.encode("utf-8")).hexdigest()
 
 
-def get_bds_mapping() -> Dict[str, Tuple[str, str]]:
-    mapping = {
-        "ban-can-ho-chung-cu-mini": ("Bán", "Căn hộ chung cư mini"),
-        "ban-can-ho-chung-cu": ("Bán", "Căn hộ chung cư"),
-        "ban-nha-rieng": ("Bán", "Nhà riêng"),
-        "ban-nha-biet-thu-lien-ke": ("Bán", "Biệt thự liền kề"),
-        "ban-nha-mat-pho": ("Bán", "Nhà mặt phố"),
-        "ban-shophouse-nha-pho-thuong-mai": ("Bán", "Shophouse"),
-        "ban-dat-nen-du-an": ("Bán", "Đất nền dự án"),
-        "ban-dat": ("Bán", "Đất"),
-        "ban-trang-trai-khu-nghi-duong": ("Bán", "Trang trại/Khu nghỉ dưỡng"),
-        "ban-condotel": ("Bán", "Condotel"),
-        "ban-kho-nha-xuong": ("Bán", "Kho, nhà xưởng"),
-        "ban-loai-bat-dong-san-khac": ("Bán", "BĐS khác"),
-        "cho-thue-can-ho-chung-cu-mini": ("Thuê", "Căn hộ chung cư mini"),
-        "cho-thue-can-ho-chung-cu": ("Thuê", "Căn hộ chung cư"),
-        "cho-thue-nha-rieng": ("Thuê", "Nhà riêng"),
-        "cho-thue-nha-biet-thu-lien-ke": ("Thuê", "Biệt thự liền kề"),
-        "cho-thue-nha-mat-pho": ("Thuê", "Nhà mặt phố"),
-        "cho-thue-shophouse-nha-pho-thuong-mai": ("Thuê", "Shophouse"),
-        "cho-thue-nha-tro-phong-tro": ("Thuê", "Nhà trọ, phòng trọ"),
-        "cho-thue-van-phong": ("Thuê", "Văn phòng"),
-        "cho-thue-sang-nhuong-cua-hang-ki-ot": ("Thuê", "Cửa hàng, Ki-ốt"),
-        "cho-thue-kho-nha-xuong-dat": ("Thuê", "Kho, nhà xưởng, đất"),
-        "cho-thue-loai-bat-dong-san-khac": ("Thuê", "BĐS khác"),
-    }
-    return dict(sorted(mapping.items(), key=lambda x: len(x[0]), reverse=True))
-
-
 def classify_detail_url(url: str) -> Tuple[Optional[str], Optional[str]]:
-    path = urlparse(url).path.lstrip("/")
-    for prefix, (trade_type, loaihinh) in get_bds_mapping().items():
-        if path == prefix or path.startswith(prefix + "-"):
-            return loaihinh, trade_type
-    return None, None
+    return get_classifier().classify(url)
 
 
 def normalize_category_url(url: str) -> str:
@@ -0,0 +1,120 @@
+"""
+Phân loại link chi tiết batdongsan.com.vn -> (loaihinh, trade_type) theo slug đầu path.
+
+Mapping prefix (ban-dat, ban-dat-nen-du-an, cho-thue-van-phong...) được compile 1 lần
+thành trie theo từng đoạn slug (tách bằng '-'). Mỗi URL chỉ đi 1 lượt qua các đoạn đầu
+của path và lấy prefix dài nhất khớp, tương đương vòng cũ
+    for prefix in mapping (dài trước): path == prefix or path.startswith(prefix + "-")
+nhưng không phụ thuộc số prefix. Trie cache theo nội dung mapping (mapping đổi -> build lại).
+
+Usage:
+    from bds_url_classifier import classify_url
+    loaihinh, trade_type = classify_url("https://batdongsan.com.vn/ban-dat-nen-du-an-xa-abc-pr123")
+"""
+
+import hashlib
+import json
+import threading
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+# Prefix -> (trade_type, loaihinh)
+BDS_MAPPING: Dict[str, Tuple[str, str]] = {
+    "ban-can-ho-chung-cu-mini": ("Bán", "Căn hộ chung cư mini"),
+    "ban-can-ho-chung-cu": ("Bán", "Căn hộ chung cư"),
+    "ban-nha-rieng": ("Bán", "Nhà riêng"),
+    "ban-nha-biet-thu-lien-ke": ("Bán", "Biệt thự liền kề"),
+    "ban-nha-mat-pho": ("Bán", "Nhà mặt phố"),
+    "ban-shophouse-nha-pho-thuong-mai": ("Bán", "Shophouse"),
+    "ban-dat-nen-du-an": ("Bán", "Đất nền dự án"),
+    "ban-dat": ("Bán", "Đất"),
+    "ban-trang-trai-khu-nghi-duong": ("Bán", "Trang trại/Khu nghỉ dưỡng"),
+    "ban-condotel": ("Bán", "Condotel"),
+    "ban-kho-nha-xuong": ("Bán", "Kho, nhà xưởng"),
+    "ban-loai-bat-dong-san-khac": ("Bán", "BĐS khác"),
+    "cho-thue-can-ho-chung-cu-mini": ("Thuê", "Căn hộ chung cư mini"),
+    "cho-thue-can-ho-chung-cu": ("Thuê", "Căn hộ chung cư"),
+    "cho-thue-nha-rieng": ("Thuê", "Nhà riêng"),
+    "cho-thue-nha-biet-thu-lien-ke": ("Thuê", "Biệt thự liền kề"),
+    "cho-thue-nha-mat-pho": ("Thuê", "Nhà mặt phố"),
+    "cho-thue-shophouse-nha-pho-thuong-mai": ("Thuê", "Shophouse"),
+    "cho-thue-nha-tro-phong-tro": ("Thuê", "Nhà trọ, phòng trọ"),
+    "cho-thue-van-phong": ("Thuê", "Văn phòng"),
+    "cho-thue-sang-nhuong-cua-hang-ki-ot": ("Thuê", "Cửa hàng, Ki-ốt"),
+    "cho-thue-kho-nha-xuong-dat": ("Thuê", "Kho, nhà xưởng, đất"),
+    "cho-thue-loai-bat-dong-san-khac": ("Thuê", "BĐS khác"),
+}
+
+
+def get_bds_mapping() -> Dict[str, Tuple[str, str]]:
+    """Bản sao mapping, prefix dài đứng trước (giữ thứ tự cũ cho code còn duyệt tuần tự)."""
+    return dict(sorted(BDS_MAPPING.items(), key=lambda x: len(x[0]), reverse=True))
+
+
+class SlugTrie:
+    """Trie theo đoạn slug; node = [children: dict, value: (loaihinh, trade_type) | None]."""
+
+    __slots__ = ("root", "version", "size")
+
+    def __init__(self, mapping: Dict[str, Tuple[str, str]], version: str = ""):
+        self.root = [{}, None]
+        self.version = version
+        self.size = 0
+        for prefix, (trade_type, loaihinh) in mapping.items():
+            node = self.root
+            for seg in prefix.strip("-").split("-"):
+                node = node[0].setdefault(seg, [{}, None])
+            node[1] = (loaihinh, trade_type)
+            self.size += 1
+
+    def match_path(self, path: str) -> Tuple[Optional[str], Optional[str]]:
+        """(loaihinh, trade_type) của prefix dài nhất khớp đầu path (theo ranh giới '-')."""
+        node = self.root
+        best = None
+        for seg in path.split("-"):
+            node = node[0].get(seg)
+            if node is None:
+                break
+            if node[1] is not None:
+                best = node[1]
+        return best if best is not None else (None, None)
+
+    def classify(self, url: str) -> Tuple[Optional[str], Optional[str]]:
+        return self.match_path(url_path(url))
+
+
+def url_path(url: str) -> str:
+    url = url or ""
+    try:
+        return (urlparse(url).path or "").lstrip("/")
+    except Exception:
+        return url.replace("https://batdongsan.com.vn/", "").replace("https://www.batdongsan.com.vn/", "")
+
+
+def mapping_version(mapping: Dict[str, Tuple[str, str]]) -> str:
+    raw = json.dumps(sorted(mapping.items()), ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+_CLASSIFIERS: Dict[str, SlugTrie] = {}
+_CLASSIFIERS_LOCK = threading.Lock()
+_DEFAULT = [None]
+
+
+def get_classifier(mapping: Optional[Dict[str, Tuple[str, str]]] = None) -> SlugTrie:
+    """Trie đã compile cho mapping (mặc định BDS_MAPPING), cache theo mapping_version."""
+    if mapping is None:
+        if _DEFAULT[0] is None:
+            _DEFAULT[0] = get_classifier(BDS_MAPPING)
+        return _DEFAULT[0]
+    version = mapping_version(mapping)
+    with _CLASSIFIERS_LOCK:
+        trie = _CLASSIFIERS.get(version)
+        if trie is None:
+            trie = _CLASSIFIERS[version] = SlugTrie(mapping, version)
+    return trie
+
+
+def classify_url(url: str) -> Tuple[Optional[str], Optional[str]]:
+    """Phân loại theo BDS_MAPPING (mapping khác: get_classifier(mapping) 1 lần rồi gọi .classify)."""
+    return get_classifier().classify(url)
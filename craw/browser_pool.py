@@ -0,0 +1,206 @@
+"""
+Pool browser dùng chung cho các tác vụ cào headless (extension_api_server, ...).
+
+Mỗi WebScraper (1 Chromium) mở sẵn pages_per_browser page, mỗi page là 1 session
+của Crawl4AI (arun(..., session_id=...) dùng lại đúng tab đó). Caller mượn 1 page qua
+lease() nên đường đi của từng URL không còn chi phí khởi động browser.
+
+  - Page được đóng và mở lại (kill_session) sau max_navigations lượt
+  - Browser vượt max_memory_mb (RSS cả cây process) thì không cho mượn thêm,
+    đợi trả hết page rồi đóng và mở browser mới
+  - Lỗi trong lúc mượn -> page đó được mở lại ở lượt sau
+  - block_resources: chặn image/font/media cho trang detail không cần tải ảnh
+
+Usage:
+    pool = BrowserPool(browsers=2, pages_per_browser=4)
+    await pool.start()
+    async with pool.lease() as page:
+        result = await page.scrape_simple(url, bypass_cache=True)
+    await pool.close()
+"""
+
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Dict, List, Optional
+
+from web_scraper import WebScraper
+
+DEFAULT_BLOCK_RESOURCES = ("image", "font", "media")
+SESSION_METHODS = frozenset({"scrape_simple", "scrape_with_js", "scrape_with_schema", "scrape_with_regex"})
+
+
+class _BrowserSlot:
+    __slots__ = ("scraper", "navigations", "leased", "retiring", "generation")
+
+    def __init__(self, scraper: WebScraper, generation: int):
+        self.scraper = scraper
+        self.navigations: Dict[str, int] = {}
+        self.leased = 0
+        self.retiring = False
+        self.generation = generation
+
+
+class PageLease:
+    """1 page (session) đang mượn. scrape_* tự gắn session_id, thuộc tính khác lấy từ WebScraper."""
+
+    def __init__(self, slot: _BrowserSlot, session_id: str):
+        self._slot = slot
+        self.session_id = session_id
+        self.scraper = slot.scraper
+        self.navigations = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.scraper, name)
+        if name in SESSION_METHODS:
+            self.navigations += 1
+            return partial(attr, session_id=self.session_id)
+        return attr
+
+
+class BrowserPool:
+    def __init__(
+        self,
+        browsers: int = 2,
+        pages_per_browser: int = 4,
+        max_navigations: int = 100,
+        max_memory_mb: Optional[float] = 1500,
+        headless: bool = True,
+        block_resources=DEFAULT_BLOCK_RESOURCES,
+    ):
+        self.browsers = max(1, int(browsers))
+        self.pages_per_browser = max(1, int(pages_per_browser))
+        self.max_navigations = max_navigations
+        self.max_memory_mb = max_memory_mb
+        self.headless = headless
+        self.block_resources = list(block_resources or ())
+        self._free: Optional[asyncio.Queue] = None
+        self._slots: List[_BrowserSlot] = []
+        self._session_ids = itertools.count(1)
+        self._generations = itertools.count(1)
+        self._closed = False
+        self.stats_counters = {"leases": 0, "pages_recycled": 0, "browsers_opened": 0, "browsers_recycled": 0}
+
+    @property
+    def size(self) -> int:
+        """Số page có thể mượn cùng lúc."""
+        return self.browsers * self.pages_per_browser
+
+    # ---------- browser ----------
+
+    async def _open_slot(self) -> _BrowserSlot:
+        delay = 2
+        while True:
+            try:
+                scraper = WebScraper(headless=self.headless, verbose=False, block_resources=self.block_resources)
+                await scraper.__aenter__()
+                break
+            except Exception as e:
+                print(f"[BrowserPool] Không mở được browser: {e} - thử lại sau {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+        slot = _BrowserSlot(scraper, next(self._generations))
+        self._slots.append(slot)
+        self.stats_counters["browsers_opened"] += 1
+        for _ in range(self.pages_per_browser):
+            self._free.put_nowait((slot, self._new_session(slot)))
+        return slot
+
+    def _new_session(self, slot: _BrowserSlot) -> str:
+        session_id = f"pool-{slot.generation}-{next(self._session_ids)}"
+        slot.navigations[session_id] = 0
+        return session_id
+
+    async def _close_slot(self, slot: _BrowserSlot) -> None:
+        if slot in self._slots:
+            self._slots.remove(slot)
+        try:
+            await slot.scraper.close()
+        except Exception as e:
+            print(f"[BrowserPool] Lỗi khi đóng browser: {e}")
+
+    async def _recycle_slot(self, slot: _BrowserSlot) -> None:
+        await self._close_slot(slot)
+        self.stats_counters["browsers_recycled"] += 1
+        if not self._closed:
+            await self._open_slot()
+
+    def _over_memory(self, slot: _BrowserSlot) -> bool:
+        if not self.max_memory_mb:
+            return False
+        rss = slot.scraper.memory_mb()
+        return rss is not None and rss > self.max_memory_mb
+
+    # ---------- lease ----------
+
+    async def start(self) -> "BrowserPool":
+        self._free = asyncio.Queue()
+        await asyncio.gather(*(self._open_slot() for _ in range(self.browsers)))
+        print(f"[BrowserPool] {self.browsers} browser x {self.pages_per_browser} page sẵn sàng")
+        return self
+
+    @asynccontextmanager
+    async def lease(self):
+        while True:
+            slot, session_id = await self._free.get()
+            if not slot.retiring:
+                break
+            # Browser đang chờ thay: bỏ page này, browser mới sẽ bổ sung page
+            slot.navigations.pop(session_id, None)
+        slot.leased += 1
+        self.stats_counters["leases"] += 1
+        page = PageLease(slot, session_id)
+        healthy = False
+        try:
+            yield page
+            healthy = True
+        finally:
+            slot.leased -= 1
+            await self._release(slot, session_id, page.navigations, healthy)
+
+    async def _release(self, slot: _BrowserSlot, session_id: str, navigations: int, healthy: bool) -> None:
+        navs = slot.navigations.get(session_id, 0) + navigations
+        if not slot.retiring and self._over_memory(slot):
+            print(f"[BrowserPool] Browser #{slot.generation} vượt {self.max_memory_mb}MB, sẽ mở lại")
+            slot.retiring = True
+
+        if slot.retiring:
+            # Page của browser này còn trong queue sẽ bị bỏ khi lấy ra; page cuối được trả thì thay browser
+            slot.navigations.pop(session_id, None)
+            if slot.leased == 0 and slot in self._slots:
+                self._slots.remove(slot)
+                asyncio.ensure_future(self._recycle_slot(slot))
+            return
+
+        if not healthy or (self.max_navigations and navs >= self.max_navigations):
+            try:
+                await slot.scraper.kill_session(session_id)
+            except Exception as e:
+                print(f"[BrowserPool] kill_session {session_id} lỗi: {e}")
+            slot.navigations.pop(session_id, None)
+            session_id = self._new_session(slot)
+            self.stats_counters["pages_recycled"] += 1
+        else:
+            slot.navigations[session_id] = navs
+        self._free.put_nowait((slot, session_id))
+
+    async def close(self) -> None:
+        self._closed = True
+        for slot in list(self._slots):
+            await self._close_slot(slot)
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def stats(self) -> dict:
+        return dict(
+            self.stats_counters,
+            browsers=len(self._slots),
+            pages=self.size,
+            free_pages=self._free.qsize() if self._free else 0,
+            memory_mb={s.generation: s.scraper.memory_mb() for s in self._slots},
+        )
@@ -38,6 +38,7 @@ import re
 import requests
 from mogi_crawler_helper import render_mogi_ui
 from database import Database
+from template_engine import apply_exclude_words, compile_template, is_xpath_selector, parse_exclude_words, select
 # Fix asyncio for Windows
 if sys.platform == 'win32':
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
@@ -456,17 +457,14 @@ def _get_phone_selector(template: Dict[str, Any]) -> Optional[str]:
 
 
 def _is_xpath_selector(selector: str) -> bool:
-    return selector.startswith('/') or selector.startswith('(')
+    return is_xpath_selector(selector)
 
 
 def _extract_text_from_tree(tree, selector: str) -> Optional[str]:
     if not tree or not selector:
         return None
     try:
-        if selector.startswith('/') or selector.startswith('('):
-            elements = tree.xpath(selector)
-        else:
-            elements = tree.cssselect(selector)
+        elements = select(tree, selector)
     except Exception:
         return None
     for el in elements:
@@ -708,36 +706,11 @@ async def _reveal_phone_before_extract(page, url: str, template: Dict[str, Any])
 
 
 def _parse_exclude_words(field: Dict[str, Any]) -> list:
-    raw = field.get('excludeWords')
-    if not raw:
-        return []
-    if isinstance(raw, list):
-        return [str(w).strip() for w in raw if str(w).strip()]
-    if isinstance(raw, str):
-        parts = re.split(r'[|,]', raw)
-        return [p.strip() for p in parts if p.strip()]
-    return []
+    return parse_exclude_words(field)
 
 
 def _apply_exclude_words(value: Any, field: Dict[str, Any]) -> Any:
-    if value is None:
-        return None
-    words = _parse_exclude_words(field)
-    if not words:
-        return value
-    if isinstance(value, list):
-        cleaned = []
-        for v in value:
-            cleaned_val = _apply_exclude_words(v, field)
-            if cleaned_val:
-                cleaned.append(cleaned_val)
-        return cleaned
-    if not isinstance(value, str):
-        return value
-    cleaned_value = value
-    for word in words:
-        cleaned_value = cleaned_value.replace(word, "")
-    return cleaned_value.strip()
+    return apply_exclude_words(value, field)
 
 
 def _get_inner_html(el: Any) -> Optional[str]:
@@ -2153,13 +2126,17 @@ async def scrape_url(
 
         extracted_data = {}
 
+        compiled = compile_template(template)
+
 
 
-        for field in template.get('fields', []):
+        for cf in compiled.fields:
 
-            field_name = field.get('name')
+            field = cf.field
 
-            selector = field.get('selector', '').strip()
+            field_name = cf.name
+
+            selector = (field.get('selector') or '').strip()
 
             value_type = field.get('valueType', 'text')
 
@@ -2173,21 +2150,13 @@ async def scrape_url(
 
 
 
-            try:
-
-                elements = []
+            t0 = time.perf_counter()
 
-                # Tự động nhận diện XPath (bắt đầu bằng / hoặc () )
-
-                if selector.startswith('/') or selector.startswith('('):
-
-                    elements = tree.xpath(selector)
-
-                else:
+            try:
 
-                    # Nếu là CSS, chuyển sang dùng cssselect
+                # Selector (XPath hoặc CSS) đã compile sẵn trong template_engine
 
-                    elements = tree.cssselect(selector)
+                elements = cf.select(tree)
 
 
 
@@ -2384,6 +2353,8 @@ async def scrape_url(
 
                 extracted_data[field_name] = None
 
+            compiled.record(field_name, time.perf_counter() - t0)
+
 
 
         # 3. Format dữ liệu
@@ -6067,6 +6038,8 @@ with tab5:
                 detail_wait_load_max = st.number_input("Detail wait load max (s)", min_value=0.0, max_value=180.0, value=5.0, step=0.5)
                 detail_delay_min = st.number_input("Detail delay min (s)", min_value=0.0, max_value=120.0, value=2.0, step=0.5)
                 detail_delay_max = st.number_input("Detail delay max (s)", min_value=0.0, max_value=180.0, value=3.0, step=0.5)
+                detail_workers = st.number_input("Detail browser workers", min_value=1, max_value=8, value=1, help="> 1: chạy sharded, mỗi worker 1 browser + profile clone riêng")
+                detail_domain_rpm = st.number_input("Detail links/min per domain (0 = không giới hạn)", min_value=0, max_value=600, value=0)
             else:
                 detail_show_browser = False
                 detail_fake_scroll = False
@@ -6075,6 +6048,8 @@ with tab5:
                 detail_wait_load_max = 0.0
                 detail_delay_min = 0.0
                 detail_delay_max = 0.0
+                detail_workers = 1
+                detail_domain_rpm = 0
             if enable_image:
                 image_dir = st.text_input("Image dir", value=os.path.join(os.getcwd(), "output", "images"))
                 images_per_minute = st.number_input("Images per minute", min_value=1, max_value=600, value=30)
@@ -6170,6 +6145,8 @@ with tab5:
             'detail_wait_load_max': detail_wait_load_max,
             'detail_delay_min': detail_delay_min,
             'detail_delay_max': detail_delay_max,
+            'detail_workers': int(detail_workers),
+            'detail_domain_rpm': int(detail_domain_rpm),
             'image_dir': image_dir,
             'images_per_minute': images_per_minute,
             'image_domain': image_domain,
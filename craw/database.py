@@ -4,7 +4,12 @@ Supports MySQL
 """
 
 import os
-from datetime import datetime
+import time
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from typing import List, Optional
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
 from pathlib import Path
@@ -30,6 +35,189 @@ except ImportError:
         USE_MYSQL_CONNECTOR = False
 
 
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes free within the wait timeout"""
+
+
+class PooledConnection:
+    """
+    Wrapper quanh 1 connection thật lấy từ ConnectionPool.
+
+    Mọi thuộc tính/method được chuyển tiếp sang connection gốc, riêng close()
+    trả connection về pool thay vì đóng socket. Nhờ vậy code cũ kiểu
+    `conn = db.get_connection(); ...; conn.close()` tự động dùng lại kết nối.
+    """
+
+    def __init__(self, pool: "ConnectionPool", raw_conn):
+        self._pool = pool
+        self._conn = raw_conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise AttributeError(f"Pooled connection already released ({name})")
+        return getattr(conn, name)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+    def discard(self):
+        """Đóng hẳn connection (không trả về pool), dùng khi connection bị lỗi"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn, discard=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __del__(self):
+        # Caller quên close(): giải phóng slot để pool không bị cạn
+        try:
+            if self.__dict__.get('_conn') is not None:
+                self.discard()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe, bounded MySQL connection pool.
+
+    - Tối đa `max_size` connection (đang mượn + đang rảnh); quá giới hạn thì
+      acquire() chờ tối đa `timeout` giây rồi raise PoolTimeoutError.
+    - Health check: connection rảnh quá `ping_interval` giây sẽ được ping trước
+      khi giao; connection sống quá `recycle_seconds` sẽ bị đóng và mở lại
+      (tránh MySQL wait_timeout / lỗi 2006 "server has gone away").
+    - Khi trả về pool, transaction dở dang được rollback để connection sạch.
+    """
+
+    def __init__(self, factory, max_size: int = 10, timeout: float = 30.0,
+                 ping_interval: float = 30.0, recycle_seconds: float = 3600.0):
+        self._factory = factory
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.recycle_seconds = recycle_seconds
+        self._idle = deque()  # (raw_conn, created_at, last_used_at)
+        self._born = {}  # id(raw_conn) -> created_at
+        self._in_use = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    @property
+    def size(self) -> int:
+        with self._cond:
+            return self._in_use + len(self._idle)
+
+    def resize(self, max_size: int):
+        with self._cond:
+            self.max_size = max(self.max_size, int(max_size))
+            self._cond.notify_all()
+
+    def _is_alive(self, raw_conn) -> bool:
+        try:
+            if hasattr(raw_conn, 'is_connected'):
+                # mysql.connector
+                return raw_conn.is_connected()
+            raw_conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _close_raw(self, raw_conn):
+        self._born.pop(id(raw_conn), None)
+        try:
+            raw_conn.close()
+        except Exception:
+            pass
+
+    def acquire(self) -> PooledConnection:
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    raw_conn, created_at, last_used = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    raw_conn = None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"No free DB connection after {self.timeout}s (max_size={self.max_size})"
+                    )
+                self._cond.wait(remaining)
+
+        # Tạo / kiểm tra connection bên ngoài lock để không chặn thread khác
+        try:
+            if raw_conn is not None:
+                now = time.monotonic()
+                expired = self.recycle_seconds and now - created_at > self.recycle_seconds
+                stale = now - last_used > self.ping_interval
+                if expired or (stale and not self._is_alive(raw_conn)):
+                    self._close_raw(raw_conn)
+                    raw_conn = None
+            if raw_conn is None:
+                raw_conn = self._factory()
+                self._born[id(raw_conn)] = time.monotonic()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw_conn)
+
+    @staticmethod
+    def _in_transaction(raw_conn) -> bool:
+        if hasattr(raw_conn, 'in_transaction'):
+            # mysql.connector
+            return bool(raw_conn.in_transaction)
+        server_status = getattr(raw_conn, 'server_status', None)
+        if server_status is None:
+            return True
+        return bool(server_status & 0x0001)  # SERVER_STATUS_IN_TRANS
+
+    def release(self, raw_conn, discard: bool = False):
+        if getattr(raw_conn, 'open', True) is False:
+            # pymysql đánh dấu socket đã chết (lỗi 2006/2013) -> không đưa lại vào pool
+            discard = True
+        if not discard and self._in_transaction(raw_conn):
+            try:
+                raw_conn.rollback()
+            except Exception:
+                discard = True
+        created_at = self._born.get(id(raw_conn), time.monotonic())
+        if discard:
+            self._close_raw(raw_conn)
+        with self._cond:
+            self._in_use -= 1
+            if not discard:
+                self._idle.append((raw_conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for raw_conn, _, _ in idle:
+            self._close_raw(raw_conn)
+
+
+# Pool dùng chung theo (driver, host, port, user, database) trong cùng process,
+# để mỗi worker thread tạo Database() riêng vẫn dùng lại connection đã mở.
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+# Các database đã chạy init_db() trong process này
+_SCHEMA_READY = set()
+
+
 class Database:
     """Database handler for collected links - MySQL only"""
     
@@ -38,7 +226,9 @@ class Database:
                  user: str = "root",
                  password: str = "",
                  database: str = "craw_db",
-                 port: int = 3306):
+                 port: int = 3306,
+                 init_schema: bool = True,
+                 pool_size: int = 10):
         """
         Initialize MySQL database connection
         
@@ -48,6 +238,8 @@ class Database:
             password: MySQL password
             database: Database name
             port: MySQL port
+            init_schema: Run init_db() DDL (only once per process). Workers pass False.
+            pool_size: Max connections in the shared pool for this database
         """
         if not MYSQL_AVAILABLE:
             raise ImportError("MySQL library not found. Install with: pip install pymysql or pip install mysql-connector-python")
@@ -58,17 +250,62 @@ class Database:
         self.database = database
         self.port = port
         self.use_mysql_connector = USE_MYSQL_CONNECTOR if MYSQL_AVAILABLE else False
-        
-        # Don't cache connection - create new one each time for thread safety
-        self.init_db()
+
+        # Connection dùng chung qua pool (thread-safe): mỗi lần get_connection()
+        # mượn 1 connection, close() trả lại pool thay vì đóng socket.
+        pool_key = (self.use_mysql_connector, host, port, user, database)
+        with _POOLS_LOCK:
+            pool = _POOLS.get(pool_key)
+            if pool is None:
+                pool = ConnectionPool(self._connect, max_size=pool_size)
+                _POOLS[pool_key] = pool
+            else:
+                pool.resize(pool_size)
+        self.pool = pool
+
+        if init_schema and pool_key not in _SCHEMA_READY:
+            self.init_db()
+            _SCHEMA_READY.add(pool_key)
     
     def get_connection(self, use_database: bool = True):
         """
-        Get MySQL database connection (creates new connection each time for thread safety)
+        Get MySQL database connection from the shared pool
+
+        The returned connection is thread-confined: use it from one thread only and
+        call close() (or use `with db.connection() as conn`) to hand it back.
         
         Args:
             use_database: If True, connect to specific database. If False, connect without database (for creating database)
         """
+        if use_database:
+            return self.pool.acquire()
+        return self._connect(use_database=False)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager trả về connection từ pool, rollback nếu có lỗi và luôn trả lại pool
+
+        Usage:
+            with db.connection() as conn:
+                cursor = conn.cursor()
+                ...
+                conn.commit()
+        """
+        conn = self.pool.acquire()
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                conn.discard()
+            raise
+        finally:
+            conn.close()
+
+    def _connect(self, use_database: bool = True, local_infile: bool = False):
+        """Open a new physical MySQL connection (used by the pool)"""
         if self.use_mysql_connector:
             import mysql.connector
             conn_params = {
@@ -80,6 +317,8 @@ class Database:
             }
             if use_database:
                 conn_params['database'] = self.database
+            if local_infile:
+                conn_params['allow_local_infile'] = True
             conn = mysql.connector.connect(**conn_params)
             return conn
         else:
@@ -96,6 +335,8 @@ class Database:
             
             if use_database:
                 conn_params['db'] = self.database
+            if local_infile:
+                conn_params['local_infile'] = True
             conn = MySQLdb.connect(**conn_params)
             return conn
     
@@ -216,6 +457,23 @@ class Database:
             cursor.execute("ALTER TABLE collected_links ADD INDEX idx_collected_links_updated_at (updated_at)")
         except Exception:
             pass
+        # Lease cho hàng đợi claim (claim_links / ack_links / nack_links)
+        try:
+            cursor.execute("ALTER TABLE collected_links ADD COLUMN lease_owner VARCHAR(64) DEFAULT NULL")
+        except Exception:
+            pass
+        try:
+            cursor.execute("ALTER TABLE collected_links ADD COLUMN lease_expires_at DATETIME DEFAULT NULL")
+        except Exception:
+            pass
+        try:
+            cursor.execute("ALTER TABLE collected_links ADD INDEX idx_collected_links_lease (status, lease_expires_at)")
+        except Exception:
+            pass
+        try:
+            cursor.execute("ALTER TABLE collected_links ADD INDEX idx_collected_links_lease_owner (lease_owner)")
+        except Exception:
+            pass
 
         # Create scraped_details table (lưu kết quả cào chi tiết)
         cursor.execute('''
@@ -550,6 +808,8 @@ class Database:
                 detail_wait_load_max FLOAT DEFAULT 5,
                 detail_delay_min FLOAT DEFAULT 2,
                 detail_delay_max FLOAT DEFAULT 3,
+                detail_workers INT DEFAULT 1,
+                detail_domain_rpm INT DEFAULT 0,
                 image_dir VARCHAR(2000) DEFAULT NULL,
                 images_per_minute INT DEFAULT 30,
                 image_domain VARCHAR(255) DEFAULT NULL,
@@ -585,6 +845,8 @@ class Database:
             "ALTER TABLE scheduler_tasks ADD COLUMN detail_wait_load_max FLOAT DEFAULT 5",
             "ALTER TABLE scheduler_tasks ADD COLUMN detail_delay_min FLOAT DEFAULT 2",
             "ALTER TABLE scheduler_tasks ADD COLUMN detail_delay_max FLOAT DEFAULT 3",
+            "ALTER TABLE scheduler_tasks ADD COLUMN detail_workers INT DEFAULT 1",
+            "ALTER TABLE scheduler_tasks ADD COLUMN detail_domain_rpm INT DEFAULT 0",
             "ALTER TABLE scheduler_tasks ADD COLUMN trade_type VARCHAR(50) DEFAULT NULL",
             "ALTER TABLE scheduler_tasks ADD COLUMN image_domain VARCHAR(255) DEFAULT NULL",
             "ALTER TABLE scheduler_tasks ADD COLUMN image_status VARCHAR(50) DEFAULT NULL",
@@ -698,6 +960,46 @@ class Database:
             print(f"Warning: URL normalization failed for {url[:50]}: {e}")
             return url.strip()
     
+    COLLECTED_LINK_COLUMNS = (
+        'url', 'status', 'domain', 'loaihinh', 'trade_type',
+        'city_id', 'city_name', 'ward_id', 'ward_name',
+        'new_city_id', 'new_city_name', 'new_ward_id', 'new_ward_name',
+        'created_at',
+    )
+
+    @staticmethod
+    def _is_deadlock(exc) -> bool:
+        """MySQL 1213 (deadlock) / 1205 (lock wait timeout) - cả mysql.connector (errno) lẫn pymysql (args[0])"""
+        code = getattr(exc, 'errno', None)
+        if code is None and getattr(exc, 'args', None):
+            code = exc.args[0]
+        return code in (1205, 1213)
+
+    def _run_chunk_with_retry(self, fn, op_name: str, max_retries: int = 3):
+        """Chạy fn(conn) trong 1 transaction riêng, retry khi deadlock (chỉ retry chunk này)"""
+        attempt = 0
+        while True:
+            conn = self.get_connection()
+            try:
+                result = fn(conn)
+                conn.commit()
+                return result
+            except Exception as e:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+                if not self._is_deadlock(e):
+                    raise
+                attempt += 1
+                if attempt >= max_retries:
+                    print(f"Max retries reached for Deadlock in {op_name}.")
+                    raise
+                print(f"Deadlock detected in {op_name} (Attempt {attempt}/{max_retries}). Retrying...")
+                time.sleep(random.uniform(1, 3))  # Backoff
+            finally:
+                conn.close()
+
     def add_collected_links(
         self,
         links_list: List[str],
@@ -712,13 +1014,22 @@ class Database:
         new_city_name: Optional[str] = None,
         new_ward_id: Optional[int] = None,
         new_ward_name: Optional[str] = None,
+        chunk_size: int = 500,
+        load_data_threshold: int = 0,
     ) -> int:
         """
         Bulk insert links, skipping duplicates
         
+        Links are inserted with multi-row INSERT IGNORE statements (chunk_size rows
+        per round trip); each chunk commits on its own and is retried separately on
+        deadlock, so a conflict never replays links already stored.
+        
         Args:
             links_list: List of URL strings
             domain: Optional domain label to store (e.g., 'batdongsan', 'nhatot')
+            chunk_size: Rows per multi-row INSERT
+            load_data_threshold: If > 0 and the list has at least this many links,
+                load them via LOAD DATA LOCAL INFILE from a temp file instead
             
         Returns:
             Number of new links added
@@ -726,112 +1037,136 @@ class Database:
         if not links_list:
             return 0
         
-        # Retry loop for Deadlock handling
-        max_retries = 3
-        attempt = 0
-        while attempt < max_retries:
-            try:
-                conn = self.get_connection()
-                cursor = conn.cursor()
-                
-                added_count = 0
-                normalized_links = []
-                for url in links_list:
-                    if not url or not isinstance(url, str):
-                        continue
+        # Normalize + bỏ trùng trong cùng lô (giữ thứ tự)
+        normalized_links = []
+        seen = set()
+        for url in links_list:
+            if not url or not isinstance(url, str):
+                continue
+            normalized_url = self.normalize_url(url)
+            if normalized_url in seen:
+                continue
+            seen.add(normalized_url)
+            normalized_links.append(normalized_url)
+        if not normalized_links:
+            return 0
+        
+        now = datetime.now()
+        row_tail = (
+            'PENDING', domain, loaihinh, trade_type,
+            city_id, city_name, ward_id, ward_name,
+            new_city_id, new_city_name, new_ward_id, new_ward_name,
+            now,
+        )
+        
+        added_count = 0
+        try:
+            if load_data_threshold and len(normalized_links) >= load_data_threshold:
+                added_count = self._load_collected_links_file(normalized_links, row_tail)
+            else:
+                chunk_size = max(1, int(chunk_size))
+                columns = ", ".join(self.COLLECTED_LINK_COLUMNS)
+                row_placeholder = "(" + ", ".join(["%s"] * len(self.COLLECTED_LINK_COLUMNS)) + ")"
+                for i in range(0, len(normalized_links), chunk_size):
+                    chunk = normalized_links[i:i + chunk_size]
                     
-                    # Normalize URL before inserting
-                    normalized_url = self.normalize_url(url)
-                    normalized_links.append(normalized_url)
+                    def _insert_chunk(conn, chunk=chunk):
+                        cursor = conn.cursor()
+                        try:
+                            params = []
+                            for link in chunk:
+                                params.append(link)
+                                params.extend(row_tail)
+                            # INSERT IGNORE nhiều dòng: rowcount = số dòng thực sự được thêm
+                            cursor.execute(
+                                f"INSERT IGNORE INTO collected_links ({columns}) VALUES "
+                                + ",".join([row_placeholder] * len(chunk)),
+                                params,
+                            )
+                            return max(cursor.rowcount, 0)
+                        finally:
+                            cursor.close()
                     
-                    try:
-                        # Use INSERT IGNORE for MySQL (skips duplicates)
-                        cursor.execute('''
-                            INSERT IGNORE INTO collected_links (
-                                url, status, domain, loaihinh, trade_type,
-                                city_id, city_name, ward_id, ward_name,
-                                new_city_id, new_city_name, new_ward_id, new_ward_name,
-                                created_at
+                    added_count += self._run_chunk_with_retry(_insert_chunk, "add_collected_links")
+            
+            # If trade_type is provided, backfill NULL trade_type for these URLs.
+            if trade_type:
+                for i in range(0, len(normalized_links), 500):
+                    chunk = normalized_links[i:i + 500]
+                    
+                    def _backfill_chunk(conn, chunk=chunk):
+                        cursor = conn.cursor()
+                        try:
+                            placeholders = ",".join(["%s"] * len(chunk))
+                            cursor.execute(
+                                f"""
+                                UPDATE collected_links
+                                SET trade_type = %s
+                                WHERE trade_type IS NULL AND url IN ({placeholders})
+                                """,
+                                (trade_type, *chunk)
                             )
-                            VALUES (%s, 'PENDING', %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ''', (
-                            normalized_url,
-                            domain,
-                            loaihinh,
-                            trade_type,
-                            city_id,
-                            city_name,
-                            ward_id,
-                            ward_name,
-                            new_city_id,
-                            new_city_name,
-                            new_ward_id,
-                            new_ward_name,
-                            datetime.now()
-                        ))
-                        
-                        if cursor.rowcount > 0:
-                            added_count += 1
-                        else:
-                            # URL đã tồn tại trong DB, bỏ qua (KHÔNG thêm vào)
-                            pass
-                    except Exception as e:
-                        # Check if it is a mysql deadlock error hidden in Exception
-                        is_deadlock = False
-                        if hasattr(e, 'errno') and e.errno == 1213:
-                            is_deadlock = True
-                        
-                        if is_deadlock:
-                            raise e # Raise to outer loop to handle retry
-                            
-                        # Skip if other error (likely duplicate or invalid)
-                        print(f"Error adding link {normalized_url[:50]}: {e}")
-                        continue
-                
-                # If trade_type is provided, backfill NULL trade_type for these URLs.
-                if trade_type and normalized_links:
-                    for i in range(0, len(normalized_links), 500):
-                        chunk = normalized_links[i:i + 500]
-                        placeholders = ",".join(["%s"] * len(chunk))
-                        cursor.execute(
-                            f"""
-                            UPDATE collected_links
-                            SET trade_type = %s
-                            WHERE trade_type IS NULL AND url IN ({placeholders})
-                            """,
-                            (trade_type, *chunk)
-                        )
-                
+                        finally:
+                            cursor.close()
+                    
+                    self._run_chunk_with_retry(_backfill_chunk, "add_collected_links backfill")
+            
+            return added_count
+        except Exception as e:
+            if self._is_deadlock(e):
+                raise
+            print(f"Database Error in add_collected_links: {e}")
+            # Các chunk trước đã commit -> vẫn báo đúng số link đã thêm
+            return added_count
+
+    def _load_collected_links_file(self, normalized_links: List[str], row_tail: tuple) -> int:
+        """
+        Nạp danh sách link rất lớn bằng LOAD DATA LOCAL INFILE (1 round trip)
+        
+        Cần server bật local_infile. Trả về số dòng thực sự được thêm (IGNORE bỏ qua trùng).
+        """
+        import tempfile
+        
+        def _field(value) -> str:
+            if value is None:
+                return "\\N"
+            if isinstance(value, datetime):
+                value = value.strftime("%Y-%m-%d %H:%M:%S")
+            return (str(value).replace("\\", "\\\\")
+                    .replace("\t", "\\t").replace("\n", "\\n"))
+        
+        tail = "\t".join(_field(v) for v in row_tail)
+        fd, tmp_path = tempfile.mkstemp(prefix="collected_links_", suffix=".tsv")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                for link in normalized_links:
+                    f.write(f"{_field(link)}\t{tail}\n")
+            
+            conn = self._connect(local_infile=True)
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    f"""
+                    LOAD DATA LOCAL INFILE %s
+                    IGNORE INTO TABLE collected_links
+                    CHARACTER SET utf8mb4
+                    FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+                    LINES TERMINATED BY '\\n'
+                    ({", ".join(self.COLLECTED_LINK_COLUMNS)})
+                    """,
+                    (tmp_path,),
+                )
+                added = max(cursor.rowcount, 0)
                 conn.commit()
+                return added
+            finally:
                 cursor.close()
                 conn.close()
-                return added_count
-
-            except mysql.connector.Error as err:
-                # Catch Deadlock from outer loop (or propagated from inner)
-                if err.errno == 1213: # Deadlock
-                    attempt += 1
-                    print(f"Deadlock detected in add_collected_links (Attempt {attempt}/{max_retries}). Retrying in {attempt}s...")
-                    time.sleep(random.uniform(1, 3)) # Backoff
-                    if attempt >= max_retries:
-                         print("Max retries reached for Deadlock.")
-                         raise err
-                    # Continue while loop to retry
-                else:
-                    raise err
-            except Exception as e:
-                # Check for deadlock in generic exception
-                if hasattr(e, 'errno') and e.errno == 1213:
-                     attempt += 1
-                     print(f"Deadlock detected (Generic) in add_collected_links (Attempt {attempt}/{max_retries})...")
-                     time.sleep(random.uniform(1, 3))
-                     if attempt >= max_retries:
-                         raise e
-                     continue
-                
-                print(f"Database Error in add_collected_links: {e}")
-                return 0
-        return 0
+        finally:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
 
     def add_scraped_detail(self, url: str, data: dict, domain: Optional[str] = None, link_id: Optional[int] = None, success: bool = True):
         """
@@ -907,12 +1242,59 @@ class Database:
             cursor.close()
             conn.close()
 
-    def add_scraped_detail_flat(self, url: str, data: dict, domain: Optional[str] = None, link_id: Optional[int] = None, loaihinh: Optional[str] = None, trade_type: Optional[str] = None) -> Optional[int]:
-        """
-        Lưu bản ghi detail vào bảng scraped_details_flat với các cột cụ thể.
-        loaihinh, trade_type: lấy từ collected_links khi crawl detail
-        full: auto=1 nếu có đủ title, domain, mota, khoanggia, dientich, diachi, sodienthoai, loaihinh, trade_type
-        """
+    _SCRAPED_DETAIL_FLAT_INSERT = '''
+                INSERT INTO scraped_details_flat (
+                    link_id, url, domain, title, img_count, mota, khoanggia, dientich,
+                    sophongngu, sophongvesinh, huongnha, huongbancong, mattien, duongvao, phaply, noithat,
+                    sotang, loaihinhnhao, dientichsudung, gia_m2, gia_mn, dacdiemnhadat, chieungang, chieudai, thuocduan,
+                    trangthaiduan, tenmoigioi, sodienthoai, map, matin, loaitin, ngayhethan, ngaydang, diachi,
+                    street_ext, ward_ext, district_ext, city_ext,
+                    city_code, district_id, ward_id, street_id, lat, lng,
+                    mogi_city_id, mogi_district_id, mogi_ward_id, mogi_street_id,
+                    thoigianvaoo, giadien, gianuoc, giainternet, sotiencoc, tangso, loaihinhvanphong, loaihinhdat, loaihinhcanho,
+                    diachicu, loaibds, phongan, nhabep, santhuong, chodexehoi, chinhchu,
+                    loaihinh, trade_type, full
+                ) VALUES (
+                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                    %s, %s, %s, %s,
+                    %s, %s, %s, %s, %s, %s,
+                    %s, %s, %s, %s,
+                    %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                    %s, %s, %s, %s, %s, %s, %s,
+                    %s, %s, %s
+                )
+                ON DUPLICATE KEY UPDATE
+                    khoanggia = IF(
+                        VALUES(khoanggia) IS NOT NULL
+                        AND TRIM(CAST(VALUES(khoanggia) AS CHAR)) <> ''
+                        AND (
+                            khoanggia IS NULL
+                            OR TRIM(CAST(khoanggia AS CHAR)) = ''
+                            OR TRIM(CAST(khoanggia AS CHAR)) = '0'
+                        ),
+                        VALUES(khoanggia),
+                        khoanggia
+                    ),
+                    thuocduan = VALUES(thuocduan),
+                    map = VALUES(map),
+                    full = VALUES(full),
+                    ngaydang = VALUES(ngaydang), -- Updated date if changed
+                    -- Update location inputs if improved
+                    city_code = IF(VALUES(city_code) IS NOT NULL, VALUES(city_code), city_code),
+                    district_id = IF(VALUES(district_id) IS NOT NULL, VALUES(district_id), district_id),
+                    ward_id = IF(VALUES(ward_id) IS NOT NULL, VALUES(ward_id), ward_id),
+                    street_id = IF(VALUES(street_id) IS NOT NULL, VALUES(street_id), street_id),
+                    lat = IF(VALUES(lat) IS NOT NULL, VALUES(lat), lat),
+                    lng = IF(VALUES(lng) IS NOT NULL, VALUES(lng), lng),
+                    mogi_city_id = IF(VALUES(mogi_city_id) IS NOT NULL, VALUES(mogi_city_id), mogi_city_id),
+                    mogi_district_id = IF(VALUES(mogi_district_id) IS NOT NULL, VALUES(mogi_district_id), mogi_district_id),
+                    mogi_ward_id = IF(VALUES(mogi_ward_id) IS NOT NULL, VALUES(mogi_ward_id), mogi_ward_id),
+                    mogi_street_id = IF(VALUES(mogi_street_id) IS NOT NULL, VALUES(mogi_street_id), mogi_street_id)
+            '''
+
+    def _scraped_detail_flat_params(self, url: str, data: dict, domain: Optional[str] = None, link_id: Optional[int] = None, loaihinh: Optional[str] = None, trade_type: Optional[str] = None) -> Optional[tuple]:
+        """Tham số cho _SCRAPED_DETAIL_FLAT_INSERT (None nếu data rỗng)."""
         if not data:
             return None
         data_lower = {}
@@ -966,139 +1348,101 @@ class Database:
             trade_type and str(trade_type).strip()
         ]) else 0
         
+        imgs = data.get('img')
+        if isinstance(imgs, list):
+            img_count = len(imgs)
+        else:
+            img_count = 1 if imgs else None
+        map_value = data.get('map')
+        if isinstance(map_value, list):
+            map_value = next((v for v in map_value if isinstance(v, str) and v.strip()), None)
+        elif isinstance(map_value, dict):
+            map_value = map_value.get('src') or map_value.get('url') or map_value.get('value')
+        if isinstance(map_value, str):
+            map_value = map_value.strip()
+        return (
+            link_id,
+            url,
+            domain,
+            data.get('title'),
+            img_count,
+            data.get('mota'),
+            data.get('khoanggia'),
+            data.get('dientich'),
+            data.get('sophongngu'),
+            data.get('sophongvesinh'),
+            data.get('huongnha'),
+            data.get('huongbancong'),
+            data.get('mattien'),
+            data.get('duongvao'),
+            data.get('phaply'),
+            data.get('noithat'),
+            data.get('sotang'),
+            data.get('loaihinhnhao') or data.get('loaibds'),
+            data.get('dientichsudung'),
+            _get_data_value('gia_m2', 'gia/m2', 'gia m2', 'gia_m²', 'gia/m²', 'gia m²'),
+            _get_data_value('gia_mn', 'gia/mn', 'gia mn'),
+            data.get('dacdiemnhadat'),
+            data.get('chieungang'),
+            data.get('chieudai'),
+            data.get('thuocduan'),
+            data.get('trangthaiduan'),
+            _get_data_value('tenmoigioi', 'moigioi', 'ten moi gioi', 'ten_moi_gioi'),
+            data.get('sodienthoai'),
+            map_value,
+            data.get('matin'),
+            data.get('loaitin'),
+            data.get('ngayhethan'),
+            data.get('ngaydang'),
+            data.get('diachi'),
+            data.get('street_ext'),
+            data.get('ward_ext'),
+            data.get('district_ext'),
+            data.get('city_ext'),
+            data.get('city_code'),
+            data.get('district_id'),
+            data.get('ward_id'),
+            data.get('street_id'),
+            data.get('lat'),
+            data.get('lng'),
+            data.get('mogi_city_id'),
+            data.get('mogi_district_id'),
+            data.get('mogi_ward_id'),
+            data.get('mogi_street_id'),
+            data.get('thoigianvaoo'),
+            data.get('giadien'),
+            data.get('gianuoc'),
+            data.get('giainternet'),
+            data.get('sotiencoc'),
+            data.get('tangso'),
+            data.get('loaihinhvanphong'),
+            data.get('loaihinhdat'),
+            data.get('loaihinhcanho'),
+            data.get('diachicu'),
+            data.get('loaibds'),
+            data.get('phongan'),
+            data.get('nhabep'),
+            data.get('santhuong'),
+            data.get('chodexehoi'),
+            data.get('chinhchu'),
+            loaihinh,
+            trade_type,
+            is_full
+        )
+
+    def add_scraped_detail_flat(self, url: str, data: dict, domain: Optional[str] = None, link_id: Optional[int] = None, loaihinh: Optional[str] = None, trade_type: Optional[str] = None) -> Optional[int]:
+        """
+        Lưu bản ghi detail vào bảng scraped_details_flat với các cột cụ thể.
+        loaihinh, trade_type: lấy từ collected_links khi crawl detail
+        full: auto=1 nếu có đủ title, domain, mota, khoanggia, dientich, diachi, sodienthoai, loaihinh, trade_type
+        """
+        params = self._scraped_detail_flat_params(url, data, domain, link_id, loaihinh, trade_type)
+        if params is None:
+            return None
         conn = self.get_connection()
         cursor = conn.cursor()
         try:
-            imgs = data.get('img')
-            if isinstance(imgs, list):
-                img_count = len(imgs)
-            else:
-                img_count = 1 if imgs else None
-            map_value = data.get('map')
-            if isinstance(map_value, list):
-                map_value = next((v for v in map_value if isinstance(v, str) and v.strip()), None)
-            elif isinstance(map_value, dict):
-                map_value = map_value.get('src') or map_value.get('url') or map_value.get('value')
-            if isinstance(map_value, str):
-                map_value = map_value.strip()
-            cursor.execute('''
-                INSERT INTO scraped_details_flat (
-                    link_id, url, domain, title, img_count, mota, khoanggia, dientich,
-                    sophongngu, sophongvesinh, huongnha, huongbancong, mattien, duongvao, phaply, noithat,
-                    sotang, loaihinhnhao, dientichsudung, gia_m2, gia_mn, dacdiemnhadat, chieungang, chieudai, thuocduan,
-                    trangthaiduan, tenmoigioi, sodienthoai, map, matin, loaitin, ngayhethan, ngaydang, diachi,
-                    street_ext, ward_ext, district_ext, city_ext,
-                    city_code, district_id, ward_id, street_id, lat, lng,
-                    mogi_city_id, mogi_district_id, mogi_ward_id, mogi_street_id,
-                    thoigianvaoo, giadien, gianuoc, giainternet, sotiencoc, tangso, loaihinhvanphong, loaihinhdat, loaihinhcanho,
-                    diachicu, loaibds, phongan, nhabep, santhuong, chodexehoi, chinhchu,
-                    loaihinh, trade_type, full
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s
-                )
-                ON DUPLICATE KEY UPDATE
-                    khoanggia = IF(
-                        VALUES(khoanggia) IS NOT NULL
-                        AND TRIM(CAST(VALUES(khoanggia) AS CHAR)) <> ''
-                        AND (
-                            khoanggia IS NULL
-                            OR TRIM(CAST(khoanggia AS CHAR)) = ''
-                            OR TRIM(CAST(khoanggia AS CHAR)) = '0'
-                        ),
-                        VALUES(khoanggia),
-                        khoanggia
-                    ),
-                    thuocduan = VALUES(thuocduan),
-                    map = VALUES(map),
-                    full = VALUES(full),
-                    ngaydang = VALUES(ngaydang), -- Updated date if changed
-                    -- Update location inputs if improved
-                    city_code = IF(VALUES(city_code) IS NOT NULL, VALUES(city_code), city_code),
-                    district_id = IF(VALUES(district_id) IS NOT NULL, VALUES(district_id), district_id),
-                    ward_id = IF(VALUES(ward_id) IS NOT NULL, VALUES(ward_id), ward_id),
-                    street_id = IF(VALUES(street_id) IS NOT NULL, VALUES(street_id), street_id),
-                    lat = IF(VALUES(lat) IS NOT NULL, VALUES(lat), lat),
-                    lng = IF(VALUES(lng) IS NOT NULL, VALUES(lng), lng),
-                    mogi_city_id = IF(VALUES(mogi_city_id) IS NOT NULL, VALUES(mogi_city_id), mogi_city_id),
-                    mogi_district_id = IF(VALUES(mogi_district_id) IS NOT NULL, VALUES(mogi_district_id), mogi_district_id),
-                    mogi_ward_id = IF(VALUES(mogi_ward_id) IS NOT NULL, VALUES(mogi_ward_id), mogi_ward_id),
-                    mogi_street_id = IF(VALUES(mogi_street_id) IS NOT NULL, VALUES(mogi_street_id), mogi_street_id)
-            ''', (
-                link_id,
-                url,
-                domain,
-                data.get('title'),
-                img_count,
-                data.get('mota'),
-                data.get('khoanggia'),
-                data.get('dientich'),
-                data.get('sophongngu'),
-                data.get('sophongvesinh'),
-                data.get('huongnha'),
-                data.get('huongbancong'),
-                data.get('mattien'),
-                data.get('duongvao'),
-                data.get('phaply'),
-                data.get('noithat'),
-                data.get('sotang'),
-                data.get('loaihinhnhao') or data.get('loaibds'),
-                data.get('dientichsudung'),
-                _get_data_value('gia_m2', 'gia/m2', 'gia m2', 'gia_m²', 'gia/m²', 'gia m²'),
-                _get_data_value('gia_mn', 'gia/mn', 'gia mn'),
-                data.get('dacdiemnhadat'),
-                data.get('chieungang'),
-                data.get('chieudai'),
-                data.get('thuocduan'),
-                data.get('trangthaiduan'),
-                _get_data_value('tenmoigioi', 'moigioi', 'ten moi gioi', 'ten_moi_gioi'),
-                data.get('sodienthoai'),
-                map_value,
-                data.get('matin'),
-                data.get('loaitin'),
-                data.get('ngayhethan'),
-                data.get('ngaydang'),
-                data.get('diachi'),
-                data.get('street_ext'),
-                data.get('ward_ext'),
-                data.get('district_ext'),
-                data.get('city_ext'),
-                data.get('city_code'),
-                data.get('district_id'),
-                data.get('ward_id'),
-                data.get('street_id'),
-                data.get('lat'),
-                data.get('lng'),
-                data.get('mogi_city_id'),
-                data.get('mogi_district_id'),
-                data.get('mogi_ward_id'),
-                data.get('mogi_street_id'),
-                data.get('thoigianvaoo'),
-                data.get('giadien'),
-                data.get('gianuoc'),
-                data.get('giainternet'),
-                data.get('sotiencoc'),
-                data.get('tangso'),
-                data.get('loaihinhvanphong'),
-                data.get('loaihinhdat'),
-                data.get('loaihinhcanho'),
-                data.get('diachicu'),
-                data.get('loaibds'),
-                data.get('phongan'),
-                data.get('nhabep'),
-                data.get('santhuong'),
-                data.get('chodexehoi'),
-                data.get('chinhchu'),
-                loaihinh,
-                trade_type,
-                is_full
-            ))
+            cursor.execute(self._SCRAPED_DETAIL_FLAT_INSERT, params)
             conn.commit()
             # With ON DUPLICATE KEY UPDATE, lastrowid can be 0 even when update succeeds.
             # Return existing row id by URL so callers can treat this as success.
@@ -1118,6 +1462,50 @@ class Database:
             cursor.close()
             conn.close()
 
+    def add_scraped_details_flat_bulk(self, rows: list) -> list:
+        """
+        Upsert nhiều detail trong 1 câu INSERT ... VALUES (...), (...) ON DUPLICATE KEY UPDATE
+        (cùng cột/logic với add_scraped_detail_flat), commit 1 lần.
+        rows: [{"url", "data", "domain", "link_id", "loaihinh", "trade_type"}]
+        Lỗi cả batch (1 dòng quá dài / sai kiểu...) -> rollback rồi lưu lại từng dòng bằng
+        add_scraped_detail_flat, dòng vẫn lỗi thì bỏ qua.
+        Trả về các phần tử của rows đã lưu được (không tính dòng data rỗng / dòng lỗi).
+        """
+        batch_rows = []
+        params = []
+        for row in rows or []:
+            p = self._scraped_detail_flat_params(
+                row.get("url"), row.get("data"), row.get("domain"),
+                row.get("link_id"), row.get("loaihinh"), row.get("trade_type"),
+            )
+            if p is not None:
+                batch_rows.append(row)
+                params.append(p)
+        if not params:
+            return []
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            # pymysql executemany gộp VALUES thành 1 câu multi-row (giữ phần ON DUPLICATE KEY UPDATE)
+            cursor.executemany(self._SCRAPED_DETAIL_FLAT_INSERT, params)
+            conn.commit()
+            return batch_rows
+        except Exception as e:
+            conn.rollback()
+            print(f"Error bulk adding {len(params)} scraped_details_flat rows, retrying one by one: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+        saved = []
+        for row in batch_rows:
+            row_id = self.add_scraped_detail_flat(
+                row.get("url"), row.get("data"), row.get("domain"),
+                row.get("link_id"), row.get("loaihinh"), row.get("trade_type"),
+            )
+            if row_id:
+                saved.append(row)
+        return saved
+
     def add_detail_images(self, detail_id: int, images: list):
         """
         Lưu danh sách ảnh vào bảng scraped_detail_images gắn với detail_id.
@@ -1699,6 +2087,7 @@ class Database:
                 SET status = 'PENDING'
                 WHERE status LIKE 'IN_PROGRESS%%'
                   AND updated_at < DATE_SUB(NOW(), INTERVAL %s MINUTE)
+                  AND (lease_expires_at IS NULL OR lease_expires_at < NOW())
             ''', (timeout_minutes,))
             affected = cursor.rowcount
             conn.commit()
@@ -1969,9 +2358,9 @@ class Database:
                     listing_wait_next_min, listing_wait_next_max,
                     detail_show_browser, detail_fake_scroll, detail_fake_hover,
                     detail_wait_load_min, detail_wait_load_max,
-                    detail_delay_min, detail_delay_max,
+                    detail_delay_min, detail_delay_max, detail_workers, detail_domain_rpm,
                     image_dir, images_per_minute, image_domain, image_status, last_run_at, next_run_at
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             ''', (
                 task.get('name'),
                 1 if task.get('active', True) else 0,
@@ -2012,6 +2401,8 @@ class Database:
                 task.get('detail_wait_load_max', 5),
                 task.get('detail_delay_min', 2),
                 task.get('detail_delay_max', 3),
+                task.get('detail_workers', 1),
+                task.get('detail_domain_rpm', 0),
                 task.get('image_dir'),
                 task.get('images_per_minute', 30),
                 task.get('image_domain'),
@@ -2129,7 +2520,8 @@ class Database:
                        detail_wait_load_min, detail_wait_load_max,
                        detail_delay_min, detail_delay_max,
                        image_dir, images_per_minute,
-                       last_run_at, next_run_at
+                       last_run_at, next_run_at,
+                       detail_workers, detail_domain_rpm
                 FROM scheduler_tasks
                 WHERE active = 1 AND is_running = 0 AND cancel_requested = 0 
                   AND (run_now = 1 OR next_run_at IS NULL OR next_run_at <= %s)
@@ -2185,6 +2577,8 @@ class Database:
                         'images_per_minute': row[42],
                         'last_run_at': row[43],
                         'next_run_at': row[44],
+                        'detail_workers': row[45],
+                        'detail_domain_rpm': row[46],
                     })
                 else:
                     result.append(row)
@@ -2333,6 +2727,184 @@ class Database:
             cursor.close()
             conn.close()
 
+    # =========================
+    # Lease-based link queue
+    # =========================
+    @staticmethod
+    def new_worker_token(prefix: str = "worker") -> str:
+        """Token định danh 1 consumer (1 thread/worker) khi claim link, tối đa 64 ký tự"""
+        import socket
+        import uuid
+        host = socket.gethostname().split('.')[0][:16]
+        return f"{prefix[:24]}-{host}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def claim_links(
+        self,
+        worker_token: str,
+        limit: int = 10,
+        lease_seconds: int = 600,
+        domain: Optional[str] = None,
+        loaihinh: Optional[str] = None,
+        trade_type: Optional[str] = None,
+        from_status: str = 'PENDING',
+        newest_first: bool = False,
+    ) -> List[dict]:
+        """
+        Claim tối đa `limit` link bằng 1 câu UPDATE ... ORDER BY id LIMIT n (atomic).
+
+        Link được claim chuyển sang IN_PROGRESS với lease_owner=worker_token và
+        lease_expires_at = now + lease_seconds. Link IN_PROGRESS có lease đã hết hạn
+        (worker crash) được claim lại ngay, không phải chờ reset 30 phút.
+        Mỗi thread/worker phải dùng token riêng.
+
+        Returns:
+            List of dict (id, url, status, domain, loaihinh, trade_type, created_at)
+        """
+        if limit <= 0:
+            return []
+        # Tính expiry ở Python để SELECT lại đúng lô vừa claim (token + expiry)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT NOW()")
+            row = cursor.fetchone()
+            db_now = row[0] if isinstance(row, tuple) else list(row.values())[0]
+        finally:
+            cursor.close()
+            conn.close()
+        lease_until = db_now + timedelta(seconds=int(lease_seconds))
+        order = "DESC" if newest_first else "ASC"
+
+        def _claim(conn):
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f'''
+                    UPDATE collected_links
+                    SET status = 'IN_PROGRESS', lease_owner = %s, lease_expires_at = %s
+                    WHERE (
+                            (status = %s AND (lease_expires_at IS NULL OR lease_expires_at <= %s))
+                            OR (status = 'IN_PROGRESS' AND lease_expires_at < %s)
+                          )
+                      AND (domain = %s OR %s IS NULL)
+                      AND (loaihinh = %s OR %s IS NULL)
+                      AND (trade_type = %s OR %s IS NULL)
+                    ORDER BY id {order}
+                    LIMIT %s
+                ''', (worker_token, lease_until, from_status, db_now, db_now,
+                      domain, domain, loaihinh, loaihinh, trade_type, trade_type, int(limit)))
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+        claimed = self._run_chunk_with_retry(_claim, "claim_links")
+        if not claimed:
+            return []
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f'''
+                SELECT id, url, status, domain, loaihinh, trade_type, created_at
+                FROM collected_links
+                WHERE lease_owner = %s AND status = 'IN_PROGRESS' AND lease_expires_at = %s
+                ORDER BY id {order}
+            ''', (worker_token, lease_until))
+            rows = cursor.fetchall()
+            result = []
+            for row in rows:
+                if isinstance(row, tuple):
+                    result.append({
+                        'id': row[0],
+                        'url': row[1],
+                        'status': row[2],
+                        'domain': row[3],
+                        'loaihinh': row[4],
+                        'trade_type': row[5],
+                        'created_at': row[6],
+                    })
+                else:
+                    result.append(row)
+            return result
+        finally:
+            cursor.close()
+            conn.close()
+
+    def renew_link_leases(self, worker_token: str, link_ids: Optional[List[int]] = None, lease_seconds: int = 600) -> int:
+        """Heartbeat: gia hạn lease cho các link IN_PROGRESS của worker (tất cả nếu link_ids=None)"""
+        sql = '''
+            UPDATE collected_links
+            SET lease_expires_at = DATE_ADD(NOW(), INTERVAL %s SECOND)
+            WHERE lease_owner = %s AND status = 'IN_PROGRESS'
+        '''
+        params = [int(lease_seconds), worker_token]
+        if link_ids is not None:
+            if not link_ids:
+                return 0
+            sql += f" AND id IN ({','.join(['%s'] * len(link_ids))})"
+            params.extend(link_ids)
+
+        def _renew(conn):
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+        return self._run_chunk_with_retry(_renew, "renew_link_leases")
+
+    def ack_links(self, worker_token: str, link_ids: List[int], status: str = 'CRAWLED') -> int:
+        """
+        Bulk ack: set status cuối cho các link worker đang giữ lease và xóa lease.
+        Link đã mất lease (bị worker khác claim lại) không bị ghi đè.
+        """
+        if not link_ids:
+            return 0
+
+        def _ack(conn):
+            cursor = conn.cursor()
+            try:
+                placeholders = ','.join(['%s'] * len(link_ids))
+                cursor.execute(f'''
+                    UPDATE collected_links
+                    SET status = %s, lease_owner = NULL, lease_expires_at = NULL
+                    WHERE lease_owner = %s AND status = 'IN_PROGRESS' AND id IN ({placeholders})
+                ''', (status, worker_token, *link_ids))
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+        return self._run_chunk_with_retry(_ack, "ack_links")
+
+    def nack_links(self, worker_token: str, link_ids: Optional[List[int]] = None,
+                   status: str = 'PENDING', retry_delay_seconds: int = 0) -> int:
+        """
+        Bulk nack: trả link về hàng đợi (mặc định PENDING). Với retry_delay_seconds > 0,
+        link chỉ được claim lại sau khoảng delay đó. link_ids=None trả lại mọi lease của worker.
+        """
+        sql = '''
+            UPDATE collected_links
+            SET status = %s, lease_owner = NULL,
+                lease_expires_at = IF(%s > 0, DATE_ADD(NOW(), INTERVAL %s SECOND), NULL)
+            WHERE lease_owner = %s AND status = 'IN_PROGRESS'
+        '''
+        params = [status, int(retry_delay_seconds), int(retry_delay_seconds), worker_token]
+        if link_ids is not None:
+            if not link_ids:
+                return 0
+            sql += f" AND id IN ({','.join(['%s'] * len(link_ids))})"
+            params.extend(link_ids)
+
+        def _nack(conn):
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+        return self._run_chunk_with_retry(_nack, "nack_links")
+
     def get_undownloaded_detail_images(self, limit: int = 200, domain: Optional[str] = None):
         conn = self.get_connection()
         cursor = conn.cursor()
@@ -2381,3 +2953,72 @@ class Database:
         finally:
             cursor.close()
             conn.close()
+
+
+class LinkLeaseQueue:
+    """
+    Consumer của hàng đợi collected_links dựa trên lease (1 instance cho mỗi thread/worker).
+
+    Usage:
+        queue = LinkLeaseQueue(db, "mogi-fast", domain="mogi.vn")
+        while True:
+            links = queue.claim(20)
+            if not links:
+                break
+            for link in links:
+                queue.heartbeat()
+                ...
+                queue.ack([link['id']], 'CRAWLED')
+        queue.release()
+    """
+
+    def __init__(self, db: Database, owner_prefix: str = "worker", lease_seconds: int = 600,
+                 domain: Optional[str] = None, loaihinh: Optional[str] = None,
+                 trade_type: Optional[str] = None, newest_first: bool = False,
+                 worker_token: Optional[str] = None):
+        self.db = db
+        self.token = worker_token or db.new_worker_token(owner_prefix)
+        self.lease_seconds = int(lease_seconds)
+        self.filters = {'domain': domain, 'loaihinh': loaihinh, 'trade_type': trade_type}
+        self.newest_first = newest_first
+        self._last_renew = time.monotonic()
+
+    def claim(self, limit: int = 10, from_status: str = 'PENDING') -> List[dict]:
+        links = self.db.claim_links(
+            self.token,
+            limit=limit,
+            lease_seconds=self.lease_seconds,
+            from_status=from_status,
+            newest_first=self.newest_first,
+            **self.filters,
+        )
+        self._last_renew = time.monotonic()
+        return links
+
+    def heartbeat(self, force: bool = False) -> int:
+        """Gia hạn lease, tối đa 1 lần mỗi lease_seconds/3 giây trừ khi force=True"""
+        now = time.monotonic()
+        if not force and now - self._last_renew < self.lease_seconds / 3:
+            return 0
+        self._last_renew = now
+        try:
+            return self.db.renew_link_leases(self.token, lease_seconds=self.lease_seconds)
+        except Exception as e:
+            print(f"[LinkLeaseQueue] Heartbeat failed for {self.token}: {e}")
+            return 0
+
+    def ack(self, link_ids: List[int], status: str = 'CRAWLED') -> int:
+        return self.db.ack_links(self.token, [i for i in link_ids if i is not None], status)
+
+    def nack(self, link_ids: Optional[List[int]] = None, status: str = 'PENDING', retry_delay_seconds: int = 0) -> int:
+        if link_ids is not None:
+            link_ids = [i for i in link_ids if i is not None]
+        return self.db.nack_links(self.token, link_ids, status, retry_delay_seconds)
+
+    def release(self) -> int:
+        """Trả lại mọi link còn đang giữ lease (gọi khi worker dừng sớm)"""
+        try:
+            return self.nack()
+        except Exception as e:
+            print(f"[LinkLeaseQueue] Release failed for {self.token}: {e}")
+            return 0
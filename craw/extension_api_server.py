@@ -1,56 +1,249 @@
 """
 API Server cho Extension - Gọi Crawl4AI để cào dữ liệu
 Version đơn giản - bỏ hết các kiểm tra ngoại lệ dài dòng
+
+Server asyncio (1 event loop cho cả process):
+  - BrowserPool (browser_pool.py): N browser x M page mở sẵn từ lúc start, request mượn 1 page
+    qua lease() thay vì mở browser mới cho mỗi request; page được mở lại sau max_uses lượt hoặc khi lỗi
+  - Hàng đợi request có giới hạn (queue_size): đầy thì trả 503 ngay (backpressure)
+  - ResultCache: cache kết quả thành công theo (action, URL, hash template/fields), có TTL;
+    request giống nhau đang chạy dở thì chờ chung 1 lượt cào
+  - LatencyStats: p50/p90/p99 thời gian xử lý, xem qua GET /stats
+
+Usage:
+    python extension_api_server.py [port] [--browsers 2] [--pages 2] [--queue-size 16] [--cache-ttl 300]
 """
 
+import argparse
 import asyncio
 import json
 import os
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlparse
 import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent))
-from web_scraper import WebScraper
+from browser_pool import BrowserPool
+from template_engine import template_hash
 
+HTTP_REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found', 503: 'Service Unavailable'}
 
-class ExtensionAPIHandler(BaseHTTPRequestHandler):
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
-        self.end_headers()
-    
-    def do_POST(self):
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
-        data = json.loads(post_data.decode('utf-8'))
-        
+
+class ResultCache:
+    """Cache LRU + TTL cho kết quả scrape thành công."""
+
+    def __init__(self, ttl=300, max_entries=500):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(data):
+        action = data.get('action', '')
+        spec = data.get('template') if action == 'scrape_with_template' else data.get('fields')
+        return (action, data.get('url'), template_hash({'spec': spec}))
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def stats(self):
+        return {'entries': len(self._items), 'hits': self.hits, 'misses': self.misses, 'ttl': self.ttl}
+
+
+class LatencyStats:
+    """Percentile thời gian xử lý request trên cửa sổ window request gần nhất."""
+
+    def __init__(self, window=1000):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, pct):
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+        return ordered[idx]
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'window': len(self._samples),
+            'p50_ms': round(self.percentile(50) * 1000, 1),
+            'p90_ms': round(self.percentile(90) * 1000, 1),
+            'p99_ms': round(self.percentile(99) * 1000, 1),
+            'max_ms': round(max(self._samples, default=0.0) * 1000, 1),
+        }
+
+
+class ExtensionAPIHandler:
+    ACTIONS = ('scrape_with_template', 'scrape_with_fields')
+
+    def __init__(self, browsers=2, pages=2, queue_size=16, cache_ttl=300, max_uses=50):
+        # Không chặn ảnh: template lấy src/data-src của <img>, lazy-load cần request ảnh chạy
+        self.pool = BrowserPool(browsers, pages_per_browser=pages, max_navigations=max_uses,
+                                block_resources=("font", "media"))
+        self.cache = ResultCache(cache_ttl)
+        self.latency = LatencyStats()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._inflight = {}
+        self._workers = []
+        self.rejected = 0
+
+    async def start(self):
+        await self.pool.start()
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.pool.size)]
+
+    async def stop(self):
+        for w in self._workers:
+            w.cancel()
+        await self.pool.close()
+
+    async def _worker(self):
+        while True:
+            data, fut = await self.queue.get()
+            try:
+                result = await self.dispatch(data)
+                if not fut.done():
+                    fut.set_result(result)
+            except Exception as e:
+                if not fut.done():
+                    fut.set_result({'success': False, 'error': str(e)})
+            finally:
+                self.queue.task_done()
+
+    async def dispatch(self, data):
         action = data.get('action', '')
         if action == 'scrape_with_template':
-            result = asyncio.run(self.handle_scrape_with_template(data))
-        elif action == 'scrape_with_fields':
-            result = asyncio.run(self.handle_scrape_with_fields(data))
-        else:
-            result = {'success': False, 'error': f'Unknown action: {action}'}
-        
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json; charset=utf-8')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps(result, ensure_ascii=False).encode('utf-8'))
-    
-    def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json; charset=utf-8')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps({
-            'status': 'ok',
-            'message': 'Extension API Server is running'
-        }, ensure_ascii=False).encode('utf-8'))
-    
+            return await self.handle_scrape_with_template(data)
+        return await self.handle_scrape_with_fields(data)
+
+    async def submit(self, data):
+        """(status, result) cho 1 request POST."""
+        action = data.get('action', '')
+        if action not in self.ACTIONS:
+            return 200, {'success': False, 'error': f'Unknown action: {action}'}
+
+        key = self.cache.key(data)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return 200, dict(cached, cached=True)
+
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.get_running_loop().create_future()
+            try:
+                self.queue.put_nowait((data, fut))
+            except asyncio.QueueFull:
+                self.rejected += 1
+                return 503, {'success': False, 'error': 'Server busy, retry later', 'queue_size': self.queue.maxsize}
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda f, k=key: self._on_done(k, f))
+        return 200, await asyncio.shield(fut)
+
+    def _on_done(self, key, fut):
+        self._inflight.pop(key, None)
+        result = fut.result()
+        if result.get('success'):
+            self.cache.put(key, result)
+
+    def stats(self):
+        return {
+            'latency': self.latency.stats(),
+            'queue': {'depth': self.queue.qsize(), 'max': self.queue.maxsize, 'rejected': self.rejected},
+            'pool': self.pool.stats(),
+            'cache': self.cache.stats(),
+        }
+
+    # ---------- HTTP ----------
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path = request_line.decode('latin-1').split(' ', 2)[:2]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length') or 0))
+
+                started = time.perf_counter()
+                status, payload = await self.route(method.upper(), urlparse(path).path, body)
+                if method.upper() == 'POST':
+                    self.latency.record(time.perf_counter() - started)
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                self._write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        if method == 'OPTIONS':
+            return 204, None
+        if method == 'GET':
+            if path == '/stats':
+                return 200, self.stats()
+            return 200, {'status': 'ok', 'message': 'Extension API Server is running'}
+        if method == 'POST':
+            try:
+                data = json.loads(body.decode('utf-8'))
+            except ValueError as e:
+                return 400, {'success': False, 'error': f'Invalid JSON: {e}'}
+            return await self.submit(data)
+        return 404, {'success': False, 'error': f'Unsupported method: {method}'}
+
+    @staticmethod
+    def _write_response(writer, status, payload, keep_alive):
+        body = b'' if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = [
+            f'HTTP/1.1 {status} {HTTP_REASONS.get(status, "OK")}',
+            'Access-Control-Allow-Origin: *',
+            'Access-Control-Allow-Methods: POST, GET, OPTIONS',
+            'Access-Control-Allow-Headers: Content-Type',
+            f'Content-Length: {len(body)}',
+            f'Connection: {"keep-alive" if keep_alive else "close"}',
+        ]
+        if payload is not None:
+            head.append('Content-Type: application/json; charset=utf-8')
+        if status == 503:
+            head.append('Retry-After: 1')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+
+
     async def handle_scrape_with_template(self, data):
         print("\n" + "="*80)
         print("🚀 HANDLE_SCRAPE_WITH_TEMPLATE - REQUEST RECEIVED")
@@ -184,7 +377,7 @@ class ExtensionAPIHandler(BaseHTTPRequestHandler):
         print(json.dumps(schema, indent=2, ensure_ascii=False))
         print("="*80 + "\n")
         
-        async with WebScraper(headless=True, verbose=False) as scraper:
+        async with self.pool.lease() as scraper:
             print("🔄 Calling Crawl4AI...")
             result = await scraper.scrape_with_schema(url, schema, bypass_cache=True)
             
@@ -597,7 +790,7 @@ class ExtensionAPIHandler(BaseHTTPRequestHandler):
         print(json.dumps(schema, indent=2, ensure_ascii=False))
         print("="*80 + "\n")
         
-        async with WebScraper(headless=True, verbose=False) as scraper:
+        async with self.pool.lease() as scraper:
             print("🔄 Calling Crawl4AI...")
             result = await scraper.scrape_with_schema(url, schema, bypass_cache=True)
             
@@ -894,24 +1087,31 @@ class ExtensionAPIHandler(BaseHTTPRequestHandler):
                 }
 
 
-def run_server(port=8765):
-    server_address = ('localhost', port)
-    httpd = HTTPServer(server_address, ExtensionAPIHandler)
+
+async def serve(port=8765, browsers=2, pages=2, queue_size=16, cache_ttl=300, max_uses=50):
+    api = ExtensionAPIHandler(browsers=browsers, pages=pages, queue_size=queue_size, cache_ttl=cache_ttl, max_uses=max_uses)
+    await api.start()
+    server = await asyncio.start_server(api.handle_connection, 'localhost', port)
     print(f"🚀 Extension API Server đang chạy tại http://localhost:{port}")
-    print("📋 Sẵn sàng nhận requests từ extension...")
+    print(f"📋 Sẵn sàng nhận requests từ extension... (browsers={browsers}x{pages} page, queue={queue_size}, cache_ttl={cache_ttl}s)")
+    print(f"📊 Thống kê latency: http://localhost:{port}/stats")
     print("💡 Nhấn Ctrl+C để dừng server\n")
-    
     try:
-        httpd.serve_forever()
+        async with server:
+            await server.serve_forever()
+    finally:
+        await api.stop()
+
+
+def run_server(port=8765, **kwargs):
+    try:
+        asyncio.run(serve(port, **kwargs))
     except KeyboardInterrupt:
         print("\n\n🛑 Đang dừng server...")
-        httpd.shutdown()
         print("✅ Server đã dừng")
 
 
 if __name__ == '__main__':
-    import sys
-    
     os.environ['HOME'] = str(Path(__file__).parent)
     os.environ['USERPROFILE'] = str(Path(__file__).parent)
     os.environ['CRAWL4_AI_BASE_DIRECTORY'] = str(Path(__file__).parent / '.crawl4ai')
@@ -919,11 +1119,14 @@ if __name__ == '__main__':
     crawl4ai_dir = Path(__file__).parent / '.crawl4ai'
     crawl4ai_dir.mkdir(exist_ok=True)
     
-    port = 8765
-    if len(sys.argv) > 1:
-        try:
-            port = int(sys.argv[1])
-        except ValueError:
-            print(f"⚠️  Port không hợp lệ, dùng port mặc định: {port}")
+    parser = argparse.ArgumentParser(description="Extension API Server (Crawl4AI)")
+    parser.add_argument("port", nargs="?", type=int, default=8765)
+    parser.add_argument("--browsers", type=int, default=2, help="Số browser mở sẵn")
+    parser.add_argument("--pages", type=int, default=2, help="Số page mỗi browser (browsers x pages = số request xử lý song song)")
+    parser.add_argument("--queue-size", type=int, default=16, help="Số request chờ tối đa, vượt quá trả 503")
+    parser.add_argument("--cache-ttl", type=int, default=300, help="TTL cache kết quả (giây), 0 = tắt")
+    parser.add_argument("--max-uses", type=int, default=50, help="Mở lại page sau N request")
+    args = parser.parse_args()
     
-    run_server(port)
+    run_server(args.port, browsers=args.browsers, pages=args.pages, queue_size=args.queue_size,
+               cache_ttl=args.cache_ttl, max_uses=args.max_uses)
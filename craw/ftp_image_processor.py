@@ -3,12 +3,29 @@
 FTP Image Processor
 Download images from data_full, resize, watermark, and upload to FTP.
 
+Pipeline: download (threads, keep-alive) -> transform (process pool, logo scale sẵn theo size)
+-> upload (threads, mỗi thread giữ 1 session FTP). Giữa các stage là queue có giới hạn.
+
+Ảnh trùng (image_dedup.py) được đánh DUPLICATE kèm ftp_path của ảnh đã upload:
+trùng URL chuẩn hoá (trước khi tải), trùng content hash (sau khi tải), trùng dHash
+(sau khi decode). Cùng URL đang xử lý thì các dòng sau chờ kết quả dòng đầu.
+
 Usage:
     python3 ftp_image_processor.py [options]
 
 Options:
-    --batch N          Number of images per batch (default: 100)
-    --workers N        Number of parallel workers (default: 10)
+    --batch N          Number of images claimed per batch (default: 100)
+    --workers N        Number of upload threads, each with its own FTP session (default: 10)
+    --download-workers N   Number of download threads (default: 16)
+    --transform-workers N  Number of resize/watermark/encode processes (default: CPU count)
+    --queue-size N     Max items waiting between pipeline stages (default: 64)
+    --report-seconds N Interval for per-stage throughput / queue depth logs (default: 30)
+    --ready-flush-seconds N  Interval for bulk IMAGES_READY updates (default: 10)
+    --full-reconcile   Re-scan all listings for IMAGES_READY instead of only new ids
+                       (done automatically when the previous run was interrupted)
+    --no-dedup         Disable the cross-listing image_dedup_index lookups
+    --phash-distance N Max dHash Hamming distance for cross-listing near-duplicates, max 3
+                       (default: -1 = off; a false match attaches another listing's photo)
     --max-width N      Max width for main image (default: 1100)
     --thumb-width N    Width for thumbnail (default: 750)
     --logo PATH        Path to logo file for watermark
@@ -24,21 +41,27 @@ Options:
 import os
 import sys
 import re
+import json
 import time
+import queue
 import argparse
 import logging
+import threading
 from io import BytesIO
+from datetime import datetime
 from ftplib import FTP
 from urllib.parse import urljoin
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
 from threading import Lock
 
 import requests
+import requests.adapters
 from PIL import Image, PngImagePlugin
 
 # Setup path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from database import Database
+from image_dedup import ImageDedupIndex, content_hash, dhash, ensure_table as ensure_dedup_table, url_hash
 
 # ============================================
 # FTP Configuration
@@ -82,23 +105,17 @@ def resize_image(img: Image.Image, max_width: int) -> Image.Image:
     return img
 
 
-def apply_watermark(base_img: Image.Image, logo_img: Image.Image, 
-                    position: str, scale_pct: int, opacity: float, margin: int = 20) -> Image.Image:
-    """Apply watermark logo to image."""
-    base = base_img.convert("RGBA")
+def scale_logo(logo_img: Image.Image, base_width: int, scale_pct: int, opacity: float) -> Image.Image:
+    """Logo RGBA đã resize theo chiều rộng ảnh (scale_pct %) và áp opacity."""
     logo = logo_img.convert("RGBA")
     
-    bw, bh = base.size
-    if bw <= 0 or bh <= 0:
-        return base
-    
     # Scale logo
-    target_w = max(int(bw * (scale_pct / 100.0)), 1)
+    target_w = max(int(base_width * (scale_pct / 100.0)), 1)
     lw, lh = logo.size
     if lw > 0:
         target_h = max(int(lh * (target_w / lw)), 1)
     else:
-        target_h = max(int(bh * (scale_pct / 100.0)), 1)
+        target_h = target_w
     
     logo = logo.resize((target_w, target_h), Image.LANCZOS)
     
@@ -107,6 +124,13 @@ def apply_watermark(base_img: Image.Image, logo_img: Image.Image,
         alpha = logo.split()[-1]
         alpha = alpha.point(lambda p: int(p * opacity))
         logo.putalpha(alpha)
+    return logo
+
+
+def paste_logo(base: Image.Image, logo: Image.Image, position: str, margin: int = 20) -> Image.Image:
+    """Dán logo (đã scale) lên ảnh RGBA base tại position."""
+    bw, bh = base.size
+    target_w, target_h = logo.size
     
     # Calculate position
     x = margin
@@ -128,6 +152,19 @@ def apply_watermark(base_img: Image.Image, logo_img: Image.Image,
     return base
 
 
+def apply_watermark(base_img: Image.Image, logo_img: Image.Image, 
+                    position: str, scale_pct: int, opacity: float, margin: int = 20) -> Image.Image:
+    """Apply watermark logo to image."""
+    base = base_img.convert("RGBA")
+    
+    bw, bh = base.size
+    if bw <= 0 or bh <= 0:
+        return base
+    
+    logo = scale_logo(logo_img, bw, scale_pct, opacity)
+    return paste_logo(base, logo, position, margin)
+
+
 def has_watermark_marker(img: Image.Image) -> bool:
     """Check if image already has watermark marker in metadata."""
     info = getattr(img, "info", {}) or {}
@@ -187,13 +224,18 @@ def ensure_ftp_dir(ftp: FTP, path: str):
                 pass
 
 
-def upload_to_ftp(ftp: FTP, file_buffer: BytesIO, remote_path: str) -> bool:
-    """Upload file buffer to FTP."""
+def upload_to_ftp(ftp: FTP, file_buffer: BytesIO, remote_path: str, known_dirs: set = None) -> bool:
+    """Upload file buffer to FTP.
+
+    known_dirs: set các thư mục đã tạo trên session này (bỏ qua chuỗi CWD/MKD lặp lại).
+    """
     try:
         # Ensure directory exists
         remote_dir = os.path.dirname(remote_path)
-        if remote_dir:
+        if remote_dir and (known_dirs is None or remote_dir not in known_dirs):
             ensure_ftp_dir(ftp, remote_dir)
+            if known_dirs is not None:
+                known_dirs.add(remote_dir)
         
         # Go to root and upload
         ftp.cwd('/')
@@ -363,75 +405,228 @@ def update_image_status(db: Database, image_id: int, status: str, ftp_path: str
         conn.close()
 
 
-def check_and_mark_images_ready(db: Database, detail_id: int, table_name: str = "data_full"):
-    """Check if all images for a listing are uploaded and mark it as IMAGES_READY."""
+FINISHED_IMAGE_STATUSES = ('UPLOADED', 'FAILED', 'DUPLICATE')
+READY_CHUNK = 500
+READY_STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.checkpoints')
+
+
+def mark_images_ready_bulk(db: Database, detail_ids, table_name: str = "data_full",
+                           raise_on_error: bool = False) -> int:
+    """Mark IMAGES_READY cho các listing (theo id_img) đã xong hết ảnh.
+
+    1 query GROUP BY + 1 UPDATE ... IN (...) cho mỗi chunk, thay cho COUNT + UPDATE từng listing.
+    raise_on_error: ném lại lỗi DB thay vì chỉ log (caller cần biết để không bỏ qua các listing này).
+    """
     table_name = _validate_table_name(table_name)
+    ids = sorted({int(i) for i in detail_ids if i is not None})
+    if not ids:
+        return 0
     conn = db.get_connection()
     cursor = conn.cursor()
+    updated = 0
     try:
-        # Count pending/processing images
-        cursor.execute("""
-            SELECT COUNT(*) as pending FROM scraped_detail_images 
-            WHERE detail_id = %s AND status NOT IN ('UPLOADED', 'FAILED', 'DUPLICATE')
-        """, (detail_id,))
-        result = cursor.fetchone()
-        pending = result['pending'] if isinstance(result, dict) else result[0]
-        
-        if pending == 0:
-            # All images done - mark listing as IMAGES_READY
+        finished_ph = ",".join(["%s"] * len(FINISHED_IMAGE_STATUSES))
+        for pos in range(0, len(ids), READY_CHUNK):
+            chunk = ids[pos:pos + READY_CHUNK]
+            ph = ",".join(["%s"] * len(chunk))
+            cursor.execute(f"""
+                SELECT detail_id, SUM(status NOT IN ({finished_ph})) AS unfinished
+                FROM scraped_detail_images
+                WHERE detail_id IN ({ph})
+                GROUP BY detail_id
+            """, (*FINISHED_IMAGE_STATUSES, *chunk))
+            ready = [
+                int(r['detail_id']) for r in cursor.fetchall()
+                if int(r['unfinished'] or 0) == 0
+            ]
+            if not ready:
+                continue
+            rph = ",".join(["%s"] * len(ready))
             cursor.execute(f"""
-                UPDATE {table_name} SET images_status = 'IMAGES_READY' 
-                WHERE id_img = %s AND (images_status IS NULL OR images_status = 'PENDING')
-            """, (detail_id,))
-            if cursor.rowcount > 0:
-                logger.info(f"  ✅ {table_name} listing id_img={detail_id} -> IMAGES_READY")
+                UPDATE {table_name} SET images_status = 'IMAGES_READY'
+                WHERE id_img IN ({rph}) AND (images_status IS NULL OR images_status = 'PENDING')
+            """, ready)
+            updated += cursor.rowcount
             conn.commit()
+        if updated > 0:
+            logger.info(f"  ✅ {table_name}: {updated} listing(s) -> IMAGES_READY")
+        return updated
     except Exception as e:
-        logger.error(f"Failed to check images ready: {e}")
+        logger.error(f"Failed to mark images ready: {e}")
+        if raise_on_error:
+            raise
+        return updated
     finally:
         cursor.close()
         conn.close()
 
 
-def reconcile_images_ready(db: Database, table_name: str = "data_full") -> int:
-    """Backfill IMAGES_READY for rows whose images are all finished.
+def check_and_mark_images_ready(db: Database, detail_id: int, table_name: str = "data_full"):
+    """Check if all images for a listing are uploaded and mark it as IMAGES_READY."""
+    mark_images_ready_bulk(db, [detail_id], table_name)
+
+
+def _ready_state_path(table_name: str) -> str:
+    return os.path.join(READY_STATE_DIR, f"images_ready.{table_name}.json")
+
+
+def _load_ready_state(table_name: str) -> dict:
+    try:
+        with open(_ready_state_path(table_name), "r", encoding="utf-8") as f:
+            state = json.load(f)
+        return {"last_id": int(state["last_id"]), "dirty": bool(state.get("dirty"))}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {"last_id": 0, "dirty": False}
+
+
+def load_reconcile_watermark(table_name: str) -> int:
+    return _load_ready_state(table_name)["last_id"]
+
+
+def save_reconcile_watermark(table_name: str, last_id: int, dirty: bool = False):
+    os.makedirs(READY_STATE_DIR, exist_ok=True)
+    path = _ready_state_path(table_name)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"last_id": int(last_id), "dirty": bool(dirty), "updated_at": int(time.time())}, f)
+    os.replace(tmp, path)
+
 
-    This handles rows created after their images were already uploaded, where
-    no worker will call `check_and_mark_images_ready(detail_id)` again.
+def begin_reconcile_run(table_name: str) -> bool:
+    """Đánh dấu dirty lúc bắt đầu run; trả về True nếu run trước chưa reconcile xong (crash/lỗi).
+
+    Run bị kill giữa finish() và flush() để lại listing cũ hơn watermark đã xong ảnh nhưng
+    chưa mark, run sau thấy dirty thì reconcile lại toàn bảng.
+    """
+    state = _load_ready_state(table_name)
+    save_reconcile_watermark(table_name, state["last_id"], dirty=True)
+    return state["dirty"]
+
+
+def reconcile_images_ready(db: Database, table_name: str = "data_full", since_id: int = None,
+                           batch: int = 2000, detail_ids=()) -> int:
+    """Backfill IMAGES_READY cho listing đổi trong run này (detail_ids) và listing mới (id > watermark).
+
+    Xử lý trường hợp listing được tạo sau khi ảnh của nó đã upload: không worker nào
+    đánh dấu lại listing đó. Listing cũ hơn watermark mà có ảnh xong trong run này nằm trong
+    detail_ids (ImagesReadyTracker.touched), kể cả khi flush của tracker lỗi.
+    since_id=0: quét lại toàn bảng (vẫn theo batch).
+    Chỉ xoá cờ dirty khi mọi bước thành công; watermark chỉ tiến tới batch cuối đã mark xong.
     """
     table_name = _validate_table_name(table_name)
+    last_id = load_reconcile_watermark(table_name) if since_id is None else int(since_id)
+    start_id = last_id
+    done_id = last_id  # chỉ tiến khi cả batch đã mark xong, batch lỗi được quét lại ở lần sau
+    updated = 0
+    ok = False
+    try:
+        updated += mark_images_ready_bulk(db, detail_ids, table_name, raise_on_error=True)
+    except Exception as e:
+        logger.error(f"Failed to reconcile touched listings in {table_name}: {e}")
+        # Giữ dirty -> run sau reconcile toàn bảng
+        save_reconcile_watermark(table_name, load_reconcile_watermark(table_name), dirty=True)
+        return updated
     conn = db.get_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute(f"""
-            UPDATE {table_name} d
-            LEFT JOIN (
-                SELECT detail_id, COUNT(*) AS unfinished
-                FROM scraped_detail_images
-                WHERE status NOT IN ('UPLOADED', 'FAILED', 'DUPLICATE')
-                GROUP BY detail_id
-            ) p ON p.detail_id = d.id_img
-            SET d.images_status = 'IMAGES_READY'
-            WHERE (d.images_status IS NULL OR d.images_status = 'PENDING')
-              AND d.id_img IS NOT NULL
-              AND COALESCE(p.unfinished, 0) = 0
-              AND EXISTS (
-                  SELECT 1
-                  FROM scraped_detail_images s
-                  WHERE s.detail_id = d.id_img
-              )
-        """)
-        updated = cursor.rowcount
-        conn.commit()
-        if updated > 0:
-            logger.info(f"Reconciled IMAGES_READY rows in {table_name}: {updated}")
-        return updated
+        while True:
+            cursor.execute(f"""
+                SELECT id, id_img, images_status
+                FROM {table_name}
+                WHERE id > %s
+                ORDER BY id
+                LIMIT %s
+            """, (last_id, batch))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = int(rows[-1]['id'])
+            pending = [
+                r['id_img'] for r in rows
+                if r['id_img'] is not None and r['images_status'] in (None, 'PENDING')
+            ]
+            if pending:
+                updated += mark_images_ready_bulk(db, pending, table_name, raise_on_error=True)
+            done_id = last_id
+            if len(rows) < batch:
+                break
+        ok = True
     except Exception as e:
         logger.error(f"Failed to reconcile IMAGES_READY in {table_name}: {e}")
-        return 0
     finally:
         cursor.close()
         conn.close()
+    # since_id=0 quét từ đầu: không lùi watermark đã lưu
+    save_reconcile_watermark(table_name, max(done_id, load_reconcile_watermark(table_name)), dirty=not ok)
+    if updated > 0:
+        logger.info(f"Reconciled IMAGES_READY rows in {table_name}: {updated} (id > {start_id})")
+    return updated
+
+
+class ImagesReadyTracker:
+    """
+    Đếm số ảnh còn dở của từng listing (id_img) trong lần chạy này.
+    Listing về 0 được đưa vào hàng chờ, flush() mark IMAGES_READY hàng loạt
+    (mark_images_ready_bulk vẫn kiểm tra DB vì listing có thể còn ảnh chưa claim).
+    """
+
+    def __init__(self, db: Database, table_name: str = "data_full", flush_seconds: float = 10):
+        self.db = db
+        self.table_name = _validate_table_name(table_name)
+        self.flush_seconds = flush_seconds
+        self.outstanding = {}
+        self.candidates = set()
+        self.touched = set()
+        self.marked = 0
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._done = threading.Event()
+        self._thread = None
+
+    def claim(self, detail_id):
+        with self._lock:
+            self.outstanding[detail_id] = self.outstanding.get(detail_id, 0) + 1
+
+    def finish(self, detail_id):
+        """1 ảnh của listing đã xong (UPLOADED/FAILED/DUPLICATE)."""
+        with self._lock:
+            self.touched.add(detail_id)
+            left = self.outstanding.get(detail_id, 1) - 1
+            if left > 0:
+                self.outstanding[detail_id] = left
+                return
+            self.outstanding.pop(detail_id, None)
+            self.candidates.add(detail_id)
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                ids, self.candidates = self.candidates, set()
+            if not ids:
+                return 0
+            try:
+                count = mark_images_ready_bulk(self.db, ids, self.table_name, raise_on_error=True)
+            except Exception:
+                # Trả lại hàng chờ, lần flush sau thử lại
+                with self._lock:
+                    self.candidates |= ids
+                return 0
+            self.marked += count
+            return count
+
+    def _loop(self):
+        while not self._done.wait(self.flush_seconds):
+            self.flush()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='images-ready', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
 
 
 # ============================================
@@ -451,112 +646,441 @@ def generate_filename(id_detail: int, slug_name: str, idx: int, data_full_id: in
     return f"{id_detail}-{slug}-{index}-nhadat.cafeland.vn.jpg"
 
 
-def process_single_image(row: dict, logo_img: Image.Image, args, ftp: FTP, 
-                         db: Database, stats: dict, stats_lock: Lock) -> tuple:
-    """Process a single image: download, resize, watermark, upload."""
-    image_url = row.get('image_url') if isinstance(row, dict) else row[4]
-    image_id = row.get('image_id') if isinstance(row, dict) else row[3]
-    listing_id = row.get('listing_id') if isinstance(row, dict) else row[0]
-    slug_name = row.get('slug_name') if isinstance(row, dict) else row[2]
-    idx = row.get('idx') if isinstance(row, dict) else row[5]
-    
-    try:
-        # Download image
-        resp = requests.get(image_url, timeout=30)
-        resp.raise_for_status()
-        
-        # Open and process
-        img = Image.open(BytesIO(resp.content))
-        
-        # Resize
-        img = resize_image(img, args.max_width)
-        
-        # Watermark
-        if logo_img and not has_watermark_marker(img):
-            img = apply_watermark(
-                img, logo_img, 
-                args.logo_position, 
-                args.logo_scale, 
-                args.logo_opacity
-            )
-        
-        # Convert to RGB for JPEG
-        if img.mode in ('RGBA', 'LA', 'P'):
-            img = img.convert('RGB')
-        
-        # Save to buffer
-        buffer = BytesIO()
-        save_kwargs = {'format': 'JPEG', 'quality': 85}
-        if logo_img:
-            add_watermark_marker('JPEG', save_kwargs)
-        img.save(buffer, **save_kwargs)
-        
-        # Generate filename and path
-        id_img = row.get('id_img') if isinstance(row, dict) else row[1]
-        filename = generate_filename(id_img, slug_name, idx, listing_id)
-        
-        # Save to year/month folder (no day)
-        from datetime import datetime
-        now = datetime.now()
-        date_folder = f"{now.year}/{now.month}"
-        remote_path = f"{FTP_CONFIG['remote_dir']}/{date_folder}/{filename}"
-        
-        # Web path for database: /static01/sgd/cnews/... (không có /cafeland prefix)
-        # URL sẽ là: https://static2.cafeland.vn/static01/sgd/cnews/...
-        web_path = f"/static01/sgd/cnews/{date_folder}/{filename}"
-        
-        # Upload to FTP
-        if not args.dry_run:
-            if upload_to_ftp(ftp, buffer, remote_path):
-                # Create thumbnail (-sm) for first image (idx=0)
-                if idx == 0:
-                    thumb_img = resize_image(img.copy(), args.thumb_width)
-                    thumb_buffer = BytesIO()
-                    thumb_img.save(thumb_buffer, format='JPEG', quality=85)
-                    
-                    # Generate -sm filename
-                    base_name = filename.rsplit('.', 1)[0]
-                    thumb_filename = f"{base_name}-sm.jpg"
-                    thumb_remote_path = f"{FTP_CONFIG['remote_dir']}/{date_folder}/{thumb_filename}"
-                    
-                    if upload_to_ftp(ftp, thumb_buffer, thumb_remote_path):
-                        logger.info(f"  📷 Thumbnail: {thumb_filename}")
-
-                if verify_uploaded_file(ftp, remote_path, web_path):
-                    update_image_status(db, image_id, 'UPLOADED', web_path)
-                    check_and_mark_images_ready(db, id_img, args.table)
-                else:
-                    update_image_status(db, image_id, 'FAILED', None, 'Upload verify failed')
-                    with stats_lock:
-                        stats['fail'] += 1
-                    return ('fail', image_url, remote_path, 'Upload verify failed')
-                
-                with stats_lock:
-                    stats['ok'] += 1
-                return ('ok', image_url, remote_path, None)
+def build_remote_paths(row: dict, now=None) -> tuple:
+    """(filename, remote_path, web_path, date_folder) cho ảnh, lưu theo folder năm/tháng (không có ngày)."""
+    now = now or datetime.now()
+    filename = generate_filename(row['id_img'], row.get('slug_name'), row.get('idx'), row['listing_id'])
+    date_folder = f"{now.year}/{now.month}"
+    remote_path = f"{FTP_CONFIG['remote_dir']}/{date_folder}/{filename}"
+    # Web path for database: /static01/sgd/cnews/... (không có /cafeland prefix)
+    # URL sẽ là: https://static2.cafeland.vn/static01/sgd/cnews/...
+    web_path = f"/static01/sgd/cnews/{date_folder}/{filename}"
+    return filename, remote_path, web_path, date_folder
+
+
+# ============================================
+# Transform (chạy trong process pool)
+# ============================================
+
+_TRANSFORM = {}
+
+
+def init_transform_worker(logo_path: str, position: str, scale_pct: int, opacity: float,
+                          max_width: int, thumb_width: int):
+    """Initializer của process pool: load logo 1 lần mỗi process."""
+    _TRANSFORM.clear()
+    _TRANSFORM.update({
+        'logo': None,
+        'logo_cache': {},
+        'position': position,
+        'scale_pct': scale_pct,
+        'opacity': opacity,
+        'max_width': max_width,
+        'thumb_width': thumb_width,
+    })
+    if logo_path:
+        logo = Image.open(logo_path)
+        logo.load()
+        _TRANSFORM['logo'] = logo.convert("RGBA")
+
+
+def _cached_logo(base_width: int) -> Image.Image:
+    """Logo đã scale + opacity theo chiều rộng ảnh, mỗi size chỉ resize 1 lần / process."""
+    cache = _TRANSFORM['logo_cache']
+    logo = cache.get(base_width)
+    if logo is None:
+        logo = scale_logo(_TRANSFORM['logo'], base_width, _TRANSFORM['scale_pct'], _TRANSFORM['opacity'])
+        if len(cache) > 256:
+            cache.clear()
+        cache[base_width] = logo
+    return logo
+
+
+def transform_image(content: bytes, make_thumb: bool) -> tuple:
+    """Bytes ảnh gốc -> (jpeg chính, jpeg thumbnail -sm hoặc None, dHash trước khi đóng logo)."""
+    img = Image.open(BytesIO(content))
+    img = resize_image(img, _TRANSFORM['max_width'])
+    phash = dhash(img)
+
+    watermark = _TRANSFORM['logo'] is not None
+    if watermark and not has_watermark_marker(img):
+        base = img.convert("RGBA")
+        if base.size[0] > 0 and base.size[1] > 0:
+            paste_logo(base, _cached_logo(base.size[0]), _TRANSFORM['position'])
+        img = base
+
+    # Convert to RGB for JPEG
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGB')
+
+    buffer = BytesIO()
+    save_kwargs = {'format': 'JPEG', 'quality': 85}
+    if watermark:
+        add_watermark_marker('JPEG', save_kwargs)
+    img.save(buffer, **save_kwargs)
+
+    thumb = None
+    if make_thumb:
+        thumb_img = resize_image(img.copy(), _TRANSFORM['thumb_width'])
+        thumb_buffer = BytesIO()
+        thumb_img.save(thumb_buffer, format='JPEG', quality=85)
+        thumb = thumb_buffer.getvalue()
+    return buffer.getvalue(), thumb, phash
+
+
+# ============================================
+# Pipeline: download -> transform -> upload
+# ============================================
+
+_STOP = object()
+
+
+class PipelineStage:
+    """
+    1 stage = N thread đọc in_q, gọi fn(item, ctx), đẩy kết quả (khác None) sang out_q.
+    ctx là dict riêng mỗi thread (requests.Session, FTP...), tạo bởi init_ctx().
+    Thread cuối cùng của stage kết thúc sẽ đẩy _STOP cho stage sau.
+    """
+
+    def __init__(self, name, fn, workers, in_q, out_q=None, next_workers=0,
+                 init_ctx=None, close_ctx=None, on_error=None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.in_q = in_q
+        self.out_q = out_q
+        self.next_workers = next_workers
+        self.init_ctx = init_ctx
+        self.close_ctx = close_ctx
+        self.on_error = on_error
+        self.count = 0
+        self.errors = 0
+        self.busy = 0.0
+        self._lock = Lock()
+        self._alive = self.workers
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{self.name}-{i + 1}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def join(self):
+        for t in self._threads:
+            t.join()
+
+    def _run(self):
+        ctx = {}
+        try:
+            if self.init_ctx:
+                ctx = self.init_ctx() or {}
+            while True:
+                item = self.in_q.get()
+                if item is _STOP:
+                    break
+                t0 = time.time()
+                try:
+                    out = self.fn(item, ctx)
+                    ok = True
+                except Exception as e:
+                    out = None
+                    ok = False
+                    if self.on_error:
+                        self.on_error(item, e)
+                with self._lock:
+                    self.busy += time.time() - t0
+                    if ok:
+                        self.count += 1
+                    else:
+                        self.errors += 1
+                if out is not None and self.out_q is not None:
+                    self.out_q.put(out)
+        finally:
+            if self.close_ctx:
+                try:
+                    self.close_ctx(ctx)
+                except Exception:
+                    pass
+            with self._lock:
+                self._alive -= 1
+                last = self._alive == 0
+            if last and self.out_q is not None:
+                for _ in range(self.next_workers):
+                    self.out_q.put(_STOP)
+
+
+class ImagePipeline:
+    def __init__(self, args, db: Database, logo_path: str = None):
+        self.args = args
+        self.db = db
+        self.logo_path = logo_path
+        self.stats = {'ok': 0, 'fail': 0, 'duplicate': 0, 'uploaded_bytes': 0}
+        self.stats_lock = Lock()
+        depth = max(4, int(args.queue_size))
+        self.download_q = queue.Queue(maxsize=depth)
+        self.transform_q = queue.Queue(maxsize=depth)
+        self.upload_q = queue.Queue(maxsize=depth)
+        self.transform_pool = None
+        self.stages = []
+        self.started = None
+        self._done = threading.Event()
+        self._reporter = None
+        self.ready = ImagesReadyTracker(db, args.table, args.ready_flush_seconds)
+        self.dedup = None if args.no_dedup else ImageDedupIndex(db, args.phash_distance)
+        # url_hash đang trong pipeline -> các dòng cùng URL chờ kết quả dòng đầu
+        self._inflight = {}
+        self._inflight_lock = Lock()
+
+    # ---------- helpers ----------
+
+    def _settle(self, row: dict, web_path: str = None, error: str = None):
+        """Dòng đầu của 1 URL đã xong: các dòng chờ cùng URL nhận cùng kết quả."""
+        if not row.pop('_leader', False):
+            return
+        with self._inflight_lock:
+            followers = self._inflight.pop(row.get('_url_hash'), [])
+        for follower in followers:
+            if error is not None:
+                self._fail(follower, error)
             else:
-                update_image_status(db, image_id, 'FAILED', None, 'FTP upload failed')
-                with stats_lock:
-                    stats['fail'] += 1
-                return ('fail', image_url, None, 'FTP upload failed')
-        else:
+                self._duplicate(follower, web_path)
+
+    def _fail(self, row: dict, error: str):
+        update_image_status(self.db, row['image_id'], 'FAILED', None, error)
+        self.ready.finish(row['id_img'])
+        with self.stats_lock:
+            self.stats['fail'] += 1
+        logger.warning(f"❌ {str(row.get('image_url'))[:50]}... Error: {error}")
+        self._settle(row, error=error)
+
+    def _duplicate(self, row: dict, web_path: str = None, reason: str = None):
+        """DUPLICATE + ftp_path của ảnh đã upload (listing_uploader đọc cả 2 trạng thái)."""
+        update_image_status(self.db, row['image_id'], 'DUPLICATE', web_path)
+        self.ready.finish(row['id_img'])
+        with self.stats_lock:
+            self.stats['duplicate'] += 1
+        if reason:
+            logger.info(f"♻️  {str(row.get('image_url'))[:50]}... {reason} -> {web_path}")
+        self._settle(row, web_path)
+
+    def _ok(self, row: dict, remote_path: str):
+        with self.stats_lock:
+            self.stats['ok'] += 1
+        logger.info(f"✅ {str(row.get('image_url'))[:50]}... -> {remote_path}")
+
+    # ---------- stage: download ----------
+
+    @staticmethod
+    def _download_ctx():
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=4)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return {'session': session}
+
+    @staticmethod
+    def _close_download_ctx(ctx):
+        if ctx.get('session'):
+            ctx['session'].close()
+
+    def _download(self, row, ctx):
+        resp = ctx['session'].get(row['image_url'], timeout=30)
+        resp.raise_for_status()
+        content = resp.content
+        chash = content_hash(content)
+        if self.dedup is not None:
+            web_path = self.dedup.find_content(chash)
+            if web_path:
+                self.dedup.record_alias(row['image_url'], web_path, chash)
+                self._duplicate(row, web_path, 'same content')
+                return None
+        return row, content, chash
+
+    # ---------- stage: transform ----------
+
+    def _transform(self, item, ctx):
+        row, content, chash = item
+        future = self.transform_pool.submit(transform_image, content, row.get('idx') == 0)
+        main_bytes, thumb_bytes, phash = future.result()
+        if self.dedup is not None:
+            web_path = self.dedup.find_phash(phash)
+            if web_path:
+                self.dedup.record_alias(row['image_url'], web_path, chash)
+                self._duplicate(row, web_path, 'similar image')
+                return None
+        return row, main_bytes, thumb_bytes, chash, phash, len(content)
+
+    # ---------- stage: upload ----------
+
+    @staticmethod
+    def _upload_ctx():
+        return {'ftp': None, 'dirs': set()}
+
+    @staticmethod
+    def _close_upload_ctx(ctx):
+        ftp = ctx.get('ftp')
+        if ftp is not None:
+            try:
+                ftp.quit()
+            except Exception:
+                pass
+
+    def _ftp(self, ctx, reconnect=False):
+        if reconnect or ctx['ftp'] is None:
+            self._close_upload_ctx(ctx)
+            ctx['ftp'] = connect_ftp()
+            ctx['dirs'] = set()
+        return ctx['ftp']
+
+    def _upload(self, item, ctx):
+        row, main_bytes, thumb_bytes, chash, phash, source_size = item
+        filename, remote_path, web_path, date_folder = build_remote_paths(row)
+
+        if self.args.dry_run:
             logger.info(f"[DRY-RUN] Would upload to: {remote_path}")
-            if idx == 0:
-                base_name = filename.rsplit('.', 1)[0]
-                logger.info(f"[DRY-RUN] Would also upload thumbnail: {base_name}-sm.jpg")
-            with stats_lock:
-                stats['ok'] += 1
-            return ('ok', image_url, remote_path, None)
-            
-    except Exception as e:
-        update_image_status(db, image_id, 'FAILED', None, str(e))
-        with stats_lock:
-            stats['fail'] += 1
-        return ('fail', image_url, None, str(e))
+            if thumb_bytes is not None:
+                logger.info(f"[DRY-RUN] Would also upload thumbnail: {filename.rsplit('.', 1)[0]}-sm.jpg")
+            self._ok(row, remote_path)
+            self._settle(row)
+            return None
+
+        ftp = self._ftp(ctx)
+        if not upload_to_ftp(ftp, BytesIO(main_bytes), remote_path, ctx['dirs']):
+            # Session FTP có thể đã bị server đóng: kết nối lại 1 lần rồi thử lại
+            ftp = self._ftp(ctx, reconnect=True)
+            if not upload_to_ftp(ftp, BytesIO(main_bytes), remote_path, ctx['dirs']):
+                self._fail(row, 'FTP upload failed')
+                return None
+
+        uploaded_bytes = len(main_bytes)
+
+        if thumb_bytes is not None:
+            thumb_filename = f"{filename.rsplit('.', 1)[0]}-sm.jpg"
+            thumb_remote_path = f"{FTP_CONFIG['remote_dir']}/{date_folder}/{thumb_filename}"
+            if upload_to_ftp(ftp, BytesIO(thumb_bytes), thumb_remote_path, ctx['dirs']):
+                uploaded_bytes += len(thumb_bytes)
+                logger.info(f"  📷 Thumbnail: {thumb_filename}")
+
+        with self.stats_lock:
+            self.stats['uploaded_bytes'] += uploaded_bytes
+
+        if not verify_uploaded_file(ftp, remote_path, web_path):
+            self._fail(row, 'Upload verify failed')
+            return None
+
+        update_image_status(self.db, row['image_id'], 'UPLOADED', web_path)
+        if self.dedup is not None:
+            self.dedup.record(row['image_url'], web_path, chash, phash, source_size, row['image_id'])
+        self.ready.finish(row['id_img'])
+        self._ok(row, remote_path)
+        self._settle(row, web_path)
+        return None
+
+    # ---------- run ----------
+
+    def _on_error(self, stage_name):
+        def _handler(item, exc):
+            row = item[0] if isinstance(item, tuple) else item
+            try:
+                self._fail(row, str(exc) or f"{stage_name} failed")
+            except Exception as e:
+                logger.error(f"[{stage_name}] failed to record error: {e}")
+        return _handler
+
+    def start(self):
+        args = self.args
+        if self.dedup is not None:
+            ensure_dedup_table(self.db)
+        self.transform_pool = ProcessPoolExecutor(
+            max_workers=args.transform_workers,
+            initializer=init_transform_worker,
+            initargs=(self.logo_path, args.logo_position, args.logo_scale, args.logo_opacity,
+                      args.max_width, args.thumb_width),
+        )
+        download = PipelineStage(
+            'download', self._download, args.download_workers, self.download_q, self.transform_q,
+            next_workers=args.transform_workers, init_ctx=self._download_ctx,
+            close_ctx=self._close_download_ctx, on_error=self._on_error('download'),
+        )
+        # Mỗi thread transform giữ đúng 1 job trong process pool -> số ảnh đang decode bị chặn
+        transform = PipelineStage(
+            'transform', self._transform, args.transform_workers, self.transform_q, self.upload_q,
+            next_workers=args.workers, on_error=self._on_error('transform'),
+        )
+        upload = PipelineStage(
+            'upload', self._upload, args.workers, self.upload_q,
+            init_ctx=self._upload_ctx, close_ctx=self._close_upload_ctx,
+            on_error=self._on_error('upload'),
+        )
+        self.stages = [download, transform, upload]
+        for stage in self.stages:
+            stage.start()
+        self.started = time.time()
+        if not args.dry_run:
+            self.ready.start()
+        self._reporter = threading.Thread(target=self._report_loop, name='pipeline-report', daemon=True)
+        self._reporter.start()
+
+    def _report_loop(self):
+        while not self._done.wait(self.args.report_seconds):
+            logger.info(f"[pipeline] {self.metrics(time.time() - self.started)}")
+
+    def submit_batch(self, rows: list) -> int:
+        """
+        Đưa batch vào stage download (block khi queue đầy = backpressure).
+        URL đã upload trước đó -> DUPLICATE ngay; URL đang xử lý -> chờ dòng đầu.
+        Trả về số ảnh thực sự được tải.
+        """
+        known = self.dedup.lookup_urls([r['image_url'] for r in rows]) if self.dedup is not None else {}
+        submitted = 0
+        for row in rows:
+            self.ready.claim(row['id_img'])
+            web_path = known.get(row['image_url'])
+            if web_path:
+                self._duplicate(row, web_path)
+                continue
+            row['_url_hash'] = url_hash(row['image_url'])
+            with self._inflight_lock:
+                followers = self._inflight.get(row['_url_hash'])
+                if followers is not None:
+                    followers.append(row)
+                    continue
+                self._inflight[row['_url_hash']] = []
+            row['_leader'] = True
+            self.download_q.put(row)
+            submitted += 1
+        return submitted
+
+    def finish(self):
+        """Không còn ảnh mới: chờ mọi stage chạy hết rồi đóng process pool."""
+        for _ in range(self.stages[0].workers):
+            self.download_q.put(_STOP)
+        for stage in self.stages:
+            stage.join()
+        self.transform_pool.shutdown(wait=True)
+        self._done.set()
+        if not self.args.dry_run:
+            self.ready.stop()
+
+    def metrics(self, elapsed: float) -> str:
+        queues = {'download': self.download_q, 'transform': self.transform_q, 'upload': self.upload_q}
+        parts = []
+        for stage in self.stages:
+            rate = stage.count / elapsed if elapsed > 0 else 0.0
+            util = stage.busy / (elapsed * stage.workers) * 100 if elapsed > 0 else 0.0
+            parts.append(
+                f"{stage.name}: {stage.count} ok/{stage.errors} err, {rate:.2f}/s, "
+                f"busy {util:.0f}%, queue {queues[stage.name].qsize()}"
+            )
+        parts.append(
+            f"duplicate: {self.stats['duplicate']}, ftp {self.stats['uploaded_bytes'] / 1048576:.1f}MB"
+        )
+        return " | ".join(parts)
 
 
 def run_processor(args):
-    """Main processing loop."""
+    """Main processing loop: claim ảnh PENDING và đẩy qua pipeline download -> transform -> upload."""
     logger.info("=== FTP IMAGE PROCESSOR ===")
     
     # Test connection
@@ -570,49 +1094,29 @@ def run_processor(args):
             logger.error(f"❌ FTP connection failed: {e}")
             return
     
-    # Load logo if specified
-    logo_img = None
+    # Check logo (process transform tự load lại từ path)
+    logo_path = None
     if args.logo:
         try:
-            logo_img = Image.open(args.logo)
+            with Image.open(args.logo) as logo_img:
+                logo_img.verify()
+            logo_path = args.logo
             logger.info(f"Loaded logo: {args.logo}")
         except Exception as e:
             logger.error(f"Failed to load logo: {e}")
             return
     
-    # Initialize
-    db = Database()
-    stats = {'ok': 0, 'fail': 0}
-    stats_lock = Lock()
-    
-    # Thread-local FTP connections
-    import threading
-    ftp_connections = threading.local()
-    
-    def get_thread_ftp():
-        """Get or create FTP connection for current thread."""
-        if not hasattr(ftp_connections, 'ftp') or ftp_connections.ftp is None:
-            ftp_connections.ftp = connect_ftp()
-        return ftp_connections.ftp
-    
-    def process_with_thread_ftp(row):
-        """Wrapper to process image with thread-local FTP."""
-        try:
-            ftp = get_thread_ftp()
-            return process_single_image(row, logo_img, args, ftp, db, stats, stats_lock)
-        except Exception as e:
-            # Reconnect on error
-            try:
-                ftp_connections.ftp = connect_ftp()
-                ftp = ftp_connections.ftp
-                return process_single_image(row, logo_img, args, ftp, db, stats, stats_lock)
-            except Exception as e2:
-                return ('fail', str(row), None, str(e2))
+    # Pool đủ cho thread download/upload + main thread
+    db = Database(pool_size=max(1, int(args.workers)) + int(args.download_workers) + 4)
+    full_reconcile = args.full_reconcile
+    if not args.dry_run and begin_reconcile_run(args.table):
+        logger.warning("Previous run did not finish IMAGES_READY reconcile, re-scanning the whole table at the end")
+        full_reconcile = True
+    pipeline = ImagePipeline(args, db, logo_path)
+    pipeline.start()
+    total_processed = 0
     
     try:
-        offset = 0
-        total_processed = 0
-        
         while True:
             try:
                 rows = get_pending_images(
@@ -620,7 +1124,6 @@ def run_processor(args):
                     start_id=args.start_id,
                     end_id=args.end_id,
                     limit=args.batch,
-                    offset=offset,
                     table_name=args.table,
                 )
             except Exception as e:
@@ -633,90 +1136,52 @@ def run_processor(args):
                 raise
             
             if not rows:
-                reconcile_images_ready(db, args.table)
                 logger.info("No more images to process")
                 break
             
-            logger.info(f"Processing batch: {len(rows)} images (offset: {offset})")
-            
-            # Track processed URLs in this batch to avoid redundant uploads
-            batch_urls = set()
-            unique_rows = []
-            
-            for row in rows:
-                image_url = row['image_url'] if isinstance(row, dict) else row[4]
-                if image_url in batch_urls:
-                    # Duplicate in batch - mark as SKIPPED or just ignore?
-                    # Better to mark as DUPLICATE to avoid reprocessing
-                    image_id = row['image_id'] if isinstance(row, dict) else row[3] # id in scraped_detail_images
-                    # But if we mark as duplicate, check_and_mark_images_ready might fail if it counts valid images?
-                    # check_and_mark_images_ready counts "status NOT IN ('UPLOADED', 'FAILED')"
-                    # So if we mark passed duplicates as 'DUPLICATE', count will decrease.
-                    # Let's verify check_and_mark_images_ready logic:
-                    # SELECT COUNT(*) as pending FROM scraped_detail_images WHERE detail_id = %s AND status NOT IN ('UPLOADED', 'FAILED')
-                    # So 'DUPLICATE' is considered "Done". Good.
-                    update_image_status(db, image_id, 'DUPLICATE', None, 'Duplicate URL in batch')
-                    continue
-                
-                batch_urls.add(image_url)
-                unique_rows.append(row)
-            
-            if not unique_rows:
-                reconcile_images_ready(db, args.table)
-                logger.info("All images in batch were duplicates.")
-                total_processed += len(rows)
-                continue
-                
-            logger.info(f"Unique images in batch: {len(unique_rows)} / {len(rows)}")
-            
-            if args.dry_run:
-                # Dry run - sequential
-                for row in unique_rows:
-                    status, url, path, error = process_single_image(
-                        row, logo_img, args, None, db, stats, stats_lock
-                    )
-                    if status == 'ok':
-                        logger.info(f"✅ {url[:50]}... -> {path}")
-            else:
-                # Real run - parallel with thread-local FTP
-                with ThreadPoolExecutor(max_workers=args.workers) as executor:
-                    futures = [executor.submit(process_with_thread_ftp, row) for row in unique_rows]
-                    
-                    for future in as_completed(futures):
-                        try:
-                            status, url, path, error = future.result()
-                            if status == 'ok':
-                                logger.info(f"✅ {url[:50]}... -> {path}")
-                            else:
-                                logger.warning(f"❌ {url[:50]}... Error: {error}")
-                        except Exception as e:
-                            logger.error(f"Worker error: {e}")
-
-            reconcile_images_ready(db, args.table)
+            # URL đã upload / đang xử lý -> DUPLICATE kèm ftp_path của ảnh đầu
+            # ('DUPLICATE' được tính là đã xong khi mark IMAGES_READY)
+            unique = pipeline.submit_batch(rows)
             
             total_processed += len(rows)
+            logger.info(f"Claimed batch: {len(rows)} images ({unique} unique), total {total_processed}")
             
             # Check limit
             if args.limit > 0 and total_processed >= args.limit:
                 logger.info(f"Reached limit of {args.limit} images")
                 break
-            
-            offset += args.batch
-            
-            # Brief pause between batches
-            time.sleep(0.3)
-        
-        logger.info("=" * 50)
-        logger.info(f"COMPLETED. Total: {total_processed}, OK: {stats['ok']}, FAIL: {stats['fail']}")
-        
     finally:
-        pass  # Thread-local connections will be cleaned up automatically
+        pipeline.finish()
+    
+    if not args.dry_run:
+        reconcile_images_ready(db, args.table, since_id=0 if full_reconcile else None,
+                               detail_ids=pipeline.ready.touched)
+    elapsed = time.time() - pipeline.started
+    logger.info(f"[pipeline] {pipeline.metrics(elapsed)}")
+    logger.info(f"IMAGES_READY marked this run: {pipeline.ready.marked} ({len(pipeline.ready.touched)} listings touched)")
+    if pipeline.dedup is not None:
+        logger.info(f"Image dedup: {pipeline.dedup.summary()}")
+    logger.info("=" * 50)
+    logger.info(
+        f"COMPLETED. Total: {total_processed}, OK: {pipeline.stats['ok']}, "
+        f"FAIL: {pipeline.stats['fail']}, DUPLICATE: {pipeline.stats['duplicate']}, "
+        f"FTP: {pipeline.stats['uploaded_bytes'] / 1048576:.1f}MB in {elapsed:.1f}s"
+    )
 
 
 def main():
     parser = argparse.ArgumentParser(description='FTP Image Processor')
     parser.add_argument('--batch', type=int, default=100, help='Batch size')
-    parser.add_argument('--workers', type=int, default=10, help='Number of workers')
+    parser.add_argument('--workers', type=int, default=10, help='Number of upload workers (FTP sessions)')
+    parser.add_argument('--download-workers', type=int, default=16, help='Number of download threads')
+    parser.add_argument('--transform-workers', type=int, default=os.cpu_count() or 2, help='Number of transform processes')
+    parser.add_argument('--queue-size', type=int, default=64, help='Max queued items between stages')
+    parser.add_argument('--report-seconds', type=float, default=30, help='Pipeline metrics log interval')
+    parser.add_argument('--ready-flush-seconds', type=float, default=10, help='Interval for bulk IMAGES_READY updates')
+    parser.add_argument('--full-reconcile', action='store_true', help='Re-scan the whole table for IMAGES_READY at the end')
+    parser.add_argument('--no-dedup', action='store_true', help='Disable cross-listing image dedup index')
+    parser.add_argument('--phash-distance', type=int, default=-1,
+                        help='Max dHash distance for cross-listing near-duplicates (default -1 = off, max 3)')
     parser.add_argument('--max-width', type=int, default=1100, help='Max image width')
     parser.add_argument('--thumb-width', type=int, default=750, help='Thumbnail width')
     parser.add_argument('--logo', type=str, default='/home/chungnt/crawlvip/output/logo/domain-nhadat-cafeland.png', help='Logo file path')
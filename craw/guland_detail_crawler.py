@@ -11,6 +11,7 @@ Flow:
 """
 
 import argparse
+import asyncio
 import json
 import os
 import random
@@ -31,9 +32,11 @@ except Exception:
 
 sys.path.append(os.getcwd())
 try:
-    from craw.database import Database
+    from craw.database import Database, LinkLeaseQueue
+    from craw.async_fetch_engine import AsyncFetcher, RETRY, crawl_queue
 except ImportError:
-    from database import Database
+    from database import Database, LinkLeaseQueue
+    from async_fetch_engine import AsyncFetcher, RETRY, crawl_queue
 
 
 DOMAIN = "guland.vn"
@@ -320,6 +323,33 @@ def claim_pending_links_shard(
         conn.close()
 
 
+def save_detail(db: Database, row: Dict[str, Any], data: Dict[str, Any]):
+    """Lưu flat + raw + ảnh, trả về (detail_id, images)"""
+    url = row["url"]
+    images = normalize_images(data.get("img"))
+    if images:
+        data["img"] = images
+
+    detail_id = db.add_scraped_detail_flat(
+        url=url,
+        data=data,
+        domain=DOMAIN,
+        link_id=row["id"],
+        loaihinh=row.get("loaihinh"),
+        trade_type=row.get("trade_type"),
+    )
+    db.add_scraped_detail(
+        url=url,
+        data=data,
+        domain=DOMAIN,
+        link_id=row["id"],
+        success=bool(detail_id),
+    )
+    if detail_id and images:
+        db.add_detail_images(detail_id=detail_id, images=images)
+    return detail_id, images
+
+
 def run_full(
     template_path: str,
     batch_limit: int,
@@ -362,8 +392,6 @@ def run_full(
         for i, row in enumerate(rows, start=1):
             link_id = row["id"]
             url = row["url"]
-            loaihinh = row.get("loaihinh")
-            trade_type = row.get("trade_type")
 
             print(f"[{i}/{len(rows)}] Crawling id={link_id} url={url}")
             html_text = fetch_html(url)
@@ -386,29 +414,9 @@ def run_full(
                 continue
 
             data = extract_with_template(html_text, template)
-            images = normalize_images(data.get("img"))
-            if images:
-                data["img"] = images
-
-            detail_id = db.add_scraped_detail_flat(
-                url=url,
-                data=data,
-                domain=DOMAIN,
-                link_id=link_id,
-                loaihinh=loaihinh,
-                trade_type=trade_type,
-            )
-            db.add_scraped_detail(
-                url=url,
-                data=data,
-                domain=DOMAIN,
-                link_id=link_id,
-                success=bool(detail_id),
-            )
+            detail_id, images = save_detail(db, row, data)
 
             if detail_id:
-                if images:
-                    db.add_detail_images(detail_id=detail_id, images=images)
                 db.update_link_status(url, "DONE")
                 total_ok += 1
                 consecutive_block = 0
@@ -431,6 +439,63 @@ def run_full(
     )
 
 
+def run_async(
+    template_path: str,
+    concurrency: int,
+    rate: float,
+    max_consecutive_block: int,
+    batch_limit: int,
+    limit: int = 0,
+) -> None:
+    """
+    --async: link claim qua LinkLeaseQueue (nhiều process chạy song song không trùng link,
+    không cần --worker-index/--worker-count), fetch bằng asyncio theo giới hạn host.
+    Trang chặn được trả về PENDING (claim lại sau) thay vì set ERROR.
+    """
+    if not os.path.isfile(template_path):
+        raise SystemExit(f"Template not found: {template_path}")
+    with open(template_path, "r", encoding="utf-8") as f:
+        template = json.load(f)
+
+    db = Database()
+    queue = LinkLeaseQueue(db, "guland-async", domain=DOMAIN)
+
+    async def handle(row, result, fetcher):
+        url = row["url"]
+        if not result.ok:
+            print(f"  [x] {result.error or 'HTTP ' + str(result.status)} {url}")
+            return "ERROR" if result.status == 404 else RETRY
+        data = await asyncio.to_thread(extract_with_template, result.text, template)
+        detail_id, images = await asyncio.to_thread(save_detail, db, row, data)
+        if not detail_id:
+            print(f"  -> save failed {url}")
+            return "ERROR"
+        print(f"  -> Saved detail_id={detail_id}, images={len(images)} {url}")
+        return "DONE"
+
+    async def _main():
+        async with AsyncFetcher(
+            per_host=concurrency,
+            rate_per_host=rate,
+            timeout=40,
+            headers=HEADERS,
+            is_blocked=lambda status, text: is_blocked(text),
+            backend="curl",
+        ) as fetcher:
+            return await crawl_queue(
+                queue,
+                handle,
+                fetcher,
+                workers=concurrency,
+                claim_size=batch_limit,
+                max_links=limit,
+                max_consecutive_block=max_consecutive_block,
+                label="guland-async",
+            )
+
+    asyncio.run(_main())
+
+
 def run_single(url: str, template_path: str) -> None:
     if not os.path.isfile(template_path):
         raise SystemExit(f"Template not found: {template_path}")
@@ -461,11 +526,25 @@ def main() -> int:
         default=3,
         help="Stop full crawl when consecutive blocked pages > this value (default: 3)",
     )
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Crawl pending links with asyncio fetcher")
+    parser.add_argument("--concurrency", type=int, default=4, help="--async: max in-flight requests to guland.vn")
+    parser.add_argument("--rate", type=float, default=2.0, help="--async: max requests/second to guland.vn")
+    parser.add_argument("--limit", type=int, default=0, help="--async: stop after N links (0 = all)")
     args = parser.parse_args()
 
     if args.url:
         run_single(url=args.url, template_path=args.template)
         return 0
+    if args.use_async:
+        run_async(
+            template_path=args.template,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            max_consecutive_block=args.max_consecutive_block,
+            batch_limit=args.batch_limit,
+            limit=args.limit,
+        )
+        return 0
     if args.full:
         run_full(
             template_path=args.template,
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Dedup ảnh cho ftp_image_processor: cùng 1 ảnh đăng lại ở tin khác / domain khác
+không phải tải, đóng watermark và đẩy FTP thêm lần nữa.
+
+Bảng image_dedup_index, mỗi dòng = 1 URL (đã chuẩn hoá) -> web_path đã upload:
+  - url_hash      sha1 của URL chuẩn hoá (bỏ fragment, tham số resize, host lowercase...)
+  - content_hash  sha1 bytes ảnh gốc (có sau lần tải đầu)
+  - phash         dHash 64 bit, chia 4 band 16 bit (phash_b0..b3) để tra gần đúng:
+                  khoảng cách Hamming <= 3 thì chắc chắn trùng ít nhất 1 band
+
+Thứ tự kiểm tra trong pipeline:
+  1. claim batch  -> lookup_urls(): trùng URL thì DUPLICATE luôn, không tải
+  2. sau download -> find_content(): trùng bytes
+  3. sau transform -> find_phash(): ảnh giống (resize/nén lại); mặc định tắt (phash_distance=-1)
+     vì dHash trùng nhầm sẽ gắn ảnh của BĐS khác vào tin, chỉ bật khi chấp nhận rủi ro đó
+  4. upload xong  -> record(); URL khác trỏ về ảnh đã có -> record_alias()
+
+Usage:
+    python3 image_dedup.py --ensure-table
+    python3 image_dedup.py --backfill          # nạp URL -> ftp_path từ ảnh đã UPLOADED
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import threading
+from io import BytesIO
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+TABLE = "image_dedup_index"
+LOOKUP_CHUNK = 500
+PHASH_BANDS = 4
+MAX_PHASH_DISTANCE = 3  # giới hạn để tra theo band vẫn đầy đủ (pigeonhole)
+# Tham số chỉ đổi kích thước/chất lượng, cùng 1 ảnh gốc
+RESIZE_PARAMS = {"w", "h", "width", "height", "q", "quality", "resize", "size", "fit", "format", "auto", "dpr"}
+
+
+def ensure_table(db: Database) -> None:
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {TABLE} (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                url_hash CHAR(40) NOT NULL,
+                content_hash CHAR(40) DEFAULT NULL,
+                phash BIGINT UNSIGNED DEFAULT NULL,
+                phash_b0 SMALLINT UNSIGNED DEFAULT NULL,
+                phash_b1 SMALLINT UNSIGNED DEFAULT NULL,
+                phash_b2 SMALLINT UNSIGNED DEFAULT NULL,
+                phash_b3 SMALLINT UNSIGNED DEFAULT NULL,
+                web_path VARCHAR(512) NOT NULL,
+                bytes INT DEFAULT NULL,
+                image_id INT DEFAULT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE KEY uq_idi_url (url_hash),
+                INDEX idx_idi_content (content_hash),
+                INDEX idx_idi_b0 (phash_b0),
+                INDEX idx_idi_b1 (phash_b1),
+                INDEX idx_idi_b2 (phash_b2),
+                INDEX idx_idi_b3 (phash_b3)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# ============================================
+# Hash
+# ============================================
+
+def normalize_image_url(url: str) -> str:
+    """URL ảnh chuẩn hoá: https, host lowercase, bỏ fragment + tham số resize, sort query."""
+    url = (url or "").strip()
+    if url.startswith("//"):
+        url = "https:" + url
+    parts = urlsplit(url)
+    scheme = "https" if parts.scheme in ("http", "https") else parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in RESIZE_PARAMS)
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+def url_hash(url: str) -> str:
+    return hashlib.sha1(normalize_image_url(url).encode("utf-8")).hexdigest()
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha1(content).hexdigest()
+
+
+def dhash(img: Image.Image, size: int = 8) -> int:
+    """Difference hash 64 bit (ảnh xám (size+1) x size, so sánh pixel kề nhau theo hàng)."""
+    gray = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    px = list(gray.getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (px[offset + col] > px[offset + col + 1])
+    return value
+
+
+def dhash_bytes(content: bytes):
+    """dHash từ bytes ảnh gốc, None nếu không decode được."""
+    try:
+        with Image.open(BytesIO(content)) as img:
+            return dhash(img)
+    except Exception:
+        return None
+
+
+def phash_bands(value: int) -> list:
+    return [(value >> (16 * i)) & 0xFFFF for i in range(PHASH_BANDS)]
+
+
+# ============================================
+# Index
+# ============================================
+
+class ImageDedupIndex:
+    """
+    Tra/ghi image_dedup_index, có cache trong process (content_hash -> web_path).
+    Thread-safe: các stage download/upload gọi song song, mỗi lần lấy connection từ pool.
+    """
+
+    def __init__(self, db: Database, phash_distance: int = -1):
+        self.db = db
+        self.phash_distance = min(int(phash_distance), MAX_PHASH_DISTANCE)
+        self._content = {}
+        self._lock = threading.Lock()
+        self.stats = {"url_hits": 0, "content_hits": 0, "phash_hits": 0, "recorded": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _query(self, sql: str, params) -> list:
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+
+    def lookup_urls(self, urls) -> dict:
+        """{image_url: web_path} cho các URL đã có ảnh upload (1 query mỗi chunk)."""
+        by_hash = {}
+        for url in urls:
+            if url:
+                by_hash.setdefault(url_hash(url), []).append(url)
+        found = {}
+        keys = list(by_hash)
+        for pos in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[pos:pos + LOOKUP_CHUNK]
+            ph = ",".join(["%s"] * len(chunk))
+            rows = self._query(f"SELECT url_hash, web_path FROM {TABLE} WHERE url_hash IN ({ph})", chunk)
+            for r in rows:
+                for url in by_hash.get(r["url_hash"], ()):
+                    found[url] = r["web_path"]
+        with self._lock:
+            self.stats["url_hits"] += len(found)
+        return found
+
+    def find_content(self, chash: str):
+        with self._lock:
+            web_path = self._content.get(chash)
+        if web_path is None:
+            rows = self._query(f"SELECT web_path FROM {TABLE} WHERE content_hash = %s LIMIT 1", (chash,))
+            web_path = rows[0]["web_path"] if rows else None
+        if web_path is not None:
+            self._count("content_hits")
+        return web_path
+
+    def find_phash(self, value):
+        """web_path của ảnh có dHash cách value <= phash_distance (None nếu tắt hoặc không có)."""
+        if value is None or self.phash_distance < 0:
+            return None
+        bands = phash_bands(value)
+        where = " OR ".join(f"phash_b{i} = %s" for i in range(PHASH_BANDS))
+        # Lọc khoảng cách ngay trong SQL: band phổ biến không đẩy được ảnh trùng thật ra khỏi kết quả
+        rows = self._query(f"""
+            SELECT phash, web_path FROM {TABLE}
+            WHERE ({where}) AND BIT_COUNT(phash ^ %s) <= %s
+            ORDER BY BIT_COUNT(phash ^ %s), id
+            LIMIT 1
+        """, [*bands, int(value), self.phash_distance, int(value)])
+        if not rows:
+            return None
+        self._count("phash_hits")
+        return rows[0]["web_path"]
+
+    def record(self, image_url: str, web_path: str, chash: str = None, phash=None,
+               size: int = None, image_id: int = None):
+        """Ghi URL -> web_path (và content/phash nếu có). URL đã có thì giữ web_path cũ."""
+        bands = phash_bands(phash) if phash is not None else [None] * PHASH_BANDS
+        conn = self.db.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                INSERT INTO {TABLE}
+                    (url_hash, content_hash, phash, phash_b0, phash_b1, phash_b2, phash_b3, web_path, bytes, image_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    content_hash = COALESCE(content_hash, VALUES(content_hash)),
+                    phash = COALESCE(phash, VALUES(phash)),
+                    phash_b0 = COALESCE(phash_b0, VALUES(phash_b0)),
+                    phash_b1 = COALESCE(phash_b1, VALUES(phash_b1)),
+                    phash_b2 = COALESCE(phash_b2, VALUES(phash_b2)),
+                    phash_b3 = COALESCE(phash_b3, VALUES(phash_b3))
+            """, (url_hash(image_url), chash, phash, *bands, web_path, size, image_id))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Failed to record image dedup entry: {e}")
+            return
+        finally:
+            cursor.close()
+            conn.close()
+        with self._lock:
+            self.stats["recorded"] += 1
+            if chash:
+                self._content[chash] = web_path
+
+    def record_alias(self, image_url: str, web_path: str, chash: str = None):
+        """URL mới trỏ về ảnh đã upload: lần sau trùng ngay ở bước lookup_urls."""
+        self.record(image_url, web_path, chash)
+
+    def summary(self) -> str:
+        with self._lock:
+            return " ".join(f"{k}={v}" for k, v in self.stats.items())
+
+
+def backfill_from_uploaded(db: Database, batch: int = 5000) -> int:
+    """Nạp URL -> ftp_path từ scraped_detail_images đã UPLOADED (keyset theo id)."""
+    ensure_table(db)
+    last_id = 0
+    total = 0
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        while True:
+            cursor.execute("""
+                SELECT id, image_url, ftp_path
+                FROM scraped_detail_images
+                WHERE id > %s AND status = 'UPLOADED' AND ftp_path IS NOT NULL
+                ORDER BY id
+                LIMIT %s
+            """, (last_id, batch))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = int(rows[-1]["id"])
+            values = [(url_hash(r["image_url"]), r["ftp_path"], int(r["id"])) for r in rows if r["image_url"]]
+            if values:
+                cursor.executemany(f"""
+                    INSERT IGNORE INTO {TABLE} (url_hash, web_path, image_id)
+                    VALUES (%s, %s, %s)
+                """, values)
+                total += cursor.rowcount
+                conn.commit()
+            logger.info(f"Backfill: last_id={last_id} inserted={total}")
+            if len(rows) < batch:
+                break
+    finally:
+        cursor.close()
+        conn.close()
+    return total
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%H:%M:%S')
+    parser = argparse.ArgumentParser(description='Image dedup index for ftp_image_processor')
+    parser.add_argument('--ensure-table', action='store_true', help='Create image_dedup_index if missing')
+    parser.add_argument('--backfill', action='store_true', help='Seed URL hashes from already uploaded images')
+    parser.add_argument('--batch', type=int, default=5000, help='Backfill batch size')
+    args = parser.parse_args()
+
+    db = Database()
+    if args.ensure_table:
+        ensure_table(db)
+        logger.info(f"{TABLE} ready")
+    if args.backfill:
+        total = backfill_from_uploaded(db, args.batch)
+        logger.info(f"Backfill done: {total} rows")
+
+
+if __name__ == '__main__':
+    main()
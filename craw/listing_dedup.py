@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate listing detector (MinHash + LSH) cho data_full / data_no_full.
+
+Cùng 1 BĐS được cào từ nhiều domain (batdongsan, mogi, alonhadat, guland, nhatot,
+meeymap...) nên source_post_id khác nhau. Ở đây:
+  - shingle 3 từ của title + description (bỏ dấu, bỏ HTML); text ít hơn MIN_SHINGLES shingle
+    (vd chỉ có title ngắn) không có signature, không được index và không bao giờ bị match
+  - MinHash NUM_PERM hàm băm (numpy), LSH BANDS x ROWS
+  - block theo ward_id; ứng viên phải cùng band giá / band diện tích (lệch tối đa 1 band)
+  - Jaccard ước lượng >= threshold -> dup_of = listing gốc (listing được index sớm nhất của cụm)
+
+Signature lưu ở bảng listing_minhash, chạy incremental theo id > MAX(listing_id) đã index
+của từng bảng. listing_uploader --skip-near-duplicates bỏ qua listing có listing cùng cụm
+đã LISTING_UPLOADED.
+
+Usage:
+    python3 listing_dedup.py                        # data_full rồi data_no_full, chỉ dòng mới
+    python3 listing_dedup.py --tables data_full --batch 5000
+    python3 listing_dedup.py --rebuild              # xoá index, tính lại từ đầu
+                                                    # (cần chạy 1 lần sau khi thêm cột shingle_count)
+"""
+
+import argparse
+import hashlib
+import logging
+import math
+import os
+import re
+import sys
+import time
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+TABLE = "listing_minhash"
+ALLOWED_TABLES = ("data_full", "data_no_full")
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+MIN_SHINGLES = 5         # ít hơn: 2 tin cùng title ngắn sẽ có Jaccard ~1.0 dù khác BĐS
+DEFAULT_THRESHOLD = 0.7
+PRICE_BAND_STEP = 1.15   # band giá theo log, 1 band ~ 15%
+AREA_BAND_STEP = 1.10    # band diện tích theo log, 1 band ~ 10%
+_PRIME = np.uint64((1 << 31) - 1)
+
+_rng = np.random.RandomState(20240601)  # seed cố định: signature cũ trong DB vẫn so được
+_PERM_A = _rng.randint(1, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_NON_WORD_RE = re.compile(r"[^0-9a-z]+")
+
+
+def _validate_table_name(table_name: str) -> str:
+    if table_name not in ALLOWED_TABLES:
+        raise ValueError(f"Unsupported table: {table_name}")
+    return table_name
+
+
+def ensure_table(db: Database) -> None:
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {TABLE} (
+                table_name VARCHAR(32) NOT NULL,
+                listing_id BIGINT NOT NULL,
+                source VARCHAR(100) DEFAULT NULL,
+                ward_id INT DEFAULT NULL,
+                price_band SMALLINT DEFAULT NULL,
+                area_band SMALLINT DEFAULT NULL,
+                signature VARBINARY({NUM_PERM * 4}) DEFAULT NULL,
+                dup_of_table VARCHAR(32) DEFAULT NULL,
+                dup_of_id BIGINT DEFAULT NULL,
+                similarity DECIMAL(4,3) DEFAULT NULL,
+                shingle_count SMALLINT DEFAULT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (table_name, listing_id),
+                INDEX idx_lmh_block (ward_id, price_band),
+                INDEX idx_lmh_dup (dup_of_table, dup_of_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """)
+        conn.commit()
+
+        cursor.execute(f"SHOW COLUMNS FROM {TABLE} LIKE 'shingle_count'")
+        if not cursor.fetchone():
+            cursor.execute(f"ALTER TABLE {TABLE} ADD COLUMN shingle_count SMALLINT DEFAULT NULL AFTER similarity")
+            conn.commit()
+            # Dòng cũ chưa có shingle_count -> bị bỏ qua khi match cho tới khi --rebuild
+            logger.warning(f"{TABLE}.shingle_count added; run with --rebuild to re-index existing rows")
+    finally:
+        cursor.close()
+        conn.close()
+
+
+# ============================================
+# Shingle / MinHash
+# ============================================
+
+def normalize_text(text: str) -> str:
+    """Lowercase, bỏ HTML, bỏ dấu tiếng Việt, chỉ giữ chữ/số."""
+    text = _TAG_RE.sub(" ", str(text or "")).lower().replace("đ", "d")
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return _NON_WORD_RE.sub(" ", text).strip()
+
+
+def shingles(text: str, k: int = SHINGLE_SIZE) -> set:
+    words = normalize_text(text).split()
+    if not words:
+        return set()
+    if len(words) < k:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+
+def _shingle_hashes(items) -> np.ndarray:
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in items),
+        dtype=np.uint64,
+        count=len(items),
+    )
+
+
+def minhash(items) -> np.ndarray:
+    """Signature uint32[NUM_PERM] của tập shingle ((a*x + b) mod 2^31-1, min theo từng hàm)."""
+    x = _shingle_hashes(list(items))
+    if not len(x):
+        return None
+    hashed = (_PERM_A[:, None] * x[None, :] + _PERM_B[:, None]) % _PRIME
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def listing_shingles(listing: dict) -> set:
+    return shingles(f"{listing.get('title') or ''} {listing.get('description') or ''}")
+
+
+def signature_of(listing: dict):
+    """Signature của listing, None nếu text quá ngắn (< MIN_SHINGLES shingle) để so sánh."""
+    items = listing_shingles(listing)
+    if len(items) < MIN_SHINGLES:
+        return None
+    return minhash(items)
+
+
+def similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """Jaccard ước lượng = tỉ lệ hàm băm có min bằng nhau."""
+    return float(np.count_nonzero(sig_a == sig_b)) / NUM_PERM
+
+
+def band_keys(sig: np.ndarray) -> list:
+    return [(band, sig[band * ROWS:(band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+
+
+def log_band(value, step: float):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if value <= 0 or math.isnan(value):
+        return None
+    return int(math.floor(math.log(value) / math.log(step)))
+
+
+# ============================================
+# LSH index (theo ward)
+# ============================================
+
+class LSHIndex:
+    """Bucket (ward_id, band, band_bytes) -> entries; entry = (table, id, source, price_band, area_band, sig, root)."""
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, cross_source_only: bool = True):
+        self.threshold = threshold
+        self.cross_source_only = cross_source_only
+        self.buckets = defaultdict(list)
+        self.loaded_wards = set()
+
+    def add(self, ward_id, entry):
+        for key in band_keys(entry[5]):
+            self.buckets[(ward_id, *key)].append(entry)
+
+    def query(self, ward_id, source, price_band, area_band, sig):
+        """(entry, sim) giống nhất vượt threshold, None nếu không có."""
+        best = None
+        seen = set()
+        for key in band_keys(sig):
+            for entry in self.buckets.get((ward_id, *key), ()):
+                ref = (entry[0], entry[1])
+                if ref in seen:
+                    continue
+                seen.add(ref)
+                if self.cross_source_only and entry[2] == source:
+                    continue
+                if abs(entry[3] - price_band) > 1 or abs(entry[4] - area_band) > 1:
+                    continue
+                sim = similarity(sig, entry[5])
+                if sim >= self.threshold and (best is None or sim > best[1]):
+                    best = (entry, sim)
+        return best
+
+
+def load_wards(db: Database, index: LSHIndex, ward_ids) -> int:
+    """Nạp signature đã lưu của các ward chưa có trong index (1 query / chunk ward)."""
+    wards = sorted({int(w) for w in ward_ids if w is not None} - index.loaded_wards)
+    loaded = 0
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        for pos in range(0, len(wards), 200):
+            chunk = wards[pos:pos + 200]
+            ph = ",".join(["%s"] * len(chunk))
+            cursor.execute(f"""
+                SELECT table_name, listing_id, source, ward_id, price_band, area_band, signature,
+                       dup_of_table, dup_of_id
+                FROM {TABLE}
+                WHERE ward_id IN ({ph}) AND signature IS NOT NULL
+                  AND price_band IS NOT NULL AND area_band IS NOT NULL
+                  AND shingle_count >= %s
+            """, chunk + [MIN_SHINGLES])
+            for r in cursor.fetchall():
+                sig = np.frombuffer(r["signature"], dtype=np.uint32)
+                root = (r["dup_of_table"], int(r["dup_of_id"])) if r["dup_of_id"] else (r["table_name"], int(r["listing_id"]))
+                index.add(int(r["ward_id"]), (r["table_name"], int(r["listing_id"]), r["source"],
+                                              int(r["price_band"]), int(r["area_band"]), sig, root))
+                loaded += 1
+            index.loaded_wards.update(chunk)
+    finally:
+        cursor.close()
+        conn.close()
+    return loaded
+
+
+# ============================================
+# Incremental run
+# ============================================
+
+def last_indexed_id(db: Database, table_name: str) -> int:
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT MAX(listing_id) AS last_id FROM {TABLE} WHERE table_name = %s", (table_name,))
+        row = cursor.fetchone()
+        return int(row["last_id"] or 0) if row else 0
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def fetch_batch(db: Database, table_name: str, last_id: int, limit: int) -> list:
+    table_name = _validate_table_name(table_name)
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT id, source, title, description, price, area, ward_id
+            FROM {table_name}
+            WHERE id > %s
+            ORDER BY id
+            LIMIT %s
+        """, (last_id, limit))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def index_batch(db: Database, index: LSHIndex, table_name: str, rows: list) -> tuple:
+    """Tính signature, tìm listing gốc, ghi listing_minhash. Trả về (indexed, duplicates)."""
+    load_wards(db, index, [r.get("ward_id") for r in rows])
+    values = []
+    dups = 0
+    for r in rows:
+        items = listing_shingles(r)
+        sig = minhash(items) if len(items) >= MIN_SHINGLES else None
+        ward_id = int(r["ward_id"]) if r.get("ward_id") is not None else None
+        price_band = log_band(r.get("price"), PRICE_BAND_STEP)
+        area_band = log_band(r.get("area"), AREA_BAND_STEP)
+        dup_of = (None, None)
+        sim = None
+        if sig is not None and None not in (ward_id, price_band, area_band):
+            match = index.query(ward_id, r.get("source"), price_band, area_band, sig)
+            root = (table_name, int(r["id"]))
+            if match is not None:
+                entry, sim = match
+                root = entry[6]
+                dup_of = root
+                dups += 1
+            index.add(ward_id, (table_name, int(r["id"]), r.get("source"), price_band, area_band, sig, root))
+        values.append((
+            table_name, int(r["id"]), r.get("source"), ward_id, price_band, area_band,
+            sig.tobytes() if sig is not None else None, dup_of[0], dup_of[1],
+            round(sim, 3) if sim is not None else None, len(items),
+        ))
+
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(f"""
+            INSERT INTO {TABLE}
+                (table_name, listing_id, source, ward_id, price_band, area_band, signature,
+                 dup_of_table, dup_of_id, similarity, shingle_count)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                source = VALUES(source), ward_id = VALUES(ward_id),
+                price_band = VALUES(price_band), area_band = VALUES(area_band),
+                signature = VALUES(signature), dup_of_table = VALUES(dup_of_table),
+                dup_of_id = VALUES(dup_of_id), similarity = VALUES(similarity),
+                shingle_count = VALUES(shingle_count)
+        """, values)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    return len(values), dups
+
+
+def run_incremental(db: Database, table_name: str, index: LSHIndex, batch: int = 2000, max_batches: int = 0) -> tuple:
+    table_name = _validate_table_name(table_name)
+    last_id = last_indexed_id(db, table_name)
+    started = time.time()
+    total = dups = batches = 0
+    while True:
+        rows = fetch_batch(db, table_name, last_id, batch)
+        if not rows:
+            break
+        indexed, found = index_batch(db, index, table_name, rows)
+        total += indexed
+        dups += found
+        batches += 1
+        last_id = int(rows[-1]["id"])
+        elapsed = max(time.time() - started, 1e-6)
+        logger.info(f"[{table_name}] last_id={last_id} indexed={total} near_dup={dups} rate={total / elapsed:.1f} rows/s")
+        if len(rows) < batch or (max_batches and batches >= max_batches):
+            break
+    return total, dups
+
+
+# ============================================
+# Dùng cho listing_uploader
+# ============================================
+
+def near_duplicate_uploaded(db: Database, table_name: str, listing_id: int, limit: int = 50):
+    """
+    (table, id) của 1 listing cùng cụm near-duplicate đã LISTING_UPLOADED, None nếu không có.
+    Cụm = listing gốc + các listing có dup_of trỏ về gốc; chỉ tính các dòng đủ MIN_SHINGLES
+    (dòng index trước khi có shingle_count bị bỏ qua, không bao giờ skip nhầm).
+    """
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"SELECT dup_of_table, dup_of_id, shingle_count FROM {TABLE} WHERE table_name = %s AND listing_id = %s",
+            (table_name, listing_id),
+        )
+        row = cursor.fetchone()
+        if row is None or row["shingle_count"] is None or int(row["shingle_count"]) < MIN_SHINGLES:
+            return None
+        root = (row["dup_of_table"], int(row["dup_of_id"])) if row["dup_of_id"] else (table_name, int(listing_id))
+        cursor.execute(f"""
+            SELECT table_name, listing_id FROM {TABLE}
+            WHERE ((dup_of_table = %s AND dup_of_id = %s) OR (table_name = %s AND listing_id = %s))
+              AND shingle_count >= %s
+            LIMIT %s
+        """, (root[0], root[1], root[0], root[1], MIN_SHINGLES, limit))
+        members = {(r["table_name"], int(r["listing_id"])) for r in cursor.fetchall()}
+        members.discard((table_name, int(listing_id)))
+        by_table = defaultdict(list)
+        for tbl, lid in members:
+            if tbl in ALLOWED_TABLES:
+                by_table[tbl].append(lid)
+        for tbl, ids in by_table.items():
+            ph = ",".join(["%s"] * len(ids))
+            cursor.execute(
+                f"SELECT id FROM {tbl} WHERE id IN ({ph}) AND images_status = 'LISTING_UPLOADED' LIMIT 1",
+                ids,
+            )
+            hit = cursor.fetchone()
+            if hit:
+                return tbl, int(hit["id"])
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%H:%M:%S')
+    parser = argparse.ArgumentParser(description='Near-duplicate listing detector (MinHash/LSH)')
+    parser.add_argument('--tables', type=str, default='data_full,data_no_full', help='Comma-separated tables to index, in order')
+    parser.add_argument('--batch', type=int, default=2000, help='Rows per batch')
+    parser.add_argument('--max-batches', type=int, default=0, help='Stop after N batches per table (0=all)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Min estimated Jaccard to flag a near-duplicate')
+    parser.add_argument('--same-source', action='store_true', help='Also match listings from the same source')
+    parser.add_argument('--rebuild', action='store_true', help='Drop the stored index and rebuild from id 0')
+    args = parser.parse_args()
+
+    tables = [_validate_table_name(t.strip()) for t in args.tables.split(',') if t.strip()]
+    db = Database()
+    ensure_table(db)
+    if args.rebuild:
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"TRUNCATE TABLE {TABLE}")
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        logger.info(f"{TABLE} truncated")
+
+    index = LSHIndex(args.threshold, cross_source_only=not args.same_source)
+    for table_name in tables:
+        total, dups = run_incremental(db, table_name, index, args.batch, args.max_batches)
+        logger.info(f"[{table_name}] done: indexed={total} near_dup={dups}")
+
+
+if __name__ == '__main__':
+    main()
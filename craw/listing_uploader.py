@@ -8,6 +8,12 @@ Workflow:
 2. Lấy tất cả ftp_path của ảnh thuộc tin đó
 3. POST lên API cafeland
 4. Update images_status = 'LISTING_UPLOADED'
+
+Pipeline: 1 executor sống suốt phiên chạy (--workers luồng upload, mỗi luồng 1 requests.Session riêng),
+batch kế tiếp được claim trước trong lúc batch hiện tại đang upload, trạng thái được gom lại
+và ghi bằng UPDATE ... CASE id theo lô.
+Dòng UPLOADING bị kẹt do process chết (SIGKILL, OOM) được trả về IMAGES_READY lúc khởi động
+(--stale-claim-minutes, mặc định 60).
 """
 
 import sys
@@ -18,12 +24,17 @@ import argparse
 import logging
 import html
 import re
+import threading
+import uuid
 import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Optional
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from database import Database
+from location_resolver import get_resolver
+from listing_dedup import near_duplicate_uploaded
 
 # Logging
 logging.basicConfig(
@@ -41,6 +52,23 @@ ALLOWED_TABLES = {"data_full", "data_no_full"}
 AREA_FILTER_TABLE = "upload_area_lt20"
 _LOCATION_NAME_CACHE = None
 RETRYABLE_DB_ERROR_CODES = {1205, 1206, 1213, 2006, 2013}
+STATUS_FLUSH_SIZE = 50
+STATUS_FLUSH_SECONDS = 2.0
+STATUS_CHUNK_SIZE = 500
+UPLOADED_STATUSES = ("LISTING_UPLOADED", "DUPLICATE_SKIPPED")
+_HTTP = threading.local()
+
+
+def get_http_session() -> requests.Session:
+    """requests.Session riêng cho từng luồng worker (giữ keep-alive tới API)."""
+    session = getattr(_HTTP, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _HTTP.session = session
+    return session
 
 
 def _validate_table_name(table_name: str) -> str:
@@ -86,41 +114,21 @@ def run_db_with_retry(fn, op_name: str, max_attempts: int = 5, base_sleep: float
     raise last_exc
 
 
-def load_location_name_cache():
+def load_location_name_cache(db: Database = None):
     global _LOCATION_NAME_CACHE
     if _LOCATION_NAME_CACHE is not None:
         return _LOCATION_NAME_CACHE
 
-    province_map = {}
-    ward_map = {}
     def _run():
-        db = Database()
-        conn = db.get_connection()
-        cursor = conn.cursor()
+        conn = (db or Database(init_schema=False)).get_connection()
         try:
-            cursor.execute(
-                """
-                SELECT new_city_id, new_city_name, new_city_parent_id
-                FROM transaction_city_merge
-                """
-            )
-            for row in cursor.fetchall():
-                cid = row.get("new_city_id")
-                name = (row.get("new_city_name") or "").strip()
-                parent_id = row.get("new_city_parent_id")
-                if not cid or not name:
-                    continue
-                if int(parent_id or 0) == 0:
-                    province_map[int(cid)] = name
-                else:
-                    ward_map[int(cid)] = name
+            return get_resolver(conn, sections=("admin",))
         finally:
-            cursor.close()
             conn.close()
 
-    run_db_with_retry(_run, "load_location_name_cache")
+    resolver = run_db_with_retry(_run, "load_location_name_cache")
 
-    _LOCATION_NAME_CACHE = (province_map, ward_map)
+    _LOCATION_NAME_CACHE = (resolver.province_names, resolver.ward_names)
     return _LOCATION_NAME_CACHE
 
 
@@ -269,6 +277,32 @@ def ensure_uploaded_at_schema(db: Database, table_name: str = "data_full"):
         conn.close()
 
 
+def ensure_upload_claim_schema(db: Database, table_name: str = "data_full"):
+    """Cột upload_claim: token của lần claim IMAGES_READY -> UPLOADING (mỗi batch 1 token),
+    upload_claimed_at: lúc claim, để reset_stale_claims nhận ra claim của process đã chết."""
+    table_name = _validate_table_name(table_name)
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SHOW COLUMNS FROM {table_name} LIKE 'upload_claim'")
+        if not cursor.fetchone():
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN upload_claim CHAR(32) NULL DEFAULT NULL")
+            conn.commit()
+
+        cursor.execute(f"SHOW COLUMNS FROM {table_name} LIKE 'upload_claimed_at'")
+        if not cursor.fetchone():
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN upload_claimed_at DATETIME NULL DEFAULT NULL")
+            conn.commit()
+
+        cursor.execute(f"SHOW INDEX FROM {table_name} WHERE Key_name='idx_{table_name}_upload_claim'")
+        if not cursor.fetchone():
+            cursor.execute(f"CREATE INDEX idx_{table_name}_upload_claim ON {table_name} (upload_claim)")
+            conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
 def normalize_house_direction(value):
     """Pass through Cafeland-compatible direction enum 1..8, else None.
 
@@ -297,7 +331,8 @@ def get_ready_listings(
 ) -> list:
     """Get listings with images_status = 'IMAGES_READY'.
 
-    Normal mode: atomically marks rows IMAGES_READY -> UPLOADING, then selects UPLOADING.
+    Normal mode: atomically marks rows IMAGES_READY -> UPLOADING with a per-call upload_claim token,
+    then selects only the rows carrying that token (never rows claimed by an earlier batch).
     Dry-run mode: SELECT only, does not update DB status.
     """
     order_sql = "ASC" if str(order).lower() != "desc" else "DESC"
@@ -352,9 +387,12 @@ def get_ready_listings(
                 else:
                     custom_area_where = " AND (af.province_id IS NOT NULL OR df.source = 'vinhome')"
 
+            claim_filter = ""
+            claim_params = []
             if dry_run:
                 where_status = "IMAGES_READY"
             else:
+                claim = uuid.uuid4().hex
                 join_area = custom_area_join or (f"""
                 LEFT JOIN {AREA_FILTER_TABLE} af
                     ON af.province_id = df.province_id
@@ -381,13 +419,17 @@ def get_ready_listings(
                         ORDER BY df.id {order_sql}
                         LIMIT %s
                     ) picked ON picked.id = {table_name}.id
-                    SET {table_name}.images_status = 'UPLOADING'
-                """, tuple(custom_area_params + province_filter_params + source_filter_params + [limit]))
+                    SET {table_name}.images_status = 'UPLOADING',
+                        {table_name}.upload_claim = %s,
+                        {table_name}.upload_claimed_at = NOW()
+                """, tuple(custom_area_params + province_filter_params + source_filter_params + [limit, claim]))
                 affected = cursor.rowcount
                 conn.commit()
                 if affected == 0:
                     return []
                 where_status = "UPLOADING"
+                claim_filter = " AND df.upload_claim = %s"
+                claim_params = [claim]
 
             join_area = custom_area_join or (f"""
                 LEFT JOIN {AREA_FILTER_TABLE} af
@@ -445,6 +487,7 @@ def get_ready_listings(
                 ON df.ward_id = tcm_ward.new_city_id 
                 AND tcm_ward.action_type = 0
             WHERE df.images_status = '{where_status}'
+              {claim_filter}
               AND COALESCE(df.price, 0) > 0
               AND (df.source <> 'vinhome' OR df.ward_id IS NOT NULL)
               {custom_area_where}
@@ -452,7 +495,7 @@ def get_ready_listings(
               {source_filter}
             ORDER BY df.id {order_sql}
             LIMIT %s
-            """, tuple(custom_area_params + province_filter_params + source_filter_params + [limit]))
+            """, tuple(claim_params + custom_area_params + province_filter_params + source_filter_params + [limit]))
             return cursor.fetchall()
         except Exception:
             try:
@@ -539,7 +582,7 @@ def get_listing_by_id(db: Database, listing_id: int, dry_run: bool = False, tabl
             cursor.execute(
             f"""
             UPDATE {table_name}
-            SET images_status='UPLOADING'
+            SET images_status='UPLOADING', upload_claimed_at=NOW()
             WHERE id=%s AND images_status='IMAGES_READY' AND COALESCE(price, 0) > 0
             """,
             (listing_id,),
@@ -632,7 +675,7 @@ def get_listing_images(db: Database, detail_id: int, table_name: str = "data_ful
             SELECT DISTINCT sdi.ftp_path 
             FROM scraped_detail_images sdi
             INNER JOIN {table_name} df ON sdi.detail_id = df.id_img
-            WHERE sdi.detail_id = %s AND sdi.status = 'UPLOADED' AND sdi.ftp_path IS NOT NULL
+            WHERE sdi.detail_id = %s AND sdi.status IN ('UPLOADED', 'DUPLICATE') AND sdi.ftp_path IS NOT NULL
             ORDER BY sdi.idx
             """, (detail_id,))
             rows = cursor.fetchall()
@@ -656,7 +699,7 @@ def update_listing_status(db: Database, listing_id: int, status: str, error: str
         conn = db.get_connection()
         cursor = conn.cursor()
         try:
-            if status in ("LISTING_UPLOADED", "DUPLICATE_SKIPPED"):
+            if status in UPLOADED_STATUSES:
                 cursor.execute(
                     f"UPDATE {table_name} SET images_status=%s, uploaded_at=NOW() WHERE id=%s",
                     (status, listing_id),
@@ -682,6 +725,170 @@ def update_listing_status(db: Database, listing_id: int, status: str, error: str
     except Exception as e:
         logger.error(f"Failed to update listing status: {e}")
 
+def update_listing_statuses(db: Database, items: list, table_name: str = "data_full") -> list:
+    """Bulk update status: items = [(listing_id, status)], 1 câu UPDATE ... CASE id mỗi chunk.
+
+    Trả về các listing_id đã ghi xong (chunk lỗi bị bỏ ra, caller tự thử lại).
+    """
+    table_name = _validate_table_name(table_name)
+    if not items:
+        return []
+
+    def _run(chunk):
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        try:
+            ids = [lid for lid, _ in chunk]
+            uploaded_ids = [lid for lid, status in chunk if status in UPLOADED_STATUSES]
+            case_sql = " ".join(["WHEN %s THEN %s"] * len(chunk))
+            params = []
+            for lid, status in chunk:
+                params.extend([lid, status])
+            uploaded_sql = ""
+            if uploaded_ids:
+                uploaded_sql = (
+                    f", uploaded_at = CASE WHEN id IN ({','.join(['%s'] * len(uploaded_ids))}) "
+                    "THEN NOW() ELSE uploaded_at END"
+                )
+                params.extend(uploaded_ids)
+            params.extend(ids)
+            cursor.execute(
+                f"UPDATE {table_name} SET images_status = CASE id {case_sql} END{uploaded_sql} "
+                f"WHERE id IN ({','.join(['%s'] * len(ids))})",
+                tuple(params),
+            )
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    written = []
+    for i in range(0, len(items), STATUS_CHUNK_SIZE):
+        chunk = items[i:i + STATUS_CHUNK_SIZE]
+        try:
+            run_db_with_retry(lambda: _run(chunk), f"update_listing_statuses[{table_name}]")
+            written.extend(lid for lid, _ in chunk)
+        except Exception as e:
+            logger.error(f"Failed to bulk update {len(chunk)} listing statuses: {e}")
+    return written
+
+
+def release_claimed_listings(db: Database, listing_ids, table_name: str = "data_full"):
+    """Trả các listing đã claim nhưng chưa xử lý (Ctrl-C, lỗi, future bị huỷ) về IMAGES_READY."""
+    table_name = _validate_table_name(table_name)
+    ids = sorted(set(int(i) for i in listing_ids))
+    if not ids:
+        return 0
+
+    def _run(chunk):
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"UPDATE {table_name} SET images_status = 'IMAGES_READY', upload_claim = NULL, upload_claimed_at = NULL "
+                f"WHERE id IN ({','.join(['%s'] * len(chunk))}) AND images_status = 'UPLOADING'",
+                tuple(chunk),
+            )
+            conn.commit()
+            return cursor.rowcount
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    released = 0
+    for i in range(0, len(ids), STATUS_CHUNK_SIZE):
+        chunk = ids[i:i + STATUS_CHUNK_SIZE]
+        try:
+            released += run_db_with_retry(lambda: _run(chunk), f"release_claimed_listings[{table_name}]")
+        except Exception as e:
+            logger.error(f"Failed to release {len(chunk)} claimed listings: {e}")
+    return released
+
+
+def reset_stale_claims(db: Database, table_name: str = "data_full", older_than_minutes: int = 60) -> int:
+    """Trả các dòng UPLOADING bị kẹt (process claim đã chết: SIGKILL, OOM) về IMAGES_READY.
+
+    Claim cũ hơn older_than_minutes (hoặc không có upload_claimed_at, claim từ bản cũ) coi như bỏ;
+    chọn ngưỡng lớn hơn thời gian xử lý 1 batch để không cướp claim của uploader khác đang chạy.
+    Listing đã POST xong nhưng chưa kịp ghi status trước khi chết sẽ được POST lại.
+    """
+    table_name = _validate_table_name(table_name)
+
+    def _run():
+        conn = db.get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"UPDATE {table_name} SET images_status = 'IMAGES_READY', upload_claim = NULL, upload_claimed_at = NULL "
+                "WHERE images_status = 'UPLOADING' "
+                "AND (upload_claimed_at IS NULL OR upload_claimed_at < NOW() - INTERVAL %s MINUTE)",
+                (int(older_than_minutes),),
+            )
+            conn.commit()
+            return cursor.rowcount
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    try:
+        return run_db_with_retry(_run, f"reset_stale_claims[{table_name}]")
+    except Exception as e:
+        logger.error(f"Failed to reset stale UPLOADING claims: {e}")
+        return 0
+
+
+class StatusWriter:
+    """Gom status của các listing đã xử lý, flush khi đủ STATUS_FLUSH_SIZE hoặc sau STATUS_FLUSH_SECONDS."""
+
+    def __init__(self, db: Database, table_name: str, flush_size: int = STATUS_FLUSH_SIZE, flush_seconds: float = STATUS_FLUSH_SECONDS,
+                 on_written=None):
+        self.db = db
+        self.table_name = table_name
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.on_written = on_written  # callback(ids) sau khi status đã commit
+        self.pending = {}
+        self.last_flush = time.time()
+
+    def add(self, listing_id: int, status: str):
+        self.pending[listing_id] = status
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+
+    def maybe_flush(self):
+        if self.pending and time.time() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        items = list(self.pending.items())
+        self.pending = {}
+        self.last_flush = time.time()
+        written = set(update_listing_statuses(self.db, items, table_name=self.table_name))
+        # Chunk lỗi giữ lại cho lần flush sau (status mới hơn, nếu có, được ưu tiên)
+        for lid, status in items:
+            if lid not in written:
+                self.pending.setdefault(lid, status)
+        if written and self.on_written is not None:
+            self.on_written(written)
+
 def is_duplicate_uploaded(db: Database, listing: dict, table_name: str = "data_full") -> bool:
     """Anti-duplicate: skip if same (source, source_post_id) has already been uploaded."""
     table_name = _validate_table_name(table_name)
@@ -716,8 +923,10 @@ def is_duplicate_uploaded(db: Database, listing: dict, table_name: str = "data_f
 
     return run_db_with_retry(_run, f"is_duplicate_uploaded[{table_name}]")
 
-def upload_listing(listing: dict, images: list, dry_run: bool = False, api_mode: str = "normal") -> tuple:
+def upload_listing(listing: dict, images: list, dry_run: bool = False, api_mode: str = "normal", session: requests.Session = None) -> tuple:
     """Upload a single listing to API.
+
+    session: mặc định dùng Session riêng của luồng hiện tại (get_http_session).
     
     Returns: (success: bool, listing_id: int, error: str or None)
     """
@@ -855,7 +1064,7 @@ def upload_listing(listing: dict, images: list, dry_run: bool = False, api_mode:
             'data_form': json_payload
         }
         
-        response = requests.post(
+        response = (session or get_http_session()).post(
             get_api_url(api_mode),
             data=post_body,
             headers=headers,
@@ -903,8 +1112,12 @@ def should_retry(error: str) -> bool:
     ]
     return any(m in e for m in transient_markers)
 
-def process_one_listing(db: Database, listing: dict, dry_run: bool, retries: int, table_name: str = "data_full", api_mode: str = "normal") -> tuple:
-    """Process 1 listing with retries. Returns (success, listing_id, error_or_none)."""
+def process_one_listing(db: Database, listing: dict, dry_run: bool, retries: int, table_name: str = "data_full", api_mode: str = "normal",
+                        skip_near_duplicates: bool = False) -> tuple:
+    """Process 1 listing with retries. Returns (success, listing_id, error_or_none).
+
+    skip_near_duplicates: bỏ qua listing có tin cùng cụm near-duplicate (listing_dedup.py) đã upload.
+    """
     listing_id = listing['id'] if isinstance(listing, dict) else listing[0]
     id_img = listing['id_img'] if isinstance(listing, dict) else listing[11]
     try:
@@ -918,6 +1131,13 @@ def process_one_listing(db: Database, listing: dict, dry_run: bool, retries: int
     if not dry_run and isinstance(listing, dict) and is_duplicate_uploaded(db, listing, table_name=table_name):
         return (True, listing_id, "DUPLICATE_SKIPPED")
 
+    if not dry_run and skip_near_duplicates:
+        uploaded = run_db_with_retry(
+            lambda: near_duplicate_uploaded(db, table_name, listing_id), f"near_duplicate_uploaded[{table_name}]"
+        )
+        if uploaded:
+            return (True, listing_id, f"NEAR_DUPLICATE_SKIPPED:{uploaded[0]}#{uploaded[1]}")
+
     images = get_listing_images(db, id_img, table_name=table_name)
     if not images:
         return (False, listing_id, "NO_IMAGES")
@@ -936,116 +1156,202 @@ def process_one_listing(db: Database, listing: dict, dry_run: bool, retries: int
         break
     return (False, listing_id, last_err or "UNKNOWN_ERROR")
 
+def result_status(success: bool, error: Optional[str]) -> str:
+    """Map kết quả process_one_listing -> images_status."""
+    if success:
+        if error and (error == "DUPLICATE_SKIPPED" or error.startswith("NEAR_DUPLICATE_SKIPPED")):
+            return "DUPLICATE_SKIPPED"
+        return "LISTING_UPLOADED"
+    if error in ("NO_IMAGES", "NO_PRICE"):
+        return error
+    return "UPLOAD_FAILED"
+
+
 def run_uploader(args):
-    """Main processing loop."""
+    """Main processing loop (producer/consumer).
+
+    - 1 ThreadPoolExecutor upload sống suốt phiên chạy, luôn giữ tối đa 2 x workers listing đang xử lý
+    - 1 luồng fetch claim batch kế tiếp ngay khi hàng đợi còn < 1 batch (dry-run: chờ batch hiện tại xong
+      vì dry-run không claim, fetch sớm sẽ lấy lại đúng các dòng đang xử lý)
+    - status gom qua StatusWriter, ghi bulk
+    """
     logger.info("=== LISTING UPLOADER ===")
     logger.info(f"Table: {args.table}")
     logger.info(f"API URL: {get_api_url(args.api_mode)}")
     if args.exclude_province_ids:
         logger.info(f"Exclude provinces: {args.exclude_province_ids}")
     
-    db = Database()
+    workers = max(1, int(args.workers))
+    # Pool đủ cho mọi worker upload + luồng fetch + main thread, tránh mở connection mới mỗi lần gọi DB
+    db = Database(pool_size=workers + 4)
     ensure_uploaded_at_schema(db, table_name=args.table)
+    ensure_upload_claim_schema(db, table_name=args.table)
     if args.area_filter_lt20:
         ensure_area_filter_schema(db)
         refresh_area_filter_table(db)
         logger.info(f"Area filter enabled via {AREA_FILTER_TABLE}")
+    if not args.dry_run and args.stale_claim_minutes > 0:
+        reset = reset_stale_claims(db, table_name=args.table, older_than_minutes=args.stale_claim_minutes)
+        if reset:
+            logger.warning(f"Reset {reset} stale UPLOADING listings (claimed > {args.stale_claim_minutes} min ago) to IMAGES_READY")
     stats = {'ok': 0, 'fail': 0}
-    stats_lock = Lock()
-    
+    # id đã claim (UPLOADING) mà status cuối chưa commit -> trả về IMAGES_READY khi dừng
+    claimed = set()
+    # status đã commit thì mới bỏ khỏi claimed
+    writer = StatusWriter(db, args.table, on_written=claimed.difference_update)
+    max_inflight = workers * 2
+    single_id = getattr(args, "id", None)
+
+    def _fetch(batch_size):
+        if single_id:
+            one = get_listing_by_id(db, int(single_id), dry_run=args.dry_run, table_name=args.table)
+            if not one:
+                logger.info(f"Listing id={single_id} not ready (need images_status=IMAGES_READY) or not found.")
+                return []
+            return [one]
+        return get_ready_listings(
+            db,
+            limit=batch_size,
+            dry_run=args.dry_run,
+            order=args.order,
+            table_name=args.table,
+            area_filter=args.area_filter_lt20,
+            exclude_province_ids=args.exclude_province_ids,
+            area_filter_table=args.area_filter_table,
+            area_filter_max_total=args.area_filter_max_total,
+        )
+
+    def _handle_future(fut):
+        """Ghi kết quả 1 future; lỗi của 1 future không được chặn các future khác đã xong."""
+        lid = inflight.pop(fut)
+        try:
+            _handle(*fut.result())
+        except Exception as e:
+            # Không biết đã POST hay chưa -> UPLOAD_FAILED (không trả về IMAGES_READY để tránh POST lại)
+            logger.error(f"❌ Listing {lid} crashed while processing: {e}")
+            stats['fail'] += 1
+            if not args.dry_run:
+                writer.add(lid, "UPLOAD_FAILED")
+
+    def _handle(success, lid, error):
+        status = result_status(success, error)
+        if not args.dry_run:
+            writer.add(lid, status)
+        if success:
+            if status == "DUPLICATE_SKIPPED" and error != "DUPLICATE_SKIPPED":
+                logger.info(f"⏭️ Listing {lid} skipped (near-duplicate of {error.split(':', 1)[1]} already uploaded)")
+            elif status == "DUPLICATE_SKIPPED":
+                logger.info(f"⏭️ Listing {lid} skipped (duplicate source_post_id already uploaded)")
+            else:
+                logger.info(f"✅ Listing {lid} uploaded")
+            stats['ok'] += 1
+        else:
+            if status == "NO_IMAGES":
+                logger.warning(f"⚠️ Listing {lid} has no images, skipping")
+            elif status == "NO_PRICE":
+                logger.warning(f"⚠️ Listing {lid} has no price, skipping")
+            logger.error(f"❌ Listing {lid} failed: {error}")
+            stats['fail'] += 1
+
+    started = time.time()
+    total_processed = 0
+    total_claimed = 0
+    pending = []
+    inflight = {}  # future -> listing id
+    fetch_fut = None
+    exhausted = False
+    idle_until = 0.0
+
+    upload_ex = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+    fetch_ex = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fetch")
     try:
-        total_processed = 0
-        
         while True:
-            # If user targets one listing id, process once and exit.
-            if getattr(args, "id", None):
-                one = get_listing_by_id(db, int(args.id), dry_run=args.dry_run, table_name=args.table)
-                if not one:
-                    logger.info(f"Listing id={args.id} not ready (need images_status=IMAGES_READY) or not found.")
-                    break
-                listings = [one]
-                batch_size = 1
-            else:
-            # Determine batch size respecting the limit
-                batch_size = args.batch
-                if args.limit > 0:
-                    remaining = args.limit - total_processed
-                    if remaining <= 0:
-                        break
-                    if remaining < batch_size:
-                        batch_size = remaining
-
-                listings = get_ready_listings(
-                    db,
-                    limit=batch_size,
-                    dry_run=args.dry_run,
-                    order=args.order,
-                    table_name=args.table,
-                    area_filter=args.area_filter_lt20,
-                    exclude_province_ids=args.exclude_province_ids,
-                    area_filter_table=args.area_filter_table,
-                    area_filter_max_total=args.area_filter_max_total,
-                )
-            
-            if not listings:
-                if args.continuous:
-                    logger.info("No listings ready, waiting 5s...")
-                    time.sleep(5)
-                    continue
+            # Nhận batch đã prefetch
+            if fetch_fut is not None and fetch_fut.done():
+                listings = fetch_fut.result()
+                fetch_fut = None
+                if listings:
+                    if not args.dry_run:
+                        claimed.update(l['id'] for l in listings)
+                    logger.info(f"Claimed batch: {len(listings)} listings (queue={len(pending) + len(listings)}, in-flight={len(inflight)})")
+                    pending.extend(listings)
+                    total_claimed += len(listings)
+                    if single_id:
+                        exhausted = True
+                elif single_id or not args.continuous:
+                    exhausted = True
                 else:
-                    logger.info("No more listings to process")
-                    break
-            
-            logger.info(f"Processing batch: {len(listings)} listings")
-            
-            workers = max(1, int(args.workers))
-            # Upload concurrently inside a batch
-            with ThreadPoolExecutor(max_workers=workers) as ex:
-                futs = [
-                    ex.submit(process_one_listing, db, listing, args.dry_run, int(args.retries), args.table, args.api_mode)
-                    for listing in listings
-                ]
-                for fut in as_completed(futs):
-                    success, lid, error = fut.result()
-                    if success:
-                        if not args.dry_run:
-                            if error == "DUPLICATE_SKIPPED":
-                                update_listing_status(db, lid, 'DUPLICATE_SKIPPED', table_name=args.table)
-                                logger.info(f"⏭️ Listing {lid} skipped (duplicate source_post_id already uploaded)")
-                            else:
-                                update_listing_status(db, lid, 'LISTING_UPLOADED', table_name=args.table)
-                                logger.info(f"✅ Listing {lid} uploaded")
-                        with stats_lock:
-                            stats['ok'] += 1
-                    else:
-                        if not args.dry_run:
-                            if error == "NO_IMAGES":
-                                update_listing_status(db, lid, 'NO_IMAGES', table_name=args.table)
-                                logger.warning(f"⚠️ Listing {lid} has no images, skipping")
-                            elif error == "NO_PRICE":
-                                update_listing_status(db, lid, 'NO_PRICE', table_name=args.table)
-                                logger.warning(f"⚠️ Listing {lid} has no price, skipping")
-                            else:
-                                update_listing_status(db, lid, 'UPLOAD_FAILED', table_name=args.table)
-                        logger.error(f"❌ Listing {lid} failed: {error}")
-                        with stats_lock:
-                            stats['fail'] += 1
-            
-            total_processed += len(listings)
-            if getattr(args, "id", None):
-                break
-            
-            if args.limit > 0 and total_processed >= args.limit:
-                logger.info(f"Reached limit of {args.limit} listings")
+                    logger.info("No listings ready, waiting 5s...")
+                    idle_until = time.time() + 5
+
+            if args.limit > 0 and total_claimed >= args.limit:
+                exhausted = True
+
+            # Prefetch batch kế tiếp
+            if fetch_fut is None and not exhausted and time.time() >= idle_until:
+                need_more = len(pending) < args.batch
+                if args.dry_run:
+                    need_more = not pending and not inflight
+                if need_more:
+                    batch_size = args.batch
+                    if args.limit > 0:
+                        batch_size = min(batch_size, args.limit - total_claimed)
+                    fetch_fut = fetch_ex.submit(_fetch, batch_size)
+
+            # Giữ executor luôn đủ việc
+            while pending and len(inflight) < max_inflight:
+                listing = pending.pop(0)
+                fut = upload_ex.submit(process_one_listing, db, listing, args.dry_run, int(args.retries), args.table,
+                                       args.api_mode, args.skip_near_duplicates)
+                inflight[fut] = listing['id']
+
+            if exhausted and not pending and not inflight and fetch_fut is None:
                 break
-            
-            time.sleep(0.5)
-        
-        logger.info("=" * 50)
-        logger.info(f"COMPLETED. Total: {total_processed}, OK: {stats['ok']}, FAIL: {stats['fail']}")
-        
+
+            if inflight:
+                done, _ = wait(list(inflight), timeout=0.5, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    _handle_future(fut)
+                    total_processed += 1
+            elif fetch_fut is not None:
+                wait([fetch_fut], timeout=0.5)
+            else:
+                time.sleep(0.2)
+
+            writer.maybe_flush()
+
+        if args.limit > 0 and total_processed >= args.limit:
+            logger.info(f"Reached limit of {args.limit} listings")
+
     except KeyboardInterrupt:
         logger.info("Interrupted by user")
+    finally:
+        upload_ex.shutdown(wait=True, cancel_futures=True)
+        fetch_ex.shutdown(wait=True)
+        # Batch prefetch đã claim nhưng chưa vào hàng đợi
+        if fetch_fut is not None and not fetch_fut.cancelled() and fetch_fut.exception() is None and not args.dry_run:
+            claimed.update(l['id'] for l in (fetch_fut.result() or []))
+        # Listing đã upload xong nhưng chưa kịp xử lý kết quả vẫn phải ghi status
+        for fut in list(inflight):
+            if fut.done() and not fut.cancelled():
+                _handle_future(fut)
+                total_processed += 1
+        writer.flush()
+        # Đã có kết quả nhưng ghi status lỗi: không trả về IMAGES_READY (sẽ POST lại), để UPLOADING
+        unwritten = claimed & set(writer.pending)
+        if unwritten:
+            logger.error(f"Status not saved for {len(unwritten)} processed listings, left as UPLOADING: {sorted(unwritten)}")
+        release = claimed - unwritten
+        if release:
+            released = release_claimed_listings(db, release, table_name=args.table)
+            logger.info(f"Released {released} unprocessed claimed listings back to IMAGES_READY")
+
+    elapsed = max(time.time() - started, 1e-6)
+    logger.info("=" * 50)
+    logger.info(
+        f"COMPLETED. Total: {total_processed}, OK: {stats['ok']}, FAIL: {stats['fail']}, "
+        f"Rate: {total_processed * 60 / elapsed:.1f}/min"
+    )
 
 
 def main():
@@ -1055,8 +1361,10 @@ def main():
     parser.add_argument('--dry-run', action='store_true', help='Dry run without posting')
     parser.add_argument('--continuous', action='store_true', help='Run continuously, wait for new listings')
     parser.add_argument('--id', type=int, default=0, help='Upload a specific data_full.id (requires IMAGES_READY)')
-    parser.add_argument('--workers', type=int, default=15, help='Concurrent uploads per batch')
+    parser.add_argument('--workers', type=int, default=15, help='Concurrent upload workers (long-lived pool)')
     parser.add_argument('--retries', type=int, default=3, help='Retry count per listing on transient errors')
+    parser.add_argument('--stale-claim-minutes', type=int, default=60,
+                        help='At startup, reset UPLOADING listings claimed more than N minutes ago to IMAGES_READY (0=off)')
     parser.add_argument('--order', type=str, default='asc', choices=['asc', 'desc'], help='Pick listings in asc/desc id order')
     parser.add_argument('--table', type=str, default='data_full', choices=['data_full', 'data_no_full'], help='Source listing table')
     parser.add_argument('--api-mode', type=str, default='normal', choices=['normal', 'null-contact'], help='Target API mode')
@@ -1064,6 +1372,7 @@ def main():
     parser.add_argument('--area-filter-table', type=str, default='', help='Optional custom area filter table to join by province_id + ward_id')
     parser.add_argument('--area-filter-max-total', type=int, default=None, help='Optional max total_count threshold when using --area-filter-table')
     parser.add_argument('--allow-source', type=str, default='', help='Comma-separated source values to allow for upload, e.g. meeyland.com,nhadat')
+    parser.add_argument('--skip-near-duplicates', action='store_true', help='Skip listings whose near-duplicate cluster (listing_dedup.py) already has an uploaded listing')
     parser.add_argument('--exclude-province-ids', type=str, default='', help='Comma-separated province_id list to exclude, e.g. 63,1')
     
     args = parser.parse_args()
@@ -0,0 +1,513 @@
+"""
+Location resolver dùng chung cho các convert_* / stepN_mergekhuvuc / listing_uploader.
+
+Trước đây mỗi script tự dựng lại dict từ transaction_city_merge (build_location_maps),
+location_detail, location_homedy, location_meeland, duan_*_duan_merge lúc khởi động,
+hoặc JOIN lại location_detail trong SQL cho từng batch. Module này nạp các bảng đó
+1 lần / process (theo section, khi cần), giữ index gọn:
+
+  - admin:    transaction_city_merge -> tên tỉnh/xã theo id, key tên đã chuẩn hoá -> ứng viên tốt nhất
+              (new_city_name / old_city_name), old_city_id -> new_city_id, trie theo token tên tỉnh
+  - nhatot:   location_detail (region/area/ward -> cafeland_id)
+  - homedy:   location_homedy (location_id -> cafeland_id)
+  - meeyland: location_meeland (code -> cafeland_id)
+  - project:<source>: duan_<source>_duan_merge (tên hoặc id dự án nguồn -> duan_id, duan_ten)
+
+Snapshot pickle (craw/.cache/location_resolver.pkl) giúp process khởi động nhanh, hết hạn sau max_age giây.
+Section project:* không vào snapshot: bảng merge dự án nhỏ và được xác nhận thêm liên tục
+(apply_confirmed_duan_*, merge_duan_*), mỗi process luôn đọc lại từ DB.
+
+Usage:
+    resolver = get_resolver(conn, sections=("admin", "project:alonhadat"))
+    locs = resolver.resolve_many([row["diachi"] for row in rows])
+    project = resolver.project("alonhadat", row["thuocduan"])
+"""
+
+import os
+import re
+import time
+import pickle
+import threading
+import unicodedata
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "location_resolver.pkl")
+SNAPSHOT_MAX_AGE = 6 * 3600
+SNAPSHOT_VERSION = 2
+
+# source -> (bảng merge, cột khoá nguồn, kiểu khoá)
+# name: tên đã chuẩn hoá (project_key), raw: tên gốc chỉ strip (khớp tuyệt đối), id: id dự án nguồn
+PROJECT_SOURCES = {
+    "alonhadat": ("duan_alonhadat_duan_merge", "alonhadat_project_name", "name"),
+    "guland": ("duan_guland_duan_merge", "guland_project_name", "raw"),
+    "homedy": ("duan_homedy_duan_merge", "homedy_project_id", "id"),
+    "meeyland": ("duan_meeyland_duan_merge", "meeyland_project_id", "id"),
+}
+
+
+# ---------------------------------------------------------------------------
+# Chuẩn hoá tên
+# ---------------------------------------------------------------------------
+
+def clean_raw(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value or value == "---":
+        return None
+    return value
+
+
+def normalize_text(value) -> str:
+    """Bỏ dấu, lower, mở rộng viết tắt hành chính (tt./p./x.), gộp khoảng trắng."""
+    value = clean_raw(value)
+    if not value:
+        return ""
+    value = value.replace("đ", "d").replace("Đ", "D")
+    value = unicodedata.normalize("NFD", value)
+    value = "".join(ch for ch in value if unicodedata.category(ch) != "Mn")
+    value = value.lower()
+    value = re.sub(r"\btt\.\s*", "thi tran ", value)
+    value = re.sub(r"\btt\s+", "thi tran ", value)
+    value = re.sub(r"\bp\.\s*", "phuong ", value)
+    value = re.sub(r"\bp\s+", "phuong ", value)
+    value = re.sub(r"\bx\.\s*", "xa ", value)
+    value = re.sub(r"\bx\s+", "xa ", value)
+    value = re.sub(r"\s+", " ", value)
+    return value.strip()
+
+
+def province_key(value) -> str:
+    value = normalize_text(value)
+    return re.sub(r"^(tp\.?|thanh pho|tinh)\s+", "", value).strip()
+
+
+def ward_key(value) -> str:
+    value = normalize_text(value)
+    return re.sub(r"^(phuong|xa|thi tran)\s+", "", value).strip()
+
+
+def project_key(value) -> str:
+    value = clean_raw(value)
+    if not value:
+        return ""
+    value = re.sub(r"\s*\(\s*xem\s+chi\s+tiết\s+dự\s+án\s*\)\s*$", "", value, flags=re.IGNORECASE)
+    return normalize_text(value)
+
+
+class LocationMatch(NamedTuple):
+    id: int
+    name: Optional[str]
+    old_name: Optional[str]
+    action_type: int
+    is_new: bool  # khớp theo new_city_name (False: khớp theo old_city_name)
+
+
+def _better(a: tuple, b: Optional[tuple]) -> bool:
+    """Ứng viên tốt hơn: action_type = 0 trước, rồi new_city_id nhỏ hơn (giống pick_best cũ)."""
+    if b is None:
+        return True
+    return (a[0] != 0, a[1]) < (b[0] != 0, b[1])
+
+
+class NameTrie:
+    """Trie theo token: tìm tên dài nhất xuất hiện trọn token trong 1 chuỗi đã chuẩn hoá."""
+
+    __slots__ = ("root",)
+    _END = ""
+
+    def __init__(self):
+        self.root: Dict[str, Any] = {}
+
+    def add(self, key: str, value: Any) -> None:
+        node = self.root
+        for tok in key.split():
+            node = node.setdefault(tok, {})
+        node.setdefault(self._END, value)
+
+    def longest_match(self, text: str) -> Optional[Any]:
+        tokens = text.split()
+        best, best_len = None, 0
+        for start in range(len(tokens)):
+            node = self.root
+            for pos in range(start, len(tokens)):
+                node = node.get(tokens[pos])
+                if node is None:
+                    break
+                if self._END in node and pos - start + 1 > best_len:
+                    best, best_len = node[self._END], pos - start + 1
+        return best
+
+
+# ---------------------------------------------------------------------------
+# Parser địa chỉ mặc định
+# ---------------------------------------------------------------------------
+
+def parse_comma_address(resolver: "LocationResolver", address) -> dict:
+    """'[đường,] xã/phường, tỉnh' -> province_id/ward_id/street (tên mới trước, tên cũ sau)."""
+    out = {
+        "province_id": None,
+        "ward_id": None,
+        "street": None,
+        "city_name_raw": None,
+        "ward_name_raw": None,
+        "address_case": None,
+    }
+    address = clean_raw(address)
+    if not address:
+        return out
+    parts = [p.strip() for p in address.split(",") if p.strip()]
+    if not parts:
+        return out
+
+    out["city_name_raw"] = parts[-1]
+    province = resolver.find_province(parts[-1])
+    ward_name_raw = parts[-2] if len(parts) >= 2 else None
+    out["ward_name_raw"] = ward_name_raw
+    if province:
+        out["province_id"] = province.id
+        if ward_name_raw:
+            ward = resolver.find_ward(province.id, ward_name_raw)
+            if ward:
+                out["ward_id"] = ward.id
+                out["address_case"] = "new" if ward.is_new else "old"
+    if len(parts) >= 3:
+        out["street"] = clean_raw(parts[0])
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Resolver
+# ---------------------------------------------------------------------------
+
+class LocationResolver:
+    def __init__(self):
+        self.sections = set()
+        # admin
+        self.province_names: Dict[int, str] = {}
+        self.ward_names: Dict[int, str] = {}
+        self.ward_parent: Dict[int, int] = {}
+        self.province_new: Dict[str, tuple] = {}
+        self.province_old: Dict[str, tuple] = {}
+        self.ward_new: Dict[Tuple[int, str], tuple] = {}
+        self.ward_old: Dict[Tuple[int, str], tuple] = {}
+        self.old_to_new: Dict[int, int] = {}
+        self.province_trie = NameTrie()
+        # nguồn theo id
+        self.nhatot: Dict[tuple, int] = {}
+        self.homedy: Dict[Tuple[str, str], int] = {}
+        self.meeyland: Dict[Tuple[str, str], Any] = {}
+        self.projects: Dict[str, Dict[str, Tuple[int, Optional[str]]]] = {}
+        self._memo: Dict[tuple, dict] = {}
+        self._from_snapshot = False
+
+    # ---------- nạp dữ liệu ----------
+
+    def load(self, conn, *sections: str) -> "LocationResolver":
+        """Nạp các section chưa có (admin, nhatot, homedy, meeyland, project:<source>)."""
+        for section in sections:
+            if section in self.sections:
+                continue
+            if section == "admin":
+                self._load_admin(conn)
+            elif section == "nhatot":
+                self._load_nhatot(conn)
+            elif section == "homedy":
+                self._load_homedy(conn)
+            elif section == "meeyland":
+                self._load_meeyland(conn)
+            elif section.startswith("project:"):
+                self._load_projects(conn, section.split(":", 1)[1])
+            else:
+                raise ValueError(f"Unknown location section: {section}")
+            self.sections.add(section)
+        return self
+
+    @staticmethod
+    def _fetch(conn, sql):
+        cur = conn.cursor()
+        try:
+            cur.execute(sql)
+            return cur.fetchall()
+        finally:
+            cur.close()
+
+    def _load_admin(self, conn):
+        rows = self._fetch(conn, """
+            SELECT old_city_id, new_city_id, new_city_parent_id, new_city_name, old_city_name, action_type
+            FROM transaction_city_merge
+        """)
+        old_best: Dict[int, tuple] = {}
+        for r in rows:
+            if r.get("new_city_id") is None:
+                continue
+            new_id = int(r["new_city_id"])
+            parent_id = int(r.get("new_city_parent_id") or 0)
+            cand = (int(r.get("action_type") or 0), new_id,
+                    clean_raw(r.get("new_city_name")), clean_raw(r.get("old_city_name")))
+            new_name, old_name = cand[2], cand[3]
+            if parent_id == 0:
+                if new_name:
+                    self.province_names[new_id] = new_name
+                    self._put(self.province_new, province_key(new_name), cand)
+                if old_name:
+                    self._put(self.province_old, province_key(old_name), cand)
+            else:
+                if new_name:
+                    self.ward_names[new_id] = new_name
+                    self._put(self.ward_new, (parent_id, ward_key(new_name)), cand)
+                if old_name:
+                    self._put(self.ward_old, (parent_id, ward_key(old_name)), cand)
+                self.ward_parent[new_id] = parent_id
+            if r.get("old_city_id") is not None:
+                old_id = int(r["old_city_id"])
+                if _better(cand, old_best.get(old_id)):
+                    old_best[old_id] = cand
+        self.old_to_new = {old_id: cand[1] for old_id, cand in old_best.items()}
+        self._build_trie()
+
+    @staticmethod
+    def _put(index: dict, key, cand: tuple) -> None:
+        if key and (not isinstance(key, tuple) or key[1]) and _better(cand, index.get(key)):
+            index[key] = cand
+
+    def _build_trie(self):
+        self.province_trie = NameTrie()
+        for index, is_new in ((self.province_new, True), (self.province_old, False)):
+            for key, cand in index.items():
+                self.province_trie.add(key, (cand, is_new))
+
+    def _load_nhatot(self, conn):
+        rows = self._fetch(conn, """
+            SELECT level, region_id, area_id, ward_id, cafeland_id
+            FROM location_detail
+            WHERE level IN (1, 2, 3) AND cafeland_id IS NOT NULL
+        """)
+        for r in rows:
+            level = int(r["level"])
+            key = (str(r["region_id"]), str(r["area_id"]), str(r["ward_id"]))[:level]
+            self.nhatot[(level,) + key] = int(r["cafeland_id"])
+
+    def _load_homedy(self, conn):
+        rows = self._fetch(conn, """
+            SELECT level_type, location_id, cafeland_id
+            FROM location_homedy
+            WHERE cafeland_id IS NOT NULL
+        """)
+        for r in rows:
+            self.homedy[(r["level_type"], str(r["location_id"]))] = int(r["cafeland_id"])
+
+    def _load_meeyland(self, conn):
+        rows = self._fetch(conn, """
+            SELECT level_type, code, cafeland_id, district_meey_id, meey_id
+            FROM location_meeland
+            WHERE cafeland_id IS NOT NULL AND code IS NOT NULL
+        """)
+        for r in rows:
+            level, code = r["level_type"], str(r["code"])
+            cafeland_id = int(r["cafeland_id"])
+            if level == "district":
+                self.meeyland[("district", code)] = (cafeland_id, r.get("meey_id"))
+            elif level == "ward":
+                self.meeyland[("ward", code)] = cafeland_id
+                self.meeyland[("ward_in_district", f"{code}_{r.get('district_meey_id')}")] = cafeland_id
+            else:
+                self.meeyland[(level, code)] = cafeland_id
+
+    def _load_projects(self, conn, source):
+        if source not in PROJECT_SOURCES:
+            raise ValueError(f"Unknown project source: {source}")
+        table, column, kind = PROJECT_SOURCES[source]
+        rows = self._fetch(conn, f"""
+            SELECT {column} AS src_key, duan_id, duan_ten
+            FROM {table}
+            WHERE {column} IS NOT NULL AND duan_id IS NOT NULL
+        """)
+        mapping: Dict[str, Tuple[int, Optional[str]]] = {}
+        for r in rows:
+            key = _project_lookup_key(kind, r["src_key"])
+            if not key:
+                continue
+            duan_id = int(r["duan_id"])
+            prev = mapping.get(key)
+            # Trùng tên/id: giữ duan_id lớn nhất (mới nhất)
+            if not prev or duan_id > prev[0]:
+                mapping[key] = (duan_id, clean_raw(r.get("duan_ten")))
+        self.projects[source] = mapping
+
+    # ---------- snapshot ----------
+
+    def _state(self) -> dict:
+        state = {k: v for k, v in self.__dict__.items() if not k.startswith("_")}
+        state["projects"] = {}
+        state["sections"] = {s for s in self.sections if not s.startswith("project:")}
+        return state
+
+    def save_snapshot(self, path: str = SNAPSHOT_PATH) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({"version": SNAPSHOT_VERSION, "state": self._state()}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load_snapshot(cls, path: str = SNAPSHOT_PATH, max_age: float = SNAPSHOT_MAX_AGE) -> Optional["LocationResolver"]:
+        try:
+            if max_age and time.time() - os.path.getmtime(path) > max_age:
+                return None
+            with open(path, "rb") as f:
+                payload = pickle.load(f)
+        except Exception:
+            return None
+        if not isinstance(payload, dict) or payload.get("version") != SNAPSHOT_VERSION:
+            return None
+        resolver = cls()
+        resolver.__dict__.update(payload["state"])
+        resolver._from_snapshot = True
+        return resolver
+
+    # ---------- tra cứu tên ----------
+
+    def find_province(self, name, fuzzy: bool = True) -> Optional[LocationMatch]:
+        """Tỉnh theo tên (new_city_name trước, old_city_name sau). fuzzy: tìm tên tỉnh nằm trong chuỗi."""
+        key = province_key(name)
+        if not key:
+            return None
+        cand, is_new = self.province_new.get(key), True
+        if cand is None:
+            cand, is_new = self.province_old.get(key), False
+        if cand is None and fuzzy:
+            hit = self.province_trie.longest_match(key)
+            if hit:
+                cand, is_new = hit
+        if cand is None:
+            return None
+        return LocationMatch(cand[1], cand[2], cand[3], cand[0], is_new)
+
+    def find_old_province(self, name) -> Optional[LocationMatch]:
+        """Tỉnh theo tên cũ (old_city_name) - cho địa chỉ kiểu cũ tỉnh/huyện/xã."""
+        cand = self.province_old.get(province_key(name))
+        if cand is None:
+            return None
+        return LocationMatch(cand[1], cand[2], cand[3], cand[0], False)
+
+    def find_ward(self, province_id, name, allow_old: bool = True) -> Optional[LocationMatch]:
+        """Xã/phường theo tên trong tỉnh province_id (new_city_name trước, old_city_name sau)."""
+        key = ward_key(name)
+        if not province_id or not key:
+            return None
+        cand = self.ward_new.get((int(province_id), key))
+        if cand is not None:
+            return LocationMatch(cand[1], cand[2], cand[3], cand[0], True)
+        return self.find_old_ward(province_id, name) if allow_old else None
+
+    def find_old_ward(self, province_id, name) -> Optional[LocationMatch]:
+        key = ward_key(name)
+        cand = self.ward_old.get((int(province_id), key)) if province_id and key else None
+        if cand is None:
+            return None
+        return LocationMatch(cand[1], cand[2], cand[3], cand[0], False)
+
+    def province_name(self, province_id) -> str:
+        return self.province_names.get(int(province_id or 0), "")
+
+    def ward_name(self, ward_id) -> str:
+        return self.ward_names.get(int(ward_id or 0), "")
+
+    def merged_id(self, old_city_id, default=None):
+        """old_city_id (trước sáp nhập) -> new_city_id, không có thì default."""
+        if old_city_id is None:
+            return default
+        return self.old_to_new.get(int(old_city_id), default)
+
+    def resolve_many(self, addresses: Iterable[Any],
+                     parser: Callable[["LocationResolver", Any], dict] = parse_comma_address) -> List[dict]:
+        """Parse + tra cứu hàng loạt địa chỉ; địa chỉ trùng (rất hay gặp) chỉ parse 1 lần."""
+        out = []
+        memo = self._memo
+        for address in addresses:
+            key = (parser, address)
+            res = memo.get(key)
+            if res is None:
+                res = parser(self, address)
+                if len(memo) > 200000:
+                    memo.clear()
+                memo[key] = res
+            out.append(dict(res))
+        return out
+
+    # ---------- tra cứu theo id nguồn ----------
+
+    def nhatot_ids(self, region, area=None, ward=None, apply_merge: bool = True) -> Tuple[Optional[int], Optional[int], Optional[int]]:
+        """(cf_province_id, cf_district_id, cf_ward_id) từ region/area/ward của nhatot (location_detail)."""
+        region, area, ward = str(region), str(area), str(ward)
+        province_id = self.nhatot.get((1, region))
+        district_id = self.nhatot.get((2, region, area))
+        ward_id = self.nhatot.get((3, region, area, ward))
+        if apply_merge and ward_id is not None:
+            ward_id = self.merged_id(ward_id, ward_id)
+        return province_id, district_id, ward_id
+
+    def homedy_id(self, level_type: str, location_id) -> Optional[int]:
+        if location_id is None:
+            return None
+        return self.homedy.get((level_type, str(location_id)))
+
+    def meeyland_id(self, level_type: str, code) -> Any:
+        """level_type: city / district (-> (cafeland_id, meey_id)) / ward / ward_in_district ('{code}_{district_meey_id}')"""
+        if code is None or code == "":
+            return None
+        return self.meeyland.get((level_type, str(code)))
+
+    def project(self, source: str, value) -> Optional[Tuple[int, Optional[str]]]:
+        """(duan_id, duan_ten) của dự án nguồn (theo tên đã chuẩn hoá hoặc id)."""
+        mapping = self.projects.get(source) or {}
+        key = _project_lookup_key(PROJECT_SOURCES[source][2], value)
+        return mapping.get(key) if key else None
+
+
+def _project_lookup_key(kind: str, value) -> str:
+    if kind == "name":
+        return project_key(value)
+    if kind == "raw":
+        return clean_raw(value) or ""
+    return str(value).strip() if value is not None else ""
+
+
+_RESOLVER: Optional[LocationResolver] = None
+_RESOLVER_LOCK = threading.Lock()
+
+
+def get_resolver(conn=None, sections: Iterable[str] = ("admin",), snapshot: bool = True,
+                 max_age: float = SNAPSHOT_MAX_AGE, refresh: bool = False) -> LocationResolver:
+    """
+    Resolver dùng chung trong process. Section chưa có được nạp từ snapshot (còn hạn)
+    hoặc từ DB qua conn (pymysql DictCursor), rồi ghi lại snapshot.
+    Section project:* luôn nạp từ DB; refresh=True bỏ qua cả snapshot lẫn resolver đã nạp.
+    """
+    global _RESOLVER
+    sections = tuple(sections)
+    with _RESOLVER_LOCK:
+        if refresh:
+            _RESOLVER = None
+        if _RESOLVER is None and snapshot and not refresh:
+            _RESOLVER = LocationResolver.load_snapshot(max_age=max_age)
+        if _RESOLVER is None:
+            _RESOLVER = LocationResolver()
+        missing = [s for s in sections if s not in _RESOLVER.sections]
+        if missing:
+            if conn is None:
+                raise RuntimeError(f"Location sections {missing} not loaded and no connection given")
+            snapshot_sections = [s for s in missing if not s.startswith("project:")]
+            if _RESOLVER._from_snapshot and snapshot_sections:
+                # Không trộn section cũ từ snapshot với section mới nạp: nạp lại tất cả từ DB
+                # (project:* độc lập với phần còn lại, nạp thẳng lên resolver từ snapshot được)
+                _RESOLVER = LocationResolver().load(conn, *sorted(_RESOLVER.sections), *missing)
+            else:
+                _RESOLVER.load(conn, *missing)
+            if snapshot and snapshot_sections:
+                try:
+                    _RESOLVER.save_snapshot()
+                except OSError as e:
+                    print(f"[location_resolver] snapshot save failed: {e}")
+        return _RESOLVER
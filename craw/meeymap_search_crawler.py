@@ -8,14 +8,22 @@ Phase 1:
 - crawl each leaf band with a fixed limit
 - save rows into scraped_details_flat
 - write checkpoint/log/split-log for resume and audit
+
+Location mode (--use-location-table) can crawl several parts at once in-process
+(--parallel-parts N): one curl session per thread, a global rate limiter instead of
+per-part sleeps, and a shared ExistingKeyIndex (matin/url digests preloaded once per
+domain) instead of per-page DB lookups. Each page is saved with one multi-row upsert.
 """
 
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional, Tuple
 
@@ -24,6 +32,8 @@ try:
 except Exception:
     cffi_requests = None
 
+import numpy as np
+
 from database import Database
 
 
@@ -52,6 +62,9 @@ MAX_LNG = 109.9
 MAX_LAT = 23.5
 MIN_LAT = 8.3
 ROOT_PARTS = 10
+KEY_PRELOAD_CHUNK = 50000
+
+_LOG_LOCK = threading.Lock()
 
 
 def log(message: str) -> None:
@@ -170,6 +183,18 @@ def parse_args() -> argparse.Namespace:
         default=1,
         help="Total workers when splitting location parts by city",
     )
+    parser.add_argument(
+        "--parallel-parts",
+        type=int,
+        default=1,
+        help="Location mode: crawl this many parts concurrently in-process (shared rate limit + dedup index)",
+    )
+    parser.add_argument(
+        "--max-rps",
+        type=float,
+        default=0.0,
+        help="Global request rate for --parallel-parts; 0 = parallel_parts / delay",
+    )
     parser.add_argument(
         "--refresh-existing-contact",
         action="store_true",
@@ -184,8 +209,9 @@ def ensure_parent_dir(path: str) -> None:
 
 def write_line(path: str, line: str) -> None:
     ensure_parent_dir(path)
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(line.rstrip("\n") + "\n")
+    with _LOG_LOCK:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line.rstrip("\n") + "\n")
 
 
 def log_both(args: argparse.Namespace, message: str) -> None:
@@ -199,15 +225,14 @@ def log_split(args: argparse.Namespace, message: str) -> None:
 
 
 def log_event(args: argparse.Namespace, payload: Dict[str, Any]) -> None:
-    ensure_parent_dir(args.log_jsonl)
-    with open(args.log_jsonl, "a", encoding="utf-8") as f:
-        f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+    write_line(args.log_jsonl, json.dumps(payload, ensure_ascii=False))
 
 
 def save_checkpoint(args: argparse.Namespace, payload: Dict[str, Any]) -> None:
     ensure_parent_dir(args.checkpoint_file)
-    with open(args.checkpoint_file, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    with _LOG_LOCK:
+        with open(args.checkpoint_file, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
 
 
 def load_checkpoint(path: str) -> Optional[Dict[str, Any]]:
@@ -288,6 +313,101 @@ def build_payload_locations(
     return payload
 
 
+class RateLimiter:
+    """Thread-safe global pacing: at most `rps` requests/second across all workers (rps <= 0 disables)."""
+
+    def __init__(self, rps: float):
+        self.interval = 1.0 / rps if rps and rps > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> float:
+        if self.interval <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next_at)
+            self._next_at = at + self.interval
+        delay = at - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+def _key_digest(kind: str, value: Any) -> int:
+    raw = f"{kind}:{value}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "little")
+
+
+class ExistingKeyIndex:
+    """
+    matin/url already in scraped_details_flat for one domain, kept as sorted uint64
+    digests (8 bytes/key) + a set for keys claimed during this run.
+    claim() is check-and-add under a lock so parallel parts never save the same listing twice.
+    """
+
+    def __init__(self, digests: Optional[np.ndarray] = None):
+        self._preloaded = np.unique(digests) if digests is not None else np.empty(0, dtype=np.uint64)
+        self._claimed: set = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def preload(cls, db: Database, domain: str, chunk: int = KEY_PRELOAD_CHUNK) -> "ExistingKeyIndex":
+        digests: List[int] = []
+        last_id = 0
+        conn = db.get_connection()
+        cur = conn.cursor()
+        try:
+            while True:
+                cur.execute(
+                    """
+                    SELECT id, matin, url
+                    FROM scraped_details_flat
+                    WHERE domain = %s AND id > %s
+                    ORDER BY id
+                    LIMIT %s
+                    """,
+                    (domain, last_id, chunk),
+                )
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    if row.get("matin") is not None:
+                        digests.append(_key_digest("m", row["matin"]))
+                    if row.get("url"):
+                        digests.append(_key_digest("u", row["url"]))
+                last_id = int(rows[-1]["id"])
+                if len(rows) < chunk:
+                    break
+        finally:
+            cur.close()
+            conn.close()
+        return cls(np.fromiter(digests, dtype=np.uint64, count=len(digests)))
+
+    def __len__(self) -> int:
+        return len(self._preloaded) + len(self._claimed)
+
+    def _known(self, digest: int) -> bool:
+        if digest in self._claimed:
+            return True
+        pos = int(np.searchsorted(self._preloaded, np.uint64(digest)))
+        return pos < len(self._preloaded) and int(self._preloaded[pos]) == digest
+
+    def claim(self, matin: Optional[str], url: Optional[str]) -> bool:
+        """True nếu tin mới (và giữ chỗ matin/url); False nếu đã có trong DB hoặc đã được part khác lấy."""
+        keys = []
+        if matin:
+            keys.append(_key_digest("m", matin))
+        if url:
+            keys.append(_key_digest("u", url))
+        with self._lock:
+            if any(self._known(k) for k in keys):
+                return False
+            self._claimed.update(keys)
+        return True
+
+
 def make_session(args: argparse.Namespace):
     if cffi_requests is None:
         raise RuntimeError("curl_cffi is required for meeymap_search_crawler.py")
@@ -859,7 +979,15 @@ def crawl_location_part(
     part: Dict[str, Any],
     start_page: int,
     total_seen_saved: Tuple[int, int],
+    limiter: Optional[RateLimiter] = None,
+    key_index: Optional[ExistingKeyIndex] = None,
+    checkpoint: bool = True,
 ) -> Tuple[int, int]:
+    """
+    Crawl 1 location part. Chạy song song (--parallel-parts) thì truyền limiter (thay cho sleep
+    giữa các page), key_index (thay cho load_existing_keys + run_seen) và checkpoint=False
+    (main ghi danh sách part đã xong).
+    """
     total_seen, total_saved = total_seen_saved
     part_label = part["label"]
     city_meey_id = part["city_meey_id"]
@@ -871,26 +999,29 @@ def crawl_location_part(
         log_both(args, f"[SKIP_PART] part={part_label} reason=missing_city name={part_name}")
         return total_seen, total_saved
 
-    save_checkpoint(
-        args,
-        {
-            "status": "part_started",
-            "part": part_label,
-            "page": start_page,
-            "next_page": start_page,
-            "city_meey_id": city_meey_id,
-            "district_meey_id": district_meey_id,
-            "ward_meey_id": ward_meey_id,
-            "name": part_name,
-            "updated_at": utc_now(),
-        },
-    )
+    if checkpoint:
+        save_checkpoint(
+            args,
+            {
+                "status": "part_started",
+                "part": part_label,
+                "page": start_page,
+                "next_page": start_page,
+                "city_meey_id": city_meey_id,
+                "district_meey_id": district_meey_id,
+                "ward_meey_id": ward_meey_id,
+                "name": part_name,
+                "updated_at": utc_now(),
+            },
+        )
     log_both(
         args,
         f"[PART] part={part_label} start_page={start_page} "
         f"city={city_meey_id} district={district_meey_id} ward={ward_meey_id or '-'} name={part_name}",
     )
 
+    if limiter is not None:
+        limiter.wait()
     _, first_obj = fetch_page_locations(
         session,
         city_meey_id,
@@ -922,7 +1053,9 @@ def crawl_location_part(
         if page == start_page:
             page_items = items
         else:
-            if args.delay > 0:
+            if limiter is not None:
+                limiter.wait()
+            elif args.delay > 0:
                 log_both(args, f"[SLEEP] part={part_label} next_page={page} seconds={args.delay}")
                 time.sleep(args.delay)
             _, page_obj = fetch_page_locations(
@@ -959,14 +1092,18 @@ def crawl_location_part(
             if mapped.get("url"):
                 page_urls.append(mapped["url"])
 
-        existing_matins, existing_urls = load_existing_keys(db, args.domain, page_matins, page_urls)
+        if key_index is None:
+            existing_matins, existing_urls = load_existing_keys(db, args.domain, page_matins, page_urls)
+        page_rows: List[Dict[str, Any]] = []
         for idx, mapped in enumerate(mapped_items, 1):
             total_seen += 1
             matin = str(mapped.get("matin")) if mapped.get("matin") else None
             url = mapped.get("url")
 
             is_dup = False
-            if matin and (matin in existing_matins or matin in run_seen_matins):
+            if key_index is not None:
+                is_dup = not key_index.claim(matin, url)
+            elif matin and (matin in existing_matins or matin in run_seen_matins):
                 is_dup = True
             elif url and (url in existing_urls or url in run_seen_urls):
                 is_dup = True
@@ -999,43 +1136,59 @@ def crawl_location_part(
                     run_seen_urls.add(url)
                 continue
 
-            row_id = db.add_scraped_detail_flat(
-                link_id=None,
-                url=mapped["url"],
-                domain=args.domain,
-                data=mapped,
-                loaihinh=mapped["loaihinh"],
-                trade_type=mapped["trade_type"],
+            page_rows.append(
+                {
+                    "link_id": None,
+                    "url": mapped["url"],
+                    "domain": args.domain,
+                    "data": mapped,
+                    "loaihinh": mapped["loaihinh"],
+                    "trade_type": mapped["trade_type"],
+                    "idx": idx,
+                    "matin": matin,
+                }
             )
-            if row_id:
+            if matin:
+                run_seen_matins.add(matin)
+            if url:
+                run_seen_urls.add(url)
+
+        if page_rows:
+            # 1 multi-row upsert + 1 commit cho cả page (lỗi thì database tự lưu lại từng dòng)
+            saved_rows = {id(row) for row in db.add_scraped_details_flat_bulk(page_rows)}
+            for row in page_rows:
+                code = row["data"].get("matin")
+                if id(row) not in saved_rows:
+                    # chưa lưu được -> gặp lại ở page sau thì thử lưu tiếp
+                    run_seen_matins.discard(row["matin"])
+                    run_seen_urls.discard(row["url"])
+                    log_both(args, f"  [SKIP] part={part_label} page={page} idx={row['idx']} code={code} reason=save_failed")
+                    continue
                 page_saved += 1
                 total_saved += 1
-                log_both(args, f"  [SAVE] part={part_label} page={page} idx={idx} code={mapped.get('matin')} row_id={row_id}")
-                if matin:
-                    run_seen_matins.add(matin)
-                if url:
-                    run_seen_urls.add(url)
+                log_both(args, f"  [SAVE] part={part_label} page={page} idx={row['idx']} code={code}")
 
-        save_checkpoint(
-            args,
-            {
-                "status": "page_done",
-                "part": part_label,
-                "page": page,
-                "next_page": page + 1,
-                "city_meey_id": city_meey_id,
-                "district_meey_id": district_meey_id,
-                "ward_meey_id": ward_meey_id,
-                "name": part_name,
-                "total_results": total_results,
-                "total_pages": total_pages,
-                "items": len(page_items),
-                "saved": page_saved,
-                "duplicate_items": page_dup_hits,
-                "duplicate_total_part": part_dup_hits,
-                "updated_at": utc_now(),
-            },
-        )
+        if checkpoint:
+            save_checkpoint(
+                args,
+                {
+                    "status": "page_done",
+                    "part": part_label,
+                    "page": page,
+                    "next_page": page + 1,
+                    "city_meey_id": city_meey_id,
+                    "district_meey_id": district_meey_id,
+                    "ward_meey_id": ward_meey_id,
+                    "name": part_name,
+                    "total_results": total_results,
+                    "total_pages": total_pages,
+                    "items": len(page_items),
+                    "saved": page_saved,
+                    "duplicate_items": page_dup_hits,
+                    "duplicate_total_part": part_dup_hits,
+                    "updated_at": utc_now(),
+                },
+            )
         log_both(
             args,
             f"[PAGE_SUMMARY] part={part_label} page={page} saved={page_saved} dup={page_dup_hits} dup_total_part={part_dup_hits}",
@@ -1052,6 +1205,78 @@ def crawl_location_part(
     return total_seen, total_saved
 
 
+def crawl_location_parts_parallel(
+    db: Database,
+    args: argparse.Namespace,
+    parts: List[Dict[str, Any]],
+    start_page_by_label: Dict[str, int],
+    done_parts: List[str],
+) -> Tuple[int, int, List[str]]:
+    """
+    Crawl nhiều location part cùng lúc (--parallel-parts). Checkpoint ghi danh sách part
+    đã xong (status=parallel_progress) để --resume bỏ qua các part đó.
+    """
+    workers = max(1, args.parallel_parts)
+    rps = args.max_rps if args.max_rps > 0 else (workers / args.delay if args.delay > 0 else 0.0)
+    limiter = RateLimiter(rps)
+
+    t0 = time.time()
+    key_index = ExistingKeyIndex() if args.dry_run else ExistingKeyIndex.preload(db, args.domain)
+    log_both(
+        args,
+        f"[PARALLEL] parts={len(parts)} workers={workers} max_rps={rps or 'unlimited'} "
+        f"preloaded_keys={len(key_index)} preload_s={time.time() - t0:.1f}",
+    )
+
+    local = threading.local()
+    state_lock = threading.Lock()
+    done = list(done_parts)
+    failed: List[str] = []
+    totals = [0, 0]
+
+    def _run(part: Dict[str, Any]) -> Tuple[int, int]:
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = make_session(args)
+        return crawl_location_part(
+            session,
+            db,
+            args,
+            part,
+            start_page_by_label.get(part["label"], 1),
+            (0, 0),
+            limiter=limiter,
+            key_index=key_index,
+            checkpoint=False,
+        )
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_run, part): part["label"] for part in parts}
+        for future in as_completed(futures):
+            label = futures[future]
+            try:
+                seen, saved = future.result()
+            except Exception as exc:
+                log_both(args, f"[PART_FAILED] part={label} error={str(exc)[:200]}")
+                failed.append(label)
+                continue
+            with state_lock:
+                totals[0] += seen
+                totals[1] += saved
+                done.append(label)
+                save_checkpoint(
+                    args,
+                    {
+                        "status": "parallel_progress",
+                        "done_parts": done,
+                        "updated_at": utc_now(),
+                        "total_seen": totals[0],
+                        "total_saved": totals[1],
+                    },
+                )
+    return totals[0], totals[1], failed
+
+
 def get_part_meta(session: Any, bounds: List[List[float]], args: argparse.Namespace, part_label: str) -> Tuple[int, int]:
     probe_limit = min(args.limit, 10)
     _, obj = fetch_page(session, bounds, probe_limit, 1, args, part_label)
@@ -1375,9 +1600,13 @@ def main() -> int:
 
     start_part = args.start_part
     start_page = args.start_page
+    done_parts: List[str] = []
     if args.resume:
         cp = load_checkpoint(args.checkpoint_file)
-        if cp and cp.get("status") in {"page_done", "page_started", "part_started", "stop_empty"}:
+        if cp and cp.get("status") == "parallel_progress":
+            done_parts = [str(p) for p in cp.get("done_parts") or []]
+            log_both(args, f"[RESUME] parallel done_parts={len(done_parts)} checkpoint={args.checkpoint_file}")
+        elif cp and cp.get("status") in {"page_done", "page_started", "part_started", "stop_empty"}:
             start_part = str(cp.get("part") or start_part)
             start_page = int(cp.get("next_page") or cp.get("page") or start_page)
             log_both(args, f"[RESUME] part={start_part} page={start_page} checkpoint={args.checkpoint_file}")
@@ -1388,7 +1617,7 @@ def main() -> int:
         f"[CONFIG] api={args.api_url} domain={args.domain} category={args.category or '-'} "
         f"zoom={args.zoom or '-'} fakeCoordinates={bool(args.fake_coordinates)} useLocationTable={bool(args.use_location_table)} "
         f"worker={args.worker_index}/{args.worker_total} refreshExistingContact={bool(args.refresh_existing_contact)} "
-        f"autoSplitThreshold={args.auto_split_threshold}",
+        f"autoSplitThreshold={args.auto_split_threshold} parallelParts={args.parallel_parts}",
     )
 
     db = Database()
@@ -1415,22 +1644,34 @@ def main() -> int:
         )
         total_seen = 0
         total_saved = 0
-        started = False
-        for part in parts:
-            if not started:
-                if part["label"] != start_part:
-                    continue
-                started = True
-            current_start_page = start_page if part["label"] == start_part else 1
-            total_seen, total_saved = crawl_location_part(
-                session,
-                db,
-                args,
-                part,
-                current_start_page,
-                (total_seen, total_saved),
+        if args.parallel_parts > 1:
+            labels = [p["label"] for p in parts]
+            skip = set(done_parts)
+            pending = [p for p in parts[labels.index(start_part):] if p["label"] not in skip]
+            total_seen, total_saved, failed = crawl_location_parts_parallel(
+                db, args, pending, {start_part: start_page}, done_parts
             )
-            start_page = 1
+            if failed:
+                # Giữ checkpoint parallel_progress để --resume chạy lại các part lỗi
+                log_both(args, f"[DONE_WITH_ERRORS] seen={total_seen} saved={total_saved} failed_parts={','.join(failed)}")
+                return 1
+        else:
+            started = False
+            for part in parts:
+                if not started:
+                    if part["label"] != start_part:
+                        continue
+                    started = True
+                current_start_page = start_page if part["label"] == start_part else 1
+                total_seen, total_saved = crawl_location_part(
+                    session,
+                    db,
+                    args,
+                    part,
+                    current_start_page,
+                    (total_seen, total_saved),
+                )
+                start_page = 1
 
         save_checkpoint(
             args,
@@ -12,24 +12,28 @@ import json
 import random
 import logging
 import argparse
+import asyncio
 import threading
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from concurrent.futures import ThreadPoolExecutor
 from lxml import html as lxml_html
-from lxml.cssselect import CSSSelector
 from urllib.parse import urlparse, parse_qs
 
 # Setup path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from database import Database
+from database import Database, LinkLeaseQueue
+from template_engine import compile_template, select
+from async_fetch_engine import AsyncFetcher, RETRY, crawl_queue
 
 # === CONFIGURATION ===
 DEFAULT_THREADS = 10
 DEFAULT_BATCH_SIZE = 50
 DEFAULT_DELAY_MIN = 0.5
 DEFAULT_DELAY_MAX = 1.0
+DEFAULT_ASYNC_CONCURRENCY = 16
+DEFAULT_RATE = 8.0  # request/giây cho mogi.vn ở chế độ --async
 
 # Load template
 TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'template', 'mogidetails.json')
@@ -62,6 +66,15 @@ def load_template() -> list:
 def get_random_ua():
     return random.choice(USER_AGENTS)
 
+def build_headers():
+    return {
+        'User-Agent': get_random_ua(),
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'Referer': 'https://mogi.vn/',
+        'DNT': '1',
+    }
+
 def create_session(proxy=None):
     session = requests.Session()
     retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
@@ -69,13 +82,7 @@ def create_session(proxy=None):
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     
-    session.headers.update({
-        'User-Agent': get_random_ua(),
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Referer': 'https://mogi.vn/',
-        'DNT': '1',
-    })
+    session.headers.update(build_headers())
     
     if proxy:
         session.proxies = {
@@ -140,13 +147,10 @@ def extract_phone_from_html(html_content: str) -> str:
     if phone_format: return phone_format.group(1)
     return None
 
-def extract_value_by_selector(tree, selector: str, value_type: str = 'text'):
+def extract_value_by_selector(tree, selector: str, value_type: str = 'text', elements=None):
     try:
-        if selector.startswith('//'):
-            elements = tree.xpath(selector)
-        else:
-            css_sel = CSSSelector(selector)
-            elements = css_sel(tree)
+        if elements is None:
+            elements = select(tree, selector)
         
         if not elements: return None
         element = elements[0]
@@ -183,6 +187,88 @@ def extract_value_by_selector(tree, selector: str, value_type: str = 'text'):
     except:
         return None
 
+def parse_detail_html(url, html_content, template_fields):
+    """HTML trang chi tiết -> data (chưa có thuocduan, xem fetch ProjectInfo)"""
+    tree = lxml_html.fromstring(html_content)
+    data = {}
+    
+    # Metadata
+    data.update(extract_location_ids_from_html(html_content))
+    url_ids = extract_location_ids_from_url(url)
+    for k, v in url_ids.items():
+        if v and not data.get(k): data[k] = v
+        
+    # Fields (selector compile sẵn, cache theo template)
+    compiled = compile_template({'fields': template_fields})
+    for cf in compiled.fields:
+        name = cf.name
+        selector = cf.field.get('selector')
+        val_type = cf.field.get('valueType', 'text')
+        if name and selector:
+            t0 = time.perf_counter()
+            try:
+                elements = cf.select(tree)
+            except Exception:
+                elements = []
+            val = extract_value_by_selector(tree, selector, val_type, elements=elements)
+            compiled.record(name, time.perf_counter() - t0)
+            if val: data[name] = val
+            
+    # Phone override
+    phone = extract_phone_from_html(html_content)
+    if phone: data['sodienthoai'] = phone
+    
+    # Map override
+    # Always try to find map iframe or link regardless of template result
+    
+    # 1. Try iframe src (Old method) - CHECK BOTH src AND data-src
+    map_iframes = tree.xpath('//div[contains(@class,"map-content")]//iframe')
+    found_map = False
+    for iframe in map_iframes:
+        # Check src then data-src
+        src = iframe.get('src')
+        if not src or 'google.com/maps' not in src:
+            src = iframe.get('data-src')
+        
+        if src:
+            coord_match = re.search(r'[?&]q=(-?\d+\.?\d*),(-?\d+\.?\d*)', src)
+            if coord_match:
+                data['map'] = f"{coord_match.group(1)},{coord_match.group(2)}"
+                found_map = True
+                break
+            
+    # 2. If valid map not found, try NEW method (google-maps-link)
+    if not found_map:
+        map_links = tree.xpath('//div[contains(@class,"google-maps-link")]//a/@href')
+        if map_links:
+            href = map_links[0]
+            ll_match = re.search(r'[?&]ll=(-?\d+\.?\d*),(-?\d+\.?\d*)', href)
+            if ll_match:
+                data['map'] = f"{ll_match.group(1)},{ll_match.group(2)}"
+            else:
+                q_match = re.search(r'[?&]q=(-?\d+\.?\d*),(-?\d+\.?\d*)', href)
+                if q_match:
+                    data['map'] = f"{q_match.group(1)},{q_match.group(2)}"
+    return data
+
+def extract_project_id(html_content):
+    """projectid trong script (fetchText('/template/ProjectInfo?projectid=' + 0, ...), 0/None nếu không có"""
+    pid_match = re.search(r"projectid='\s*\+\s*(\d+)", html_content)
+    if not pid_match:
+        pid_match = re.search(r"projectid=(\d+)", html_content)
+    return int(pid_match.group(1)) if pid_match else 0
+
+def project_info_url(project_id):
+    return f"https://mogi.vn/template/ProjectInfo?projectid={project_id}"
+
+def parse_project_title(project_html):
+    p_tree = lxml_html.fromstring(project_html)
+    # Selector: .project-info .project-title
+    titles = p_tree.cssselect('.project-info .project-title')
+    if titles:
+        return titles[0].text_content().strip()
+    return None
+
 def scrape_page(session, url, template_fields):
     try:
         resp = session.get(url, timeout=10)
@@ -198,216 +284,214 @@ def scrape_page(session, url, template_fields):
             return {'_error': f'HTTP {resp.status_code}'}
             
         html_content = resp.text
-        tree = lxml_html.fromstring(html_content)
-        data = {}
-        
-        # Metadata
-        data.update(extract_location_ids_from_html(html_content))
-        url_ids = extract_location_ids_from_url(url)
-        for k, v in url_ids.items():
-            if v and not data.get(k): data[k] = v
-            
-        # Fields
-        for field in template_fields:
-            name = field.get('name')
-            selector = field.get('selector')
-            val_type = field.get('valueType', 'text')
-            if name and selector:
-                val = extract_value_by_selector(tree, selector, val_type)
-                if val: data[name] = val
-                
-        # Phone override
-        phone = extract_phone_from_html(html_content)
-        if phone: data['sodienthoai'] = phone
-        
-        # Map override
-        # Map override
-        # Always try to find map iframe or link regardless of template result
-        
-        # 1. Try iframe src (Old method) - CHECK BOTH src AND data-src
-        map_iframes = tree.xpath('//div[contains(@class,"map-content")]//iframe')
-        found_map = False
-        for iframe in map_iframes:
-            # Check src then data-src
-            src = iframe.get('src')
-            if not src or 'google.com/maps' not in src:
-                src = iframe.get('data-src')
-            
-            if src:
-                coord_match = re.search(r'[?&]q=(-?\d+\.?\d*),(-?\d+\.?\d*)', src)
-                if coord_match:
-                    data['map'] = f"{coord_match.group(1)},{coord_match.group(2)}"
-                    found_map = True
-                    break
-                
-        # 2. If valid map not found, try NEW method (google-maps-link)
-        if not found_map:
-            map_links = tree.xpath('//div[contains(@class,"google-maps-link")]//a/@href')
-            if map_links:
-                href = map_links[0]
-                ll_match = re.search(r'[?&]ll=(-?\d+\.?\d*),(-?\d+\.?\d*)', href)
-                if ll_match:
-                    data['map'] = f"{ll_match.group(1)},{ll_match.group(2)}"
-                else:
-                    q_match = re.search(r'[?&]q=(-?\d+\.?\d*),(-?\d+\.?\d*)', href)
-                    if q_match:
-                        data['map'] = f"{q_match.group(1)},{q_match.group(2)}"
+        data = parse_detail_html(url, html_content, template_fields)
         
         # Project Info Logic (Dynamic Fetch)
         try:
-            # Extract projectid from script
-            # patterns: fetchText('/template/ProjectInfo?projectid=' + 0,
-            pid_match = re.search(r"projectid='\s*\+\s*(\d+)", html_content)
-            if not pid_match:
-                pid_match = re.search(r"projectid=(\d+)", html_content)
-                
-            if pid_match:
-                project_id = int(pid_match.group(1))
-                if project_id > 0:
-                    # Fetch dynamic content
-                    api_url = f"https://mogi.vn/template/ProjectInfo?projectid={project_id}"
-                    try:
-                        p_resp = session.get(api_url, timeout=5)
-                        if p_resp.status_code == 200:
-                            p_tree = lxml_html.fromstring(p_resp.text)
-                            # Selector: .project-info .project-title
-                            titles = p_tree.cssselect('.project-info .project-title')
-                            if titles:
-                                data['thuocduan'] = titles[0].text_content().strip()
-                    except:
-                        pass
+            project_id = extract_project_id(html_content)
+            if project_id > 0:
+                try:
+                    p_resp = session.get(project_info_url(project_id), timeout=5)
+                    if p_resp.status_code == 200:
+                        title = parse_project_title(p_resp.text)
+                        if title:
+                            data['thuocduan'] = title
+                except:
+                    pass
         except:
             pass
             
         return data
         
-        return data
-        
     except Exception as e:
         return {'_error': str(e)}
 
-def worker(worker_id, links, proxy, template_fields, delay_min, delay_max):
-    db = Database() # New connection per thread
+def worker(worker_id, batch_size, proxy, template_fields, delay_min, delay_max, max_batches=0):
+    # Mỗi thread 1 token lease riêng: claim link trực tiếp từ collected_links,
+    # nhiều thread/process chạy song song không bao giờ lấy trùng link.
+    db = Database(init_schema=False)
+    queue = LinkLeaseQueue(db, f"mogi-fast-w{worker_id}", domain='mogi.vn', newest_first=True)
     session = create_session(proxy)
     
     count = 0
-    for item in links:
-        url = item['url']
-        link_id = item['id']
-        loaihinh = item.get('loaihinh')
-        trade_type = item.get('trade_type')
-        
-        # Delay
-        time.sleep(random.uniform(delay_min, delay_max))
-        
-        try:
-            data = scrape_page(session, url, template_fields)
-            
-            if '_error' in data:
-                err = data['_error']
-                if err == 'CLOUDFLARE':
-                    logger.warning(f"Worker {worker_id}: Cloudflare detected on {url}. Stopping thread.")
-                    with stats_lock: stats['captcha'] += 1
-                    break # Stop this thread? Or skip? Better stop/retry later logic.
-                elif err == '404':
-                    logger.info(f"Worker {worker_id}: 404 Not Found {url}")
-                    with db_lock:
-                        db.update_link_status(url, 'ERROR') # Mark as error/done so we don't retry immediately
-                    with stats_lock: stats['error'] += 1
-                else:
-                    logger.error(f"Worker {worker_id}: Error {err} on {url}")
-                    # Keep as PENDING or mark ERROR? If http error, maybe retry later.
-                    with stats_lock: stats['error'] += 1
-            else:
-                # Success
-                with db_lock:
-                    detail_id = db.add_scraped_detail_flat(
-                        url=url,
-                        data=data,
-                        domain='mogi',
-                        link_id=link_id,
-                        loaihinh=loaihinh,
-                        trade_type=trade_type
-                    )
-                    if detail_id and 'img' in data and isinstance(data['img'], list):
-                        db.add_detail_images(detail_id, data['img'])
-                    db.update_link_status(url, 'DONE')
+    batches = 0
+    stop = False
+    try:
+        while not stop:
+            with stats_lock:
+                if stats['captcha'] > 5:
+                    break
+            links = queue.claim(batch_size)
+            if not links:
+                break
+            batches += 1
+            for item in links:
+                url = item['url']
+                link_id = item['id']
+                queue.heartbeat()
                 
-                with stats_lock: stats['success'] += 1
-                logger.info(f"Worker {worker_id}: scraped {url}")
+                # Delay
+                time.sleep(random.uniform(delay_min, delay_max))
                 
-        except Exception as e:
-            logger.error(f"Worker {worker_id}: Exception on {url}: {e}")
-            with stats_lock: stats['error'] += 1
-            
-        count += 1
-        
-    # db.close_connection() - Not needed as Database class doesn't hold persistent connection
+                try:
+                    data = scrape_page(session, url, template_fields)
+                    
+                    if '_error' in data:
+                        err = data['_error']
+                        if err == 'CLOUDFLARE':
+                            logger.warning(f"Worker {worker_id}: Cloudflare detected on {url}. Stopping thread.")
+                            with stats_lock: stats['captcha'] += 1
+                            stop = True
+                            break # Link còn lại trong lô được trả về hàng đợi ở finally
+                        elif err == '404':
+                            logger.info(f"Worker {worker_id}: 404 Not Found {url}")
+                            queue.ack([link_id], 'ERROR') # Mark as error/done so we don't retry immediately
+                            with stats_lock: stats['error'] += 1
+                        else:
+                            logger.error(f"Worker {worker_id}: Error {err} on {url}")
+                            # HTTP error tạm thời: trả về PENDING, claim lại sau 5 phút
+                            queue.nack([link_id], retry_delay_seconds=300)
+                            with stats_lock: stats['error'] += 1
+                    else:
+                        # Success
+                        with db_lock:
+                            save_detail(db, item, data)
+                        queue.ack([link_id], 'DONE')
+                        
+                        with stats_lock: stats['success'] += 1
+                        logger.info(f"Worker {worker_id}: scraped {url}")
+                        
+                except Exception as e:
+                    logger.error(f"Worker {worker_id}: Exception on {url}: {e}")
+                    queue.nack([link_id], retry_delay_seconds=300)
+                    with stats_lock: stats['error'] += 1
+                    
+                count += 1
+            if max_batches and batches >= max_batches:
+                break
+    finally:
+        queue.release()
+    return count
+
+def save_detail(db, link, data):
+    detail_id = db.add_scraped_detail_flat(
+        url=link['url'],
+        data=data,
+        domain='mogi',
+        link_id=link['id'],
+        loaihinh=link.get('loaihinh'),
+        trade_type=link.get('trade_type')
+    )
+    if detail_id and 'img' in data and isinstance(data['img'], list):
+        db.add_detail_images(detail_id, data['img'])
+    return detail_id
+
+async def run_async(args, template_fields):
+    """
+    --async: 1 event loop, link claim liên tục, song song theo host + token bucket thay cho
+    N thread * sleep(delay). ProjectInfo fetch qua cùng fetcher (chung giới hạn mogi.vn).
+    """
+    db = Database(init_schema=False)
+    queue = LinkLeaseQueue(db, "mogi-async", domain='mogi.vn', newest_first=True)
+
+    async def handle(link, result, fetcher):
+        url = link['url']
+        if not result.ok:
+            if result.status == 404:
+                logger.info(f"404 Not Found {url}")
+                return 'ERROR'
+            logger.error(f"Error {result.error or 'HTTP ' + str(result.status)} on {url}")
+            return RETRY
+        data = await asyncio.to_thread(parse_detail_html, url, result.text, template_fields)
+        project_id = extract_project_id(result.text)
+        if project_id > 0:
+            p_result = await fetcher.fetch(project_info_url(project_id), timeout=5, retries=0)
+            if p_result.ok:
+                try:
+                    title = parse_project_title(p_result.text)
+                    if title:
+                        data['thuocduan'] = title
+                except Exception:
+                    pass
+        await asyncio.to_thread(save_detail, db, link, data)
+        logger.info(f"scraped {url}")
+        return 'DONE'
+
+    async with AsyncFetcher(
+        per_host=args.concurrency,
+        rate_per_host=args.rate,
+        timeout=10,
+        headers=build_headers(),
+        impersonate=None,
+        proxy=args.proxy,
+    ) as fetcher:
+        return await crawl_queue(
+            queue,
+            handle,
+            fetcher,
+            workers=args.concurrency,
+            claim_size=args.batch,
+            max_links=args.test_limit,
+            label="mogi-async",
+        )
+
+def log_field_timing(template_fields, top=10):
+    report = compile_template({'fields': template_fields}).timing_report()
+    for name, t in list(report.items())[:top]:
+        logger.info(f"[timing] {name}: avg={t['avg_ms']}ms max={t['max_ms']}ms calls={t['calls']}")
 
 def main():
     parser = argparse.ArgumentParser(description="Mogi Fast Crawler (Requests)")
     parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help='Number of threads')
-    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH_SIZE, help='Batch size per thread loop')
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH_SIZE, help='Links claimed per thread each round')
     parser.add_argument('--delay-min', type=float, default=DEFAULT_DELAY_MIN, help='Min delay')
     parser.add_argument('--delay-max', type=float, default=DEFAULT_DELAY_MAX, help='Max delay')
     parser.add_argument('--proxy', type=str, default=None, help='Proxy (http://ip:port)')
     parser.add_argument('--test-limit', type=int, default=0, help='Run only N links for testing')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Asyncio fetch (per-host concurrency + rate limit) instead of threads')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_ASYNC_CONCURRENCY, help='--async: max in-flight requests')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='--async: max requests/second to mogi.vn')
     args = parser.parse_args()
     
-    db = Database()
+    Database()  # init schema (lease columns) once
     template_fields = load_template()
     
+    if args.use_async:
+        logger.info(f"Starting async crawler: concurrency={args.concurrency} rate={args.rate}/s. Proxy: {args.proxy}")
+        asyncio.run(run_async(args, template_fields))
+        log_field_timing(template_fields)
+        return
+    
     logger.info(f"Starting Fast Crawler with {args.threads} threads. Proxy: {args.proxy}")
     
-    while True:
-        # Fetch pending links
-        # fetch_size = threads * batch
-        limit = args.batch * args.threads
-        if args.test_limit > 0:
-            limit = args.test_limit
-            
-        pending_links = db.get_pending_links(limit=limit, domain='mogi.vn') # Filter for mogi.vn input
-        
-        if not pending_links:
-            logger.info("No pending links found. Exiting.")
-            break
-            
-        logger.info(f"Fetched {len(pending_links)} links.")
-        
-        # Split into chunks for threads
-        # Actually simpler: just pass full list to executor and let them pop? 
-        # Or split evenly. Splitting evenly is easier for session reuse.
-        chunk_size = (len(pending_links) + args.threads - 1) // args.threads
-        chunks = [pending_links[i:i + chunk_size] for i in range(0, len(pending_links), chunk_size)]
-        
-        with ThreadPoolExecutor(max_workers=args.threads) as executor:
-            futures = []
-            for i, chunk in enumerate(chunks):
-                futures.append(executor.submit(
-                    worker, 
-                    i+1, 
-                    chunk, 
-                    args.proxy, 
-                    template_fields, 
-                    args.delay_min, 
-                    args.delay_max
-                ))
-            
-            for f in futures:
-                f.result()
-                
-        # Update UI stats or log
-        logger.info(f"Batch finished. Stats: {stats}")
-        
-        if args.test_limit > 0:
-            logger.info("Test limit reached. Stopping.")
-            break
-            
-        if stats['captcha'] > 5:
-            logger.warning("Too many Cloudflare blocks. Stopping.") # Basic circuit breaker
-            break
-            
-        time.sleep(1)
+    if args.test_limit > 0:
+        # Test: 1 thread, 1 lô test_limit link
+        worker(1, args.test_limit, args.proxy, template_fields, args.delay_min, args.delay_max, max_batches=1)
+        logger.info(f"Test limit reached. Stats: {stats}")
+        log_field_timing(template_fields)
+        return
+    
+    # Mỗi thread tự claim lô tiếp theo khi xong lô hiện tại (không chờ thread chậm nhất)
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        futures = [
+            executor.submit(
+                worker,
+                i + 1,
+                args.batch,
+                args.proxy,
+                template_fields,
+                args.delay_min,
+                args.delay_max,
+            )
+            for i in range(args.threads)
+        ]
+        for f in futures:
+            f.result()
+    
+    if stats['captcha'] > 5:
+        logger.warning("Too many Cloudflare blocks. Stopping.") # Basic circuit breaker
+    logger.info(f"No more pending links. Stats: {stats}")
+    log_field_timing(template_fields)
 
 if __name__ == "__main__":
     main()
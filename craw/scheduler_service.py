@@ -63,6 +63,9 @@ signal.signal(signal.SIGINT, signal_handler)
 if hasattr(signal, 'SIGTERM'):
     signal.signal(signal.SIGTERM, signal_handler)
 
+# Thời gian giữ lease 1 link ở detail stage (heartbeat gia hạn mỗi ~1/3 khoảng này)
+LINK_LEASE_SECONDS = 600
+
 from listing_crawler import crawl_listing
 from scraper_core import scrape_url
 from web_scraper import WebScraper
@@ -363,39 +366,11 @@ def download_images(
 
 
 
-async def scrape_pending_links(
-    links: list,
-    template: dict,
-    db: Database,
-    task_id: Optional[int] = None,
-    detail_show_browser: bool = False,
-    detail_fake_hover: bool = True,
-    detail_fake_scroll: bool = True,
-    detail_wait_load_min: float = 2.0,
-    detail_wait_load_max: float = 5.0,
-    detail_delay_min: float = 2.0,
-    detail_delay_max: float = 3.0,
-    log_callback=None,
-    cancel_callback=None,
-    max_retries: int = 2,
-    stop_on_block: bool = True,
-    get_more_links_callback=None,  # Callback để lấy thêm links từ DB
-):
-    ok_count = 0
-    try:
-        import database as _db_mod
-        print(f"[detail observe] database module: {_db_mod.__file__}")
-    except Exception:
-        pass
-    fail_count = 0
-    total_links = len(links)
-    if log_callback:
-        log_callback(f"Start detail: {total_links} pending link(s)")
-    if cancel_callback and cancel_callback():
-        if log_callback:
-            log_callback("Cancel requested before starting detail")
-        return ok_count, fail_count, total_links, False
-
+def _prepare_detail_profile(task_id: Optional[int], worker_index: Optional[int] = None, log_callback=None) -> str:
+    """
+    Tạo (hoặc dùng lại) Playwright profile cho detail stage, copy cookie từ profile chính.
+    worker_index > 0 tạo profile clone riêng cho từng browser worker khi chạy sharded.
+    """
     # Mỗi task dùng profile riêng theo task_id để tránh conflict
     # Profile chính (không có suffix) chỉ dùng làm nguồn copy cookie
     base_profile_dir = os.path.join(
@@ -404,13 +379,13 @@ async def scrape_pending_links(
     )
     os.makedirs(base_profile_dir, exist_ok=True)
     
-    # Task dùng profile riêng của mình
+    # Task dùng profile riêng của mình; worker phụ (sharded mode) dùng bản clone riêng
     if task_id:
         profile_dir = base_profile_dir + f"_{task_id}"
     else:
         profile_dir = base_profile_dir + f"_{int(time.time())}"
-    
-    has_lock = False  # Không cần lock nữa vì mỗi task có profile riêng
+    if worker_index:
+        profile_dir += f"_w{worker_index}"
     
     # Kiểm tra xem profile task đã có cookie chưa
     import shutil
@@ -421,7 +396,7 @@ async def scrape_pending_links(
         # Profile task đã có cookie, dùng luôn
         print(f"[detail] Task {task_id}: Using existing profile with cookies: {profile_dir}")
         if log_callback:
-            log_callback(f"Using existing profile: playwright_profile_tab3_detail_{task_id}")
+            log_callback(f"Using existing profile: {os.path.basename(profile_dir)}")
         cookie_copied = True
     else:
         # Profile task chưa có cookie, copy từ profile chính
@@ -477,6 +452,73 @@ async def scrape_pending_links(
             if copy_errors:
                 print(f"[detail] Copy errors: {copy_errors}")
     
+    return profile_dir
+
+
+async def scrape_pending_links(
+    links: list,
+    template: dict,
+    db: Database,
+    task_id: Optional[int] = None,
+    detail_show_browser: bool = False,
+    detail_fake_hover: bool = True,
+    detail_fake_scroll: bool = True,
+    detail_wait_load_min: float = 2.0,
+    detail_wait_load_max: float = 5.0,
+    detail_delay_min: float = 2.0,
+    detail_delay_max: float = 3.0,
+    log_callback=None,
+    cancel_callback=None,
+    max_retries: int = 2,
+    stop_on_block: bool = True,
+    get_more_links_callback=None,  # Callback để lấy thêm links từ DB
+    worker_index: Optional[int] = None,  # Sharded mode: index của browser worker (0 = profile gốc của task)
+    rate_budget=None,  # Sharded mode: _DomainRateBudget dùng chung giữa các worker
+    domain_stats: Optional[dict] = None,  # Sharded mode: {domain: {'ok': n, 'fail': n}} dùng chung
+    lease_token: Optional[str] = None,  # Token lease (claim_links); có thì ack/heartbeat theo lease
+    lease_seconds: int = 600,
+):
+    ok_count = 0
+    try:
+        import database as _db_mod
+        print(f"[detail observe] database module: {_db_mod.__file__}")
+    except Exception:
+        pass
+    fail_count = 0
+    total_links = len(links)
+
+    def _count_domain(link: dict, key: str):
+        if domain_stats is None:
+            return
+        entry = domain_stats.setdefault(link.get('domain') or 'unknown', {'ok': 0, 'fail': 0})
+        entry[key] += 1
+
+    def _mark_link(link: dict, status: str):
+        # Link claim theo lease: ack (chỉ ghi nếu worker còn giữ lease)
+        if lease_token and link.get('id'):
+            db.ack_links(lease_token, [link.get('id')], status)
+        else:
+            db.update_link_status(link.get('url'), status)
+
+    _last_renew = [time.monotonic()]
+    def _renew_lease():
+        if not lease_token or time.monotonic() - _last_renew[0] < lease_seconds / 3:
+            return
+        _last_renew[0] = time.monotonic()
+        try:
+            db.renew_link_leases(lease_token, lease_seconds=lease_seconds)
+        except Exception as renew_err:
+            print(f"[detail] Lease heartbeat failed: {renew_err}")
+
+    if log_callback:
+        log_callback(f"Start detail: {total_links} pending link(s)")
+    if cancel_callback and cancel_callback():
+        if log_callback:
+            log_callback("Cancel requested before starting detail")
+        return ok_count, fail_count, total_links, False
+
+    profile_dir = _prepare_detail_profile(task_id, worker_index, log_callback)
+    
     # Tắt managed_browser để Crawl4AI dùng trực tiếp browser, không tạo browser ẩn riêng
     use_managed_browser = False
     print(f"[detail observe] Using profile: {profile_dir}")
@@ -524,7 +566,7 @@ async def scrape_pending_links(
                             page_url = await shared_page.evaluate("window.location.href")
                             print(f"[detail observe] Got active page from profile {profile_dir}, URL: {page_url}")
                             if log_callback:
-                                log_callback(f"Browser ready, got active page (profile: playwright_profile_tab3_detail_{task_id})")
+                                log_callback(f"Browser ready, got active page (profile: {os.path.basename(profile_dir)})")
                         except Exception as url_err:
                             print(f"[detail observe] Got active page but cannot get URL: {url_err}")
                             if log_callback:
@@ -599,6 +641,7 @@ async def scrape_pending_links(
                 while current_links:
                     for link in current_links:
                         global_idx += 1
+                        _renew_lease()
                         if cancel_callback and cancel_callback():
                             if log_callback:
                                 log_callback(f"Cancel requested mid-run at link {global_idx}, ok={ok_count}, fail={fail_count}")
@@ -630,6 +673,14 @@ async def scrape_pending_links(
                                                 log_callback(f"Cancel requested during delay at link {global_idx}, ok={ok_count}, fail={fail_count}")
                                             return ok_count, fail_count, total_links, False
 
+                                # Budget theo domain (chia sẻ giữa các worker khi chạy sharded)
+                                if rate_budget is not None:
+                                    ok_sleep = await rate_budget.acquire(link.get('domain'), cancel_callback)
+                                    if not ok_sleep:
+                                        if log_callback:
+                                            log_callback(f"Cancel requested during rate wait at link {global_idx}, ok={ok_count}, fail={fail_count}")
+                                        return ok_count, fail_count, total_links, False
+
                                 # Kiểm tra và khôi phục page nếu bị đóng
                                 if shared_page is None:
                                     shared_page = await scraper.get_active_page()
@@ -789,8 +840,9 @@ async def scrape_pending_links(
                                         status_code = m.group(1)
 
                                 if _is_cloudflare_block(html_content, last_error, status_code) and stop_on_block:
-                                    db.update_link_status(url, 'ERROR')
+                                    _mark_link(link, 'ERROR')
                                     fail_count += 1
+                                    _count_domain(link, 'fail')
                                     if log_callback:
                                         log_callback(f"[Link {global_idx}] CANCEL Cloudflare/anti-bot detected (code={status_code or 'n/a'})")
                                     return ok_count, fail_count, total_links, True
@@ -813,8 +865,9 @@ async def scrape_pending_links(
                                             db.add_detail_images(detail_id, imgs)
                                         elif isinstance(imgs, str):
                                             db.add_detail_images(detail_id, [imgs])
-                                    db.update_link_status(url, 'CRAWLED')
+                                    _mark_link(link, 'CRAWLED')
                                     ok_count += 1
+                                    _count_domain(link, 'ok')
                                     if log_callback:
                                         log_callback(f"[Link {global_idx}] OK - saved detail_id={detail_id}")
                                     break
@@ -825,8 +878,9 @@ async def scrape_pending_links(
                                     if log_callback:
                                         log_callback(f"[Link {global_idx}] FAIL{f' HTTP {status_code}' if status_code else ''}: {last_error or 'Unknown error'}" + (f" (retry {attempt}/{max_retries})" if should_retry else ""))
                                     if not should_retry:
-                                        db.update_link_status(url, 'ERROR')
+                                        _mark_link(link, 'ERROR')
                                         fail_count += 1
+                                        _count_domain(link, 'fail')
                                         break
                                     attempt += 1
                                     ok_sleep = await _sleep_with_cancel(random.uniform(1, 5), cancel_callback)
@@ -835,14 +889,15 @@ async def scrape_pending_links(
                                             log_callback(f"Cancel requested during retry delay at link {global_idx}, ok={ok_count}, fail={fail_count}")
                                         return ok_count, fail_count, total_links, False
                         except Exception as e:
-                            db.update_link_status(url, 'ERROR')
+                            _mark_link(link, 'ERROR')
                             fail_count += 1
+                            _count_domain(link, 'fail')
                             if log_callback:
                                 log_callback(f"[Link {global_idx}] ERROR: {e}")
                     
                     # Sau khi xử lý xong batch, lấy thêm links nếu có callback
                     if get_more_links_callback:
-                        current_links = get_more_links_callback()
+                        current_links = get_more_links_callback(lease_token) if lease_token else get_more_links_callback()
                         if current_links:
                             total_links += len(current_links)
                             if log_callback:
@@ -863,8 +918,14 @@ async def scrape_pending_links(
                     except Exception:
                         log_callback(f"Task finished, browser page already closed or inaccessible")
     finally:
-        # Không cần release lock nữa vì mỗi task có profile riêng
-        pass
+        # Trả lại các link đã claim nhưng chưa xử lý (cancel/block/lỗi browser)
+        if lease_token:
+            try:
+                released = db.nack_links(lease_token)
+                if released and log_callback:
+                    log_callback(f"Released {released} unprocessed link(s) back to PENDING")
+            except Exception as release_err:
+                print(f"[detail] Cannot release leased links: {release_err}")
 
     if log_callback:
         remaining = max(total_links - (ok_count + fail_count), 0)
@@ -872,6 +933,119 @@ async def scrape_pending_links(
     return ok_count, fail_count, len(links), False
 
 
+class _DomainRateBudget:
+    """Giới hạn số link/phút cho mỗi domain, dùng chung giữa các browser worker trong cùng event loop"""
+
+    def __init__(self, per_minute: float = 0):
+        self.interval = 60.0 / per_minute if per_minute and per_minute > 0 else 0.0
+        self._next_slot = {}
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, domain: Optional[str], cancel_callback=None) -> bool:
+        if not self.interval:
+            return True
+        key = domain or 'unknown'
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(key, 0.0))
+            self._next_slot[key] = slot + self.interval
+        return await _sleep_with_cancel(slot - now, cancel_callback)
+
+
+async def scrape_pending_links_sharded(
+    links: list,
+    template: dict,
+    db: Database,
+    workers: int = 2,
+    domain_rate_per_minute: float = 0,
+    task_id: Optional[int] = None,
+    log_callback=None,
+    cancel_callback=None,
+    get_more_links_callback=None,
+    **scrape_kwargs,
+):
+    """
+    Chạy N browser worker song song (mỗi worker 1 Chromium + profile clone riêng).
+
+    Worker 0 xử lý batch đầu tiên (đã claim bằng lease_token gốc), các worker còn lại claim
+    link riêng từ collected_links qua get_more_links_callback(token) với token "<lease_token>-w<n>",
+    nên không có 2 worker cùng lấy 1 link.
+    Mỗi worker vẫn tự phát hiện Cloudflare/cancel; khi 1 worker bị block thì các worker
+    còn lại cũng dừng. Trả về (ok, fail, total, blocked) giống scrape_pending_links.
+    """
+    workers = max(1, int(workers or 1))
+    rate_budget = _DomainRateBudget(domain_rate_per_minute)
+    domain_stats = {}
+    stop_event = asyncio.Event()
+    started_at = time.monotonic()
+
+    def _stopped() -> bool:
+        if stop_event.is_set():
+            return True
+        return bool(cancel_callback and cancel_callback())
+
+    base_token = scrape_kwargs.pop('lease_token', None)
+
+    async def _run_worker(idx: int, shard: list):
+        token = base_token if idx == 0 or not base_token else f"{base_token}-w{idx}"
+        if not shard and get_more_links_callback:
+            shard = (get_more_links_callback(token) if token else get_more_links_callback()) or []
+        if not shard:
+            return 0, 0, 0, False
+
+        def _worker_log(msg: str):
+            if log_callback:
+                log_callback(f"[W{idx}] {msg}")
+
+        res = await scrape_pending_links(
+            shard,
+            template,
+            db,
+            task_id=task_id,
+            log_callback=_worker_log,
+            cancel_callback=_stopped,
+            get_more_links_callback=get_more_links_callback,
+            worker_index=idx,
+            rate_budget=rate_budget,
+            domain_stats=domain_stats,
+            lease_token=token,
+            **scrape_kwargs,
+        )
+        if res[3]:
+            stop_event.set()
+        return res
+
+    if log_callback:
+        rate_msg = f"{domain_rate_per_minute:g} link/min/domain" if domain_rate_per_minute else "no domain budget"
+        log_callback(f"Sharded detail: {workers} browser worker(s), {rate_msg}")
+
+    results = await asyncio.gather(
+        *[_run_worker(i, list(links) if i == 0 else []) for i in range(workers)],
+        return_exceptions=True,
+    )
+
+    ok_count = fail_count = total = 0
+    blocked = False
+    for i, res in enumerate(results):
+        if isinstance(res, Exception):
+            if log_callback:
+                log_callback(f"[W{i}] Worker crashed: {res}")
+            continue
+        ok_count += res[0]
+        fail_count += res[1]
+        total += res[2]
+        blocked = blocked or bool(res[3])
+
+    elapsed_min = max(time.monotonic() - started_at, 1.0) / 60.0
+    for domain, counts in sorted(domain_stats.items()):
+        done = counts['ok'] + counts['fail']
+        msg = (f"Throughput {domain}: ok={counts['ok']}, fail={counts['fail']}, "
+               f"{done / elapsed_min:.1f} link/min")
+        print(f"[detail sharded] {msg}")
+        if log_callback:
+            log_callback(msg)
+    return ok_count, fail_count, total, blocked
+
 
 def _as_bool(val, default=False):
     try:
@@ -1036,55 +1210,76 @@ def run_task(db: Database, task: dict):
                     # Lấy batch nhỏ links (10 links/lần) để chia sẻ với các task khác
                     # Task sẽ loop lấy thêm links đến khi hết pending
                     BATCH_SIZE = 10
-                    all_pending = db.get_pending_links(
-                        limit=BATCH_SIZE,
-                        domain=task.get('domain'),
-                        loaihinh=task.get('loaihinh'),
-                        trade_type=task.get('trade_type'),
-                    )
+                    # Claim theo lease: link của worker crash tự về hàng đợi khi lease hết hạn
+                    try:
+                        db.reset_stale_in_progress_links(timeout_minutes=30)
+                    except Exception:
+                        pass
+                    lease_token = db.new_worker_token(f"task{task_id}")
+
+                    def _claim_links(token: str = lease_token):
+                        return db.claim_links(
+                            token,
+                            limit=BATCH_SIZE,
+                            lease_seconds=LINK_LEASE_SECONDS,
+                            domain=task.get('domain'),
+                            loaihinh=task.get('loaihinh'),
+                            trade_type=task.get('trade_type'),
+                            newest_first=True,
+                        )
+
+                    all_pending = _claim_links()
                     
                     if not all_pending:
                         db.add_scheduler_log(task_id, "detail", "SKIP", "No PENDING links")
                         finish_reason = "No pending links"
                     else:
                         total_seen = len(all_pending)
-                        db.add_scheduler_log(task_id, "detail", "INFO", f"Found {total_seen} pending links (batch {BATCH_SIZE}), starting with 1 browser...")
+                        db.add_scheduler_log(task_id, "detail", "INFO", f"Found {total_seen} pending links (batch {BATCH_SIZE}), starting with {max(1, int(task.get('detail_workers') or 1))} browser(s)...")
 
                         def _log_detail(msg: str):
                             db.add_scheduler_log(task_id, "detail", "INFO", msg)
                         
-                        # Callback để lấy thêm links từ DB (10 links mỗi lần)
+                        # Callback để claim thêm links từ DB (10 links mỗi lần, theo token của worker)
                         # Như vậy mỗi lần chỉ "giữ" 10 links IN_PROGRESS, task khác vẫn có thể lấy được
-                        def _get_more_links():
-                            return db.get_pending_links(
-                                limit=BATCH_SIZE,
-                                domain=task.get('domain'),
-                                loaihinh=task.get('loaihinh'),
-                                trade_type=task.get('trade_type'),
+                        _get_more_links = _claim_links
+
+                        detail_kwargs = dict(
+                            task_id=task_id,
+                            detail_show_browser=bool(task.get('detail_show_browser', 0)),
+                            detail_fake_hover=bool(task.get('detail_fake_hover', 1)),
+                            detail_fake_scroll=bool(task.get('detail_fake_scroll', 1)),
+                            detail_wait_load_min=float(task.get('detail_wait_load_min') or 2),
+                            detail_wait_load_max=float(task.get('detail_wait_load_max') or 5),
+                            detail_delay_min=float(task.get('detail_delay_min') or 2),
+                            detail_delay_max=float(task.get('detail_delay_max') or 3),
+                            log_callback=_log_detail,
+                            cancel_callback=is_cancel_requested,
+                            max_retries=2,
+                            stop_on_block=True,
+                            get_more_links_callback=_get_more_links,  # Lấy thêm 10 links sau mỗi batch
+                            lease_token=lease_token,
+                            lease_seconds=LINK_LEASE_SECONDS,
+                        )
+                        detail_workers = max(1, int(task.get('detail_workers') or 1))
+                        if detail_workers > 1:
+                            # Sharded: N browser song song, cùng claim link từ collected_links
+                            ok, fail, total, blocked = run_async_safe(
+                                scrape_pending_links_sharded(
+                                    all_pending,
+                                    template,
+                                    db,
+                                    workers=detail_workers,
+                                    domain_rate_per_minute=float(task.get('detail_domain_rpm') or 0),
+                                    **detail_kwargs,
+                                )
                             )
-
-                        # Chạy với callback để lấy thêm links liên tục
-                        # Browser mở 1 lần, loop lấy links đến khi hết
-                        ok, fail, total, blocked = run_async_safe(
-                            scrape_pending_links(
-                                all_pending,
-                                template,
-                                db,
-                                task_id=task_id,
-                                detail_show_browser=bool(task.get('detail_show_browser', 0)),
-                                detail_fake_hover=bool(task.get('detail_fake_hover', 1)),
-                                detail_fake_scroll=bool(task.get('detail_fake_scroll', 1)),
-                                detail_wait_load_min=float(task.get('detail_wait_load_min') or 2),
-                                detail_wait_load_max=float(task.get('detail_wait_load_max') or 5),
-                                detail_delay_min=float(task.get('detail_delay_min') or 2),
-                                detail_delay_max=float(task.get('detail_delay_max') or 3),
-                                log_callback=_log_detail,
-                                cancel_callback=is_cancel_requested,
-                                max_retries=2,
-                                stop_on_block=True,
-                                get_more_links_callback=_get_more_links,  # Lấy thêm 10 links sau mỗi batch
+                        else:
+                            # Chạy với callback để lấy thêm links liên tục
+                            # Browser mở 1 lần, loop lấy links đến khi hết
+                            ok, fail, total, blocked = run_async_safe(
+                                scrape_pending_links(all_pending, template, db, **detail_kwargs)
                             )
-                        )
                         total_ok = ok
                         total_fail = fail
                         
@@ -1203,7 +1398,8 @@ def run_scheduler_loop():
             task_id = t_task.get('id')
             task_name = t_task.get('name')
             print(f"[Worker] Starting task {task_id} - {task_name}")
-            db_worker = Database(host="localhost", user="root", password="", database="craw_db")
+            # Dùng chung connection pool với scheduler, schema đã được init ở thread chính
+            db_worker = Database(host="localhost", user="root", password="", database="craw_db", init_schema=False)
             try:
                 run_task(db_worker, t_task)
                 print(f"[Worker] Finished task {task_id} - {task_name}")
@@ -6,12 +6,14 @@ Uses lxml extraction to support CSS/XPath selectors.
 import asyncio
 import random
 import re
+import time
 from datetime import datetime
 from typing import Dict, Any, Optional
 from urllib.parse import urlparse
 
 from lxml import html as lxml_html
 
+from template_engine import apply_exclude_words, compile_template, is_xpath_selector, parse_exclude_words, select
 from web_scraper import WebScraper
 
 
@@ -51,17 +53,14 @@ def _get_phone_selector(template: Dict[str, Any]) -> Optional[str]:
 
 
 def _is_xpath_selector(selector: str) -> bool:
-    return selector.startswith('/') or selector.startswith('(')
+    return is_xpath_selector(selector)
 
 
 def _extract_text_from_tree(tree, selector: str) -> Optional[str]:
     if not tree or not selector:
         return None
     try:
-        if selector.startswith('/') or selector.startswith('('):
-            elements = tree.xpath(selector)
-        else:
-            elements = tree.cssselect(selector)
+        elements = select(tree, selector)
     except Exception:
         return None
     for el in elements:
@@ -293,36 +292,11 @@ async def _reveal_phone_before_extract(page, url: str, template: Dict[str, Any])
 
 
 def _parse_exclude_words(field: Dict[str, Any]) -> list:
-    raw = field.get('excludeWords')
-    if not raw:
-        return []
-    if isinstance(raw, list):
-        return [str(w).strip() for w in raw if str(w).strip()]
-    if isinstance(raw, str):
-        parts = re.split(r'[|,]', raw)
-        return [p.strip() for p in parts if p.strip()]
-    return []
+    return parse_exclude_words(field)
 
 
 def _apply_exclude_words(value: Any, field: Dict[str, Any]) -> Any:
-    if value is None:
-        return None
-    words = _parse_exclude_words(field)
-    if not words:
-        return value
-    if isinstance(value, list):
-        cleaned = []
-        for v in value:
-            cleaned_val = _apply_exclude_words(v, field)
-            if cleaned_val:
-                cleaned.append(cleaned_val)
-        return cleaned
-    if not isinstance(value, str):
-        return value
-    cleaned_value = value
-    for word in words:
-        cleaned_value = cleaned_value.replace(word, "")
-    return cleaned_value.strip()
+    return apply_exclude_words(value, field)
 
 
 def format_extracted_data_fixed(extracted_data: Any, template: Dict) -> Dict:
@@ -513,20 +487,21 @@ async def scrape_url(
 
         tree = lxml_html.fromstring(html_content)
         extracted_data = {}
+        extract_ms = {}
+        compiled = compile_template(template)
 
-        for field in template.get('fields', []):
-            field_name = field.get('name')
-            selector = (field.get('selector') or field.get('cssSelector') or field.get('xpath') or '').strip()
+        for cf in compiled.fields:
+            field = cf.field
+            field_name = cf.name
+            selector = cf.selector
             value_type = field.get('valueType', 'text')
             if not selector:
                 extracted_data[field_name] = None
                 continue
 
+            t0 = time.perf_counter()
             try:
-                if selector.startswith('/') or selector.startswith('('):
-                    elements = tree.xpath(selector)
-                else:
-                    elements = tree.cssselect(selector)
+                elements = cf.select(tree)
 
                 values = []
 
@@ -657,7 +632,7 @@ async def scrape_url(
                         if not val:
                             val = el if isinstance(el, str) else el.text_content().strip()
                         if value_type in ('text', 'innerText'):
-                            val = _apply_exclude_words(val, field)
+                            val = cf.apply_exclude(val)
                         _add_value(val)
 
                 if not values:
@@ -695,6 +670,9 @@ async def scrape_url(
             except Exception as e:
                 print(f"Error extract field '{field_name}': {e}")
                 extracted_data[field_name] = None
+            elapsed = time.perf_counter() - t0
+            compiled.record(field_name, elapsed)
+            extract_ms[field_name] = round(elapsed * 1000, 3)
 
         # Debug log: hiển thị dữ liệu đã extract
         non_empty_fields = {k: v for k, v in extracted_data.items() if v is not None}
@@ -712,6 +690,7 @@ async def scrape_url(
             'url': url,
             'data': formatted_data,
             'html': html_content,
+            'extract_ms': extract_ms,
             'timestamp': datetime.now().isoformat()
         }
 
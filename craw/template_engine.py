@@ -0,0 +1,222 @@
+"""
+Template engine dùng chung cho scraper_core, dashboard, mogi_fast_crawler, alonhadat_detail_crawler.
+
+Template JSON (craw/template/*.json) được compile 1 lần:
+  - selector (XPath hoặc CSS) -> lxml.etree.XPath đã compile (CSS dịch qua cssselect 1 lần)
+  - excludeWords -> 1 regex
+  - cache theo hash nội dung template
+
+Thời gian extract từng field được cộng dồn trên CompiledTemplate (timing_report()).
+
+Usage:
+    compiled = compile_template(template)
+    for cf in compiled.fields:
+        t0 = time.perf_counter()
+        elements = cf.select(tree)
+        ...
+        val = cf.apply_exclude(val)
+        compiled.record(cf.name, time.perf_counter() - t0)
+"""
+
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from lxml import etree
+from lxml.cssselect import CSSSelector
+
+TEMPLATE_CACHE_SIZE = 64
+_SKIP_TEXT_TAGS = {"script", "style"}
+
+
+def is_xpath_selector(selector: str) -> bool:
+    sel = (selector or "").strip()
+    return sel.startswith("/") or sel.startswith("(")
+
+
+@lru_cache(maxsize=2048)
+def compile_selector(selector: str) -> etree.XPath:
+    """XPath/CSS selector -> XPath object đã compile (cache theo chuỗi selector)."""
+    selector = selector.strip()
+    if is_xpath_selector(selector):
+        return etree.XPath(selector)
+    # Giống HtmlElement.cssselect(): translator 'html'
+    return CSSSelector(selector, translator="html")
+
+
+def select(tree, selector: str) -> list:
+    return compile_selector(selector)(tree)
+
+
+def parse_exclude_words(field: Dict[str, Any]) -> List[str]:
+    raw = field.get("excludeWords")
+    if not raw:
+        return []
+    if isinstance(raw, list):
+        return [str(w).strip() for w in raw if str(w).strip()]
+    if isinstance(raw, str):
+        parts = re.split(r"[|,]", raw)
+        return [p.strip() for p in parts if p.strip()]
+    return []
+
+
+@lru_cache(maxsize=1024)
+def exclude_regex(words: Tuple[str, ...]) -> Optional["re.Pattern"]:
+    if not words:
+        return None
+    return re.compile("|".join(re.escape(w) for w in words))
+
+
+def _apply_exclude_regex(value: Any, pattern, empty_as_none: bool) -> Any:
+    if value is None:
+        return None
+    if pattern is None:
+        return value
+    if isinstance(value, list):
+        out = []
+        for v in value:
+            cleaned = _apply_exclude_regex(v, pattern, empty_as_none)
+            if cleaned:
+                out.append(cleaned)
+        return out
+    if not isinstance(value, str):
+        return value
+    cleaned = pattern.sub("", value).strip()
+    if empty_as_none and not cleaned:
+        return None
+    return cleaned
+
+
+def apply_exclude_words(value: Any, field: Dict[str, Any], empty_as_none: bool = False) -> Any:
+    """Xoá excludeWords khỏi value (str hoặc list[str]), strip kết quả."""
+    return _apply_exclude_regex(value, exclude_regex(tuple(parse_exclude_words(field))), empty_as_none)
+
+
+def node_text(el: Any, separator: str = "", strip: bool = False) -> str:
+    """
+    Text của node lxml. separator="" và strip=False giống text_content();
+    separator + strip=True giống BeautifulSoup get_text(separator, strip=True) (bỏ script/style).
+    """
+    if isinstance(el, str):
+        return el.strip() if strip else el
+    if not separator and not strip:
+        return el.text_content()
+
+    parts: List[str] = []
+
+    def _add(text):
+        if not text:
+            return
+        if strip:
+            text = text.strip()
+            if not text:
+                return
+        parts.append(text)
+
+    def _walk(node):
+        if not isinstance(node.tag, str) or node.tag in _SKIP_TEXT_TAGS:
+            return
+        _add(node.text)
+        for child in node:
+            _walk(child)
+            _add(child.tail)
+
+    _walk(el)
+    return separator.join(parts)
+
+
+class CompiledField:
+    __slots__ = ("field", "name", "selector", "value_type", "is_xpath", "xpath", "error", "exclude")
+
+    def __init__(self, field: Dict[str, Any]):
+        self.field = field
+        self.name = field.get("name")
+        self.selector = (field.get("selector") or field.get("cssSelector") or field.get("xpath") or "").strip()
+        self.value_type = field.get("valueType") or field.get("type") or "text"
+        self.is_xpath = is_xpath_selector(self.selector)
+        self.xpath = None
+        self.error = None
+        if self.selector:
+            try:
+                self.xpath = compile_selector(self.selector)
+            except Exception as e:
+                self.error = e
+        self.exclude = exclude_regex(tuple(parse_exclude_words(field)))
+
+    def select(self, tree) -> list:
+        """Chạy selector đã compile; selector lỗi thì raise lại lỗi compile (như tree.xpath/cssselect cũ)."""
+        if self.error is not None:
+            raise self.error
+        if self.xpath is None:
+            return []
+        return self.xpath(tree)
+
+    def apply_exclude(self, value: Any, empty_as_none: bool = False) -> Any:
+        return _apply_exclude_regex(value, self.exclude, empty_as_none)
+
+
+class CompiledTemplate:
+    def __init__(self, template: Dict[str, Any], template_hash: str):
+        self.template = template
+        self.hash = template_hash
+        self.fields = [CompiledField(f) for f in template.get("fields", []) if isinstance(f, dict)]
+        self.by_name = {cf.name: cf for cf in self.fields if cf.name}
+        self._timing: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stat = self._timing.get(name)
+            if stat is None:
+                stat = self._timing[name] = [0, 0.0, 0.0]
+            stat[0] += 1
+            stat[1] += seconds
+            if seconds > stat[2]:
+                stat[2] = seconds
+
+    def timing_report(self) -> Dict[str, Dict[str, float]]:
+        """{field: {calls, total_ms, avg_ms, max_ms}}, field chậm nhất đứng đầu."""
+        with self._lock:
+            items = list(self._timing.items())
+        report = {}
+        for name, (calls, total, peak) in sorted(items, key=lambda kv: kv[1][1], reverse=True):
+            report[name] = {
+                "calls": calls,
+                "total_ms": round(total * 1000, 3),
+                "avg_ms": round(total * 1000 / calls, 3) if calls else 0.0,
+                "max_ms": round(peak * 1000, 3),
+            }
+        return report
+
+    def reset_timing(self) -> None:
+        with self._lock:
+            self._timing.clear()
+
+
+_TEMPLATE_CACHE: "OrderedDict[str, CompiledTemplate]" = OrderedDict()
+_TEMPLATE_CACHE_LOCK = threading.Lock()
+
+
+def template_hash(template: Dict[str, Any]) -> str:
+    raw = json.dumps(template, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def compile_template(template: Dict[str, Any]) -> CompiledTemplate:
+    """Compile template (cache LRU theo hash nội dung, template sửa trên dashboard sẽ tự compile lại)."""
+    key = template_hash(template or {})
+    with _TEMPLATE_CACHE_LOCK:
+        compiled = _TEMPLATE_CACHE.get(key)
+        if compiled is not None:
+            _TEMPLATE_CACHE.move_to_end(key)
+            return compiled
+    compiled = CompiledTemplate(template or {}, key)
+    with _TEMPLATE_CACHE_LOCK:
+        _TEMPLATE_CACHE[key] = compiled
+        while len(_TEMPLATE_CACHE) > TEMPLATE_CACHE_SIZE:
+            _TEMPLATE_CACHE.popitem(last=False)
+    return compiled
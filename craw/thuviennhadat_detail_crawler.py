@@ -13,6 +13,7 @@ Thuviennhadat detail crawler
 from __future__ import annotations
 
 import argparse
+import asyncio
 import html
 import json
 import os
@@ -28,9 +29,11 @@ from curl_cffi import requests as cffi_requests
 
 sys.path.append(os.getcwd())
 try:
-    from craw.database import Database
+    from craw.database import Database, LinkLeaseQueue
+    from craw.async_fetch_engine import AsyncFetcher, RETRY, crawl_queue
 except Exception:
-    from database import Database
+    from database import Database, LinkLeaseQueue
+    from async_fetch_engine import AsyncFetcher, RETRY, crawl_queue
 
 
 DOMAIN = "thuviennhadat.vn"
@@ -417,37 +420,42 @@ def fetch_html(url: str) -> Optional[str]:
     return r.text or ""
 
 
-def process_one(db: Database, row: Dict[str, Any]) -> bool:
-    link_id = row.get("id")
-    url = row.get("url")
+def save_detail(db: Database, row: Dict[str, Any], data: Dict[str, Any]) -> Optional[int]:
     loaihinh = row.get("loaihinh")
-    trade_type = row.get("trade_type")
-
-    print(f"[FETCH] id={link_id} url={url}")
-    html = fetch_html(url)
-    if not html:
-        db.update_link_status(url, "ERROR")
-        return False
-
-    data = parse_detail(url, html)
     # Theo yêu cầu: loaibds lấy từ loaihinh ở collected_links
     if loaihinh:
         data["loaibds"] = loaihinh
     detail_id = db.add_scraped_detail_flat(
-        url=url,
+        url=row.get("url"),
         data=data,
         domain=DOMAIN,
-        link_id=link_id,
+        link_id=row.get("id"),
         loaihinh=loaihinh,
-        trade_type=trade_type,
+        trade_type=row.get("trade_type"),
     )
-
     if detail_id:
         imgs = data.get("img") or []
         if imgs:
             db.add_detail_images(detail_id, imgs)
+    return detail_id
+
+
+def process_one(db: Database, row: Dict[str, Any]) -> bool:
+    link_id = row.get("id")
+    url = row.get("url")
+
+    print(f"[FETCH] id={link_id} url={url}")
+    html = fetch_html(url)
+    if not html:
+        db.update_link_status(url, "ERROR")
+        return False
+
+    data = parse_detail(url, html)
+    detail_id = save_detail(db, row, data)
+
+    if detail_id:
         db.update_link_status(url, "DONE")
-        print(f"  -> Saved detail_id={detail_id}, images={len(imgs)}")
+        print(f"  -> Saved detail_id={detail_id}, images={len(data.get('img') or [])}")
         return True
 
     db.update_link_status(url, "ERROR")
@@ -472,6 +480,45 @@ def run_batch(limit: int, sleep_min: float, sleep_max: float):
             time.sleep(sl)
 
 
+def run_async(limit: int, concurrency: int, rate: float, batch_size: int = 50) -> None:
+    """Claim link qua LinkLeaseQueue, fetch song song bằng asyncio (giới hạn theo host)"""
+    db = Database()
+    queue = LinkLeaseQueue(db, "thuviennhadat-async", domain=DOMAIN)
+
+    async def handle(row, result, fetcher):
+        url = row["url"]
+        if not result.ok:
+            print(f"  [x] {result.error or 'HTTP ' + str(result.status)} {url}")
+            return "ERROR" if result.status == 404 else RETRY
+        data = await asyncio.to_thread(parse_detail, url, result.text)
+        detail_id = await asyncio.to_thread(save_detail, db, row, data)
+        if not detail_id:
+            print(f"  -> save failed {url}")
+            return "ERROR"
+        print(f"  -> Saved detail_id={detail_id}, images={len(data.get('img') or [])} {url}")
+        return "DONE"
+
+    async def _main():
+        async with AsyncFetcher(
+            per_host=concurrency,
+            rate_per_host=rate,
+            timeout=45,
+            headers=HEADERS,
+            backend="curl",
+        ) as fetcher:
+            return await crawl_queue(
+                queue,
+                handle,
+                fetcher,
+                workers=concurrency,
+                claim_size=batch_size,
+                max_links=limit,
+                label="thuviennhadat-async",
+            )
+
+    asyncio.run(_main())
+
+
 def run_test(url: str, out_json: Optional[str], test_loaihinh: Optional[str] = None):
     html = fetch_html(url)
     if not html:
@@ -498,6 +545,9 @@ def parse_args() -> argparse.Namespace:
     ap.add_argument("--test-url", default="")
     ap.add_argument("--test-loaihinh", default="")
     ap.add_argument("--out-json", default="")
+    ap.add_argument("--async", dest="use_async", action="store_true", help="Fetch pending links with asyncio")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--rate", type=float, default=1.0, help="--async: max requests/second")
     return ap.parse_args()
 
 
@@ -507,6 +557,10 @@ def main() -> int:
     if args.test_url:
         return run_test(args.test_url, args.out_json or None, args.test_loaihinh or None)
 
+    if args.use_async:
+        run_async(limit=args.limit, concurrency=args.concurrency, rate=args.rate)
+        return 0
+
     run_batch(limit=args.limit, sleep_min=args.sleep_min, sleep_max=args.sleep_max)
     return 0
 
@@ -6,7 +6,9 @@ Hỗ trợ nhiều tính năng: cào đơn giản, extract theo schema, extract
 import asyncio
 import json
 import os
+import socket
 import sys
+import threading
 from pathlib import Path
 from typing import Optional, Dict, List, Any
 from datetime import datetime
@@ -29,6 +31,62 @@ from crawl4ai import LLMConfig
 from crawl4ai import PruningContentFilter, BM25ContentFilter
 
 
+DEBUG_PORT_BASE = 9222
+DEBUG_PORT_RANGE = 200
+
+_debug_ports_in_use = set()
+_debug_ports_lock = threading.Lock()
+
+
+def _port_is_free(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind(("127.0.0.1", port))
+            return True
+        except OSError:
+            return False
+
+
+def allocate_debug_port() -> int:
+    """Cấp debugging port chưa instance nào giữ và đang trống trên máy (thay cho 9222 + id % 100 dễ trùng)."""
+    with _debug_ports_lock:
+        for port in range(DEBUG_PORT_BASE, DEBUG_PORT_BASE + DEBUG_PORT_RANGE):
+            if port not in _debug_ports_in_use and _port_is_free(port):
+                _debug_ports_in_use.add(port)
+                return port
+    raise RuntimeError(f"No free debugging port in {DEBUG_PORT_BASE}-{DEBUG_PORT_BASE + DEBUG_PORT_RANGE - 1}")
+
+
+def release_debug_port(port: Optional[int]) -> None:
+    with _debug_ports_lock:
+        _debug_ports_in_use.discard(port)
+
+
+def process_tree_rss_mb(pid: Optional[int]) -> Optional[float]:
+    """Tổng RSS (MB) của process + các process con (đọc /proc, chỉ Linux). None nếu không đo được."""
+    if not pid or not os.path.isdir("/proc"):
+        return None
+    total_kb = 0
+    stack, seen = [int(pid)], set()
+    while stack:
+        cur = stack.pop()
+        if cur in seen:
+            continue
+        seen.add(cur)
+        try:
+            with open(f"/proc/{cur}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+            with open(f"/proc/{cur}/task/{cur}/children", "r") as f:
+                stack.extend(int(c) for c in f.read().split())
+        except (OSError, ValueError):
+            if cur == int(pid):
+                return None
+    return total_kb / 1024.0
+
+
 class WebScraper:
     """Tool cào dữ liệu từ trang web"""
     
@@ -43,11 +101,13 @@ class WebScraper:
         keep_open: bool = False,
         user_data_dir: str = None,
         use_managed_browser: bool = True,
+        block_resources: Optional[List[str]] = None,
     ):
         """
         Khởi tạo WebScraper
         Args:
             user_data_dir: Đường dẫn thư mục lưu Profile (Cookie, Cache...)
+            block_resources: resource_type bị chặn trên mọi page (vd ["image", "font", "media"])
         """
         # Tạo unique instance ID để đảm bảo không bị share browser
         WebScraper._instance_counter += 1
@@ -57,6 +117,7 @@ class WebScraper:
         print(f"[WebScraper] Creating instance #{self._instance_id} with unique_id={self._unique_id}")
         
         self.keep_open = keep_open
+        self.block_resources = frozenset(block_resources or ())
 
         stealth_args = [
             "--disable-blink-features=AutomationControlled", # Quan trọng nhất: Tắt dấu hiệu Robot
@@ -90,9 +151,9 @@ class WebScraper:
         # Chỉ bật persistent context khi có user_data_dir
         use_persistent = bool(user_data_dir)
         
-        # Tính debugging port unique dựa trên instance ID để tránh conflict
-        # Base port 9222, mỗi instance +1
-        unique_debug_port = 9222 + (self._instance_id % 100)
+        # Debugging port cấp theo port còn trống, trả lại khi đóng browser
+        unique_debug_port = allocate_debug_port()
+        self.debug_port = unique_debug_port
         
         self.browser_config = BrowserConfig(
             headless=headless,
@@ -119,6 +180,8 @@ class WebScraper:
         for attempt in range(1, max_retries + 1):
             try:
                 self.crawler = AsyncWebCrawler(config=self.browser_config)
+                if self.block_resources:
+                    self.crawler.crawler_strategy.set_hook("on_page_context_created", self._install_resource_blocker)
                 await self.crawler.__aenter__()
                 print(f"[WebScraper #{self._instance_id}] Crawler initialized successfully on attempt {attempt}")
                 return self
@@ -132,9 +195,11 @@ class WebScraper:
                         retry_delay *= 2  # Exponential backoff
                     else:
                         print(f"[WebScraper #{self._instance_id}] All {max_retries} attempts failed, raising error")
+                        release_debug_port(self.debug_port)
                         raise
                 else:
                     # Lỗi khác không phải CDP, raise ngay
+                    release_debug_port(self.debug_port)
                     raise
         return self
     
@@ -143,11 +208,38 @@ class WebScraper:
         # Giữ browser mở nếu được yêu cầu (dùng cho quan sát thủ công)
         if self.crawler and not self.keep_open:
             await self.crawler.__aexit__(exc_type, exc_val, exc_tb)
+            release_debug_port(self.debug_port)
     
     async def close(self):
         """Đóng browser thủ công khi keep_open=True"""
         if self.crawler:
             await self.crawler.__aexit__(None, None, None)
+        release_debug_port(self.debug_port)
+
+    async def _install_resource_blocker(self, page, context=None, **kwargs):
+        """Hook on_page_context_created: abort request có resource_type nằm trong block_resources."""
+        async def _route(route):
+            if route.request.resource_type in self.block_resources:
+                await route.abort()
+            else:
+                await route.continue_()
+        await page.route("**/*", _route)
+        return page
+
+    async def kill_session(self, session_id: str) -> None:
+        """Đóng page gắn với session_id (page mới sẽ được tạo ở lần arun tiếp theo)."""
+        if self.crawler and session_id:
+            await self.crawler.crawler_strategy.kill_session(session_id)
+
+    def browser_pid(self) -> Optional[int]:
+        bm = getattr(getattr(self.crawler, "crawler_strategy", None), "browser_manager", None)
+        mb = getattr(bm, "managed_browser", None) if bm else None
+        bp = getattr(mb, "browser_process", None) if mb else None
+        return getattr(bp, "pid", None)
+
+    def memory_mb(self) -> Optional[float]:
+        """RSS của browser (process chính + renderer), None nếu không đo được."""
+        return process_tree_rss_mb(self.browser_pid())
 
     async def get_active_page(self):
         """
@@ -268,19 +360,21 @@ class WebScraper:
             print(f"[WebScraper] navigate_and_get_html error: {e}")
             return {"success": False, "error": str(e), "html": ""}
     
-    async def scrape_simple(self, url: str, bypass_cache: bool = False) -> Dict[str, Any]:
+    async def scrape_simple(self, url: str, bypass_cache: bool = False, session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Cào dữ liệu đơn giản - lấy markdown và HTML
         
         Args:
             url: URL cần cào
             bypass_cache: Bỏ qua cache
+            session_id: Giữ page theo session (BrowserPool lease), None = page tạm cho 1 lần
             
         Returns:
             Dict chứa markdown, HTML và metadata
         """
         config = CrawlerRunConfig(
-            cache_mode=CacheMode.BYPASS if bypass_cache else CacheMode.ENABLED
+            cache_mode=CacheMode.BYPASS if bypass_cache else CacheMode.ENABLED,
+            session_id=session_id
         )
         
         result = await self.crawler.arun(url=url, config=config)
@@ -296,7 +390,8 @@ class WebScraper:
             "timestamp": datetime.now().isoformat()
         }
     
-    async def scrape_with_js(self, url: str, js_code: List[str], bypass_cache: bool = False) -> Dict[str, Any]:
+    async def scrape_with_js(self, url: str, js_code: List[str], bypass_cache: bool = False,
+                             session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Cào dữ liệu với JavaScript code để thao tác trang
         
@@ -304,13 +399,15 @@ class WebScraper:
             url: URL cần cào
             js_code: List các dòng JavaScript code
             bypass_cache: Bỏ qua cache
+            session_id: Giữ page theo session (BrowserPool lease), None = page tạm cho 1 lần
             
         Returns:
             Dict chứa markdown, HTML và metadata
         """
         config = CrawlerRunConfig(
             cache_mode=CacheMode.BYPASS if bypass_cache else CacheMode.ENABLED,
-            js_code=js_code
+            js_code=js_code,
+            session_id=session_id
         )
         
         result = await self.crawler.arun(url=url, config=config)
@@ -326,7 +423,8 @@ class WebScraper:
             "timestamp": datetime.now().isoformat()
         }
     
-    async def scrape_with_schema(self, url: str, schema: Dict, bypass_cache: bool = False) -> Dict[str, Any]:
+    async def scrape_with_schema(self, url: str, schema: Dict, bypass_cache: bool = False,
+                                 session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Cào dữ liệu với schema CSS selector
         
@@ -334,6 +432,7 @@ class WebScraper:
             url: URL cần cào
             schema: Schema định nghĩa cấu trúc dữ liệu cần extract
             bypass_cache: Bỏ qua cache
+            session_id: Giữ page theo session (BrowserPool lease), None = page tạm cho 1 lần
             
         Example schema:
             {
@@ -371,7 +470,8 @@ class WebScraper:
         config = CrawlerRunConfig(
             extraction_strategy=extraction_strategy,
             cache_mode=CacheMode.BYPASS if bypass_cache else CacheMode.ENABLED,
-            word_count_threshold=10
+            word_count_threshold=10,
+            session_id=session_id
         )
         
         print(f"[WebScraper] Đang scrape URL: {url[:80]}...")
@@ -404,7 +504,8 @@ class WebScraper:
         }
     
     async def scrape_with_regex(self, url: str, patterns: Optional[Dict[str, str]] = None, 
-                                builtin_patterns: Optional[int] = None, bypass_cache: bool = False) -> Dict[str, Any]:
+                                builtin_patterns: Optional[int] = None, bypass_cache: bool = False,
+                                session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Cào dữ liệu sử dụng regex patterns
         
@@ -413,6 +514,7 @@ class WebScraper:
             patterns: Dict custom patterns {label: regex}
             builtin_patterns: Bit flags cho built-in patterns (Email, Phone, etc.)
             bypass_cache: Bỏ qua cache
+            session_id: Giữ page theo session (BrowserPool lease), None = page tạm cho 1 lần
         """
         extraction_strategy = RegexExtractionStrategy(
             pattern=builtin_patterns or RegexExtractionStrategy.All,
@@ -421,7 +523,8 @@ class WebScraper:
         
         config = CrawlerRunConfig(
             extraction_strategy=extraction_strategy,
-            cache_mode=CacheMode.BYPASS if bypass_cache else CacheMode.ENABLED
+            cache_mode=CacheMode.BYPASS if bypass_cache else CacheMode.ENABLED,
+            session_id=session_id
         )
         
         result = await self.crawler.arun(url=url, config=config)
@@ -7,12 +7,13 @@ import subprocess
 import sys
 import time
 from datetime import datetime, timedelta
-from urllib.parse import urlparse
 
 import pymysql
 from pymysql.err import OperationalError
 from seleniumbase import SB
 
+from craw.bds_url_classifier import get_classifier
+
 os.environ["no_proxy"] = "*"
 if "http_proxy" in os.environ:
     del os.environ["http_proxy"]
@@ -248,12 +249,15 @@ def insert_links(links, batch_date):
     existing_prj_ids = get_existing_prj_ids(prj_candidates)
     existing_url_bases = get_existing_url_bases(base_candidates)
 
+    # loaihinh/trade_type gán luôn lúc insert (classify_batch chỉ còn vét dòng cũ)
+    classifier = get_classifier()
     conn = get_db_conn()
     try:
         cur = conn.cursor()
         sql = """
-            INSERT IGNORE INTO collected_links (url, domain, status, batch_date, prj_id, url_base, url_base_md5)
-            VALUES (%s, 'batdongsan.com.vn', %s, %s, %s, %s, %s)
+            INSERT IGNORE INTO collected_links
+                (url, domain, status, batch_date, prj_id, url_base, url_base_md5, loaihinh, trade_type)
+            VALUES (%s, 'batdongsan.com.vn', %s, %s, %s, %s, %s, %s, %s)
         """
         values = []
         for u in unique_links:
@@ -262,7 +266,8 @@ def insert_links(links, batch_date):
             is_old_pr = prj_id is not None and prj_id in existing_prj_ids
             is_old_base = bool(ub) and ub in existing_url_bases
             status = "POSTAGAIN" if (is_old_pr or is_old_base) else "PENDING"
-            values.append((u, status, batch_date, prj_id, ub, base_md5_by_url.get(u)))
+            loaihinh, trade_type = classifier.classify(u)
+            values.append((u, status, batch_date, prj_id, ub, base_md5_by_url.get(u), loaihinh, trade_type))
 
         chunk_size = 1000
         total_inserted = 0
@@ -307,35 +312,6 @@ def extract_links_in_child_sitemap(sb):
     return cleaned
 
 
-def get_bds_mapping():
-    mapping = {
-        "ban-can-ho-chung-cu-mini": ("Bán", "Căn hộ chung cư mini"),
-        "ban-can-ho-chung-cu": ("Bán", "Căn hộ chung cư"),
-        "ban-nha-rieng": ("Bán", "Nhà riêng"),
-        "ban-nha-biet-thu-lien-ke": ("Bán", "Biệt thự liền kề"),
-        "ban-nha-mat-pho": ("Bán", "Nhà mặt phố"),
-        "ban-shophouse-nha-pho-thuong-mai": ("Bán", "Shophouse"),
-        "ban-dat-nen-du-an": ("Bán", "Đất nền dự án"),
-        "ban-dat": ("Bán", "Đất"),
-        "ban-trang-trai-khu-nghi-duong": ("Bán", "Trang trại/Khu nghỉ dưỡng"),
-        "ban-condotel": ("Bán", "Condotel"),
-        "ban-kho-nha-xuong": ("Bán", "Kho, nhà xưởng"),
-        "ban-loai-bat-dong-san-khac": ("Bán", "BĐS khác"),
-        "cho-thue-can-ho-chung-cu-mini": ("Thuê", "Căn hộ chung cư mini"),
-        "cho-thue-can-ho-chung-cu": ("Thuê", "Căn hộ chung cư"),
-        "cho-thue-nha-rieng": ("Thuê", "Nhà riêng"),
-        "cho-thue-nha-biet-thu-lien-ke": ("Thuê", "Biệt thự liền kề"),
-        "cho-thue-nha-mat-pho": ("Thuê", "Nhà mặt phố"),
-        "cho-thue-shophouse-nha-pho-thuong-mai": ("Thuê", "Shophouse"),
-        "cho-thue-nha-tro-phong-tro": ("Thuê", "Nhà trọ, phòng trọ"),
-        "cho-thue-van-phong": ("Thuê", "Văn phòng"),
-        "cho-thue-sang-nhuong-cua-hang-ki-ot": ("Thuê", "Cửa hàng, Ki-ốt"),
-        "cho-thue-kho-nha-xuong-dat": ("Thuê", "Kho, nhà xưởng, đất"),
-        "cho-thue-loai-bat-dong-san-khac": ("Thuê", "BĐS khác"),
-    }
-    return dict(sorted(mapping.items(), key=lambda x: len(x[0]), reverse=True))
-
-
 def update_prj_id_for_batch(batch_date: str):
     conn = get_db_conn()
     updated = 0
@@ -401,21 +377,12 @@ def classify_batch(batch_date: str):
         if not rows:
             return {"scanned": 0, "matched": 0, "updated": 0}
 
-        mapping = get_bds_mapping()
+        classifier = get_classifier()
         updates = []
         for r in rows:
-            lid = r["id"]
-            url = r["url"] or ""
-            try:
-                p = urlparse(url)
-                path = (p.path or "").lstrip("/")
-            except Exception:
-                path = url.replace("https://batdongsan.com.vn/", "").replace("https://www.batdongsan.com.vn/", "")
-
-            for prefix, (trade, ptype) in mapping.items():
-                if path.startswith(prefix + "-") or path == prefix:
-                    updates.append((ptype, trade, lid))
-                    break
+            loaihinh, trade_type = classifier.classify(r["url"] or "")
+            if loaihinh:
+                updates.append((loaihinh, trade_type, r["id"]))
 
         if updates:
             cur.executemany(
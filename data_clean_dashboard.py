@@ -1,7 +1,17 @@
+import numpy as np
 import streamlit as st
 
 from craw.database import Database
 
+PRICE_CUBE_TTL = 600
+TRIM_RATIO = 0.1
+
+# list_time (ms) nằm trong tháng 'YYYY-MM': so sánh trực tiếp với cột -> dùng được index list_time
+MONTH_RANGE_SQL = (
+    "d.list_time >= UNIX_TIMESTAMP(CONCAT(%s, '-01')) * 1000 "
+    "AND d.list_time < UNIX_TIMESTAMP(CONCAT(%s, '-01') + INTERVAL 1 MONTH) * 1000"
+)
+
 
 def _fetch_regions(conn):
     sql = """
@@ -60,8 +70,8 @@ def _fetch_rows(conn, region_id, ward_id, type_filter, category_filter, month_fi
         extra_filters.append("d.category = %s")
         params.append(category_filter)
     if month_filter is not None:
-        extra_filters.append("DATE_FORMAT(FROM_UNIXTIME(d.list_time/1000), '%Y-%m') = %s")
-        params.append(month_filter)
+        extra_filters.append(MONTH_RANGE_SQL)
+        params.extend([month_filter, month_filter])
     extra_sql = ""
     if extra_filters:
         extra_sql = " AND " + " AND ".join(extra_filters)
@@ -181,8 +191,8 @@ def _count_rows(conn, region_id, ward_id, type_filter, category_filter, month_fi
         sql += " AND d.category = %s"
         params.append(category_filter)
     if month_filter is not None:
-        sql += " AND DATE_FORMAT(FROM_UNIXTIME(d.list_time/1000), '%Y-%m') = %s"
-        params.append(month_filter)
+        sql += " AND " + MONTH_RANGE_SQL
+        params.extend([month_filter, month_filter])
     with conn.cursor() as cur:
         cur.execute(sql, params)
         total = cur.fetchone()
@@ -233,90 +243,123 @@ def _fetch_months(conn):
     return months
 
 
-def _build_price_source(region_id, ward_id, type_filter, category_filter, month_filter):
-    params = []
-    extra_filters = []
-    if type_filter is not None:
-        extra_filters.append("d.type = %s")
-        params.append(type_filter)
-    if category_filter is not None:
-        extra_filters.append("d.category = %s")
-        params.append(category_filter)
-    if month_filter is not None:
-        extra_filters.append("DATE_FORMAT(FROM_UNIXTIME(d.list_time/1000), '%Y-%m') = %s")
-        params.append(month_filter)
-    extra_filters.append("d.price_m2_vnd IS NOT NULL")
-    extra_sql = " AND " + " AND ".join(extra_filters)
-
-    if ward_id is not None:
-        sql = """
-            SELECT d.price_m2_vnd
-            FROM transaction_city_mergev2 m
-            JOIN nhadat_nhatot n
-              ON n.match_type = 'ward' AND n.cf_ward_id = m.old_city_id
-            JOIN data_clean d
-              ON d.ward = n.nt_ward_id
-            WHERE m.new_city_id = %s
-        """
-        params = [ward_id] + params
-    elif region_id is not None:
-        sql = """
-            SELECT d.price_m2_vnd
-            FROM transaction_city_new cn
-            JOIN transaction_city_mergev2 m
-              ON m.new_city_id = cn.city_id
-            JOIN nhadat_nhatot n
-              ON n.match_type = 'ward' AND n.cf_ward_id = m.old_city_id
-            JOIN data_clean d
-              ON d.ward = n.nt_ward_id
-            WHERE cn.new_city_parent_id = %s
-        """
-        params = [region_id] + params
-    else:
-        sql = "SELECT d.price_m2_vnd FROM data_clean d WHERE 1=1"
-    sql += extra_sql
-    return sql, params
+class PriceCube:
+    """
+    price_m2_vnd của data_clean nạp 1 lần vào numpy (cùng ward/type/category/tháng),
+    thống kê cho mọi tổ hợp filter tính bằng mask trong RAM thay vì COUNT/AVG/ORDER BY OFFSET
+    lặp lại trên subquery JOIN.
 
+    Lọc theo tỉnh/xã mới giữ đúng số dòng của JOIN cũ: 1 dòng data_clean được tính
+    k lần nếu ward của nó khớp k đường transaction_city_mergev2 x nhadat_nhatot.
+    """
 
-def _calc_price_stats(conn, region_id, ward_id, type_filter, category_filter, month_filter):
-    base_sql, params = _build_price_source(region_id, ward_id, type_filter, category_filter, month_filter)
-    with conn.cursor() as cur:
-        cur.execute(f"SELECT COUNT(*) FROM ({base_sql}) t", params)
-        total = cur.fetchone()
-        total = total[0] if isinstance(total, tuple) else list(total.values())[0]
-        if total == 0:
-            return {"count": 0, "avg": None, "median_trim": None}
-        cur.execute(f"SELECT AVG(price_m2_vnd) FROM ({base_sql}) t", params)
-        avg_val = cur.fetchone()
-        avg_val = avg_val[0] if isinstance(avg_val, tuple) else list(avg_val.values())[0]
-
-        cut = int(total * 0.1)
-        trimmed = total - (cut * 2)
-        if trimmed <= 0:
-            return {"count": total, "avg": avg_val, "median_trim": None}
-
-        if trimmed % 2 == 1:
-            mid_offset = cut + (trimmed // 2)
+    def __init__(self, wards, types, categories, months, prices, paths):
+        self.wards = wards
+        self.type_values, self.type_codes = np.unique(types.astype(str), return_inverse=True)
+        self.category_values, self.category_codes = np.unique(categories.astype(str), return_inverse=True)
+        self.months = months
+        self.prices = prices
+        # paths: [(nt_ward_id, new_city_id, new_city_parent_id)]
+        self.path_ward = np.array([p[0] for p in paths], dtype=np.int64)
+        self.path_new = np.array([p[1] if p[1] is not None else -1 for p in paths], dtype=np.int64)
+        self.path_parent = np.array([p[2] if p[2] is not None else -1 for p in paths], dtype=np.int64)
+
+    def _code_mask(self, values, codes, value):
+        idx = np.searchsorted(values, str(value))
+        if idx >= len(values) or values[idx] != str(value):
+            return np.zeros(len(codes), dtype=bool)
+        return codes == idx
+
+    def _ward_weights(self, region_id, ward_id):
+        if ward_id is not None:
+            keep = self.path_new == int(ward_id)
         else:
-            mid_offset = cut + (trimmed // 2 - 1)
+            keep = self.path_parent == int(region_id)
+        nt_wards, counts = np.unique(self.path_ward[keep], return_counts=True)
+        pos = np.searchsorted(nt_wards, self.wards)
+        pos[pos >= len(nt_wards)] = 0
+        hit = nt_wards[pos] == self.wards if len(nt_wards) else np.zeros(len(self.wards), dtype=bool)
+        return np.where(hit, counts[pos] if len(counts) else 0, 0)
+
+    def select(self, region_id, ward_id, type_filter, category_filter, month_filter):
+        mask = np.ones(len(self.prices), dtype=bool)
+        if type_filter is not None:
+            mask &= self._code_mask(self.type_values, self.type_codes, type_filter)
+        if category_filter is not None:
+            mask &= self._code_mask(self.category_values, self.category_codes, category_filter)
+        if month_filter is not None:
+            year, month = str(month_filter).split("-")[:2]
+            mask &= self.months == int(year) * 100 + int(month)
+        if ward_id is None and region_id is None:
+            return self.prices[mask]
+        weights = self._ward_weights(region_id, ward_id)
+        mask &= weights > 0
+        return np.repeat(self.prices[mask], weights[mask])
+
+
+@st.cache_resource(ttl=PRICE_CUBE_TTL, show_spinner="Dang nap price_m2_vnd ...")
+def _load_price_cube(_conn):
+    with _conn.cursor() as cur:
         cur.execute(
-            f"SELECT price_m2_vnd FROM ({base_sql}) t ORDER BY price_m2_vnd LIMIT 1 OFFSET {mid_offset}",
-            params,
+            """
+            SELECT d.ward,
+                   d.type,
+                   d.category,
+                   YEAR(FROM_UNIXTIME(d.list_time/1000)) * 100 + MONTH(FROM_UNIXTIME(d.list_time/1000)) AS ym,
+                   d.price_m2_vnd
+            FROM data_clean d
+            WHERE d.price_m2_vnd IS NOT NULL
+            """
         )
-        v1 = cur.fetchone()
-        v1 = v1[0] if isinstance(v1, tuple) else list(v1.values())[0]
-        if trimmed % 2 == 1:
-            median_val = v1
-        else:
-            cur.execute(
-                f"SELECT price_m2_vnd FROM ({base_sql}) t ORDER BY price_m2_vnd LIMIT 1 OFFSET {mid_offset + 1}",
-                params,
-            )
-            v2 = cur.fetchone()
-            v2 = v2[0] if isinstance(v2, tuple) else list(v2.values())[0]
-            median_val = (v1 + v2) / 2 if v2 is not None else v1
-
-    return {"count": total, "avg": avg_val, "median_trim": median_val}
+        rows = cur.fetchall()
+        cur.execute(
+            """
+            SELECT n.nt_ward_id, m.new_city_id, cn.new_city_parent_id
+            FROM transaction_city_mergev2 m
+            JOIN nhadat_nhatot n
+              ON n.match_type = 'ward' AND n.cf_ward_id = m.old_city_id
+            LEFT JOIN transaction_city_new cn
+              ON cn.city_id = m.new_city_id
+            """
+        )
+        paths = cur.fetchall()
+    if rows and not isinstance(rows[0], tuple):
+        rows = [(r["ward"], r["type"], r["category"], r["ym"], r["price_m2_vnd"]) for r in rows]
+    if paths and not isinstance(paths[0], tuple):
+        paths = [(r["nt_ward_id"], r["new_city_id"], r["new_city_parent_id"]) for r in paths]
+    paths = [p for p in paths if p[0] is not None]
+    n = len(rows)
+    return PriceCube(
+        wards=np.fromiter((r[0] if r[0] is not None else -1 for r in rows), dtype=np.int64, count=n),
+        types=np.array([r[1] for r in rows], dtype=object),
+        categories=np.array([r[2] for r in rows], dtype=object),
+        months=np.fromiter((r[3] if r[3] is not None else 0 for r in rows), dtype=np.int64, count=n),
+        prices=np.fromiter((float(r[4]) for r in rows), dtype=np.float64, count=n),
+        paths=paths,
+    )
+
+
+def _trimmed_median(values, trim_ratio=TRIM_RATIO):
+    """Bỏ trim_ratio thấp nhất + cao nhất, lấy trung vị phần còn lại (N chẵn -> trung bình 2 phần tử giữa)."""
+    total = len(values)
+    cut = int(total * trim_ratio)
+    trimmed = total - cut * 2
+    if trimmed <= 0:
+        return None
+    if trimmed % 2 == 1:
+        k = cut + trimmed // 2
+        return float(np.partition(values, k)[k])
+    k = cut + trimmed // 2 - 1
+    part = np.partition(values, (k, k + 1))
+    return float((part[k] + part[k + 1]) / 2)
+
+
+def _calc_price_stats(cube, region_id, ward_id, type_filter, category_filter, month_filter):
+    values = cube.select(region_id, ward_id, type_filter, category_filter, month_filter)
+    total = int(len(values))
+    if total == 0:
+        return {"count": 0, "avg": None, "median_trim": None}
+    return {"count": total, "avg": float(values.mean()), "median_trim": _trimmed_median(values)}
 
 
 def main():
@@ -390,7 +433,7 @@ def main():
         rows = _fetch_rows(conn, region_id, ward_id, type_filter, category_filter, month_filter, int(limit_rows))
         st.dataframe(rows, use_container_width=True, hide_index=True)
 
-        stats = _calc_price_stats(conn, region_id, ward_id, type_filter, category_filter, month_filter)
+        stats = _calc_price_stats(_load_price_cube(conn), region_id, ward_id, type_filter, category_filter, month_filter)
         st.markdown("### Thong so gia")
         col_a, col_b, col_c = st.columns(3)
         with col_a:
@@ -402,7 +445,8 @@ def main():
         st.caption(
             "Cong thuc: sap xep price_m2_vnd tang dan, loai 10% thap nhat + 10% cao nhat, "
             "N = so mau con lai. Neu N le -> lay phan tu giua; "
-            "neu N chan -> (A[N/2 - 1] + A[N/2]) / 2."
+            "neu N chan -> (A[N/2 - 1] + A[N/2]) / 2. "
+            f"Du lieu gia nap lai moi {PRICE_CUBE_TTL // 60} phut."
         )
     finally:
         conn.close()